@@ -219,6 +219,87 @@ class ImageMixin(object):
             # create mode.components images of size == self.size
             return tuple(self[::,::,i] for i in range(self.components))
 
+    def quantize(self, colors=256, method="mediancut"):
+        """Return an ``L`` image of indices into a palette of at most
+        ``colors`` colors that approximates this ``RGB`` or ``RGBA`` image,
+        with the palette, a list of ``(r, g, b)`` tuples, in
+        ``info["palette"]``.
+
+        ``method`` is ``"mediancut"`` or ``"octree"``.  Pixels of ``RGBA``
+        images less than half opaque share an extra palette entry whose
+        index is stored in ``info["transparency"]``.  Images using no more
+        than ``colors`` colors keep them exactly.
+
+        quantize([colors[, method]]) -> image
+
+        """
+        from .quantize import quantize
+
+        if self.mode not in (RGB, RGBA):
+            raise ValueError("Only RGB and RGBA images can be quantized, "
+                             "not {}.".format(self.mode))
+        indices, palette, transparent = quantize(
+                self.buffer, self.components, colors, method)
+        res = Image(L, size=self.size)
+        res.buffer[:] = indices
+        res.info["palette"] = palette
+        if transparent is not None:
+            res.info["transparency"] = transparent
+        return res
+
+    def dither(self, target=1, method="floyd-steinberg"):
+        """Return a dithered copy of this 8-bit ``L``, ``LA``, ``RGB`` or
+        ``RGBA`` image.
+
+        When ``target`` is a number of bits from 1 to 7, each color
+        channel is reduced to ``2 ** target`` levels spread evenly from 0
+        to 255 and the image keeps its mode; alpha is left as it is.  When
+        ``target`` is a palette, a sequence of ``(r, g, b)`` tuples, the
+        ``L`` or ``RGB`` image is dithered to it and an ``L`` image of
+        palette indices is returned, with the palette in
+        ``info["palette"]`` as :meth:`quantize` does.
+
+        ``method`` is one of the error diffusion kernels
+        ``"floyd-steinberg"``, ``"atkinson"``, ``"sierra"``,
+        ``"sierra-2"`` and ``"sierra-lite"``, or ``"bayer"`` for ordered
+        dithering with an 8x8 Bayer matrix.
+
+        dither([target[, method]]) -> image
+
+        """
+        from . import dither
+
+        if self.mode not in (L, LA, RGB, RGBA):
+            raise ValueError("Only 8-bit L, LA, RGB and RGBA images can be "
+                             "dithered, not {}.".format(self.mode))
+        if method not in dither.METHODS:
+            raise ValueError("Unknown dithering method {!r}.".format(method))
+        width, height = self.size
+        data = bytes(self.buffer)
+        if isinstance(target, int):
+            if not 1 <= target <= 7:
+                raise ValueError("target must be between 1 and 7 bits.")
+            res = Image(self.mode, size=self.size)
+            out = bytearray(data)
+            n = self.components
+            for c in range(n - (self.mode in (LA, RGBA))):
+                out[c::n] = dither.dither_levels(data[c::n], width, height,
+                                                 target, method)
+            res.buffer[:] = out
+            return res
+        palette = [tuple(color) for color in target]
+        if not 1 <= len(palette) <= 256:
+            raise ValueError("A palette must have from 1 to 256 colors.")
+        if self.mode not in (L, RGB):
+            raise ValueError("Only L and RGB images can be dithered to a "
+                             "palette.")
+        res = Image(L, size=self.size)
+        res.buffer[:] = dither.dither_palette(data, width, height,
+                                              self.components, palette,
+                                              method)
+        res.info["palette"] = palette
+        return res
+
     def pixels(self):
         """pixels() -> iterator[pixel]
 
@@ -377,7 +458,8 @@ class Image(ImageMixin):
         image.
     """
 
-    def __init__(self, mode=None, size=None, color=None, source=None):
+    def __init__(self, mode=None, size=None, color=None, source=None,
+                 loader=None):
         """
         ``mode`` must be one of the constants in the ``MODES`` set,
 
@@ -401,11 +483,18 @@ class Image(ImageMixin):
         If ``source`` is present and is an image, ``mode`` and/or ``size``
         can be omitted; if they are specified and are different from the
         source mode and/or size, the source image is converted.
+
+        ``loader`` is a callable taking no arguments; if it is given along
+        with ``mode`` and ``size``, the buffer is not allocated until the
+        pixel data is first accessed, at which point it is allocated and
+        ``loader`` is called to fill it.  Image formats use this to defer
+        decoding until it is needed.
         """
         self._mode = None
         self._size = None
         self._buffer = None
-        self.info = {}
+        self._loader = None
+        self.info = util.DeferredDict()
 
         if mode is not None:
             if mode not in MODES:
@@ -452,29 +541,59 @@ class Image(ImageMixin):
                 raise ValueError("color must be an iterable with {} values, "
                                  "one for each component in {}.".format(
                                      self.components, self.mode))
-            # initialize buffer to the correct size and color
-            _buffer = util.initialize_buffer(mode, size, color)
-
-            # TODO: externalize this structure building stuff
-            line_struct = type("LineBuffer", (Line,), {
-                    "_fields_": [("pixels", mode.pixel_cls*self.size.width)],
-                    "image_cls": self.__class__,
-                    "mode": self.mode
-                })
-
-            image_struct = type("ImageBuffer", (_Image,),
-                    {"_fields_": [("lines", line_struct*self.size.height)]})
-
-            self._image_data = image_struct.from_buffer(_buffer)
-            self._buffer = memoryview(_buffer)
+            if loader is None:
+                self._allocate(color)
+            else:
+                self._loader = loader
 
         else:
             raise ValueError("You must minimally specify a source from "
                              "which to build the image or a mode and size "
                              "with which to initialize the buffer.")
 
+    def _allocate(self, color=None):
+        # initialize buffer to the correct size and color
+        if self.planar:
+            # one plane after another, each as subsampled as its component,
+            # and no lines of pixels to map onto them
+            if color is None:
+                color = self.mode.transparent_color
+            _buffer = bytearray()
+            for value, (sub_x, sub_y) in zip(color, self.subsampling):
+                _buffer += bytes((value,)) * ((self.size.width // sub_x) *
+                                              (self.size.height // sub_y))
+            self._image_data = None
+            self._buffer = memoryview(_buffer)
+            return
+        _buffer = util.initialize_buffer(self.mode, self.size, color)
+
+        # TODO: externalize this structure building stuff
+        line_struct = type("LineBuffer", (Line,), {
+                "_fields_": [("pixels", self.mode.pixel_cls*self.size.width)],
+                "image_cls": self.__class__,
+                "mode": self.mode
+            })
+
+        image_struct = type("ImageBuffer", (_Image,),
+                {"_fields_": [("lines", line_struct*self.size.height)]})
+
+        self._image_data = image_struct.from_buffer(_buffer)
+        self._buffer = memoryview(_buffer)
+
+    def _load(self):
+        """Allocate the buffer of a deferred image and fill it."""
+        loader, self._loader = self._loader, None
+        self._allocate()
+        try:
+            loader()
+        except:
+            self._loader = loader
+            raise
+
     @property
     def lines(self):
+        if self._loader is not None:
+            self._load()
         return self._image_data.lines
 
     def __str__(self):
@@ -494,6 +613,8 @@ class Image(ImageMixin):
 
     @util.readonly_property
     def buffer(self):
+        if self._loader is not None:
+            self._load()
         return self._buffer
 
     @util.readonly_property
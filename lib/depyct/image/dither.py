@@ -0,0 +1,237 @@
+# depyct/image/dither.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+"""Dithering.
+
+Error diffusion works a row at a time with integer error rows, one for the
+row being dithered and one for each row below it that the kernel reaches,
+which are cleared and reused as the rows go by.  Ordered dithering looks
+every pixel up in one of 64 tables precomputed from an 8x8 Bayer matrix,
+so that a row of one channel is dithered with eight ``translate`` calls.
+
+"""
+from depyct import util
+from .mode import L, LA, RGB, RGBA
+from .quantize import nearest_color
+
+
+__all__ = ["dither_levels", "dither_palette", "bilevel", "bilevel_rows",
+           "KERNELS", "METHODS", "BAYER"]
+
+# error diffusion kernels: (dx, dy, weight) taps and the divisor
+KERNELS = {
+    "floyd-steinberg": (((1, 0, 7), (-1, 1, 3), (0, 1, 5), (1, 1, 1)), 16),
+    "atkinson": (((1, 0, 1), (2, 0, 1), (-1, 1, 1), (0, 1, 1), (1, 1, 1),
+                  (0, 2, 1)), 8),
+    "sierra": (((1, 0, 5), (2, 0, 3), (-2, 1, 2), (-1, 1, 4), (0, 1, 5),
+                (1, 1, 4), (2, 1, 2), (-1, 2, 2), (0, 2, 3), (1, 2, 2)), 32),
+    "sierra-2": (((1, 0, 4), (2, 0, 3), (-2, 1, 1), (-1, 1, 2), (0, 1, 3),
+                  (1, 1, 2), (2, 1, 1)), 16),
+    "sierra-lite": (((1, 0, 2), (-1, 1, 1), (0, 1, 1)), 4),
+}
+
+METHODS = tuple(KERNELS) + ("bayer",)
+
+
+def _bayer(size):
+    if size == 1:
+        return [[0]]
+    m = _bayer(size // 2)
+    return ([[4 * v for v in row] + [4 * v + 2 for v in row] for row in m] +
+            [[4 * v + 3 for v in row] + [4 * v + 1 for v in row]
+             for row in m])
+
+
+BAYER = _bayer(8)
+
+# kernels reach at most two pixels either side
+_PAD = 2
+
+_BLACK = bytes(int(v == 0) for v in range(256))
+
+
+def dither_levels(plane, width, height, bits, method):
+    """Dither ``plane``, one 8-bit channel of an image, to ``2 ** bits``
+    levels spread evenly from 0 to 255, returning the dithered plane.
+
+    """
+    top = (1 << bits) - 1
+    if method == "bayer":
+        return _ordered_levels(plane, width, height, top)
+    nearest = bytes((v * top * 2 + 255) // 510 * 255 // top
+                    for v in range(256))
+    return _diffuse(plane, width, height, nearest, KERNELS[method])
+
+
+def _ordered_levels(plane, width, height, top):
+    # one table per cell of the matrix: the level that the value plus the
+    # cell's threshold falls in
+    tables = [[bytes(min(top, (v * top * 128 + 255 * (2 * t + 1)) //
+                              (255 * 128)) * 255 // top for v in range(256))
+               for t in row] for row in BAYER]
+    out = bytearray(len(plane))
+    for y in range(height):
+        start = y * width
+        line = bytes(plane[start:start + width])
+        row = bytearray(width)
+        for phase, table in enumerate(tables[y % 8]):
+            row[phase::8] = line[phase::8].translate(table)
+        out[start:start + width] = row
+    return out
+
+
+def _error_rows(kernel, size):
+    depth = max(dy for _, dy, _ in kernel[0])
+    return [[0] * size for _ in range(depth + 1)]
+
+
+def _diffuse(plane, width, height, nearest, kernel):
+    taps, divisor = kernel
+    rows = _error_rows(kernel, width + 2 * _PAD)
+    zero = [0] * len(rows[0])
+    half = divisor // 2
+    out = bytearray(len(plane))
+    for y in range(height):
+        start = y * width
+        here = rows[0]
+        spread = [(rows[dy], dx + _PAD, w) for dx, dy, w in taps]
+        for x in range(width):
+            v = plane[start + x] + (here[x + _PAD] + half) // divisor
+            if v < 0:
+                v = 0
+            elif v > 255:
+                v = 255
+            q = nearest[v]
+            out[start + x] = q
+            e = v - q
+            if e:
+                for row, offset, w in spread:
+                    row[x + offset] += e * w
+        rows.append(rows.pop(0))
+        rows[-1][:] = zero
+    return out
+
+
+def dither_palette(data, width, height, channels, palette, method):
+    """Dither the 8-bit ``L`` or ``RGB`` pixels ``data`` to ``palette``, a
+    sequence of ``(r, g, b)`` tuples, returning the palette indices.
+
+    Colors are matched with :func:`~depyct.image.quantize.nearest_color`,
+    which searches each 5:6:5 cell only once.
+
+    """
+    lookup = nearest_color(palette)
+    if channels == 1:
+        pixels = [(v, v, v) for v in data]
+    else:
+        pixels = list(zip(data[0::3], data[1::3], data[2::3]))
+    if method == "bayer":
+        return _ordered_palette(pixels, width, height, palette, lookup)
+    return _diffuse_palette(pixels, width, height, palette, lookup,
+                            KERNELS[method])
+
+
+def _ordered_palette(pixels, width, height, palette, lookup):
+    # spread the thresholds over the distance between neighboring colors
+    # of an evenly spaced palette of the same size
+    steps = max(1.0, len(palette) ** (1 / 3) - 1)
+    spread = 255 / steps
+    offsets = [[int(((2 * t + 1) / 128 - 0.5) * spread) for t in row]
+               for row in BAYER]
+    out = bytearray(width * height)
+    for y in range(height):
+        start = y * width
+        row = offsets[y % 8]
+        for x in range(width):
+            o = row[x % 8]
+            r, g, b = pixels[start + x]
+            r = min(255, max(0, r + o))
+            g = min(255, max(0, g + o))
+            b = min(255, max(0, b + o))
+            out[start + x] = lookup(r << 16 | g << 8 | b)
+    return out
+
+
+def _diffuse_palette(pixels, width, height, palette, lookup, kernel):
+    taps, divisor = kernel
+    rows = _error_rows(kernel, 3 * (width + 2 * _PAD))
+    zero = [0] * len(rows[0])
+    half = divisor // 2
+    out = bytearray(width * height)
+    for y in range(height):
+        start = y * width
+        here = rows[0]
+        spread = [(rows[dy], 3 * (dx + _PAD), w) for dx, dy, w in taps]
+        for x in range(width):
+            i = 3 * (x + _PAD)
+            r, g, b = pixels[start + x]
+            r = min(255, max(0, r + (here[i] + half) // divisor))
+            g = min(255, max(0, g + (here[i+1] + half) // divisor))
+            b = min(255, max(0, b + (here[i+2] + half) // divisor))
+            index = lookup(r << 16 | g << 8 | b)
+            out[start + x] = index
+            pr, pg, pb = palette[index]
+            er, eg, eb = r - pr, g - pg, b - pb
+            if er or eg or eb:
+                for row, offset, w in spread:
+                    j = 3 * x + offset
+                    row[j] += er * w
+                    row[j+1] += eg * w
+                    row[j+2] += eb * w
+        rows.append(rows.pop(0))
+        rows[-1][:] = zero
+    return out
+
+
+def bilevel(data, width, height, channels, method):
+    """Dither the 8-bit ``L``, ``LA``, ``RGB`` or ``RGBA`` pixels ``data``
+    to black and white, ignoring alpha, and return one byte per pixel: 1
+    for black and 0 for white.
+
+    """
+    if channels < 3:
+        gray = bytes(data[0::channels])
+    else:
+        gray = bytes(map(lambda r, g, b: (r * 77 + g * 150 + b * 29) >> 8,
+                         data[0::channels], data[1::channels],
+                         data[2::channels]))
+    plane = dither_levels(gray, width, height, 1, method)
+    return bytes(plane).translate(_BLACK)
+
+
+def bilevel_rows(image, clip, method, fail):
+    """Yield the rows of ``image`` with one byte per pixel, for writing it
+    as a bilevel image: 1 for black when ``method`` dithers the image, or
+    else 1 where ``clip(pixel, image)`` is true and 0 elsewhere.
+
+    When ``clip`` is ``None`` pixels other than the transparent color of
+    the mode are 1, and the rows of 8-bit images are thresholded against
+    it through lookup tables.  ``fail`` is called with a message when
+    ``image`` can't be dithered with ``method``.
+
+    """
+    if method is not None:
+        if image.mode not in (L, LA, RGB, RGBA):
+            fail("Only 8-bit L, LA, RGB and RGBA images can be dithered.")
+        if method not in METHODS:
+            fail("Unknown dithering method {!r}.".format(method))
+        width, height = image.size
+        bits = bilevel(bytes(image.buffer), width, height, image.components,
+                       method)
+        for start in range(0, len(bits), width):
+            yield bits[start:start + width]
+        return
+    if clip is None and image.mode.bits_per_component == 8:
+        tables = util.threshold_tables(image.mode.transparent_color)
+        line_size = image.size.width * image.bytes_per_pixel
+        buffer = image.buffer
+        for start in range(0, len(buffer), line_size):
+            yield util.threshold_row(buffer[start:start + line_size], tables)
+        return
+    if clip is None:
+        transparent = image.mode.transparent_color
+        clip = lambda p, im: p.value != transparent
+    for line in image:
+        yield bytes(int(bool(clip(p, image))) for p in line)
@@ -0,0 +1,256 @@
+# depyct/image/quantize.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+"""Color quantization.
+
+Colors are handled as integers packed ``0xRRGGBB`` rather than as
+:class:`~depyct.image.pixel.Pixel` objects: a whole image is packed with a
+few slice assignments and counted with :class:`collections.Counter`, and
+the palette builders only ever look at the distinct colors.
+
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import sys
+
+
+__all__ = ["quantize", "pack_colors", "median_cut", "octree",
+           "nearest_color", "METHODS", "TRANSPARENT"]
+
+# packed pixels at or above this are less than half opaque
+TRANSPARENT = 1 << 24
+
+# byte positions of blue, green, red and the transparency flag in a packed
+# color stored as a native unsigned int
+_LAYOUT = (0, 1, 2, 3) if sys.byteorder == "little" else (3, 2, 1, 0)
+_UNDER_HALF = bytes(int(a < 128) for a in range(256))
+
+# bit interleaving for octree paths: bit i of a byte moved to bit 3 * i
+_SPREAD = [sum(((v >> i) & 1) << (3 * i) for i in range(8))
+           for v in range(256)]
+
+
+def quantize(data, channels, colors=256, method="mediancut"):
+    """Reduce the 8-bit ``RGB`` or ``RGBA`` pixels ``data`` to palette
+    indices.
+
+    Returns the indices as :class:`bytes`, the palette as a list of
+    ``(r, g, b)`` tuples and the index of the transparent entry, which is
+    only added for ``RGBA`` data with pixels less than half opaque, or
+    ``None``.  Images with no more than ``colors`` colors keep them exactly.
+
+    """
+    try:
+        build = METHODS[method]
+    except KeyError:
+        raise ValueError("Unknown quantization method {!r}.".format(method))
+    if not 1 <= colors <= 256:
+        raise ValueError("colors must be between 1 and 256.")
+    packed = pack_colors(data, channels)
+    histogram = Counter(packed)
+    clear = [color for color in histogram if color >= TRANSPARENT]
+    for color in clear:
+        del histogram[color]
+    if clear:
+        colors = max(1, colors - 1)
+    if len(histogram) <= colors:
+        palette = [(c >> 16, c >> 8 & 0xff, c & 0xff)
+                   for c in sorted(histogram)]
+        index_of = {c: i for i, c in enumerate(sorted(histogram))}
+    else:
+        palette = build(histogram, colors)
+        lookup = nearest_color(palette)
+        index_of = {c: lookup(c) for c in histogram}
+    transparent = None
+    if clear:
+        transparent = len(palette)
+        palette.append((0, 0, 0))
+        index_of.update(dict.fromkeys(clear, transparent))
+    return bytes(map(index_of.__getitem__, packed)), palette, transparent
+
+
+def pack_colors(data, channels):
+    """Pack the 8-bit ``RGB`` or ``RGBA`` pixels ``data`` into an array of
+    ``0xRRGGBB`` integers.  Pixels of ``RGBA`` data less than half opaque
+    have :data:`TRANSPARENT` added.
+
+    """
+    count = len(data) // channels
+    packed = bytearray(4 * count)
+    b, g, r, flag = _LAYOUT
+    packed[r::4] = data[0::channels]
+    packed[g::4] = data[1::channels]
+    packed[b::4] = data[2::channels]
+    if channels == 4:
+        packed[flag::4] = bytes(data[3::4]).translate(_UNDER_HALF)
+    colors = array("I")
+    if colors.itemsize != 4:
+        colors = array("L")
+    colors.frombytes(packed)
+    return colors
+
+
+def _mean(box, histogram):
+    total = r = g = b = 0
+    for color in box:
+        n = histogram[color]
+        total += n
+        r += (color >> 16) * n
+        g += (color >> 8 & 0xff) * n
+        b += (color & 0xff) * n
+    half = total // 2
+    return ((r + half) // total, (g + half) // total, (b + half) // total)
+
+
+def median_cut(histogram, colors):
+    """Build a palette of at most ``colors`` colors from ``histogram``, a
+    mapping of packed colors to pixel counts, by median cut.
+
+    The box whose widest channel spans the most pixels times values is
+    split at the pixel median of that channel until there are ``colors``
+    boxes; each gives the mean of its colors weighted by their counts.
+
+    """
+    boxes = [_box(list(histogram), histogram)]
+    while len(boxes) < colors:
+        i = max(range(len(boxes)), key=lambda i: boxes[i][0])
+        score, shift, box = boxes[i]
+        if not score:
+            break
+        box.sort(key=lambda c: c >> shift & 0xff)
+        half = sum(map(histogram.__getitem__, box)) / 2
+        seen = 0
+        for cut, color in enumerate(box[:-1], 1):
+            seen += histogram[color]
+            if seen >= half:
+                break
+        # keep equal values of the channel in the same box
+        value = box[cut-1] >> shift & 0xff
+        while cut < len(box) - 1 and box[cut] >> shift & 0xff == value:
+            cut += 1
+        boxes[i:i+1] = _box(box[:cut], histogram), _box(box[cut:], histogram)
+    return [_mean(box, histogram) for _, _, box in boxes]
+
+
+def _box(box, histogram):
+    """Return ``(score, shift, box)`` for a median cut box, where ``shift``
+    selects its widest channel.
+
+    """
+    spread, shift = max((max(values) - min(values), shift)
+                        for shift in (16, 8, 0)
+                        for values in [[c >> shift & 0xff for c in box]])
+    return spread * sum(map(histogram.__getitem__, box)), shift, box
+
+
+def octree(histogram, colors):
+    """Build a palette of at most ``colors`` colors from ``histogram``, a
+    mapping of packed colors to pixel counts, with an octree.
+
+    Each color is a leaf at depth 8, addressed by its channels' bits
+    interleaved.  A level at a time, leaves are folded into their parents,
+    those covering the fewest pixels first, until no more than ``colors``
+    leaves remain.
+
+    """
+    nodes = {}
+    for color, n in histogram.items():
+        r, g, b = color >> 16, color >> 8 & 0xff, color & 0xff
+        nodes[_SPREAD[r] << 2 | _SPREAD[g] << 1 | _SPREAD[b]] = \
+            [n, r * n, g * n, b * n]
+    while len(nodes) > colors:
+        parents = {}
+        for code, stats in nodes.items():
+            parents.setdefault(code >> 3, []).append(stats)
+        excess = len(nodes) - colors
+        if len(parents) > colors:
+            nodes = {code: _merge(children)
+                     for code, children in parents.items()}
+            continue
+        leaves = []
+        for code, children in sorted(parents.items(),
+                                     key=lambda item: _population(item[1])):
+            if excess > 0 and len(children) > 1:
+                excess -= len(children) - 1
+                leaves.append(_merge(children))
+            else:
+                leaves.extend(children)
+        nodes = dict(enumerate(leaves))
+    palette = []
+    for n, r, g, b in nodes.values():
+        half = n // 2
+        palette.append(((r + half) // n, (g + half) // n, (b + half) // n))
+    return palette
+
+
+def _population(children):
+    return sum(stats[0] for stats in children)
+
+
+def _merge(children):
+    return [sum(stats[i] for stats in children) for i in range(4)]
+
+
+def nearest_color(palette):
+    """Return a function mapping a packed color to the index of the nearest
+    color of ``palette``, a sequence of ``(r, g, b)`` tuples.
+
+    Colors are looked up by their 5:6:5 bit prefix, and each prefix is only
+    searched once, starting from the palette entries nearest in red and
+    moving outwards until red alone puts the rest further away than the
+    best match found.
+
+    """
+    order = sorted(range(len(palette)), key=lambda i: palette[i])
+    reds = [palette[i][0] for i in order]
+    entries = [(palette[i][0], palette[i][1], palette[i][2], i)
+               for i in order]
+    cache = {}
+
+    def search(key):
+        # the middle of the 5:6:5 cell
+        r = (key >> 8 & 0xf8) | 4
+        g = (key >> 3 & 0xfc) | 2
+        b = (key << 3 & 0xf8) | 4
+        best, found = 1 << 20, 0
+        up = bisect_left(reds, r)
+        down = up - 1
+        while up < len(entries) or down >= 0:
+            if up < len(entries):
+                er, eg, eb, i = entries[up]
+                d = (er - r) ** 2
+                if d >= best:
+                    up = len(entries)
+                else:
+                    d += (eg - g) ** 2 + (eb - b) ** 2
+                    if d < best:
+                        best, found = d, i
+                    up += 1
+            if down >= 0:
+                er, eg, eb, i = entries[down]
+                d = (er - r) ** 2
+                if d >= best:
+                    down = -1
+                else:
+                    d += (eg - g) ** 2 + (eb - b) ** 2
+                    if d < best:
+                        best, found = d, i
+                    down -= 1
+        cache[key] = found
+        return found
+
+    def lookup(color):
+        key = (color >> 8 & 0xf800) | (color >> 5 & 0x07e0) | \
+              (color >> 3 & 0x001f)
+        try:
+            return cache[key]
+        except KeyError:
+            return search(key)
+
+    return lookup
+
+
+METHODS = {"mediancut": median_cut, "octree": octree}
@@ -3,3 +3,27 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+"""Image input and output.
+
+"""
+import os
+
+
+def verify(path, full=False, **options):
+    """Check the file at `path` for truncation and corruption without
+    decoding its pixels, using the format registered for its extension.
+
+    Returns a list of ``(offset, message)`` pairs, one for each problem
+    found; an empty list means the file is intact.  See
+    :meth:`~depyct.io.format.FormatBase.verify`.
+
+    """
+    from depyct.image import Image
+    from depyct.io.format import registry
+
+    ext = os.path.splitext(path)[1][1:]
+    try:
+        format = registry[ext.lower()](Image, **options)
+    except KeyError:
+        raise IOError("{} is not a recognized image format.".format(ext))
+    return format.verify(path, full)
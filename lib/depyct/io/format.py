@@ -291,21 +291,23 @@ class FormatBase(metaclass=FormatMeta):
     def open(self, source):
         """Load an image from `source` and return it.
 
+        Files opened by name are closed once :meth:`read` returns; formats
+        that defer decoding to :meth:`load` should reopen
+        :attr:`filename`.  File objects are left open for the caller to
+        close.
+
         :param source: string filename or object supporting file protocol
         :rtype: :class:`~depyct.image.ImageMixin`
 
         """
         if isinstance(source, util.string_type):
-            self.fp = open(source, "rb")
+            self.filename = source
+            with open(source, "rb") as self.fp:
+                return self.read()
         else:
+            self.filename = None
             self.fp = source
-
-        im = self.read()
-
-        if not self.fp.closed:
-            self.fp.close()
-
-        return im
+            return self.read()
 
     @abc.abstractmethod
     def read(self):
@@ -316,6 +318,29 @@ class FormatBase(metaclass=FormatMeta):
         raise NotImplementedError("{}.{} is not yet implemented".format(
                                   self.__class__.__name__, "load"))
 
+    def verify(self, source, full=False):
+        """Check the structure of `source` without decoding its pixels.
+
+        :param source: string filename or object supporting file protocol
+        :param full: also check the compressed image data, where the format
+          allows that without decoding pixels
+        :rtype: list of ``(offset, message)`` pairs, one for each problem
+          found, empty if the file is intact
+
+        """
+        if isinstance(source, util.string_type):
+            self.filename = source
+            with open(source, "rb") as self.fp:
+                return self.check(full)
+        else:
+            self.filename = None
+            self.fp = source
+            return self.check(full)
+
+    def check(self, full=False):
+        raise NotImplementedError("{}.{} is not yet implemented".format(
+                                  self.__class__.__name__, "check"))
+
     def save(self, image, destination):
         """Save `image` to `file`.
 
@@ -326,11 +351,12 @@ class FormatBase(metaclass=FormatMeta):
         """
         self.image = image
         if isinstance(destination, util.string_type):
-            self.fp = open(destination, "wb")
+            with open(destination, "wb") as self.fp:
+                self.write()
         else:
             # dealing with an open file descriptor already
             self.fp = destination
-        self.write()
+            self.write()
 
     @abc.abstractmethod
     def write(self):
@@ -1,60 +1,13 @@
 # depyct/io/plugins/bmp.py
-"""
-def process_image(name):
-    im = open(name, "rb")
-    file_header = read_bitmapfileheader(im)
-    dib_header_size = unpack(integer, im)
-    info_header = {12: read_bitmapcoreheader,
-                   40: read_bitmapinfoheader}[dib_header_size](im)
-    if info_header.compression == BI_BITFIELDS:
-        masks = ColorMask(*struct.unpack("<3I", im.read(12)))
-    else:
-        masks = None
-    if dib_header_size == 12:
-        color_struct = RGBTriple
-    else:
-        color_struct = RGBQuad
-
-    width, height = int(info_header.width), int(info_header.height)
-
-    class PaletteStruct(ctypes.LittleEndianStructure):
-
-        _fields_ = [("colors", color_struct * info_header.colors)]
-
-    palette = PaletteStruct.from_buffer_copy(im.read(ctypes.sizeof(PaletteStruct)))
-
-    row_size = (info_header.bits_per_pixel * width + 31) // 32 * 4
-    padding = row_size - (width * info_header.bits_per_pixel) // 8
-
-
-    class RowStruct(ctypes.LittleEndianStructure):
-        
-        _fields_ = [("pixels", ctypes.c_ubyte * width),
-                    ("padding", ctypes.c_ubyte * padding)]
-
-
-    class ImageStruct(ctypes.LittleEndianStructure):
-
-        _fields_ = [("rasters", RowStruct * height)]
-
-
-    image = Image(RGB, size=(width, height))
-
-    im.seek(file_header.offset)
-
-    image_data = ImageStruct.from_buffer_copy(im.read(info_header.image_size))
-
-    for y, raster in enumerate(image_data.rasters):
-        for x, idx in enumerate(raster.pixels):
-            color = palette.colors[idx]
-            image[x, height-y-1] = color.r, color.g, color.b
-
-    return image #indices
-
-"""
+from array import array
 import ctypes
+import re
+import sys
 
+from depyct.image.mode import L, RGB, RGBA
+from depyct.image.quantize import pack_colors
 from depyct.io.format import FormatBase
+from depyct import util
 
 
 def one_of(iterable, message):
@@ -132,7 +85,7 @@ class BMPCoreHeader(BMPStruct):
 
 
 COMPRESSION_METHODS = (
-         BI_RGB, BI_RLE8, BI_REL4, BI_BITFIELDS, BI_JPEG, 
+         BI_RGB, BI_RLE8, BI_RLE4, BI_BITFIELDS, BI_JPEG, 
          BI_PNG, BI_ALPHABITFIELDS
      ) = range(7)
 
@@ -259,47 +212,563 @@ class RGBQuad(RGBTriple):
     _fields_ = [("reserved", ctypes.c_ubyte)]
 
 
+# the masks implied by uncompressed 16 and 32-bit pixels
+DEFAULT_MASKS = {16: (0x7c00, 0x03e0, 0x001f, 0),
+                 32: (0xff0000, 0x00ff00, 0x0000ff, 0)}
+
+# runs worth encoding as a count in RLE8
+_RUNS = re.compile(b"(.)\\1{2,}", re.S)
+
+
 class BMPFormat(FormatBase):
-    """
+    """File format plugin for BMP images
+    ====================================
+
+    Every DIB header from the OS/2 1.x ``BITMAPCOREHEADER`` to
+    ``BITMAPV5HEADER`` is read, with 1, 2, 4 and 8-bit palette images,
+    including RLE4 and RLE8 compressed ones, 16 and 32-bit images with or
+    without bit field masks, and 24-bit images.  Images with a palette of
+    grays are read as ``L``, other palette images as ``RGB``, and images
+    with an alpha mask as ``RGBA``.  The resolution, in pixels per meter,
+    is stored in ``info["resolution"]`` when the file gives one.
+
+    ``L`` images are written as 8-bit palette images, ``RGB`` images as
+    24-bit ones and ``RGBA`` images as 32-bit ones with a V4 header and bit
+    field masks.
+
+    Options
+    -------
+
+    ``indexed``
+        When true, palette images are read as ``L`` images holding the
+        palette indices, with the palette in ``info["palette"]`` as a list
+        of ``(r, g, b)`` tuples.
+
+    ``palette``
+        When true, ``RGB`` images with no more than 256 colors are written
+        as 8-bit palette images.  ``L`` images are always written with a
+        palette: their ``info["palette"]`` if they have one, or else a
+        ramp of grays.
+
+    ``rle``
+        When true, 8-bit palette images are written with RLE8 compression.
 
     """
 
     extensions = ("bmp", "dib", "rle", "2bp")
-    mimetype = ("image/x-bmp",)
+    mimetypes = ("image/bmp", "image/x-bmp")
+    defaults = {
+        "indexed": False,
+        "palette": False,
+        "rle": False,
+    }
+
+    #: The number of bytes of image data converted and written at a time.
+    band_size = 1 << 20
 
     def read(self):
+        fh = BMPFileHeader.from_buffer_copy(
+                self._read_exactly(ctypes.sizeof(BMPFileHeader), "header"))
+        if fh.header != b"BM":
+            self.fail("Not a BMP file.")
+        dh = self._read_dib_header(fh.dib_header_size)
+        position = ctypes.sizeof(BMPFileHeader) + fh.dib_header_size - 4
+        core = isinstance(dh, BMPCoreHeader)
+        bits = dh.bits_per_pixel
+        compression = BI_RGB if core else dh.compression
+        if isinstance(dh, BMPCoreHeader2) and compression > BI_RLE4:
+            # OS/2 gives these Huffman 1D and RLE24, which are never seen
+            self.fail("Unsupported compression method {}.".format(
+                      compression))
+        width, height = dh.width, dh.height
+        bottom_up = height > 0
+        height = abs(height)
+        if width <= 0 or height == 0:
+            self.fail("Invalid image size {}x{}.".format(width, height))
+        if bits not in (1, 2, 4, 8, 16, 24, 32):
+            self.fail("Unsupported bit depth {}.".format(bits))
+        if compression in (BI_RLE8, BI_RLE4):
+            depth = 8 if compression == BI_RLE8 else 4
+            if bits != depth:
+                self.fail("RLE{0} compression needs {0}-bit pixels.".format(
+                          depth))
+            if not bottom_up:
+                self.fail("Top-down images cannot be compressed.")
+        elif compression in (BI_BITFIELDS, BI_ALPHABITFIELDS):
+            if bits not in (16, 32):
+                self.fail("Bit fields need 16 or 32-bit pixels.")
+        elif compression != BI_RGB:
+            self.fail("Unsupported compression method {}.".format(
+                      compression))
+
+        masks = None
+        if bits in (16, 32):
+            masks = DEFAULT_MASKS[bits]
+            if compression in (BI_BITFIELDS, BI_ALPHABITFIELDS):
+                if isinstance(dh, BMPV2InfoHeader):
+                    masks = (dh.red_mask, dh.green_mask, dh.blue_mask,
+                             getattr(dh, "alpha_mask", 0))
+                else:
+                    count = 4 if compression == BI_ALPHABITFIELDS else 3
+                    data = self._read_exactly(4 * count, "bit masks")
+                    position += 4 * count
+                    masks = tuple(array_from(data, "I")) + (0,) * (4 - count)
+
+        palette = None
+        if bits <= 8:
+            entry_size = 3 if core else 4
+            count = (0 if core else dh.colors) or 1 << bits
+            if fh.offset > position:
+                count = min(count, (fh.offset - position) // entry_size)
+            palette = self._read_exactly(entry_size * count, "palette")
+            position += entry_size * count
+        if fh.offset > position:
+            self._read_exactly(fh.offset - position, "file")
+        elif fh.offset < position:
+            self.fail("Pixel data overlaps the headers.")
+
+        if compression in (BI_RLE8, BI_RLE4):
+            size = dh.image_size
+            if size:
+                data = self.fp.read(size)
+                if len(data) < size:
+                    self.fail("Image data is truncated.")
+            else:
+                data = self.fp.read()
+            indices = self._rows(self._decode_rle(data, width, height, bits),
+                                 width, width, height, True)
+        else:
+            row_size = (bits * width + 31) // 32 * 4
+            data = self._read_pixels(row_size * height)
+            if bits < 8:
+                data = util.unpack_samples(data, bits)
+                row_size, bits = row_size * 8 // bits, 8
+            pixels = self._rows(data, row_size, width * bits // 8, height,
+                                bottom_up)
+            if bits == 8:
+                indices = pixels
+        if palette is not None:
+            im = self._expand_palette(indices, palette, entry_size, width,
+                                      height)
+        elif bits == 24:
+            im = self.image_cls(RGB, size=(width, height))
+            im.buffer[:] = self._swizzle(pixels, 3, (2, 1, 0))
+        else:
+            im = self._apply_masks(pixels, bits // 8, masks, width, height)
+
+        if not core and (dh.horizontal_resolution or
+                         dh.vertical_resolution):
+            im.info["resolution"] = (dh.horizontal_resolution,
+                                     dh.vertical_resolution)
+        return im
+
+    def _read_exactly(self, size, what):
+        data = self.fp.read(size)
+        if len(data) < size:
+            self.fail("File truncated in the {}.".format(what))
+        return data
+
+    def _read_dib_header(self, size):
+        headers = {ctypes.sizeof(h) + 4: h for h in DIB_HEADERS}
+        if size in headers:
+            header = headers[size]
+        elif 16 <= size < ctypes.sizeof(BMPCoreHeader2) + 4:
+            # OS/2 2.x headers may leave off any fields past the first four
+            header = BMPCoreHeader2
+        else:
+            self.fail("Unsupported DIB header size {}.".format(size))
+        data = self._read_exactly(size - 4, "DIB header")
+        return header.from_buffer_copy(data.ljust(ctypes.sizeof(header),
+                                                  b"\x00"))
+
+    def _read_pixels(self, size):
+        """Read the pixel array into a single buffer."""
+        data = bytearray(size)
+        view = memoryview(data)
+        got = 0
+        while got < size:
+            count = self.fp.readinto(view[got:])
+            if not count:
+                self.fail("Image data is truncated.")
+            got += count
+        return data
+
+    def _rows(self, data, row_size, line_size, height, bottom_up):
+        """Return the pixels of ``data``, rows of ``row_size`` bytes stored
+        bottom-up or top-down, as top-down rows of ``line_size`` bytes with
+        the padding dropped.  Rows are only copied once, when they are
+        joined; top-down data without padding is returned as it is.
+
         """
+        if not bottom_up and row_size == line_size:
+            return data
+        view = memoryview(data)
+        order = range(height - 1, -1, -1) if bottom_up else range(height)
+        return b"".join([view[y*row_size:y*row_size + line_size]
+                         for y in order])
+
+    def _decode_rle(self, data, width, height, bits):
+        """Decode RLE8 or RLE4 ``data`` into bottom-up rows of indices.
+        Pixels skipped by deltas or the ends of lines are left 0.
 
         """
-        im = open(filename, "rb")
-        fh = BMPFileHeader.read(im)
-        dib_size = fh.dib_header_size
-        dib_header = {ctypes.sizeof(h) + 4: h for h in DIB_HEADERS}[dib_size]
-        dh = dib_header.read(im)
-        # deal with bit masks
-        # determine mode
-        # get size
-        # read in the palette
-        # calculate rowsize
-        # determine if the file is large enough to have valid data
-        # read in rows
-        # if necessary, read in icc profile data
-        
+        out = bytearray(width * height)
+        high, low = util.UNPACK_TABLES[4]
+        x = y = 0
+        i = 0
+        end = len(data) - 1
+        while i < end and y < height:
+            count, value = data[i], data[i+1]
+            i += 2
+            if count:
+                if bits == 8:
+                    run = bytes((value,)) * count
+                else:
+                    run = bytes((value >> 4, value & 0x0f)) * \
+                          ((count + 1) // 2)
+            elif value == 0:
+                x, y = 0, y + 1
+                continue
+            elif value == 1:
+                break
+            elif value == 2:
+                if i + 1 >= len(data):
+                    break
+                x, y = x + data[i], y + data[i+1]
+                i += 2
+                continue
+            else:
+                count = value
+                size = count if bits == 8 else (count + 1) // 2
+                run = data[i:i+size]
+                # absolute runs are padded to a whole number of words
+                i += size + (size & 1)
+                if bits == 4:
+                    nibbles = bytearray(2 * len(run))
+                    nibbles[0::2] = run.translate(high)
+                    nibbles[1::2] = run.translate(low)
+                    run = nibbles
+            if x < width:
+                run = run[:min(count, width - x)]
+                out[y*width + x:y*width + x + len(run)] = run
+            x += count
+        return out
+
+    def _expand_palette(self, indices, palette, entry_size, width, height):
+        tables = [palette[c::entry_size].ljust(256, b"\x00")
+                  for c in (2, 1, 0)]
+        if self.config["indexed"]:
+            im = self.image_cls(L, size=(width, height))
+            im.buffer[:] = indices
+            im.info["palette"] = list(zip(*(t[:len(palette) // entry_size]
+                                            for t in tables)))
+        elif tables[0] == tables[1] == tables[2]:
+            im = self.image_cls(L, size=(width, height))
+            im.buffer[:] = bytes(indices).translate(tables[0])
+        else:
+            im = self.image_cls(RGB, size=(width, height))
+            im.buffer[:] = util.expand_palette(bytes(indices), tables)
+        return im
+
+    def _swizzle(self, pixels, size, order):
+        """Pick the bytes at ``order`` out of every ``size`` bytes of
+        ``pixels``.
+
+        """
+        out = bytearray(len(pixels) // size * len(order))
+        for c, offset in enumerate(order):
+            out[c::len(order)] = pixels[offset::size]
+        return out
+
+    def _apply_masks(self, pixels, size, masks, width, height):
+        """Build an ``RGB`` or ``RGBA`` image from 16 or 32-bit ``pixels``
+        and the bit field ``masks`` of their red, green, blue and alpha.
+
+        Channels of a whole byte are taken with one strided slice; others
+        are looked up in a table for 16-bit pixels and shifted out for
+        32-bit ones.  Channels with an empty mask are left at zero.
 
-    def write(self):
         """
+        channels = list(masks) if masks[3] else list(masks[:3])
+        ints = None
+        out = bytearray(width * height * len(channels))
+        for c, mask in enumerate(channels):
+            if not mask:
+                continue
+            shift = (mask & -mask).bit_length() - 1
+            top = mask >> shift
+            if top & (top + 1):
+                self.fail("Bit field masks must be contiguous.")
+            if top == 0xff and shift % 8 == 0:
+                out[c::len(channels)] = pixels[shift // 8::size]
+                continue
+            if ints is None:
+                ints = array_from(pixels, "H" if size == 2 else "I")
+            if top > 0xff:
+                shift += top.bit_length() - 8
+                top = 0xff
+            scale = [(v * 255 + top // 2) // top if top else 0
+                     for v in range(top + 1)]
+            if size == 2:
+                table = bytes(scale[(v >> shift) & top]
+                              for v in range(1 << 16))
+                out[c::len(channels)] = bytes(map(table.__getitem__, ints))
+            else:
+                out[c::len(channels)] = bytes(scale[(p >> shift) & top]
+                                              for p in ints)
+        im = self.image_cls(RGBA if len(channels) == 4 else RGB,
+                            size=(width, height))
+        im.buffer[:] = out
+        return im
+
+    def write(self):
+        im = self.image
+        width, height = im.size
+        indices = palette = None
+        if im.mode == L:
+            indices = im.buffer
+            if "palette" in im.info:
+                palette = [tuple(bytes(c)[:3]) for c in im.info["palette"]]
+            else:
+                palette = [(v, v, v) for v in range(256)]
+        elif im.mode == RGB and self.config["palette"]:
+            indices, palette = self._index_colors(im)
+        elif im.mode not in (RGB, RGBA):
+            self.fail("Images with mode {} cannot be saved as BMP.".format(
+                      im.mode))
+
+        if palette is not None:
+            if not 0 < len(palette) <= 256:
+                self.fail("The palette must have between 1 and 256 colors.")
+            bits, header = 8, BMPInfoHeader
+            compression = BI_RLE8 if self.config["rle"] else BI_RGB
+            colors = bytearray(4 * len(palette))
+            for c, channel in enumerate(zip(*palette)):
+                colors[2-c::4] = bytes(channel)
+        elif im.mode == RGB:
+            bits, header, compression, colors = 24, BMPInfoHeader, BI_RGB, b""
+        else:
+            bits, header, compression, colors = 32, BMPV4Header, \
+                BI_BITFIELDS, b""
+
+        row_size = (bits * width + 31) // 32 * 4
+        if compression == BI_RLE8:
+            pixels = self._encode_rle8(indices, width, height)
+            image_size = len(pixels)
+        else:
+            image_size = row_size * height
+        offset = ctypes.sizeof(BMPFileHeader) + ctypes.sizeof(header) + \
+            len(colors)
+        resolution = im.info.get("resolution", (0, 0))
+        self.fp.write(bytes(BMPFileHeader(
+            header=b"BM", size=offset + image_size, offset=offset,
+            dib_header_size=ctypes.sizeof(header) + 4)))
+        dib = header(width=width, height=height, color_planes=1,
+                     bits_per_pixel=bits, compression=compression,
+                     image_size=image_size,
+                     horizontal_resolution=resolution[0],
+                     vertical_resolution=resolution[1],
+                     colors=len(palette) if palette is not None else 0)
+        if header is BMPV4Header:
+            dib.red_mask, dib.green_mask, dib.blue_mask, dib.alpha_mask = \
+                0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000
+            # LCS_WINDOWS_COLOR_SPACE
+            dib.color_space_type = 0x57696e20
+        self.fp.write(bytes(dib))
+        self.fp.write(colors)
+        if compression == BI_RLE8:
+            self.fp.write(pixels)
+        else:
+            self._write_rows(indices if palette is not None else im.buffer,
+                             bits // 8, row_size)
+
+    def _index_colors(self, im):
+        """Return the palette indices and palette of the ``RGB`` image
+        ``im``, or ``None`` for both if it has more than 256 colors.
 
         """
-        raise NotImplementedError
+        packed = pack_colors(im.buffer, 3)
+        distinct = set(packed)
+        if len(distinct) > 256:
+            return None, None
+        ordered = sorted(distinct)
+        index_of = {c: i for i, c in enumerate(ordered)}
+        palette = [(c >> 16, c >> 8 & 0xff, c & 0xff) for c in ordered]
+        return bytes(map(index_of.__getitem__, packed)), palette
+
+    def _write_rows(self, data, pixel_size, row_size):
+        """Write the rows of ``data``, pixels of ``pixel_size`` bytes,
+        bottom-up, with red and blue swapped and each row padded to
+        ``row_size`` bytes.
+
+        Rows are gathered into bands of about :attr:`band_size` bytes; each
+        band is swizzled with one strided slice assignment per channel and
+        written with a single call, its rows joined by their padding.
 
-    def check(self):
         """
+        width, height = self.image.size
+        line_size = width * pixel_size
+        padding = bytes(row_size - line_size)
+        rows = max(1, self.band_size // row_size)
+        order = (2, 1, 0, 3)[:pixel_size]
+        for end in range(height, 0, -rows):
+            start = max(0, end - rows)
+            band = data[start*line_size:end*line_size]
+            if pixel_size > 1:
+                band = self._swizzle(band, pixel_size, order)
+            view = memoryview(band)
+            self.fp.write(padding.join(
+                    [view[y*line_size:(y+1)*line_size]
+                     for y in range(end - start - 1, -1, -1)]) + padding)
+
+    def _encode_rle8(self, indices, width, height):
+        """Return ``indices`` compressed with RLE8, bottom row first.
+
+        Runs of three or more pixels are found with a regular expression
+        and encoded as counts; what lies between them goes out in absolute
+        mode, or as runs of one when it is too short for that.
 
         """
-        raise NotImplementedError
+        lines = []
+        for y in range(height - 1, -1, -1):
+            row = bytes(indices[y*width:(y+1)*width])
+            out = bytearray()
+            last = 0
+            for m in _RUNS.finditer(row):
+                self._encode_literal(out, row[last:m.start()])
+                value, count = row[m.start()], m.end() - m.start()
+                out += bytes((255, value)) * (count // 255)
+                if count % 255:
+                    out += bytes((count % 255, value))
+                last = m.end()
+            self._encode_literal(out, row[last:])
+            lines.append(out)
+        return b"\x00\x00".join(lines) + b"\x00\x01"
+
+    def _encode_literal(self, out, literal):
+        for start in range(0, len(literal), 254):
+            chunk = literal[start:start+254]
+            if len(chunk) < 3:
+                for value in chunk:
+                    out += bytes((1, value))
+            else:
+                out += bytes((0, len(chunk))) + chunk + bytes(len(chunk) & 1)
+
+    def check(self, full=False):
+        """Check the file and DIB headers and that the file holds as much
+        pixel data as they call for.  With ``full`` RLE data is also walked,
+        without decoding it, to check that its runs stay inside the image
+        and that it ends with an end of bitmap marker.
 
-    def load(self):
         """
+        data = self.fp.read(ctypes.sizeof(BMPFileHeader))
+        if data[:2] != b"BM":
+            return [(0, "Not a BMP file.")]
+        if len(data) < ctypes.sizeof(BMPFileHeader):
+            return [(2, "File truncated in the header.")]
+        fh = BMPFileHeader.from_buffer_copy(data)
+        try:
+            dh = self._read_dib_header(fh.dib_header_size)
+        except IOError as err:
+            return [(14, str(err))]
+        problems = []
+        core = isinstance(dh, BMPCoreHeader)
+        bits = dh.bits_per_pixel
+        compression = BI_RGB if core else dh.compression
+        width, height = dh.width, abs(dh.height)
+        if width <= 0 or height == 0:
+            problems.append((14, "Invalid image size {}x{}.".format(
+                                 width, height)))
+        if bits not in (1, 2, 4, 8, 16, 24, 32):
+            problems.append((14, "Unsupported bit depth {}.".format(bits)))
+        rle = compression in (BI_RLE8, BI_RLE4)
+        if rle:
+            depth = 8 if compression == BI_RLE8 else 4
+            if bits != depth:
+                problems.append((14, "RLE{0} compression needs {0}-bit "
+                                     "pixels.".format(depth)))
+            if dh.height < 0:
+                problems.append((14, "Top-down images cannot be "
+                                     "compressed."))
+        elif compression in (BI_BITFIELDS, BI_ALPHABITFIELDS):
+            if bits not in (16, 32):
+                problems.append((14, "Bit fields need 16 or 32-bit "
+                                     "pixels."))
+        elif compression != BI_RGB:
+            problems.append((14, "Unsupported compression method {}.".format(
+                                 compression)))
+        position = 14 + fh.dib_header_size
+        if fh.offset < position:
+            problems.append((10, "Pixel data overlaps the headers."))
+            return problems
+        if len(self.fp.read(fh.offset - position)) < fh.offset - position:
+            problems.append((position, "File truncated before the pixel "
+                                       "data."))
+            return problems
+
+        if rle:
+            size = dh.image_size
+            data = self.fp.read(size) if size else self.fp.read()
+            if len(data) < size:
+                problems.append((fh.offset, "Image data is truncated."))
+            elif full and not problems:
+                problem = self._walk_rle(data, width, height, bits)
+                if problem is not None:
+                    problems.append((fh.offset + problem[0], problem[1]))
+        elif not problems:
+            size = (bits * width + 31) // 32 * 4 * height
+            while size:
+                block = self.fp.read(min(size, self.band_size))
+                if not block:
+                    problems.append((fh.offset, "Image data is "
+                                                "truncated."))
+                    break
+                size -= len(block)
+        return problems
+
+    def _walk_rle(self, data, width, height, bits):
+        """Follow the runs, ends of lines and deltas of RLE8 or RLE4
+        ``data``, returning the offset of and a message for the first
+        problem found, or ``None``.
 
         """
-        raise NotImplementedError
+        x = y = 0
+        i = 0
+        while i + 1 < len(data):
+            start = i
+            count, value = data[i], data[i+1]
+            i += 2
+            if count:
+                x += count
+            elif value == 0:
+                x, y = 0, y + 1
+            elif value == 1:
+                return None
+            elif value == 2:
+                if i + 1 >= len(data):
+                    break
+                x, y = x + data[i], y + data[i+1]
+                i += 2
+            else:
+                size = value if bits == 8 else (value + 1) // 2
+                i += size + (size & 1)
+                if i > len(data):
+                    break
+                x += value
+            if x > width or y > height or (y == height and x):
+                return start, "RLE data runs outside the image."
+        return len(data), "RLE data has no end of bitmap marker."
+
+    def load(self):
+        pass
+
+
+def array_from(data, code):
+    """Return the little-endian integers of ``data`` as an array."""
+    values = array(code)
+    if values.itemsize != {"H": 2, "I": 4}[code]:
+        values = array("L")
+    values.frombytes(bytes(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
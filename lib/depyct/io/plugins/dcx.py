@@ -1,22 +1,137 @@
 # depyct/io/plugins/dcx.py
+from collections.abc import Sequence
+import io
+import struct
 
 from depyct.io.format import FormatBase
+from depyct.io.plugins.pcx import PCXFormat
+
+DCX_MAGIC = 987654321
+
+# the offset table has room for 1024 offsets, the last always zero
+MAX_PAGES = 1023
+
+
+class DCXPages(Sequence):
+    """The pages of a DCX file, each read and decoded only when it is
+    indexed.
+
+    """
+
+    def __init__(self, dcx):
+        self._dcx = dcx
+
+    def __len__(self):
+        return len(self._dcx.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        return self._dcx.read_page(index)
 
 
 class DCXFormat(FormatBase):
     """File format plugin for DCX images
     =================================
 
+    A DCX file is a table of the offsets of up to 1023 pages followed by
+    the pages, each a PCX image.  Reading decodes the first page and
+    stores the number of pages in ``info["pages"]``; :meth:`pages` gives
+    all of them as a sequence that reads only the page indexed.
+
+    Pages are written as :class:`~depyct.io.plugins.pcx.PCXFormat` writes
+    them.
+
+    Options
+    -------
+
+    ``indexed``
+        As for PCX, read palette images as ``L`` images of their palette
+        indices.
+
+    ``pages``
+        When writing, further images written as the pages after the image
+        itself.
+
     """
 
     extensions = ("dcx",)
     mimetypes = ("image/x-dcx",)
+    defaults = {
+        "indexed": False,
+        "pages": (),
+    }
 
     def read(self):
-        raise NotImplementedError
+        header = self.fp.read(4 * (MAX_PAGES + 2))
+        if len(header) < 4 or \
+                struct.unpack_from("<I", header)[0] != DCX_MAGIC:
+            self.fail("Not a DCX file.")
+        table = struct.unpack_from("<{}I".format(len(header) // 4 - 1),
+                                   header, 4)
+        self.offsets = []
+        for offset in table:
+            if not offset:
+                break
+            self.offsets.append(offset)
+        if not self.offsets:
+            self.fail("DCX file holds no pages.")
+        im = self.read_page(0)
+        im.info["pages"] = len(self.offsets)
+        return im
+
+    def pages(self):
+        """Return the pages of the image last opened as a sequence of
+        images, each page read from the file and decoded when it is
+        indexed.
+
+        """
+        return DCXPages(self)
+
+    def read_page(self, index):
+        """Read and decode page ``index`` of the image last opened, and
+        only that page.
+
+        """
+        start = self.offsets[index]
+        later = [offset for offset in self.offsets if offset > start]
+        size = min(later) - start if later else -1
+        if self.filename is not None:
+            with open(self.filename, "rb") as fp:
+                fp.seek(start)
+                data = fp.read(size)
+        else:
+            self.fp.seek(start)
+            data = self.fp.read(size)
+        page = PCXFormat(self.image_cls, indexed=self.config["indexed"])
+        try:
+            return page.open(io.BytesIO(data))
+        except IOError as err:
+            self.fail("DCX page {}: {}".format(index, err))
 
     def load(self):
-        raise NotImplementedError
+        pass
 
     def write(self):
-        raise NotImplementedError
+        images = [self.image] + list(self.config["pages"])
+        if len(images) > MAX_PAGES:
+            self.fail("DCX files hold at most {} pages.".format(MAX_PAGES))
+        pages = []
+        for im in images:
+            buffer = io.BytesIO()
+            PCXFormat(self.image_cls).save(im, buffer)
+            pages.append(buffer.getvalue())
+        offsets = []
+        position = 4 * (MAX_PAGES + 2)
+        for page in pages:
+            offsets.append(position)
+            position += len(page)
+        offsets += [0] * (MAX_PAGES + 1 - len(offsets))
+        self.fp.write(struct.pack("<{}I".format(MAX_PAGES + 2), DCX_MAGIC,
+                                  *offsets))
+        for page in pages:
+            self.fp.write(page)
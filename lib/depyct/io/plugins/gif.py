@@ -1,8 +1,12 @@
 # depyct/io/plugins/gif.py
+from collections import namedtuple
 import ctypes
+import re
+import struct
 
-from depyct.image.mode import RGB
+from depyct.image.mode import L, LA, RGB, RGBA
 from depyct.io.format import FormatBase
+from depyct import util
 
 
 class GIFStruct(ctypes.LittleEndianStructure):
@@ -10,12 +14,18 @@ class GIFStruct(ctypes.LittleEndianStructure):
 
     @classmethod
     def load(cls, fp):
-        return cls.from_buffer_copy(fp.read(ctypes.sizeof(cls)))
+        size = ctypes.sizeof(cls)
+        data = fp.read(size)
+        if len(data) < size:
+            raise IOError("File truncated in the {}.".format(cls.__name__))
+        return cls.from_buffer_copy(data)
 
     def write(self, fp):
-        pass
+        fp.write(bytes(self))
 
 
+# bit fields are laid out from the least significant bit of each byte
+
 class GIFHeader(GIFStruct):
     _pack_ = 1
     _fields_ = [("signature", ctypes.c_char * 3),
@@ -26,10 +36,10 @@ class LogicalScreenDescriptor(GIFStruct):
     _pack_ = 1
     _fields_ = [("width", ctypes.c_uint16),
                 ("height", ctypes.c_uint16),
-                ("global_color_table_flag", ctypes.c_uint8, 1),
-                ("color_resolution", ctypes.c_uint8, 3),
-                ("sort_flag", ctypes.c_uint8, 1),
                 ("global_color_table_size", ctypes.c_uint8, 3),
+                ("sort_flag", ctypes.c_uint8, 1),
+                ("color_resolution", ctypes.c_uint8, 3),
+                ("global_color_table_flag", ctypes.c_uint8, 1),
                 ("background_color_index", ctypes.c_uint8),
                 ("aspect_ratio", ctypes.c_uint8)]
 
@@ -47,21 +57,21 @@ class ImageDescriptor(GIFStruct):
                 ("y", ctypes.c_uint16),
                 ("width", ctypes.c_uint16),
                 ("height", ctypes.c_uint16),
-                ("local_color_table_flag", ctypes.c_uint8, 1),
-                ("interface_flag", ctypes.c_uint8, 1),
-                ("sort_flag", ctypes.c_uint8, 1),
+                ("local_color_table_size", ctypes.c_uint8, 3),
                 ("reserved", ctypes.c_uint8, 2),
-                ("local_color_table_size", ctypes.c_uint8, 3)]
+                ("sort_flag", ctypes.c_uint8, 1),
+                ("interlace_flag", ctypes.c_uint8, 1),
+                ("local_color_table_flag", ctypes.c_uint8, 1)]
 
 
 class GraphicControlExtension(GIFStruct):
     _pack_ = 1
-    _fields_ = [("size", ctypes.c_byte),
-                ("delay", ctypes.c_uint16),
-                ("reserved", ctypes.c_uint8, 3),
-                ("disposal_method", ctypes.c_uint8, 3),
-                ("user_input_flag", ctypes.c_uint8, 1),
+    _fields_ = [("size", ctypes.c_uint8),
                 ("transparent_color_flag", ctypes.c_uint8, 1),
+                ("user_input_flag", ctypes.c_uint8, 1),
+                ("disposal_method", ctypes.c_uint8, 3),
+                ("reserved", ctypes.c_uint8, 3),
+                ("delay", ctypes.c_uint16),
                 ("transparent_color_index", ctypes.c_uint8),
                 ("terminator", ctypes.c_uint8)]
 
@@ -94,158 +104,779 @@ COMMENT_EXTENSION = b"\xfe"
 PLAIN_TEXT_EXTENSION = b"\x01"
 APPLICATION_EXTENSION = b"\xff"
 
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+DISPOSE_PREVIOUS = 3
+
+# the rows of each pass of an interlaced image: first row and step
+INTERLACE_PASSES = ((0, 8), (4, 8), (2, 4), (1, 2))
+
+# the LZW minimum code sizes read; codes never grow past 12 bits
+MIN_CODE_SIZES = range(1, 12)
+
+# input bytes between checks of the compression ratio once the LZW string
+# table is full
+CHECK_GAP = 10000
+
+GIFFrame = namedtuple("GIFFrame",
+                      "x y width height delay disposal transparent")
+
+
+def lzw_decode(data, min_code_size, size):
+    """Decode the LZW compressed ``data`` of a GIF image into a bytearray
+    of ``size`` palette indices.
+
+    The dictionary is a pair of flat lists holding, for each code, the
+    offset and length of its string in the output.  Every new string is
+    the previous one extended by the index that follows it there, so each
+    code is expanded with a single slice copy of output already decoded,
+    with no walking of prefix chains and no joining of bytes.  Decoding
+    stops at the end code, after ``size`` indices or at the end of
+    ``data``; indices never decoded are left 0.
+
+    Raises ValueError for a code that is not yet in the dictionary.
+
+    """
+    clear = 1 << min_code_size
+    end = clear + 1
+    offsets = [0] * 4096
+    lengths = [0] * 4096
+    # room for the longest string past the last index kept
+    out = bytearray(size + 4096)
+    code_size = min_code_size + 1
+    mask = (1 << code_size) - 1
+    next_code = end + 1
+    prev_pos = prev_len = 0
+    pos = 0
+    acc = bits = 0
+    for byte in data:
+        acc |= byte << bits
+        bits += 8
+        while bits >= code_size:
+            code = acc & mask
+            acc >>= code_size
+            bits -= code_size
+            if code == clear:
+                code_size = min_code_size + 1
+                mask = (1 << code_size) - 1
+                next_code = end + 1
+                prev_len = 0
+                continue
+            if code == end:
+                del out[size:]
+                return out
+            if code < clear:
+                out[pos] = code
+                length = 1
+            elif code < next_code:
+                start = offsets[code]
+                length = lengths[code]
+                out[pos:pos+length] = out[start:start+length]
+            elif code == next_code and prev_len:
+                length = prev_len + 1
+                out[pos:pos+prev_len] = out[prev_pos:prev_pos+prev_len]
+                out[pos+prev_len] = out[prev_pos]
+            else:
+                raise ValueError("Invalid LZW code {}.".format(code))
+            if prev_len and next_code < 4096:
+                offsets[next_code] = prev_pos
+                lengths[next_code] = prev_len + 1
+                next_code += 1
+                if next_code > mask and code_size < 12:
+                    code_size += 1
+                    mask = (1 << code_size) - 1
+            prev_pos, prev_len = pos, length
+            pos += length
+            if pos >= size:
+                del out[size:]
+                return out
+    del out[size:]
+    return out
+
+
+def lzw_encode(indices, min_code_size):
+    """Compress the palette ``indices`` of a GIF image with LZW.
+
+    The string table is a dict keyed by the code of a string's prefix
+    shifted left by 8 bits plus its last index, so that extending the
+    current match costs one hashed lookup.  Once the table is full it is
+    kept, and the clear code is only sent when the compression ratio
+    measured every :data:`CHECK_GAP` indices stops improving, as the
+    Unix compress utility does.
+
+    """
+    clear = 1 << min_code_size
+    end = clear + 1
+    table = {}
+    code_size = min_code_size + 1
+    next_code = end + 1
+    out = bytearray()
+    acc, bits = clear, code_size
+    total_bits = code_size
+    checkpoint = CHECK_GAP
+    ratio = 0
+    it = iter(indices)
+    prefix = next(it, None)
+    if prefix is None:
+        acc |= end << bits
+        return acc.to_bytes((bits + code_size + 7) // 8, "little")
+    for count, index in enumerate(it, 2):
+        key = prefix << 8 | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        acc |= prefix << bits
+        bits += code_size
+        total_bits += code_size
+        while bits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            bits -= 8
+        prefix = index
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > 1 << code_size:
+                code_size += 1
+        elif count >= checkpoint:
+            checkpoint = count + CHECK_GAP
+            current = count / total_bits
+            if current > ratio:
+                ratio = current
+                continue
+            ratio = 0
+            acc |= clear << bits
+            bits += code_size
+            total_bits += code_size
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = end + 1
+    acc |= prefix << bits
+    bits += code_size
+    # the decoder adds one last string before it reads the end code
+    if next_code < 4096 and next_code + 1 > 1 << code_size:
+        code_size += 1
+    acc |= end << bits
+    bits += code_size
+    return out + acc.to_bytes((bits + 7) // 8, "little")
+
+
+def interlaced_rows(height):
+    """Return the rows of an interlaced image in the order they are
+    stored.
+
+    """
+    return [y for start, step in INTERLACE_PASSES
+            for y in range(start, height, step)]
+
 
 class GIFFormat(FormatBase):
     """File format plugin for GIF images
     =================================
 
+    Reading decodes the first frame only, composited onto the logical
+    screen; the image is ``RGBA`` when that frame has a transparent color
+    and ``RGB`` otherwise.  The frames of an animation are decoded one at a
+    time as :meth:`frames` is iterated.
+
+    ``L``, ``LA``, ``RGB`` and ``RGBA`` images using at most 256 colors
+    can be written; pixels less than half opaque are written transparent.
+    ``L`` images with a ``palette`` in their info, such as those returned
+    by :meth:`~depyct.image.ImageMixin.quantize`, are written as the
+    palette indices they hold, with the index in ``info["transparency"]``
+    transparent.
+
+    Options
+    -------
+
+    ``frames``
+        When writing, further images of the same mode and size that make
+        the image written into an animation, with the image itself as the
+        first frame.  Each frame only stores the rectangle that changed
+        since the one before it, with the unchanged pixels inside it made
+        transparent, and disposal methods are chosen so that pixels that
+        become transparent are cleared.  Use :meth:`frames` to read them
+        back.
+
+    ``delay``
+        How long each frame of an animation is shown, in milliseconds:
+        either one value for every frame or a sequence with one per frame.
+        GIF stores delays in hundredths of a second.
+
+    ``loop``
+        How many times an animation is repeated; 0 loops forever.
+
     """
 
     extensions = ("gif", "gfa", "giff")
     mimetypes = ("image/gif",)
+    defaults = {
+        "frames": (),
+        "delay": 100,
+        "loop": 0,
+    }
 
-    def __init__(self, image_cls, **config):
-        super(GIFFormat, self).__init__(image_cls, **config)
-        self.graphic_controls = []
-        self.global_color_table = None
-        self.active_color_table = None
+    def read(self):
         self.comments = []
-        self.plain_text = []
-        self.images = []
         self.application_data = []
-
-    def read(self):
+        self.loop = None
         self.header = GIFHeader.load(self.fp)
-        self.logical_screen = LogicalScreenDescriptor.load(self.fp)
-        if self.logical_screen.global_color_table_flag:
-            # read global color table
-            size = self.logical_screen.global_color_table_size
-            ncolors = 2 ** (size + 1)
-            GlobalColorTable = type("GlobalColorTable", (GIFStruct,), {
-                    "_fields_": [("colors", RGBTriple * ncolors)]
-                })
-            self.global_color_table = GlobalColorTable.load(self.fp)
-            self.active_color_table = self.global_color_table
-        self.size = self.logical_screen.width, self.logical_screen.height
-        self.im = self.image_cls(RGB, size=self.size)
-        self.load()
-        return self
-
-    def load(self):
+        if self.header.signature != b"GIF" or \
+                self.header.version not in (b"87a", b"89a"):
+            self.fail("Not a GIF file.")
+        self.logical_screen = screen = LogicalScreenDescriptor.load(self.fp)
+        self.global_color_table = None
+        if screen.global_color_table_flag:
+            self.global_color_table = self._read_color_table(
+                    self.fp, screen.global_color_table_size)
+        self.size = screen.width, screen.height
+
+        self.first_frame = self._read_frame(self.fp)
+        if self.first_frame is None:
+            self.fail("No image data found.")
+        self.next_block = None
+        if self._seekable(self.fp):
+            self.next_block = self.fp.tell()
+
+        frame = self.first_frame[0]
+        self.alpha = frame.transparent is not None
+        im = self._create_canvas()
+        self._draw(im, *self.first_frame)
+        im.info["version"] = self.header.version
+        im.info["background"] = screen.background_color_index
+        im.info["duration"] = frame.delay * 10
+        if frame.transparent is not None:
+            im.info["transparency"] = frame.transparent
+        if self.loop is not None:
+            im.info["loop"] = self.loop
+        if self.comments:
+            im.info["comment"] = b"\n".join(self.comments)
+        return im
+
+    def frames(self):
+        """Yield the frames of the image last opened as ``(image, frame)``
+        pairs, reading and decoding each only when it is asked for.
+
+        ``image`` is the logical screen with the frame composited onto it
+        as the frame before it was disposed of; the same image is updated
+        for every frame, so copy it to keep one.  ``frame`` is a
+        :class:`GIFFrame` holding the frame's rectangle, its delay in
+        hundredths of a second, its disposal method and its transparent
+        index.
+
+        """
+        canvas = self._create_canvas()
+        fp = self._reopen()
+        try:
+            record = self.first_frame
+            dispose = None
+            while record is not None:
+                if dispose is not None:
+                    dispose()
+                frame = record[0]
+                dispose = self._disposer(canvas, frame)
+                self._draw(canvas, *record)
+                yield canvas, frame
+                record = self._read_frame(fp)
+        finally:
+            if fp is not self.fp:
+                fp.close()
+
+    def _read_frame(self, fp):
+        """Read blocks up to and including the next image, returning its
+        :class:`GIFFrame`, color table and decoded indices, or ``None`` at
+        the trailer.
+
+        """
+        control = None
         while True:
-            block_intro = self.fp.read(1)
-            if block_intro == EXTENSION:
-                label = self.fp.read(1)
+            introducer = fp.read(1)
+            if introducer == EXTENSION:
+                label = fp.read(1)
                 if label == GRAPHIC_CONTROL_EXTENSION:
-                    self._load_graphic_control_extension()
-                elif label == COMMENT_EXTENSION:
-                    self._load_comment()
-                elif label == PLAIN_TEXT_EXTENSION:
-                    self._load_plain_text()
+                    control = GraphicControlExtension.load(fp)
+                    if control.size != 4 or control.terminator != 0:
+                        self.fail("Malformed graphic control extension.")
                 elif label == APPLICATION_EXTENSION:
-                    self._load_application_extension()
+                    self._read_application_extension(fp)
+                elif label == COMMENT_EXTENSION:
+                    self.comments.append(self._read_sub_blocks(fp))
                 else:
-                    # FIXME: use message system
-                    raise IOError("Unrecognized extension block label at "
-                                  "offset {}: {} {}.".format(
-                                  self.fp.tell(), block_intro, label))
-            elif block_intro == IMAGE_SEPARATOR:
-                self._load_image()
-            elif block_intro == TRAILER:
-                break
+                    # plain text and unknown extensions are skipped
+                    self._read_sub_blocks(fp)
+            elif introducer == IMAGE_SEPARATOR:
+                return self._read_image(fp, control)
+            elif introducer == TRAILER:
+                return None
+            elif not introducer:
+                self.fail("File truncated before the trailer.")
             else:
-                # FIXME: use message system
-                raise IOError("Unrecognized block at {}: {}.".format(
-                              self.fp.tell(), block_intro))
-
-    def _load_graphic_control_extension(self):
-        gce = GraphicControlExtension.load(self.fp)
-        self.graphic_controls.append(gce)
-
-    def _load_comment(self):
-        comment = []
+                self.fail("Unrecognized block {!r}.".format(introducer))
+
+    def _read_application_extension(self, fp):
+        extension = ApplicationExtension.load(fp)
+        data = self._read_sub_blocks(fp)
+        self.application_data.append(data)
+        if extension.identifier in (b"NETSCAPE", b"ANIMEXTS") and \
+                data[:1] == b"\x01" and len(data) >= 3:
+            self.loop = struct.unpack("<H", data[1:3])[0]
+
+    def _read_image(self, fp, control):
+        descriptor = ImageDescriptor.load(fp)
+        palette = self.global_color_table
+        if descriptor.local_color_table_flag:
+            palette = self._read_color_table(
+                    fp, descriptor.local_color_table_size)
+        if palette is None:
+            self.fail("Image has no color table.")
+        code_size = fp.read(1)
+        if not code_size:
+            self.fail("Image data truncated.")
+        code_size = ord(code_size)
+        if code_size not in MIN_CODE_SIZES:
+            self.fail("Invalid LZW minimum code size {}.".format(code_size))
+        width, height = descriptor.width, descriptor.height
+        try:
+            indices = lzw_decode(self._read_sub_blocks(fp), code_size,
+                                 width * height)
+        except ValueError as err:
+            self.fail(str(err))
+        if descriptor.interlace_flag:
+            rows = indices
+            indices = bytearray(len(rows))
+            for i, y in enumerate(interlaced_rows(height)):
+                indices[y*width:(y+1)*width] = rows[i*width:(i+1)*width]
+
+        delay, disposal, transparent = 0, 0, None
+        if control is not None:
+            delay, disposal = control.delay, control.disposal_method
+            if control.transparent_color_flag:
+                transparent = control.transparent_color_index
+        frame = GIFFrame(descriptor.x, descriptor.y, width, height, delay,
+                         disposal, transparent)
+        return frame, palette, indices
+
+    def _read_color_table(self, fp, size):
+        size = 3 * 2 ** (size + 1)
+        table = fp.read(size)
+        if len(table) < size:
+            self.fail("Color table truncated.")
+        return table
+
+    def _read_sub_blocks(self, fp):
+        blocks = []
         while True:
-            size = ord(self.fp.read(1))
+            size = fp.read(1)
+            if not size:
+                self.fail("Data sub-blocks truncated.")
+            size = ord(size)
             if size == 0:
-                break
-            comment.append(self.fp.read(size))
-        comment = b"".join(comment)
-        self.comments.append(comment)
-
-    def _load_plain_text(self):
-        pte = PlainTextExtension.load(self.fp)
-        text = []
-        while True:
-            size = ord(self.fp.read(1))
-            if size == 0:
-                break
-            text.append(self.fp.read(size))
-        text = b"".join(text)
-        self.plain_text.append(text)
+                return b"".join(blocks)
+            block = fp.read(size)
+            if len(block) < size:
+                self.fail("Data sub-block truncated.")
+            blocks.append(block)
+
+    def _create_canvas(self):
+        im = self.image_cls(RGBA if self.alpha else RGB, size=self.size)
+        background = self._background()
+        if any(background):
+            im.buffer[:] = background * (self.size[0] * self.size[1])
+        return im
+
+    def _background(self):
+        """Return the pixel disposed frames are cleared to: transparent for
+        ``RGBA`` images, otherwise the background color.
+
+        """
+        if self.alpha:
+            return bytes(4)
+        table = self.global_color_table
+        index = self.logical_screen.background_color_index
+        if table is None or 3 * index + 3 > len(table):
+            return bytes(3)
+        return table[3*index:3*index+3]
+
+    def _visible(self, canvas, frame):
+        """Return the rows of ``canvas`` covered by ``frame``, as offsets
+        into its buffer, and the number of bytes of each row covered.
+
+        """
+        width, height = canvas.size
+        bpp = canvas.bytes_per_pixel
+        visible = max(0, min(frame.width, width - frame.x))
+        rows = [(frame.y + y) * width * bpp + frame.x * bpp
+                for y in range(max(0, min(frame.height, height - frame.y)))]
+        return rows, visible * bpp
+
+    def _disposer(self, canvas, frame):
+        """Return a function that disposes of ``frame`` once it has been
+        shown, or ``None`` when it stays in place.
+
+        """
+        rows, size = self._visible(canvas, frame)
+        buffer = canvas.buffer
+        if frame.disposal == DISPOSE_BACKGROUND:
+            cleared = self._background() * (size // canvas.bytes_per_pixel)
+            def dispose():
+                for r in rows:
+                    buffer[r:r+size] = cleared
+        elif frame.disposal == DISPOSE_PREVIOUS:
+            saved = [bytes(buffer[r:r+size]) for r in rows]
+            def dispose():
+                for r, data in zip(rows, saved):
+                    buffer[r:r+size] = data
+        else:
+            dispose = None
+        return dispose
+
+    def _draw(self, canvas, frame, palette, indices):
+        """Draw the palette ``indices`` of ``frame`` onto ``canvas``,
+        leaving the pixels under its transparent index untouched.
+
+        """
+        tables = [palette[c::3].ljust(256, b"\x00") for c in range(3)]
+        if self.alpha:
+            alpha = bytearray(b"\xff" * 256)
+            if frame.transparent is not None:
+                alpha[frame.transparent] = 0
+            tables.append(bytes(alpha))
+        bpp = canvas.bytes_per_pixel
+        rows, size = self._visible(canvas, frame)
+        count = size // bpp
+        buffer = canvas.buffer
+        opaque = None
+        if frame.transparent is not None:
+            opaque = re.compile(b"[^" + re.escape(
+                    bytes((frame.transparent,))) + b"]+")
+        for y, r in enumerate(rows):
+            row = indices[y*frame.width:y*frame.width + count]
+            pixels = util.expand_palette(row, tables)
+            if opaque is None:
+                buffer[r:r+size] = pixels
+            else:
+                for m in opaque.finditer(row):
+                    a, b = m.start() * bpp, m.end() * bpp
+                    buffer[r+a:r+b] = pixels[a:b]
+
+    def _reopen(self):
+        if self.filename is not None:
+            fp = open(self.filename, "rb")
+            fp.seek(self.next_block)
+            return fp
+        if self.next_block is not None:
+            self.fp.seek(self.next_block)
+        return self.fp
+
+    def _seekable(self, fp):
+        try:
+            return fp.seekable()
+        except AttributeError:
+            return False
+
+    def check(self, full=False):
+        """Walk the blocks of the file, checking the header, the extents of
+        the images and the framing of every data sub-block.  LZW data is
+        not decoded, so ``full`` has no further effect.
+
+        """
+        fp = self.fp
+        header = fp.read(13)
+        if len(header) < 6 or header[:3] != b"GIF" or \
+                header[3:6] not in (b"87a", b"89a"):
+            return [(0, "Not a GIF file.")]
+        if len(header) < 13:
+            return [(6, "File truncated in the logical screen descriptor.")]
+        problems = []
+        width, height, packed = struct.unpack("<HHB", header[6:11])
+        offset = 13
+        if packed & 0x80:
+            offset = self._skip_color_table(packed, offset, problems)
+            if offset is None:
+                return problems
 
-    def _load_application_extension(self):
-        ae = ApplicationExtension.load(self.fp)
-        application_data = []
         while True:
-            size = ord(self.fp.read(1))
-            if size == 0:
+            introducer = fp.read(1)
+            if not introducer:
+                problems.append((offset, "File truncated before the "
+                                         "trailer."))
+                return problems
+            start = offset
+            offset += 1
+            if introducer == TRAILER:
                 break
-            application_data.append(self.fp.read(size))
-        application_data = b"".join(application_data)
-        self.application_data.append(application_data)
-
-    def _load_color_table(self, size):
-        ncolors = 2 ** (size + 1)
-        ColorTable = type("ColorTable", (GIFStruct,), {
-                "_fields_": [("colors", RGBTriple * ncolors)]
-            })
-        return ColorTable.load(self.fp)
-
-    def _load_image(self):
-        image_descriptor = ImageDescriptor.load(self.fp)
-        if image_descriptor.local_color_table_flag:
-            self.active_color_table = self._load_color_table(
-                                    image_descriptor.local_color_table_size)
-        lzw_minimum_code_size = self.fp.read(1)
-        image_blocks = []
+            elif introducer == EXTENSION:
+                if not fp.read(1):
+                    problems.append((start, "Extension block truncated."))
+                    return problems
+                offset += 1
+            elif introducer == IMAGE_SEPARATOR:
+                descriptor = fp.read(9)
+                if len(descriptor) < 9:
+                    problems.append((start, "Image descriptor truncated."))
+                    return problems
+                x, y, w, h, packed = struct.unpack("<HHHHB", descriptor)
+                offset += 9
+                if x + w > width or y + h > height:
+                    problems.append((start, "Image extends past the logical "
+                                            "screen."))
+                if packed & 0x80:
+                    offset = self._skip_color_table(packed, offset,
+                                                    problems)
+                    if offset is None:
+                        return problems
+                code_size = fp.read(1)
+                if not code_size:
+                    problems.append((offset, "Image data truncated."))
+                    return problems
+                if ord(code_size) not in MIN_CODE_SIZES:
+                    problems.append((offset, "Invalid LZW minimum code "
+                                             "size {}.".format(
+                                             ord(code_size))))
+                offset += 1
+            else:
+                problems.append((start, "Unrecognized block "
+                                        "{!r}.".format(introducer)))
+                return problems
+            offset = self._skip_sub_blocks(offset, problems)
+            if offset is None:
+                return problems
+        if fp.read(1):
+            problems.append((offset, "Data found after the trailer."))
+        return problems
+
+    def _skip_color_table(self, packed, offset, problems):
+        size = 3 * 2 ** ((packed & 0x07) + 1)
+        if len(self.fp.read(size)) < size:
+            problems.append((offset, "Color table truncated."))
+            return None
+        return offset + size
+
+    def _skip_sub_blocks(self, offset, problems):
+        """Skip a sequence of data sub-blocks and its terminator, returning
+        the offset after it, or ``None`` if it is cut short.
+
+        """
         while True:
-            size = ord(self.fp.read(1))
+            size = self.fp.read(1)
+            if not size:
+                problems.append((offset, "Data sub-blocks truncated."))
+                return None
+            size = ord(size)
+            offset += 1
             if size == 0:
-                break
-            image_blocks.append(self.fp.read(size))
-        image_data = b"".join(image_blocks)
-        self._decompress_image(image_data)
-        color_table = self.global_color_table
-
-    def _decompress_image(self, image_data):
-        # TODO: LZW Decompression goes in right about here
-        self.images.append(image_data)
+                return offset
+            if len(self.fp.read(size)) < size:
+                problems.append((offset - 1, "Data sub-block truncated."))
+                return None
+            offset += size
 
     def write(self):
-        self._write_header()
-        self._write_logical_screen_descriptor()
-
-    def _write_header(self):
-        # determine gif version
-        version = b"89a"
-        header = GIFHeader(signature=b"GIF", version=version)
-        # TODO: figure out how to write structs to file
-
-    def _write_logical_screen_descriptor(self):
-        width, height = self.image.size
-        lsd = LogicalScreenDescriptor(width=width, height=height)
-        
-        if True:
-            # will there be a global color table?
-            lsd.global_color_table_flag = 1
-            # how many colors will be in it?
-            # count the colors and reverse the size calculation
-            lsd.global_color_table_size = 7
+        im = self.image
+        if im.mode not in (L, LA, RGB, RGBA):
+            self.fail("Images with mode {} cannot be saved as GIF.".format(
+                      im.mode))
+        images = [im] + list(self.config["frames"])
+        for frame in images[1:]:
+            if frame.mode != im.mode or frame.size != im.size:
+                self.fail("Every frame must have the mode and size of the "
+                          "image.")
+        delays = self.config["delay"]
+        if isinstance(delays, int):
+            delays = [delays] * len(images)
+        elif len(delays) != len(images):
+            self.fail("There must be one delay for every frame.")
+        animated = len(images) > 1
+
+        palette, transparent, targets = self._index_images(images, animated)
+        # the alpha image is read back as RGBA only if its first frame
+        # declares the transparent index
+        alpha = transparent is not None and \
+            any(transparent in target for target in targets)
+        bits = max(1, (len(palette) // 3 - 1).bit_length())
+        min_code_size = max(2, bits)
+        width, height = im.size
+
+        GIFHeader(signature=b"GIF", version=b"89a").write(self.fp)
+        LogicalScreenDescriptor(
+            width=width, height=height, global_color_table_flag=1,
+            color_resolution=7, global_color_table_size=bits - 1,
+            background_color_index=transparent if alpha else 0,
+        ).write(self.fp)
+        self.fp.write(palette.ljust(3 << bits, b"\x00"))
+        if animated:
+            self.fp.write(EXTENSION + APPLICATION_EXTENSION)
+            ApplicationExtension(size=11, identifier=b"NETSCAPE",
+                                 authentication_code=b"2.0").write(self.fp)
+            self._write_sub_blocks(struct.pack("<BH", 1, self.config["loop"]))
+        comment = im.info.get("comment")
+        if comment:
+            self.fp.write(EXTENSION + COMMENT_EXTENSION)
+            self._write_sub_blocks(comment)
+
+        if animated:
+            plan = self._plan_animation(targets, delays, transparent)
         else:
-            lsd.global_color_table_flag = 0
-            lsd.global_color_table_size = 0
-
-        #lsd.color_resolution
-        #lsd.sort_flag
-        #lsd.background_color_index
-        lsd.aspect_ratio = self.image.info.get("aspect_ratio", 0)
+            plan = [[(0, 0, width, height), delays[0], 0, targets[0], None]]
+        for rect, delay, disposal, target, canvas in plan:
+            left, top, right, bottom = rect
+            padded = canvas is not None and transparent is not None
+            region = self._crop(target, rect)
+            if padded:
+                region = self._pad(region, self._crop(canvas, rect),
+                                   transparent)
+            if animated or alpha:
+                flag = alpha or padded
+                self.fp.write(EXTENSION + GRAPHIC_CONTROL_EXTENSION)
+                GraphicControlExtension(
+                    size=4, transparent_color_flag=flag,
+                    disposal_method=disposal,
+                    delay=min(0xffff, (delay + 5) // 10),
+                    transparent_color_index=transparent if flag else 0,
+                ).write(self.fp)
+            self.fp.write(IMAGE_SEPARATOR)
+            ImageDescriptor(x=left, y=top, width=right - left,
+                            height=bottom - top).write(self.fp)
+            self.fp.write(bytes((min_code_size,)))
+            self._write_sub_blocks(lzw_encode(region, min_code_size))
+        self.fp.write(TRAILER)
+
+    def _index_images(self, images, animated):
+        """Map the pixels of ``images`` onto one palette holding every color
+        they use.
+
+        Pixels less than half opaque share a transparent index, which is
+        also reserved for animations, when there is room for it, so that
+        pixels a frame leaves unchanged can be left transparent.
+
+        Returns the palette, the transparent index or ``None``, and the
+        palette indices of each image.
+
+        """
+        pixels = [self._pixels(im) for im in images]
+        colors = {}
+        for p in pixels:
+            colors.update(dict.fromkeys(p))
+        clear = colors.pop(None, False) is not False
+        if len(colors) + clear > 256:
+            self.fail("Images with more than 256 colors must be quantized "
+                      "before they are saved as GIF.")
+        transparent = None
+        if clear or animated and len(colors) < 256:
+            transparent = len(colors)
+        lookup = {color: i for i, color in enumerate(colors)}
+        lookup[None] = transparent
+        palette = b"".join(map(bytes, colors))
+        if transparent is not None:
+            palette += bytes(3)
+        return palette, transparent, [bytes(map(lookup.__getitem__, p))
+                                      for p in pixels]
+
+    def _pixels(self, im):
+        """Return the pixels of ``im`` as ``(r, g, b)`` tuples, with
+        ``None`` for those less than half opaque or transparent.
+
+        """
+        data = bytes(im.buffer)
+        if im.mode == L and "palette" in im.info:
+            table = [tuple(bytes(c)[:3]) for c in im.info["palette"]]
+            table += [(0, 0, 0)] * (256 - len(table))
+            if im.info.get("transparency") is not None:
+                table[im.info["transparency"]] = None
+            return list(map(table.__getitem__, data))
+        n = im.mode.components
+        channels = [data[c::n] for c in range(n)]
+        alpha = channels.pop() if n in (2, 4) else None
+        if len(channels) == 1:
+            channels *= 3
+        pixels = list(zip(*channels))
+        if alpha is not None:
+            for m in re.finditer(b"[\x00-\x7f]+", alpha):
+                pixels[m.start():m.end()] = [None] * (m.end() - m.start())
+        return pixels
+
+    def _plan_animation(self, targets, delays, transparent):
+        """Decide the rectangle, delay and disposal method of each frame of
+        an animation.
+
+        Each frame after the first only covers the rectangle that differs
+        from the canvas the frame before it leaves behind.  A frame is
+        disposed of to the background only when the next one has to make
+        pixels it drew transparent again, and its rectangle is grown to
+        cover them; otherwise it is left in place.  Frames identical to the
+        one before them are dropped and their delay added to it.
+
+        Returns a list of ``[rect, delay, disposal, target, canvas]``
+        lists, where ``canvas`` holds the indices the frame is drawn over,
+        or ``None`` for the first frame, which covers the whole screen.
+
+        """
+        width, height = self.image.size
+        plan = [[(0, 0, width, height), delays[0], DISPOSE_NONE, targets[0],
+                 None]]
+        is_clear = None
+        if transparent is not None:
+            is_clear = bytes(int(i == transparent) for i in range(256))
+        for target, delay in zip(targets[1:], delays[1:]):
+            last = plan[-1]
+            if target == last[3]:
+                last[1] += delay
+                continue
+            canvas = last[3]
+            if is_clear is not None:
+                needed = self._cleared_rectangle(canvas, target, is_clear)
+                if needed is not None:
+                    rect = last[0]
+                    rect = (min(rect[0], needed[0]), min(rect[1], needed[1]),
+                            max(rect[2], needed[2]), max(rect[3], needed[3]))
+                    last[0], last[2] = rect, DISPOSE_BACKGROUND
+                    canvas = bytearray(canvas)
+                    left, top, right, bottom = rect
+                    cleared = bytes((transparent,)) * (right - left)
+                    for y in range(top, bottom):
+                        canvas[y*width+left:y*width+right] = cleared
+            rect = util.changed_rectangle(canvas, target, width, height, 1)
+            if rect is None:
+                # only the disposal changes the canvas; draw a single
+                # transparent pixel to show it
+                rect = last[0][:2] + (last[0][0] + 1, last[0][1] + 1)
+            plan.append([rect, delay, DISPOSE_NONE, target, canvas])
+        return plan
+
+    def _cleared_rectangle(self, canvas, target, is_clear):
+        """Return the rectangle holding every pixel that is transparent in
+        ``target`` but not on ``canvas``, or ``None``.
+
+        """
+        size = len(target)
+        wanted = target.translate(is_clear)
+        kept = (int.from_bytes(wanted, "big") &
+                int.from_bytes(bytes(canvas).translate(is_clear), "big"))
+        width, height = self.image.size
+        return util.changed_rectangle(kept.to_bytes(size, "big"), wanted,
+                                      width, height, 1)
+
+    def _crop(self, indices, rect):
+        left, top, right, bottom = rect
+        width = self.image.size[0]
+        return b"".join(indices[y*width+left:y*width+right]
+                        for y in range(top, bottom))
+
+    def _pad(self, region, under, transparent):
+        """Replace the indices of ``region`` that match those ``under`` it
+        by ``transparent``, giving the compressor long uniform runs.
+
+        """
+        return bytes(transparent if a == b else b
+                     for a, b in zip(under, region))
+
+    def _write_sub_blocks(self, data):
+        view = memoryview(data)
+        out = bytearray()
+        for i in range(0, len(view), 255):
+            block = view[i:i+255]
+            out.append(len(block))
+            out += block
+        out.append(0)
+        self.fp.write(out)
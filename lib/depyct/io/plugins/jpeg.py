@@ -1,22 +1,1351 @@
 # depyct/io/plugins/jpeg.py
+"""JPEG decoding and encoding.
 
+Every scan, baseline or progressive, is Huffman decoded into one array of
+quantized coefficients per component, 64 to a block in zigzag order.  The
+blocks are only transformed once the last scan is in, so that a scaled
+decode only ever dequantizes and transforms the coefficients it keeps.
+
+Encoding fills the same arrays, a block at a time, from a forward DCT and
+quantization, so that the symbols of the whole image can be counted for
+optimized Huffman tables before any of them is coded.
+
+"""
+from array import array
+from fractions import Fraction
+import heapq
+import math
+import operator
+import re
+import struct
+import sys
+
+from depyct.image.mode import L, RGB, CMYK, JPEG_YV12
 from depyct.io.format import FormatBase
 
 
+SOF0, SOF1, SOF2 = 0xc0, 0xc1, 0xc2
+DHT = 0xc4
+RST0 = 0xd0
+SOI, EOI, SOS, DQT, DNL, DRI = 0xd8, 0xd9, 0xda, 0xdb, 0xdc, 0xdd
+APP0, APP14 = 0xe0, 0xee
+TEM = 0x01
+
+# the position in a block of each coefficient in zigzag order
+ZIGZAG = [
+     0,  1,  8, 16,  9,  2,  3, 10, 17, 24, 32, 25, 18, 11,  4,  5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13,  6,  7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+]
+# the zigzag index of each position in a block
+UNZIGZAG = [ZIGZAG.index(i) for i in range(64)]
+
+# the number of bits looked at to decode a Huffman code in one step
+PEEK_BITS = 9
+
+# 8-bit samples from IDCT outputs offset by 128, wrapped to 10 bits: 0 to
+# 255 stand for themselves, 256 to 639 overshoot and 640 up are negative
+CLAMP = bytes(range(256)) + b"\xff" * 384 + b"\x00" * 384
+
+# the AAN scale factors of each position in a block, with 14 fraction bits
+_AAN = [1.0] + [math.cos(k * math.pi / 16) * math.sqrt(2) for k in range(1, 8)]
+AAN_SCALES = [int(round(_AAN[i >> 3] * _AAN[i & 7] * (1 << 14)))
+              for i in range(64)]
+
+# fixed-point constants of the AAN IDCT, with 8 fraction bits
+FIX_1_082392200 = 277
+FIX_1_414213562 = 362
+FIX_1_847759065 = 473
+FIX_2_613125930 = 669
+
+# the +128 level shift and rounding of the IDCT's final 5 bit descale,
+# added to the DC term of every row
+_ROW_BIAS = (128 << 5) + 16
+
+
+# constants of the 4 and 2-point IDCTs, with 13 fraction bits and scaled
+# to match the 8-point IDCT in level
+_R0 = int(round((1 << 13) * 0.5 * math.sqrt(0.5)))
+_R1 = int(round((1 << 13) * 0.5 * math.cos(math.pi / 8)))
+_R3 = int(round((1 << 13) * 0.5 * math.cos(3 * math.pi / 8)))
+
+# the +128 level shift and rounding of the reduced IDCTs' final descale
+_REDUCED_BIAS = (128 << 15) + (1 << 14)
+
+# fixed-point YCbCr to RGB tables, as in JFIF
+_CR_R = [int(round(1.402 * (v - 128))) for v in range(256)]
+_CB_B = [int(round(1.772 * (v - 128))) for v in range(256)]
+_CB_G = [-int(round(0.344136 * (1 << 16) * (v - 128))) for v in range(256)]
+_CR_G = [-int(round(0.714136 * (1 << 16) * (v - 128))) + (1 << 15)
+         for v in range(256)]
+
+# fixed-point RGB to YCbCr tables, as in JFIF, with 16 fraction bits; the
+# rounding and the +128 offset of the chroma are folded into the tables of
+# one channel
+_R_Y = [19595 * v for v in range(256)]
+_G_Y = [38470 * v for v in range(256)]
+_B_Y = [7471 * v + (1 << 15) for v in range(256)]
+_R_CB = [-11059 * v for v in range(256)]
+_G_CB = [-21709 * v for v in range(256)]
+_G_CR = [-27439 * v for v in range(256)]
+_B_CR = [-5329 * v for v in range(256)]
+# 0.5 times blue for Cb and red for Cr, kept below 256
+_HALF = [(v << 15) + (128 << 16) + (1 << 15) - 1 for v in range(256)]
+
+# fixed-point constants of the AAN forward DCT, with 8 fraction bits
+FIX_0_382683433 = 98
+FIX_0_541196100 = 139
+FIX_0_707106781 = 181
+FIX_1_306562965 = 334
+
+# the quantization tables of the JPEG specification, for quality 50, in
+# zigzag order
+LUMINANCE_QUANTIZATION = [
+    16, 11, 12, 14, 12, 10, 16, 14, 13, 14, 18, 17, 16, 19, 24, 40, 26, 24,
+    22, 22, 24, 49, 35, 37, 29, 40, 58, 51, 61, 60, 57, 51, 56, 55, 64, 72,
+    92, 78, 64, 68, 87, 69, 55, 56, 80, 109, 81, 87, 95, 98, 103, 104, 103,
+    62, 77, 113, 121, 112, 100, 120, 92, 101, 103, 99,
+]
+CHROMINANCE_QUANTIZATION = [
+    17, 18, 18, 24, 21, 24, 47, 26, 26, 47, 99, 66, 56, 66, 99, 99,
+] + [99] * 48
+
+# the Huffman tables of the JPEG specification: the number of codes of
+# each length from 1 to 16 bits, and their symbols
+LUMINANCE_DC = (bytes((0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0)),
+                bytes(range(12)))
+CHROMINANCE_DC = (bytes((0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0)),
+                  bytes(range(12)))
+LUMINANCE_AC = (bytes((0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 125)),
+                bytes((
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06,
+    0x13, 0x51, 0x61, 0x07, 0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08,
+    0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0, 0x24, 0x33, 0x62, 0x72,
+    0x82, 0x09, 0x0a, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45,
+    0x46, 0x47, 0x48, 0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59,
+    0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69, 0x6a, 0x73, 0x74, 0x75,
+    0x76, 0x77, 0x78, 0x79, 0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3,
+    0xa4, 0xa5, 0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6,
+    0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5, 0xc6, 0xc7, 0xc8, 0xc9,
+    0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+    0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf1, 0xf2, 0xf3, 0xf4,
+    0xf5, 0xf6, 0xf7, 0xf8, 0xf9, 0xfa,
+)))
+CHROMINANCE_AC = (bytes((0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 119)),
+                  bytes((
+    0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41,
+    0x51, 0x07, 0x61, 0x71, 0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91,
+    0xa1, 0xb1, 0xc1, 0x09, 0x23, 0x33, 0x52, 0xf0, 0x15, 0x62, 0x72, 0xd1,
+    0x0a, 0x16, 0x24, 0x34, 0xe1, 0x25, 0xf1, 0x17, 0x18, 0x19, 0x1a, 0x26,
+    0x27, 0x28, 0x29, 0x2a, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44,
+    0x45, 0x46, 0x47, 0x48, 0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58,
+    0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69, 0x6a, 0x73, 0x74,
+    0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+    0x88, 0x89, 0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a,
+    0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4,
+    0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5, 0xc6, 0xc7,
+    0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda,
+    0xe2, 0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf2, 0xf3, 0xf4,
+    0xf5, 0xf6, 0xf7, 0xf8, 0xf9, 0xfa,
+)))
+
+# the luma sampling factors of each chroma subsampling written
+SUBSAMPLING = {"4:4:4": (1, 1), "4:2:2": (2, 1), "4:2:0": (2, 2)}
+
+
+class HuffmanTable(object):
+    """A Huffman table of a DHT segment, with tables for looking codes up
+    by the next :data:`PEEK_BITS` bits of data.
+
+    ``lookup`` gives ``length << 8 | symbol`` for the codes that short, and
+    0 for longer ones, which are found with :meth:`decode_slow`.  ``fast``
+    gives ``(length, run, value)`` when the extra bits of a coefficient fit
+    in the peek as well, so that the common small coefficients are decoded
+    with a single lookup, and ``None`` otherwise.
+
+    """
+
+    def __init__(self, counts, symbols):
+        self.symbols = symbols
+        self.lookup = [0] * (1 << PEEK_BITS)
+        self.fast = [None] * (1 << PEEK_BITS)
+        self.maxcode = [-1] * 17
+        self.offset = [0] * 17
+        code = k = 0
+        for length in range(1, 17):
+            self.offset[length] = k - code
+            for _ in range(counts[length-1]):
+                if length <= PEEK_BITS:
+                    self._fill(code, length, symbols[k])
+                code += 1
+                k += 1
+            if counts[length-1]:
+                self.maxcode[length] = code - 1
+            code <<= 1
+
+    def _fill(self, code, length, symbol):
+        spare = PEEK_BITS - length
+        first = code << spare
+        size = symbol & 15
+        for p in range(first, first + (1 << spare)):
+            self.lookup[p] = length << 8 | symbol
+            if size and size <= spare:
+                v = (p >> (spare - size)) & ((1 << size) - 1)
+                if v < 1 << (size - 1):
+                    v -= (1 << size) - 1
+                self.fast[p] = (length + size, symbol >> 4, v)
+
+    def decode_slow(self, window):
+        """Return the length and symbol of the code longer than
+        :data:`PEEK_BITS` bits at the start of the 16-bit ``window``.
+
+        """
+        for length in range(PEEK_BITS + 1, 17):
+            code = window >> (16 - length)
+            if code <= self.maxcode[length]:
+                return length, self.symbols[code + self.offset[length]]
+        raise ValueError("Invalid Huffman code.")
+
+
+class Component(object):
+    """A component of a frame and the coefficients decoded for it."""
+
+    def __init__(self, ident, h, v, tq):
+        self.ident = ident
+        self.h = h
+        self.v = v
+        self.tq = tq
+        self.coefs = None
+
+
+def _words(segment):
+    """Return ``segment`` as big-endian 32-bit words, padded with zeros."""
+    words = array("I")
+    if words.itemsize != 4:
+        words = array("L")
+    words.frombytes(segment + bytes(12 - len(segment) % 4))
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+
+
+def _restart_intervals(segments, restart, mcus):
+    """Yield the MCUs of each restart interval with the words of its
+    entropy coded data.
+
+    """
+    step = restart or mcus
+    for i, segment in enumerate(segments):
+        start = i * step
+        if start >= mcus:
+            break
+        yield range(start, min(start + step, mcus)), _words(segment)
+
+
+def _decode_sequential(segments, restart, mcux, mcus, parts):
+    """Decode a sequential scan.  Each of ``parts`` describes a component
+    of the scan: its coefficients, the offsets of its blocks in an MCU, the
+    offsets between rows and columns of MCUs, and its DC and AC tables.
+
+    """
+    for interval, words in _restart_intervals(segments, restart, mcus):
+        acc = nbits = w = 0
+        preds = [0] * len(parts)
+        for m in interval:
+            my, mx = divmod(m, mcux)
+            for i, (coefs, offsets, row_step, col_step, dc, ac) in \
+                    enumerate(parts):
+                origin = my * row_step + mx * col_step
+                for offset in offsets:
+                    b = origin + offset
+                    if nbits < 32:
+                        acc = (acc & 0xffffffff) << 32 | words[w]
+                        w += 1
+                        nbits += 32
+                    e = dc.lookup[acc >> (nbits - PEEK_BITS) & 511]
+                    if e:
+                        nbits -= e >> 8
+                        s = e & 255
+                    else:
+                        length, s = dc.decode_slow(acc >> (nbits - 16) &
+                                                   0xffff)
+                        nbits -= length
+                    if s:
+                        v = acc >> (nbits - s) & ((1 << s) - 1)
+                        nbits -= s
+                        if v < 1 << (s - 1):
+                            v -= (1 << s) - 1
+                        preds[i] += v
+                    coefs[b] = preds[i]
+                    fast, lookup = ac.fast, ac.lookup
+                    k = 1
+                    while k < 64:
+                        if nbits < 32:
+                            acc = (acc & 0xffffffff) << 32 | words[w]
+                            w += 1
+                            nbits += 32
+                        p = acc >> (nbits - PEEK_BITS) & 511
+                        f = fast[p]
+                        if f is not None:
+                            length, r, v = f
+                            nbits -= length
+                            k += r
+                            if k > 63:
+                                break
+                            coefs[b+k] = v
+                            k += 1
+                            continue
+                        e = lookup[p]
+                        if e:
+                            nbits -= e >> 8
+                            rs = e & 255
+                        else:
+                            length, rs = ac.decode_slow(acc >> (nbits - 16) &
+                                                        0xffff)
+                            nbits -= length
+                        s = rs & 15
+                        if s:
+                            k += rs >> 4
+                            if k > 63:
+                                break
+                            v = acc >> (nbits - s) & ((1 << s) - 1)
+                            nbits -= s
+                            if v < 1 << (s - 1):
+                                v -= (1 << s) - 1
+                            coefs[b+k] = v
+                            k += 1
+                        elif rs == 0xf0:
+                            k += 16
+                        else:
+                            break
+
+
+def _decode_dc_first(segments, restart, mcux, mcus, parts, al):
+    for interval, words in _restart_intervals(segments, restart, mcus):
+        acc = nbits = w = 0
+        preds = [0] * len(parts)
+        for m in interval:
+            my, mx = divmod(m, mcux)
+            for i, (coefs, offsets, row_step, col_step, dc, _) in \
+                    enumerate(parts):
+                origin = my * row_step + mx * col_step
+                for offset in offsets:
+                    if nbits < 32:
+                        acc = (acc & 0xffffffff) << 32 | words[w]
+                        w += 1
+                        nbits += 32
+                    e = dc.lookup[acc >> (nbits - PEEK_BITS) & 511]
+                    if e:
+                        nbits -= e >> 8
+                        s = e & 255
+                    else:
+                        length, s = dc.decode_slow(acc >> (nbits - 16) &
+                                                   0xffff)
+                        nbits -= length
+                    if s:
+                        v = acc >> (nbits - s) & ((1 << s) - 1)
+                        nbits -= s
+                        if v < 1 << (s - 1):
+                            v -= (1 << s) - 1
+                        preds[i] += v
+                    coefs[origin+offset] = preds[i] << al
+
+
+def _decode_dc_refine(segments, restart, mcux, mcus, parts, al):
+    bit = 1 << al
+    for interval, words in _restart_intervals(segments, restart, mcus):
+        acc = nbits = w = 0
+        for m in interval:
+            my, mx = divmod(m, mcux)
+            for coefs, offsets, row_step, col_step, _, _ in parts:
+                origin = my * row_step + mx * col_step
+                for offset in offsets:
+                    if not nbits:
+                        acc = words[w]
+                        w += 1
+                        nbits = 32
+                    nbits -= 1
+                    if acc >> nbits & 1:
+                        coefs[origin+offset] |= bit
+
+
+def _decode_ac_first(segments, restart, mcux, mcus, parts, ss, se, al):
+    coefs, _, row_step, col_step, _, ac = parts[0]
+    fast, lookup = ac.fast, ac.lookup
+    for interval, words in _restart_intervals(segments, restart, mcus):
+        acc = nbits = w = 0
+        eobrun = 0
+        for m in interval:
+            if eobrun:
+                eobrun -= 1
+                continue
+            my, mx = divmod(m, mcux)
+            b = my * row_step + mx * col_step
+            k = ss
+            while k <= se:
+                if nbits < 32:
+                    acc = (acc & 0xffffffff) << 32 | words[w]
+                    w += 1
+                    nbits += 32
+                p = acc >> (nbits - PEEK_BITS) & 511
+                f = fast[p]
+                if f is not None:
+                    length, r, v = f
+                    nbits -= length
+                    k += r
+                    if k > se:
+                        break
+                    coefs[b+k] = v << al
+                    k += 1
+                    continue
+                e = lookup[p]
+                if e:
+                    nbits -= e >> 8
+                    rs = e & 255
+                else:
+                    length, rs = ac.decode_slow(acc >> (nbits - 16) & 0xffff)
+                    nbits -= length
+                r, s = rs >> 4, rs & 15
+                if s:
+                    k += r
+                    if k > se:
+                        break
+                    v = acc >> (nbits - s) & ((1 << s) - 1)
+                    nbits -= s
+                    if v < 1 << (s - 1):
+                        v -= (1 << s) - 1
+                    coefs[b+k] = v << al
+                    k += 1
+                elif r == 15:
+                    k += 16
+                else:
+                    # the rest of this band and of the next blocks' is zero
+                    eobrun = (1 << r) - 1
+                    if r:
+                        eobrun += acc >> (nbits - r) & ((1 << r) - 1)
+                        nbits -= r
+                    break
+
+
+def _decode_ac_refine(segments, restart, mcux, mcus, parts, ss, se, al):
+    coefs, _, row_step, col_step, _, ac = parts[0]
+    lookup = ac.lookup
+    p1, m1 = 1 << al, -1 << al
+    for interval, words in _restart_intervals(segments, restart, mcus):
+        acc = nbits = w = 0
+        eobrun = 0
+        for m in interval:
+            my, mx = divmod(m, mcux)
+            b = my * row_step + mx * col_step
+            k = ss
+            if not eobrun:
+                while k <= se:
+                    if nbits < 32:
+                        acc = (acc & 0xffffffff) << 32 | words[w]
+                        w += 1
+                        nbits += 32
+                    e = lookup[acc >> (nbits - PEEK_BITS) & 511]
+                    if e:
+                        nbits -= e >> 8
+                        rs = e & 255
+                    else:
+                        length, rs = ac.decode_slow(acc >> (nbits - 16) &
+                                                    0xffff)
+                        nbits -= length
+                    r, s = rs >> 4, rs & 15
+                    if s:
+                        nbits -= 1
+                        s = p1 if acc >> nbits & 1 else m1
+                    elif r != 15:
+                        eobrun = 1 << r
+                        if r:
+                            eobrun += acc >> (nbits - r) & ((1 << r) - 1)
+                            nbits -= r
+                        break
+                    # correct the nonzero coefficients passed over on the
+                    # way to the r-th zero one
+                    while k <= se:
+                        c = coefs[b+k]
+                        if c:
+                            if nbits < 32:
+                                acc = (acc & 0xffffffff) << 32 | words[w]
+                                w += 1
+                                nbits += 32
+                            nbits -= 1
+                            if acc >> nbits & 1 and not c & p1:
+                                coefs[b+k] = c + (p1 if c >= 0 else m1)
+                        else:
+                            r -= 1
+                            if r < 0:
+                                break
+                        k += 1
+                    if s and k <= se:
+                        coefs[b+k] = s
+                    k += 1
+            if eobrun:
+                # correct the nonzero coefficients left in the band
+                while k <= se:
+                    c = coefs[b+k]
+                    if c:
+                        if nbits < 32:
+                            acc = (acc & 0xffffffff) << 32 | words[w]
+                            w += 1
+                            nbits += 32
+                        nbits -= 1
+                        if acc >> nbits & 1 and not c & p1:
+                            coefs[b+k] = c + (p1 if c >= 0 else m1)
+                    k += 1
+                eobrun -= 1
+
+
+def idct_8x8(block):
+    """Transform the 64 ``block`` coefficients, in natural order, each
+    dequantized and multiplied by its AAN scale factor with 2 fraction
+    bits, into 64 8-bit samples.
+
+    This is the integer AAN IDCT of libjpeg's ``jidctfst.c``: columns then
+    rows, each with 5 multiplications, skipping those with only a DC term.
+
+    """
+    ws = [0] * 64
+    for c in range(8):
+        i0, i1, i2, i3, i4, i5, i6, i7 = block[c::8]
+        if not (i1 or i2 or i3 or i4 or i5 or i6 or i7):
+            ws[c::8] = (i0,) * 8
+            continue
+        tmp10 = i0 + i4
+        tmp11 = i0 - i4
+        tmp13 = i2 + i6
+        tmp12 = ((i2 - i6) * FIX_1_414213562 >> 8) - tmp13
+        tmp0, tmp3 = tmp10 + tmp13, tmp10 - tmp13
+        tmp1, tmp2 = tmp11 + tmp12, tmp11 - tmp12
+        z13, z10 = i5 + i3, i5 - i3
+        z11, z12 = i1 + i7, i1 - i7
+        tmp7 = z11 + z13
+        tmp11 = (z11 - z13) * FIX_1_414213562 >> 8
+        z5 = (z10 + z12) * FIX_1_847759065 >> 8
+        tmp10 = (z12 * FIX_1_082392200 >> 8) - z5
+        tmp12 = (z10 * -FIX_2_613125930 >> 8) + z5
+        tmp6 = tmp12 - tmp7
+        tmp5 = tmp11 - tmp6
+        tmp4 = tmp10 + tmp5
+        ws[c::8] = (tmp0 + tmp7, tmp1 + tmp6, tmp2 + tmp5, tmp3 - tmp4,
+                    tmp3 + tmp4, tmp2 - tmp5, tmp1 - tmp6, tmp0 - tmp7)
+    out = bytearray(64)
+    for r in range(0, 64, 8):
+        i0, i1, i2, i3, i4, i5, i6, i7 = ws[r:r+8]
+        i0 += _ROW_BIAS
+        if not (i1 or i2 or i3 or i4 or i5 or i6 or i7):
+            out[r:r+8] = bytes((CLAMP[i0 >> 5 & 1023],)) * 8
+            continue
+        tmp10 = i0 + i4
+        tmp11 = i0 - i4
+        tmp13 = i2 + i6
+        tmp12 = ((i2 - i6) * FIX_1_414213562 >> 8) - tmp13
+        tmp0, tmp3 = tmp10 + tmp13, tmp10 - tmp13
+        tmp1, tmp2 = tmp11 + tmp12, tmp11 - tmp12
+        z13, z10 = i5 + i3, i5 - i3
+        z11, z12 = i1 + i7, i1 - i7
+        tmp7 = z11 + z13
+        tmp11 = (z11 - z13) * FIX_1_414213562 >> 8
+        z5 = (z10 + z12) * FIX_1_847759065 >> 8
+        tmp10 = (z12 * FIX_1_082392200 >> 8) - z5
+        tmp12 = (z10 * -FIX_2_613125930 >> 8) + z5
+        tmp6 = tmp12 - tmp7
+        tmp5 = tmp11 - tmp6
+        tmp4 = tmp10 + tmp5
+        out[r:r+8] = (CLAMP[tmp0 + tmp7 >> 5 & 1023],
+                      CLAMP[tmp1 + tmp6 >> 5 & 1023],
+                      CLAMP[tmp2 + tmp5 >> 5 & 1023],
+                      CLAMP[tmp3 - tmp4 >> 5 & 1023],
+                      CLAMP[tmp3 + tmp4 >> 5 & 1023],
+                      CLAMP[tmp2 - tmp5 >> 5 & 1023],
+                      CLAMP[tmp1 - tmp6 >> 5 & 1023],
+                      CLAMP[tmp0 - tmp7 >> 5 & 1023])
+    return out
+
+
+def idct_4x4(block):
+    """Transform the 16 lowest frequencies of a block, dequantized and in
+    natural order, into a 4x4 block of 8-bit samples: the block scaled down
+    by 2.
+
+    """
+    ws = [0] * 16
+    for c in range(4):
+        i0, i1, i2, i3 = block[c::4]
+        if not (i1 or i2 or i3):
+            ws[c::4] = (i0 * _R0 + 1024 >> 11,) * 4
+            continue
+        e0, e1 = (i0 + i2) * _R0, (i0 - i2) * _R0
+        o0, o1 = i1 * _R1 + i3 * _R3, i1 * _R3 - i3 * _R1
+        ws[c::4] = (e0 + o0 + 1024 >> 11, e1 + o1 + 1024 >> 11,
+                    e1 - o1 + 1024 >> 11, e0 - o0 + 1024 >> 11)
+    out = bytearray(16)
+    for r in range(0, 16, 4):
+        i0, i1, i2, i3 = ws[r:r+4]
+        e0 = (i0 + i2) * _R0 + _REDUCED_BIAS
+        e1 = (i0 - i2) * _R0 + _REDUCED_BIAS
+        o0, o1 = i1 * _R1 + i3 * _R3, i1 * _R3 - i3 * _R1
+        out[r:r+4] = (CLAMP[e0 + o0 >> 15 & 1023], CLAMP[e1 + o1 >> 15 & 1023],
+                      CLAMP[e1 - o1 >> 15 & 1023], CLAMP[e0 - o0 >> 15 & 1023])
+    return out
+
+
+def idct_2x2(block):
+    """Transform the 4 lowest frequencies of a block, dequantized and in
+    natural order, into a 2x2 block of 8-bit samples: the block scaled down
+    by 4.
+
+    """
+    i0, i1, i2, i3 = block
+    # columns, then rows; each 2-point IDCT multiplies by _R0 once
+    a, b = (i0 + i2) * _R0 + 1024 >> 11, (i0 - i2) * _R0 + 1024 >> 11
+    c, d = (i1 + i3) * _R0 + 1024 >> 11, (i1 - i3) * _R0 + 1024 >> 11
+    return bytes((CLAMP[(a + c) * _R0 + _REDUCED_BIAS >> 15 & 1023],
+                  CLAMP[(a - c) * _R0 + _REDUCED_BIAS >> 15 & 1023],
+                  CLAMP[(b + d) * _R0 + _REDUCED_BIAS >> 15 & 1023],
+                  CLAMP[(b - d) * _R0 + _REDUCED_BIAS >> 15 & 1023]))
+
+
+IDCTS = {8: idct_8x8, 4: idct_4x4, 2: idct_2x2}
+
+
+def fdct_8x8(samples, start=0, stride=8):
+    """Transform the 8x8 block of 8-bit ``samples`` at ``start``, its rows
+    ``stride`` apart, into 64 coefficients in natural order, each 8 times
+    its AAN scale factor too large.
+
+    This is the integer AAN forward DCT of libjpeg's ``jfdctfst.c``: rows
+    then columns, each with 5 multiplications.
+
+    """
+    ws = [0] * 64
+    for r in range(0, 64, 8):
+        s = start + (r >> 3) * stride
+        d0, d1, d2, d3, d4, d5, d6, d7 = samples[s:s+8]
+        tmp0, tmp7 = d0 + d7, d0 - d7
+        tmp1, tmp6 = d1 + d6, d1 - d6
+        tmp2, tmp5 = d2 + d5, d2 - d5
+        tmp3, tmp4 = d3 + d4, d3 - d4
+        tmp10, tmp13 = tmp0 + tmp3, tmp0 - tmp3
+        tmp11, tmp12 = tmp1 + tmp2, tmp1 - tmp2
+        z1 = (tmp12 + tmp13) * FIX_0_707106781 >> 8
+        tmp10, tmp11, tmp12 = tmp4 + tmp5, tmp5 + tmp6, tmp6 + tmp7
+        z5 = (tmp10 - tmp12) * FIX_0_382683433 >> 8
+        z2 = (tmp10 * FIX_0_541196100 >> 8) + z5
+        z4 = (tmp12 * FIX_1_306562965 >> 8) + z5
+        z3 = tmp11 * FIX_0_707106781 >> 8
+        z11, z13 = tmp7 + z3, tmp7 - z3
+        ws[r:r+8] = (tmp0 + tmp1 + tmp2 + tmp3, z11 + z4, tmp13 + z1, z13 - z2,
+                     tmp0 + tmp3 - tmp1 - tmp2, z13 + z2, tmp13 - z1, z11 - z4)
+    for c in range(8):
+        d0, d1, d2, d3, d4, d5, d6, d7 = ws[c::8]
+        tmp0, tmp7 = d0 + d7, d0 - d7
+        tmp1, tmp6 = d1 + d6, d1 - d6
+        tmp2, tmp5 = d2 + d5, d2 - d5
+        tmp3, tmp4 = d3 + d4, d3 - d4
+        tmp10, tmp13 = tmp0 + tmp3, tmp0 - tmp3
+        tmp11, tmp12 = tmp1 + tmp2, tmp1 - tmp2
+        z1 = (tmp12 + tmp13) * FIX_0_707106781 >> 8
+        tmp10, tmp11, tmp12 = tmp4 + tmp5, tmp5 + tmp6, tmp6 + tmp7
+        z5 = (tmp10 - tmp12) * FIX_0_382683433 >> 8
+        z2 = (tmp10 * FIX_0_541196100 >> 8) + z5
+        z4 = (tmp12 * FIX_1_306562965 >> 8) + z5
+        z3 = tmp11 * FIX_0_707106781 >> 8
+        z11, z13 = tmp7 + z3, tmp7 - z3
+        ws[c::8] = (tmp0 + tmp1 + tmp2 + tmp3, z11 + z4, tmp13 + z1, z13 - z2,
+                    tmp0 + tmp3 - tmp1 - tmp2, z13 + z2, tmp13 - z1, z11 - z4)
+    # the -128 level shift of the samples only moves the DC coefficient
+    ws[0] -= 64 * 128
+    return ws
+
+
+def scale_quantization(table, quality):
+    """Scale a quantization table for ``quality``, from 1 to 100, as the
+    Independent JPEG Group's encoder does.
+
+    """
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return [min(255, max(1, (q * scale + 50) // 100)) for q in table]
+
+
+def optimal_table(frequencies):
+    """Return the number of codes of each length and the symbols of a
+    Huffman table for the 256 symbol ``frequencies``, with no code longer
+    than 16 bits or made of ones only, as in Annex K.2 of the JPEG
+    specification.
+
+    """
+    # a reserved symbol, merged first, takes the all ones code
+    heap = [(0, [256])] + [(f, [s]) for s, f in enumerate(frequencies) if f]
+    heapq.heapify(heap)
+    sizes = [0] * 257
+    while len(heap) > 1:
+        f1, s1 = heapq.heappop(heap)
+        f2, s2 = heapq.heappop(heap)
+        for s in s1 + s2:
+            sizes[s] += 1
+        heapq.heappush(heap, (f1 + f2, s1 + s2))
+    counts = [0] * 258
+    for size in sizes:
+        counts[size] += 1
+    # move the codes longer than 16 bits up the tree, two at a time
+    for i in range(257, 16, -1):
+        while counts[i]:
+            j = i - 2
+            while not counts[j]:
+                j -= 1
+            counts[i] -= 2
+            counts[i-1] += 1
+            counts[j+1] += 2
+            counts[j] -= 1
+    # drop the reserved code, the last of the longest ones
+    i = 16
+    while not counts[i]:
+        i -= 1
+    counts[i] -= 1
+    symbols = sorted((s for s in range(256) if sizes[s]),
+                     key=lambda s: (sizes[s], s))
+    return bytes(counts[1:17]), bytes(symbols)
+
+
+def huffman_codes(counts, symbols):
+    """Return the ``(code, length)`` of each of the 256 symbols of a
+    Huffman table, ``None`` for those it has no code for.
+
+    """
+    codes = [None] * 256
+    code = k = 0
+    for length in range(1, 17):
+        for _ in range(counts[length-1]):
+            codes[symbols[k]] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+
+def _pad(plane, width, height, padded_width, padded_height):
+    """Pad a plane to a larger size by repeating its last column and row."""
+    if (width, height) == (padded_width, padded_height):
+        return plane
+    extra = padded_width - width
+    rows = [plane[y:y+width] + plane[y+width-1:y+width] * extra
+            for y in range(0, width * height, width)]
+    return b"".join(rows + rows[-1:] * (padded_height - height))
+
+
+def _downsample(plane, width, fx, fy):
+    """Average the samples of each ``fx`` by ``fy`` area of a plane,
+    ``fx`` and ``fy`` being 1 or 2.
+
+    """
+    if fx == fy == 1:
+        return plane
+    sums = plane
+    if fx == 2:
+        sums = list(map(operator.add, plane[0::2], plane[1::2]))
+        width //= 2
+    if fy == 2:
+        sums = [a + b for y in range(0, len(sums), 2 * width)
+                for a, b in zip(sums[y:y+width], sums[y+width:y+2*width])]
+    n = fx * fy
+    return bytes(s + (n >> 1) >> (n >> 1) for s in sums)
+
+
+def _count_symbols(order, coefs, dc_counts, ac_counts):
+    """Count the DC and AC symbols of the blocks in ``order``, pairs of the
+    index of a component and the offset of a block in its ``coefs``, into
+    the lists of 256 counts of each component's tables.
+
+    """
+    preds = [0] * len(coefs)
+    for c, b in order:
+        block = coefs[c][b:b+64]
+        dc, ac = dc_counts[c], ac_counts[c]
+        dc[abs(block[0] - preds[c]).bit_length()] += 1
+        preds[c] = block[0]
+        run = 0
+        for v in block[1:]:
+            if not v:
+                run += 1
+                continue
+            while run > 15:
+                ac[0xf0] += 1
+                run -= 16
+            ac[run << 4 | abs(v).bit_length()] += 1
+            run = 0
+        if run:
+            ac[0x00] += 1
+
+
+def _encode_blocks(order, coefs, dc_codes, ac_codes):
+    """Huffman code the blocks in ``order`` with the codes of each
+    component's tables, returning the byte stuffed entropy coded data.
+
+    Codes and their extra bits are shifted into an integer accumulator that
+    is emptied into a bytearray a whole number of bytes at a time, after
+    each block.
+
+    """
+    out = bytearray()
+    acc = nbits = 0
+    preds = [0] * len(coefs)
+    for c, b in order:
+        block = coefs[c][b:b+64]
+        ac = ac_codes[c]
+        v = block[0] - preds[c]
+        preds[c] = block[0]
+        s = abs(v).bit_length()
+        code, length = dc_codes[c][s]
+        if v < 0:
+            v += (1 << s) - 1
+        acc = (acc << length | code) << s | v
+        nbits += length + s
+        run = 0
+        for v in block[1:]:
+            if not v:
+                run += 1
+                continue
+            while run > 15:
+                code, length = ac[0xf0]
+                acc = acc << length | code
+                nbits += length
+                run -= 16
+            s = abs(v).bit_length()
+            code, length = ac[run << 4 | s]
+            if v < 0:
+                v += (1 << s) - 1
+            acc = (acc << length | code) << s | v
+            nbits += length + s
+            run = 0
+        if run:
+            code, length = ac[0x00]
+            acc = acc << length | code
+            nbits += length
+        if nbits >= 64:
+            keep = nbits & 7
+            out += (acc >> keep).to_bytes(nbits >> 3, "big")
+            acc &= (1 << keep) - 1
+            nbits = keep
+    # pad the last byte with ones
+    pad = -nbits & 7
+    acc = acc << pad | (1 << pad) - 1
+    out += acc.to_bytes((nbits + pad) >> 3, "big")
+    return bytes(out).replace(b"\xff", b"\xff\x00")
+
+
 class JPEGFormat(FormatBase):
-    """File format plugin for XPM images
-    =================================
+    """File format plugin for JPEG images
+    ===================================
+
+    Baseline, extended sequential and progressive Huffman coded JPEG images
+    with 8-bit samples are read.  Images of one component are read as
+    ``L``, of three as ``RGB`` (converted from YCbCr unless an Adobe marker
+    or the component identifiers say they already are RGB) and of four as
+    ``CMYK``.
+
+    ``L`` images are written as baseline JPEG images of one component and
+    ``RGB`` ones converted to YCbCr, the chroma subsampled.  ``JPEG_YV12``
+    images are written as they are, with 2x2 chroma subsampling.
+
+    Options
+    -------
+
+    ``mode``
+        ``RGB`` reads images of one component as ``RGB`` as well.
+        ``JPEG_YV12`` reads the planes of a YCbCr image with 2x2 chroma
+        subsampling as they are, without upsampling or converting them; an
+        odd last row or column is dropped.
+
+    ``scale``
+        ``1``, ``1/2``, ``1/4`` or ``1/8``: decode the image scaled down by
+        that much, each block transformed with a 4x4, 2x2 or 1x1 IDCT of its
+        lowest frequencies instead of the full 8x8 one.  The size of the
+        image is rounded up.
+
+    ``quality``
+        From 1 to 100, the quality images are written with: the standard
+        quantization tables of the JPEG specification are scaled as by the
+        Independent JPEG Group's encoder.
+
+    ``subsampling``
+        The chroma subsampling of ``RGB`` images written: ``"4:4:4"``,
+        ``"4:2:2"`` or ``"4:2:0"``.
+
+    ``optimize``
+        When true, images are written with Huffman tables made for them
+        from a first pass counting their symbols, instead of the standard
+        tables.
 
     """
 
     extensions = ("jpg", "jpeg", "jpe", "jif", "jfif", "jfi")
     mimetypes = ("image/jpeg",)
+    defaults = {
+        "mode": None,
+        "scale": 1,
+        "quality": 75,
+        "subsampling": "4:2:0",
+        "optimize": False,
+    }
 
     def read(self):
-        raise NotImplementedError
+        size = Fraction(self.config["scale"]) * 8
+        if size not in (1, 2, 4, 8):
+            self.fail("JPEG images can only be scaled by 1, 1/2, 1/4 or "
+                      "1/8.")
+        if self.config["mode"] not in (None, RGB, JPEG_YV12):
+            self.fail("JPEG images cannot be read as {}.".format(
+                      self.config["mode"]))
+        self.block_size = int(size)
+        data = self.fp.read()
+        if data[:2] != b"\xff\xd8":
+            self.fail("Not a JPEG file.")
+        self.qtables = {}
+        self.htables = {}
+        self.components = None
+        self.progressive = False
+        self.restart = 0
+        self.adobe_transform = None
+        pos = 2
+        while pos < len(data):
+            if data[pos] != 0xff:
+                pos = data.find(b"\xff", pos)
+                if pos < 0:
+                    break
+                continue
+            marker = data[pos+1:pos+2]
+            if not marker:
+                break
+            marker = marker[0]
+            if marker == 0xff:
+                # fill byte
+                pos += 1
+                continue
+            if marker == EOI:
+                break
+            if marker == TEM or RST0 <= marker <= RST0 + 7:
+                pos += 2
+                continue
+            length = int.from_bytes(data[pos+2:pos+4], "big")
+            segment = data[pos+4:pos+2+length]
+            pos += 2 + length
+            if len(segment) < length - 2:
+                self.fail("JPEG file is truncated.")
+            if marker == DQT:
+                self._read_quantization_tables(segment)
+            elif marker == DHT:
+                self._read_huffman_tables(segment)
+            elif marker in (SOF0, SOF1, SOF2):
+                self._read_frame(segment, marker == SOF2)
+            elif 0xc0 <= marker <= 0xcf and marker not in (DHT, 0xc8, 0xcc):
+                self.fail("Only baseline, extended and progressive Huffman "
+                          "coded JPEG images are supported.")
+            elif marker == DRI:
+                self.restart = int.from_bytes(segment[:2], "big")
+            elif marker == APP14 and segment[:5] == b"Adobe" and \
+                    len(segment) >= 12:
+                self.adobe_transform = segment[11]
+            elif marker == SOS:
+                pos = self._read_scan(segment, data, pos)
+        if self.components is None:
+            self.fail("JPEG file has no frame.")
+        return self._build_image()
+
+    def _read_quantization_tables(self, segment):
+        pos = 0
+        while pos < len(segment):
+            precision, tq = segment[pos] >> 4, segment[pos] & 15
+            if precision:
+                values = array("H", segment[pos+1:pos+129])
+                if sys.byteorder == "little":
+                    values.byteswap()
+                pos += 129
+            else:
+                values = segment[pos+1:pos+65]
+                pos += 65
+            self.qtables[tq] = list(values)
+
+    def _read_huffman_tables(self, segment):
+        pos = 0
+        while pos < len(segment):
+            tc, th = segment[pos] >> 4, segment[pos] & 15
+            counts = segment[pos+1:pos+17]
+            total = sum(counts)
+            symbols = segment[pos+17:pos+17+total]
+            if len(counts) < 16 or len(symbols) < total:
+                self.fail("JPEG Huffman table is truncated.")
+            self.htables[tc, th] = HuffmanTable(counts, symbols)
+            pos += 17 + total
+
+    def _read_frame(self, segment, progressive):
+        if self.components is not None:
+            self.fail("JPEG file holds more than one frame.")
+        precision = segment[0]
+        height = int.from_bytes(segment[1:3], "big")
+        width = int.from_bytes(segment[3:5], "big")
+        count = segment[5]
+        if precision != 8:
+            self.fail("Only 8-bit JPEG images are supported.")
+        if not width or not height:
+            self.fail("JPEG images without a height in their frame header "
+                      "are not supported.")
+        if count not in (1, 3, 4) or len(segment) < 6 + 3 * count:
+            self.fail("JPEG frame has {} components.".format(count))
+        self.size = (width, height)
+        self.progressive = progressive
+        self.components = [
+            Component(segment[6+3*i], segment[7+3*i] >> 4,
+                      segment[7+3*i] & 15, segment[8+3*i])
+            for i in range(count)]
+        self.hmax = max(c.h for c in self.components)
+        self.vmax = max(c.v for c in self.components)
+        if min(c.h for c in self.components) < 1 or \
+                min(c.v for c in self.components) < 1 or \
+                any(self.hmax % c.h or self.vmax % c.v
+                    for c in self.components):
+            self.fail("JPEG sampling factors are not supported.")
+        self.mcux = -(-width // (8 * self.hmax))
+        self.mcuy = -(-height // (8 * self.vmax))
+        for c in self.components:
+            c.blocks_wide = self.mcux * c.h
+            c.blocks_high = self.mcuy * c.v
+            c.coefs = array("h", bytes(128 * c.blocks_wide * c.blocks_high))
+
+    def _read_scan(self, segment, data, pos):
+        """Decode the scan whose entropy coded data starts at ``pos`` of
+        ``data`` and return the position of the marker ending it.
+
+        """
+        if self.components is None:
+            self.fail("JPEG scan comes before the frame.")
+        count = segment[0]
+        by_ident = {c.ident: c for c in self.components}
+        parts = []
+        scan = []
+        for i in range(count):
+            ident, tables = segment[1+2*i], segment[2+2*i]
+            try:
+                c = by_ident[ident]
+                dc = self.htables.get((0, tables >> 4))
+                ac = self.htables.get((1, tables & 15))
+            except KeyError:
+                self.fail("JPEG scan has an unknown component.")
+            scan.append((c, dc, ac))
+        ss, se, ah, al = (segment[1+2*count], segment[2+2*count],
+                          segment[3+2*count] >> 4, segment[3+2*count] & 15)
+
+        m = re.compile(b"\xff[^\x00\xd0-\xd7\xff]").search(data, pos)
+        end = m.start() if m else len(data)
+        segments = [s.replace(b"\xff\x00", b"\xff") for s in
+                    re.split(b"\xff[\xd0-\xd7]", data[pos:end])]
+
+        width, height = self.size
+        if count == 1:
+            # a single component is coded a block at a time
+            c = scan[0][0]
+            mcux = -(-width * c.h // self.hmax // 8)
+            mcuy = -(-height * c.v // self.vmax // 8)
+            layouts = [(c, [0], 64 * c.blocks_wide, 64)]
+        else:
+            mcux, mcuy = self.mcux, self.mcuy
+            layouts = [(c, [64 * (y * c.blocks_wide + x) for y in range(c.v)
+                            for x in range(c.h)],
+                        64 * c.v * c.blocks_wide, 64 * c.h)
+                       for c, _, _ in scan]
+        for (c, dc, ac), layout in zip(scan, layouts):
+            if (ss == 0 and ah == 0 and dc is None) or \
+                    ((se > 0 or not self.progressive) and ac is None):
+                self.fail("JPEG scan uses an undefined Huffman table.")
+        parts = [(c.coefs, offsets, row_step, col_step, dc, ac)
+                 for (c, offsets, row_step, col_step), (_, dc, ac)
+                 in zip(layouts, scan)]
+        args = (segments, self.restart, mcux, mcux * mcuy, parts)
+        try:
+            if not self.progressive:
+                _decode_sequential(*args)
+            elif ss == 0:
+                if se != 0:
+                    self.fail("Progressive JPEG DC scans must hold nothing "
+                              "else.")
+                if ah:
+                    _decode_dc_refine(*args, al=al)
+                else:
+                    _decode_dc_first(*args, al=al)
+            else:
+                if count != 1 or se > 63 or ss > se:
+                    self.fail("Invalid progressive JPEG AC scan.")
+                if ah:
+                    _decode_ac_refine(*args, ss=ss, se=se, al=al)
+                else:
+                    _decode_ac_first(*args, ss=ss, se=se, al=al)
+        except ValueError as err:
+            self.fail("JPEG data is corrupt: {}".format(err))
+        except IndexError:
+            # the data ran out; whatever was decoded is kept
+            pass
+        except OverflowError:
+            self.fail("JPEG data is corrupt.")
+        return end
+
+    def _plane(self, c):
+        """Transform the coefficients of component ``c`` into a plane of
+        samples ``block_size`` times its size in blocks.
+
+        """
+        try:
+            table = self.qtables[c.tq]
+        except KeyError:
+            self.fail("JPEG component uses an undefined quantization table.")
+        n = self.block_size
+        coefs = c.coefs
+        if n == 1:
+            q = table[0]
+            return bytes(CLAMP[(d * q + 4 >> 3) + 128 & 1023]
+                         for d in coefs[::64])
+        if n == 8:
+            # each product is rounded to 2 fraction bits, not the table:
+            # the scale factors of the highest frequencies are below 1/8,
+            # and would round to nothing in the finest tables
+            mult = [q * AAN_SCALES[i] for q, i in zip(table, ZIGZAG)]
+            shift = 12
+        else:
+            mult, shift = table, 0
+        half = (1 << shift) >> 1
+        transform = IDCTS[n]
+        # the zigzag indices of the coefficients kept, in natural order
+        kept = [UNZIGZAG[r*8 + c] for r in range(n) for c in range(n)]
+        width = c.blocks_wide * n
+        plane = bytearray(width * c.blocks_high * n)
+        view = memoryview(plane)
+        for by in range(c.blocks_high):
+            for bx in range(c.blocks_wide):
+                base = (by * c.blocks_wide + bx) * 64
+                zz = coefs[base:base+64]
+                # only blocks with no AC coefficients at all are flat
+                zeros = zz.count(0)
+                if zeros == 64 or zeros == 63 and zz[0]:
+                    value = CLAMP[(zz[0] * table[0] + 4 >> 3) + 128 & 1023]
+                    samples = bytes((value,)) * (n * n)
+                else:
+                    samples = transform([zz[k] * mult[k] + half >> shift
+                                         for k in kept])
+                start = by * n * width + bx * n
+                for y in range(n):
+                    view[start + y*width:start + y*width + n] = \
+                        samples[y*n:y*n + n]
+        return plane
+
+    def _build_image(self):
+        n = self.block_size
+        width, height = self.size
+        out_width, out_height = -(-width * n // 8), -(-height * n // 8)
+        components = self.components
+        planes = [self._plane(c) for c in components]
+        requested = self.config["mode"]
+
+        if requested == JPEG_YV12:
+            if len(components) != 3 or (components[0].h, components[0].v,
+                                        self.hmax, self.vmax) != (2, 2, 2, 2):
+                self.fail("Only YCbCr JPEG images with 2x2 chroma "
+                          "subsampling can be read as JPEG_YV12.")
+            # planar images have an even width and height
+            out_width, out_height = out_width & ~1, out_height & ~1
+            if not out_width or not out_height:
+                self.fail("JPEG image is too small for JPEG_YV12.")
+            y = self._crop(planes[0], components[0], out_width, out_height)
+            cb, cr = [self._crop(p, c, out_width // 2, out_height // 2)
+                      for p, c in zip(planes[1:], components[1:])]
+            im = self.image_cls(JPEG_YV12, size=(out_width, out_height))
+            im.buffer[:] = y + cr + cb
+            return im
+
+        planes = [self._crop(self._upsample(p, c), c,
+                             out_width, out_height, True)
+                  for p, c in zip(planes, components)]
+        if len(planes) == 1:
+            if requested == RGB:
+                planes *= 3
+            else:
+                im = self.image_cls(L, size=(out_width, out_height))
+                im.buffer[:] = planes[0]
+                return im
+        elif len(planes) == 3:
+            idents = bytes(c.ident for c in components)
+            if self.adobe_transform != 0 and idents != b"RGB":
+                planes = self._ycbcr_to_rgb(*planes)
+        elif self.adobe_transform == 2:
+            self.fail("YCCK JPEG images are not supported.")
+        mode = CMYK if len(planes) == 4 else RGB
+        data = bytearray(out_width * out_height * len(planes))
+        for i, plane in enumerate(planes):
+            data[i::len(planes)] = plane
+        im = self.image_cls(mode, size=(out_width, out_height))
+        im.buffer[:] = data
+        return im
+
+    def _upsample(self, plane, c):
+        """Stretch the plane of ``c`` to the full resolution of the frame by
+        repeating samples.
+
+        """
+        fx, fy = self.hmax // c.h, self.vmax // c.v
+        if fx == fy == 1:
+            return plane
+        width = c.blocks_wide * self.block_size
+        if fx > 1:
+            wide = bytearray(len(plane) * fx)
+            for i in range(fx):
+                wide[i::fx] = plane
+            plane, width = wide, width * fx
+        if fy > 1:
+            plane = b"".join([plane[y:y+width] * fy
+                              for y in range(0, len(plane), width)])
+        return plane
+
+    def _crop(self, plane, c, width, height, upsampled=False):
+        stride = c.blocks_wide * self.block_size
+        if upsampled:
+            stride *= self.hmax // c.h
+        if stride == width:
+            return bytes(plane[:width * height])
+        return b"".join([plane[y*stride:y*stride + width]
+                         for y in range(height)])
+
+    def _ycbcr_to_rgb(self, y, cb, cr):
+        r = bytes(map(lambda y, cr: CLAMP[y + _CR_R[cr] & 1023], y, cr))
+        g = bytes(map(lambda y, cb, cr:
+                      CLAMP[y + (_CB_G[cb] + _CR_G[cr] >> 16) & 1023],
+                      y, cb, cr))
+        b = bytes(map(lambda y, cb: CLAMP[y + _CB_B[cb] & 1023], y, cb))
+        return [r, g, b]
 
     def load(self):
-        raise NotImplementedError
+        pass
 
     def write(self):
-        raise NotImplementedError
+        im = self.image
+        width, height = im.size
+        quality = self.config["quality"]
+        if not 1 <= quality <= 100:
+            self.fail("JPEG quality must be from 1 to 100.")
+        data = bytes(im.buffer)
+        if im.mode == L:
+            # plane, its size and its sampling factors
+            planes = [(data, width, height, 1, 1)]
+        elif im.mode == RGB:
+            try:
+                h, v = SUBSAMPLING[self.config["subsampling"]]
+            except KeyError:
+                self.fail("JPEG chroma subsampling must be 4:4:4, 4:2:2 or "
+                          "4:2:0.")
+            y, cb, cr = self._rgb_to_ycbcr(data)
+            planes = [(y, width, height, h, v), (cb, width, height, 1, 1),
+                      (cr, width, height, 1, 1)]
+        elif im.mode == JPEG_YV12:
+            size = width * height // 4
+            cr = data[width*height:width*height + size]
+            cb = data[width*height + size:]
+            planes = [(data[:width*height], width, height, 2, 2),
+                      (cb, width // 2, height // 2, 1, 1),
+                      (cr, width // 2, height // 2, 1, 1)]
+        else:
+            self.fail("Images with mode {} cannot be saved as JPEG.".format(
+                      im.mode))
+
+        hmax = max(p[3] for p in planes)
+        vmax = max(p[4] for p in planes)
+        mcux, mcuy = -(-width // (8 * hmax)), -(-height // (8 * vmax))
+        # luma and chroma tables, quantization then DC and AC Huffman ones
+        count = min(2, len(planes))
+        tables = [scale_quantization(LUMINANCE_QUANTIZATION, quality),
+                  scale_quantization(CHROMINANCE_QUANTIZATION, quality)]
+        coefs = []
+        for i, (plane, pw, ph, h, v) in enumerate(planes):
+            # the planes of full resolution are subsampled to size, after
+            # padding them to whole MCUs
+            cw, ch = mcux * 8 * h, mcuy * 8 * v
+            fx, fy = (hmax // h, vmax // v) if pw == width else (1, 1)
+            plane = _pad(plane, pw, ph, cw * fx, ch * fy)
+            plane = _downsample(plane, cw * fx, fx, fy)
+            coefs.append(self._transform(plane, cw, ch, tables[i > 0]))
+
+        # the blocks of each component in an MCU, in the order they're coded
+        order = [(i, ((my * v + y) * mcux * h + mx * h + x) * 64)
+                 for my in range(mcuy) for mx in range(mcux)
+                 for i, (_, _, _, h, v) in enumerate(planes)
+                 for y in range(v) for x in range(h)]
+        if self.config["optimize"]:
+            dc_counts = [[0] * 256 for _ in range(count)]
+            ac_counts = [[0] * 256 for _ in range(count)]
+            _count_symbols(order, coefs,
+                           [dc_counts[i > 0] for i in range(len(planes))],
+                           [ac_counts[i > 0] for i in range(len(planes))])
+            huffman = [(optimal_table(dc), optimal_table(ac))
+                       for dc, ac in zip(dc_counts, ac_counts)]
+        else:
+            huffman = [(LUMINANCE_DC, LUMINANCE_AC),
+                       (CHROMINANCE_DC, CHROMINANCE_AC)][:count]
+        codes = [(huffman_codes(*dc), huffman_codes(*ac))
+                 for dc, ac in huffman]
+
+        self.fp.write(b"\xff\xd8")
+        self._write_segment(APP0, b"JFIF\x00\x01\x01" +
+                            struct.pack(">BHHBB", 0, 1, 1, 0, 0))
+        self._write_segment(DQT, b"".join(bytes((i,)) + bytes(table)
+                                          for i, table in
+                                          enumerate(tables[:count])))
+        self._write_segment(SOF0, struct.pack(
+            ">BHHB", 8, height, width, len(planes)) + b"".join(
+            bytes((i + 1, h << 4 | v, i > 0))
+            for i, (_, _, _, h, v) in enumerate(planes)))
+        self._write_segment(DHT, b"".join(
+            bytes((tc << 4 | th,)) + counts + symbols
+            for th, pair in enumerate(huffman)
+            for tc, (counts, symbols) in enumerate(pair)))
+        self._write_segment(SOS, bytes((len(planes),)) + b"".join(
+            bytes((i + 1, 0x11 if i else 0x00)) for i in range(len(planes))) +
+            bytes((0, 63, 0)))
+        self.fp.write(_encode_blocks(
+            order, coefs, [codes[i > 0][0] for i in range(len(planes))],
+            [codes[i > 0][1] for i in range(len(planes))]))
+        self.fp.write(b"\xff\xd9")
+
+    def _write_segment(self, marker, payload):
+        self.fp.write(struct.pack(">BBH", 0xff, marker, len(payload) + 2))
+        self.fp.write(payload)
+
+    def _rgb_to_ycbcr(self, data):
+        r, g, b = data[0::3], data[1::3], data[2::3]
+        y = bytes(map(lambda r, g, b: _R_Y[r] + _G_Y[g] + _B_Y[b] >> 16,
+                      r, g, b))
+        cb = bytes(map(lambda r, g, b: _R_CB[r] + _G_CB[g] + _HALF[b] >> 16,
+                       r, g, b))
+        cr = bytes(map(lambda r, g, b: _HALF[r] + _G_CR[g] + _B_CR[b] >> 16,
+                       r, g, b))
+        return y, cb, cr
+
+    def _transform(self, plane, width, height, table):
+        """Transform and quantize the blocks of a plane whose width and
+        height are multiples of 8 into an array of coefficients, 64 to a
+        block in zigzag order.
+
+        """
+        # the reciprocals of the divisors of the AAN scaled coefficients,
+        # with 20 fraction bits
+        quant = [(i, int(round((1 << 31) / (q * AAN_SCALES[i]))))
+                 for q, i in zip(table, ZIGZAG)]
+        coefs = array("h", bytes(2 * width * height))
+        b = 0
+        for y in range(0, width * height, 8 * width):
+            for x in range(y, y + width, 8):
+                ws = fdct_8x8(plane, x, width)
+                coefs[b:b+64] = array("h", [ws[i] * r + (1 << 19) >> 20
+                                            for i, r in quant])
+                b += 64
+        return coefs
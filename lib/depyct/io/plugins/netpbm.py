@@ -1,39 +1,18 @@
 # depyct/io/plugins/netpbm.py
+import array
+from collections import namedtuple
 import enum
 import itertools
 import re
-import struct
+import sys
 
 from depyct.io import format
 from depyct import image
+from depyct.image import dither
 from depyct.image import mode
 from depyct import util
 
 
-if util.py27:
-    unpack_bits = lambda chunk: [(255 if (b>>i) & 1 else 0,)
-                                 for b in map(ord, chunk)
-                                 for i in range(7,-1,-1)]
-else:
-    unpack_bits = lambda chunk: [(255 if (b>>i) & 1 else 0,) for b in chunk
-                                 for i in range(7,-1,-1)]
-
-def pack_bits(iterable, endianess="big"):
-    if endianess == "big":
-        range_args = (7, -1, -1)
-    else:
-        range_args = (8,)
-    while True:
-        bit = 0
-        try:
-            for i in range(*range_args):
-                bit |= (next(iterable)<<i)
-        except StopIteration:
-            break
-        finally:
-            yield bit
-
-
 def group(iterable, chunksize):
     return zip(*(iter(iterable),) * chunksize)
 
@@ -42,6 +21,65 @@ def affine(a, i, I, o, O):
     return int(O - float((I - a)*(O - o))/(I - i))
 
 
+def scale_table(maxval, top):
+    """Map every sample value from 0 to ``maxval`` onto 0 to ``top``."""
+    return [affine(v, 0, maxval, 0, top) for v in range(maxval + 1)]
+
+
+def readinto_exactly(fp, view):
+    """Fill ``view`` from ``fp``, returning the number of bytes read, which
+    is only short of ``len(view)`` at the end of the file.
+
+    """
+    filled = 0
+    size = len(view)
+    while filled < size:
+        n = fp.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+class NetpbmStream(object):
+    """Buffered reading of the images of ``fp`` one after another.
+
+    ``fp`` may be a pipe: it is read with ``read1`` where it has one, so a
+    read returns what is already available instead of waiting for more, and
+    whatever is read past the end of one image is handed back with
+    :meth:`unread` to be read first for the next.
+
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._read1 = getattr(fp, "read1", fp.read)
+        self._pending = b""
+        self._offset = 0
+
+    def read(self, size):
+        if self._offset < len(self._pending):
+            data = self._pending[self._offset:self._offset + size]
+            self._offset += len(data)
+            return data
+        return self._read1(size)
+
+    def readinto(self, view):
+        if self._offset < len(self._pending):
+            data = self.read(len(view))
+            view[:len(data)] = data
+            return len(data)
+        return self.fp.readinto(view)
+
+    def unread(self, data):
+        self._pending = bytes(data) + self._pending[self._offset:]
+        self._offset = 0
+
+
+NetpbmHeader = namedtuple("NetpbmHeader", "magic_number size maxval mode")
+
+
+'''
 class MagicNumber(enum.Enum):
 
     PLAIN_PBM = b"P1"
@@ -244,89 +282,395 @@ class NetpbmFormat(format.FormatBase):
     """Base file format plugin for Netpbm images
     ============================================
 
+    Options
+    -------
+
+    ``format``
+        ``"raw"`` or ``"plain"``, the kind of file written.
+
+    ``maxval``
+        The largest sample value written; samples are rescaled from the
+        range of the image's mode.
+
+    ``ring_size``
+        The number of images :meth:`frames` decodes into in turn.
+
     """
 
-    defaults = {"format": "raw", "maxval": 255}
+    defaults = {"format": "raw", "maxval": 255, "ring_size": 2}
 
+    #: The number of bytes of image data converted and written at a time.
+    band_size = 1 << 20
+    #: The number of bytes of a plain raster read and tokenized at a time.
+    chunk_size = 1 << 16
 
     def read(self):
-        m = self._header_re.match(self.fp.read(512))
+        stream = NetpbmStream(self.fp)
+        header = self._read_header(stream)
+        if header is None:
+            self.fail("The file holds no image.")
+        return self._read_image(stream, header)
+
+    def frames(self, source):
+        """Yield the images of ``source``, a file or a pipe holding any
+        number of images back to back, as they are read.
+
+        The images are decoded into a ring of ``ring_size`` preallocated
+        images which are reused in turn while the mode and size of the
+        images stay the same, so an image yielded is only valid until
+        ``ring_size`` more have been read; copy it to keep it longer.
+
+        """
+        if isinstance(source, util.string_type):
+            with open(source, "rb") as fp:
+                for im in self.frames(fp):
+                    yield im
+            return
+        stream = NetpbmStream(source)
+        ring = [None] * max(1, self.config["ring_size"])
+        n = 0
+        while True:
+            header = self._read_header(stream)
+            if header is None:
+                return
+            slot = n % len(ring)
+            im = ring[slot]
+            if im is None or im.mode != header.mode or im.size != header.size:
+                im = ring[slot] = self.image_cls(header.mode, size=header.size)
+            yield self._read_image(stream, header, im)
+            n += 1
+
+    def save_frames(self, images, destination):
+        """Write ``images`` one after another to ``destination`` as a single
+        stream, flushing it after each so that a reader at the other end of
+        a pipe gets every image as soon as it is written.
+
+        """
+        if isinstance(destination, util.string_type):
+            with open(destination, "wb") as fp:
+                return self.save_frames(images, fp)
+        flush = getattr(destination, "flush", None)
+        for im in images:
+            self.save(im, destination)
+            if flush is not None:
+                flush()
+
+    def _read_header(self, stream):
+        """Read the header of the next image in ``stream``, returning a
+        :class:`NetpbmHeader`, or ``None`` at the end of the stream.
+
+        """
+        data = b""
+        while True:
+            chunk = stream.read(4096)
+            data += chunk
+            parsed = self._parse_header(data)
+            if parsed is not None:
+                header, end = parsed
+                stream.unread(data[end:])
+                if header.magic_number not in self._format:
+                    self.fail("{} images can't be read as {}.".format(
+                              header.magic_number.decode("ascii"),
+                              self.extensions[0].upper()))
+                return header
+            if not chunk or len(data) > _MAX_HEADER_SIZE:
+                if not data.strip():
+                    return None
+                self.fail("Incomplete or invalid Netpbm header.")
+
+    def _parse_header(self, data):
+        """Parse the header at the start of ``data``, returning it with the
+        offset of the raster, or ``None`` when more data is needed.
+
+        """
+        m = _MAGIC_NUMBER_RE.match(data)
         if m is None:
-            raise IOError("not a valid {}")
-        self.fp.seek(m.end())
-        magic_number = m.group("magic_number")
-        self.size = int(m.group("width")), int(m.group("height"))
-        if "maxval" in m.groupdict():
-            self.maxval = maxval = int(m.group("maxval"))
-            if maxval < 256:
-                if magic_number in (b"P3", b"P6"):
-                    self.mode = mode.RGB
-                else:
-                    self.mode = mode.L
-            elif magic_number in (b"P3", b"P6"):
-                self.mode = mode.RGB48
-            else:
-                self.mode = mode.L16
-            bit_depth = self.mode.bits_per_component
-            self.scale = lambda a: affine(a, 0, maxval, 0, 2**bit_depth - 1)
-            self.scale_pixel = lambda p: tuple(
-                    map(self.scale, p[:self.mode.components]))
+            if len(data.lstrip()) >= 2:
+                self.fail("Not a Netpbm image.")
+            return None
+        magic_number = m.group(1)
+        if magic_number == b"P7":
+            return self._parse_pam_header(data, m.end())
+        if magic_number in (b"P1", b"P4"):
+            m = _PBM_HEADER_RE.match(data, m.end())
+            if m is None:
+                return None
+            maxval, depth = 1, 1
         else:
-            self.mode = mode.L
-        im = self.image_cls(self.mode, size=self.size)
+            m = _PNM_HEADER_RE.match(data, m.end())
+            if m is None:
+                return None
+            maxval = self._check_maxval(int(m.group(3)))
+            depth = 3 if magic_number in (b"P3", b"P6") else 1
+        size = image.ImageSize(int(m.group(1)), int(m.group(2)))
+        header = NetpbmHeader(magic_number, size, maxval,
+                              _netpbm_mode(maxval, depth))
+        return header, m.end()
+
+    def _parse_pam_header(self, data, start):
+        end = _PAM_END_RE.search(data, start)
+        if end is None:
+            return None
+        headers = {}
+        for line in data[start:end.start()].split(b"\n"):
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            name, _, value = line.partition(b" ")
+            if name == b"TUPLTYPE":
+                continue
+            if name in headers:
+                self.fail("PAM header has more than one {} line.".format(
+                          name.decode("ascii")))
+            headers[name] = value.strip()
         try:
-            data = getattr(self,
-                           "_read_{}".format(self._format[magic_number]))()
-        except AssertionError as err:
-            raise IOError(err.message)
-        im[:] = data
+            width, height, depth, maxval = [
+                    int(headers[name])
+                    for name in (b"WIDTH", b"HEIGHT", b"DEPTH", b"MAXVAL")]
+        except KeyError as err:
+            self.fail("PAM header is missing {}.".format(
+                      err.args[0].decode("ascii")))
+        except ValueError:
+            self.fail("PAM header values must be integers.")
+        if not 1 <= depth <= 4:
+            self.fail("Depyct doesn't support PAM images with a depth of "
+                      "{}.".format(depth))
+        header = NetpbmHeader(b"P7", image.ImageSize(width, height),
+                              self._check_maxval(maxval),
+                              _netpbm_mode(maxval, depth))
+        return header, end.end()
+
+    def _check_maxval(self, maxval):
+        if not 0 < maxval < 65536:
+            self.fail("maxval must be between 1 and 65535, not {}.".format(
+                      maxval))
+        return maxval
+
+    def _read_image(self, stream, header, im=None):
+        """Read the raster described by ``header`` from ``stream`` into
+        ``im``, or a new image.
+
+        """
+        if im is None:
+            im = self.image_cls(header.mode, size=header.size)
+        reader = self._reader(header.magic_number)
+        reader.fp = stream
+        reader.size = header.size
+        reader.maxval = header.maxval
+        reader.mode = header.mode
+        getattr(reader, "_read_{}".format(
+                reader._format[header.magic_number]))(im)
         return im
 
+    def _reader(self, magic_number):
+        # the plugin whose _read_plain or _read_raw handles magic_number
+        cls = _READERS[magic_number]
+        if isinstance(self, cls):
+            return self
+        readers = self.__dict__.setdefault("_readers", {})
+        if cls not in readers:
+            readers[cls] = cls(self.image_cls, **self.config)
+        return readers[cls]
+
+    def _read_samples(self, im, maxval):
+        """Read raw big-endian samples straight into the buffer of ``im``.
+
+        The whole raster is read with as few calls as the file allows, 16-bit
+        samples are put into native order with a single byteswap and, unless
+        ``maxval`` is already the top of the mode's range, every sample is
+        rescaled through a lookup table.
+
+        """
+        buffer = im.buffer
+        if readinto_exactly(self.fp, buffer) < len(buffer):
+            self.fail("Image data is truncated.")
+        top = 2**im.mode.bits_per_component - 1
+        if im.mode.bits_per_component == 16:
+            samples = array.array("H")
+            samples.frombytes(buffer)
+            if sys.byteorder == "little":
+                samples.byteswap()
+            if maxval == top:
+                buffer.cast("H")[:] = samples
+            else:
+                self._store_samples(im, samples, maxval)
+        elif maxval != top:
+            data = buffer.tobytes()
+            if data and max(data) > maxval:
+                self.fail("Sample value exceeds maxval {}.".format(maxval))
+            buffer[:] = data.translate(bytes(scale_table(maxval, top)).ljust(
+                    256, b"\xff"))
+
+    def _read_tokens(self, count):
+        """Read ``count`` decimal samples from a plain raster.
+
+        The raster is read :attr:`chunk_size` bytes at a time and each chunk
+        is split as a whole, carrying a token cut off at its end over to the
+        next, so samples may be spread over lines in any way at all.
+
+        """
+        samples = array.array("L")
+        partial = b""
+        while len(samples) < count:
+            chunk = self.fp.read(self.chunk_size)
+            data = partial + chunk
+            tokens = data.split()
+            partial = b""
+            if chunk and tokens and not data[-1:].isspace():
+                partial = tokens.pop()
+            needed = count - len(samples)
+            if len(tokens) >= needed:
+                # hand back whatever follows the last sample
+                last = _TOKEN_RE.finditer(data)
+                self.fp.unread(data[list(
+                        itertools.islice(last, needed))[-1].end():])
+                del tokens[needed:]
+            try:
+                samples.extend(map(int, tokens))
+            except (ValueError, OverflowError):
+                self.fail("Plain image data may only hold decimal samples.")
+            if not chunk:
+                break
+        if len(samples) < count:
+            self.fail("Image data is truncated.")
+        return samples
+
+    def _store_samples(self, im, samples, maxval):
+        """Rescale ``samples``, ranging from 0 to ``maxval``, to the range
+        of the mode of ``im`` and copy them into its buffer.
+
+        """
+        if samples and max(samples) > maxval:
+            self.fail("Sample value exceeds maxval {}.".format(maxval))
+        top = 2**im.mode.bits_per_component - 1
+        if im.mode.bits_per_component == 16:
+            if maxval != top:
+                samples = map(scale_table(maxval, top).__getitem__, samples)
+            im.buffer.cast("H")[:] = array.array("H", samples)
+        else:
+            data = array.array("B", samples).tobytes()
+            if maxval != top:
+                data = data.translate(bytes(scale_table(maxval, top)).ljust(
+                        256, b"\xff"))
+            im.buffer[:] = data
+
     def write(self):
         fmt = self.config["format"]
         magic_number = self._magic_number.get(fmt)
         header_format = b"%b\n%d %d\n"
         header = (magic_number,) + self.image.size
         if magic_number not in (b"P1", b"P4"):
-            max = 2**self.image.mode.bits_per_component - 1
-            self.maxval = maxval = self.config.get("maxval", max)
-            bit_depth = self.image.mode.bits_per_component
-
-            # FIXME: have something that deals with conversion
-            # from one color space to another
-            self.scale = lambda a: affine(a, 0, 2**bit_depth - 1, 0, maxval)
-            if self.image.components <= 2:
-                self.scale_pixel = lambda p: tuple(map(self.scale, p[:1]))
-            else:
-                self.scale_pixel = lambda p: tuple(map(self.scale, p[:3]))
+            self.maxval = maxval = self._check_maxval(self.config["maxval"])
             header_format += b"%d\n"
             header += (maxval,)
         self.fp.write(header_format % header)
-        try:
-            # have all the info and the fp attached to the format
-            data = getattr(self, "_write_{}".format(fmt))()
-        except AssertionError as err:
-            raise IOError(err.message)
-
-
-_NETPBM_HEADER = (br"^(?P<magic_number>P[%b])\n\s*"
-                  br"(?:(?:#.*?)\n\s*)??"
-                  br"(?P<width>\d+)\s+"
-                  br"(?:(?:#.*?)\n\s*)??"
-                  br"(?P<height>\d+)\s+")
-_NETPBM_MAXVAL = br"(?:(?:#.*?)\n\s*)??(?P<maxval>\d+)\s+(?:(?:#.*?)\n\s*)??"
+        getattr(self, "_write_{}".format(fmt))()
+
+    def _scaled_bands(self, channels):
+        """Yield the samples of ``channels`` of the image being written, a
+        band of whole rows at a time, rescaled from the mode's range to
+        :attr:`maxval`.
+
+        A band is a memoryview of the image buffer itself when nothing needs
+        converting, ``bytes`` when every sample fits in a byte, and otherwise
+        an ``array('H')`` of samples in native order.
+
+        """
+        im = self.image
+        components = im.mode.components
+        sample_size = im.mode.bits_per_component // 8
+        top = 2**im.mode.bits_per_component - 1
+        line_size = im.size.width * im.bytes_per_pixel
+        rows = max(1, self.band_size // line_size) if line_size else 1
+        table = None
+        if self.maxval != top:
+            table = scale_table(top, self.maxval)
+        buffer = im.buffer
+        for start in range(0, len(buffer), rows * line_size):
+            band = buffer[start:start + rows*line_size]
+            if tuple(channels) != tuple(range(components)):
+                band = util.select_samples(band, components, channels,
+                                           sample_size)
+            if sample_size == 2:
+                band = array.array("H", bytes(band))
+                if table is not None:
+                    band = array.array("H", map(table.__getitem__, band))
+                if self.maxval <= 255:
+                    band = array.array("B", band).tobytes()
+            elif table is not None:
+                if self.maxval <= 255:
+                    band = bytes(band).translate(bytes(table))
+                else:
+                    band = array.array("H", map(table.__getitem__, band))
+            yield band
+
+    def _write_samples(self, channels):
+        """Write ``channels`` of the image as raw big-endian samples."""
+        for band in self._scaled_bands(channels):
+            if isinstance(band, array.array) and sys.byteorder == "little":
+                band.byteswap()
+            self.fp.write(band)
+
+    def _write_tokens(self, channels):
+        """Write ``channels`` of the image as plain text samples, each row
+        on its own line with the samples separated by tabs.
+
+        Every sample value is formatted once up front; rows are then joined
+        from that table.
+
+        """
+        tokens = [b"%d" % v for v in range(self.maxval + 1)]
+        row_size = self.image.size.width * len(channels)
+        for band in self._scaled_bands(channels):
+            self.fp.write(b"".join(
+                    b"\t".join(map(tokens.__getitem__,
+                                   band[i:i + row_size])) + b"\n"
+                    for i in range(0, len(band), row_size)))
+
+
+_MAX_HEADER_SIZE = 1 << 16
+_SEPARATOR = br"(?:\s|#[^\n]*\n)+"
+_MAGIC_NUMBER_RE = re.compile(br"\s*(P[1-7])")
+_PBM_HEADER_RE = re.compile((_SEPARATOR + br"(\d+)") * 2 + br"\s")
+_PNM_HEADER_RE = re.compile((_SEPARATOR + br"(\d+)") * 3 + br"\s")
+_PAM_END_RE = re.compile(br"^ENDHDR[ \t\r]*\n", re.M)
+_TOKEN_RE = re.compile(br"\S+")
+_DIGIT_RE = re.compile(br"\S")
+_PLAIN_BITS = bytes.maketrans(b"01", b"\x00\xff")
+_PLAIN_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+_TUPLTYPES = {1: b"GRAYSCALE", 2: b"GRAYSCALE_ALPHA", 3: b"RGB",
+              4: b"RGB_ALPHA"}
+
+
+def _netpbm_mode(maxval, depth):
+    if maxval < 256:
+        return {1: mode.L, 2: mode.LA, 3: mode.RGB, 4: mode.RGBA}[depth]
+    return {1: mode.L16, 2: mode.LA32, 3: mode.RGB48, 4: mode.RGBA64}[depth]
 
 
 class PbmFormat(NetpbmFormat):
     """Plugin for PBM images
     ========================
 
+    Options
+    -------
+
+    ``clip``
+        A function of a pixel and the image that is true for pixels written
+        as set, black, bits.
+
+    ``dither``
+        When writing, a method of :meth:`~depyct.image.ImageMixin.dither`.
+        The image is then converted to gray, ignoring alpha, and dithered to
+        black and white, and ``clip`` is not used.
+
     """
 
     extensions = ("pbm",)
     mimetypes = ("image/x-portable-bitmap",)
     defaults = {
         "clip": lambda c, im: c != im.mode.transparent_color,
+        "dither": None,
     }
     messages = {
         "bad_line_data":
@@ -345,49 +689,63 @@ class PbmFormat(NetpbmFormat):
     # assert len(line_data) == width, .format(len(line_data), i, width))
     # assert len(data) == height, .format(len(data), height))
 
-    def _read_plain(self):
-        data = []
-        for i, line in enumerate(self.fp): # assert 1
-            line_data = [(255 if b == b"1" else 0,) for b in line.split()] # assert 2
-            data.append(line_data)
-        return data # assert 3
-
-    def _read_raw(self):
-        data = []
-        width = self.size[0]
-        chunksize, padded = divmod(width, 8)
-        if padded:
-            chunksize += 1
-        while True:
-            chunk = self.fp.read(chunksize)
+    def _read_plain(self, im):
+        # every 0 or 1 is a pixel of its own whether or not whitespace
+        # separates it from the next
+        count = len(im.buffer)
+        digits = bytearray()
+        while len(digits) < count:
+            chunk = self.fp.read(self.chunk_size)
             if not chunk:
                 break
-            chunk_data = unpack_bits(chunk)[:width]
-            data.append(chunk_data)
-        return data
+            needed = count - len(digits)
+            digits += chunk.translate(None, b" \t\r\n\v\f")
+            if len(digits) >= count:
+                # hand back whatever follows the last pixel
+                last = _DIGIT_RE.finditer(chunk)
+                self.fp.unread(chunk[list(
+                        itertools.islice(last, needed))[-1].end():])
+        del digits[count:]
+        if digits.translate(None, b"01"):
+            self.fail("Plain PBM image data may only hold 0 and 1.")
+        if len(digits) < count:
+            self.fail("Image data is truncated.")
+        im.buffer[:] = digits.translate(_PLAIN_BITS)
+
+    def _read_raw(self, im):
+        width, height = self.size
+        row_size = (width + 7) // 8
+        packed = bytearray(row_size * height)
+        if readinto_exactly(self.fp, memoryview(packed)) < len(packed):
+            self.fail("Image data is truncated.")
+        im.buffer[:] = util.unpack_bits(packed, width, height)
 
     def _write_plain(self):
-        clip = self.config["clip"]
-        row_template = b"\t".join((b"%d",) * self.image.size.width)
-        height = self.image.size.height
-        for i, line in enumerate(self.image, 1):
-            row = row_template % tuple(
-                    int(clip(p.value, self.image)) for p in line)
-            self.fp.write(row)
-            if i != height:
-                self.fp.write(b"\n")
+        width = self.image.size.width
+        line = bytearray(b"\t" * (2*width - 1))
+        rows = []
+        for row in self._bilevel_rows():
+            line[::2] = row.translate(_PLAIN_DIGITS)
+            rows.append(bytes(line))
+        self.fp.write(b"\n".join(rows))
 
     def _write_raw(self):
+        self.fp.writelines(util.pack_bits(row)
+                           for row in self._bilevel_rows())
+
+    def _bilevel_rows(self):
+        """Yield the rows of the image being written with one byte per
+        pixel, as :func:`~depyct.image.dither.bilevel_rows` gives them.
+
+        """
         clip = self.config["clip"]
-        width = self.image.size.width
-        bytes_per_line, padded = divmod(width, 8)
-        if padded:
-            bytes_per_line += 1
-        for line in self.image:
-            self.fp.write(struct.pack(">{}B".format(bytes_per_line),
-                     *pack_bits(clip(p.value, self.image) for p in line)))
+        if clip is self.defaults["clip"]:
+            clip = None
+        else:
+            clip = lambda p, im, clip=clip: clip(p.value, im)
+        return dither.bilevel_rows(self.image, clip, self.config["dither"],
+                                   self.fail)
 
-    _header_re = re.compile(_NETPBM_HEADER % (br"14",))
     _format = {b"P1": "plain", b"P4": "raw"}
     _magic_number = {"plain": b"P1", "raw": b"P4"}
 
@@ -403,54 +761,20 @@ class PgmFormat(NetpbmFormat):
     defaults = {}
     messages = {}
 
-    def _read_plain(self):
-        data = []
-        scale = self.scale_pixel
-        for line in self.fp:
-            line_data = [scale((int(i),)) for i in line.split()]
-            data.append(line_data)
-        return data
+    def _read_plain(self, im):
+        samples = self._read_tokens(len(im.buffer) * 8 //
+                                    im.mode.bits_per_component)
+        self._store_samples(im, samples, self.maxval)
 
-    def _read_raw(self):
-        data = []
-        scale = self.scale_pixel
-        width, height = self.size
-        bpp = self.mode.bits_per_component // 8
-        struct_format = ">{}{}".format(width, "B" if bpp == 1 else "H")
-        chunksize = width * bpp
-        while True:
-            chunk = self.fp.read(chunksize)
-            if not chunk:
-                break
-            line_data = [scale((p,))
-                         for p in struct.unpack(struct_format, chunk)]
-            data.append(line_data)
-        return data
-
-    #assert format in ("raw", "plain")
-    #assert 0 < maxval < 65536
-    #if image.components != 1:
-        # issue a warning about loss of information
+    def _read_raw(self, im):
+        self._read_samples(im, self.maxval)
 
     def _write_plain(self):
-        scale = self.scale
-        height = self.image.size.height
-        row_template = b"\t".join((b"%d",) * self.image.size.width)
-        for i, line in enumerate(self.image):
-            row = row_template % tuple(scale(p.l) for p in line)
-            self.fp.write(row)
-            if i != height:
-                self.fp.write(b"\n")
+        self._write_tokens((0,))
 
     def _write_raw(self):
-        scale = self.scale
-        struct_format = ">{}{}".format(self.image.size.width,
-                                       "B" if self.maxval <= 255 else "H")
-        for i, line in enumerate(self.image):
-           self.fp.write(struct.pack(struct_format, *[scale(p.l)
-                for p in line]))
-
-    _header_re = re.compile(_NETPBM_HEADER % (br"25",) + _NETPBM_MAXVAL)
+        self._write_samples((0,))
+
     _format = {b"P2": "plain", b"P5": "raw"}
     _magic_number = {"plain": b"P2", "raw": b"P5"}
 
@@ -466,58 +790,26 @@ class PpmFormat(NetpbmFormat):
     defaults = {}
     messages = {}
 
-    def _read_plain(self):
-        data = []
-        scale = self.scale_pixel
-        for line in self.fp:
-            pixels = group(line.split(), 3)
-            line_data = [scale(tuple(int(_) for _ in p)) for p in pixels]
-            data.append(line_data)
-        return data
+    def _read_plain(self, im):
+        samples = self._read_tokens(len(im.buffer) * 8 //
+                                    im.mode.bits_per_component)
+        self._store_samples(im, samples, self.maxval)
 
-    def _read_raw(self):
-        data = []
-        scale = self.scale_pixel
-        bpp = self.mode.bits_per_component // 8
-        width, height = self.size
-        struct_format = ">{}{}".format(width*3, "B" if bpp == 1 else "H")
-        chunksize = width * 3 * bpp
-        while True:
-            chunk = self.fp.read(chunksize)
-            if not chunk:
-                break
-            pixels = group(struct.unpack(struct_format, chunk), 3)
-            line_data = [scale(p) for p in pixels]
-            data.append(line_data)
-        return data
+    def _read_raw(self, im):
+        self._read_samples(im, self.maxval)
 
     def _write_plain(self):
-        scale = self.scale_pixel
-        height = self.image.size.height
-        row_template = b"\t".join((b"%d\t%d\t%d",) * self.image.size.width)
-        for i, line in enumerate(self.image):
-            format_args = tuple(
-                    itertools.chain.from_iterable(scale(p.value) for p in line))
-            row = row_template % format_args
-            self.fp.write(row)
-            if i != height:
-                self.fp.write(b"\n")
+        self._write_tokens(self._channels())
 
     def _write_raw(self):
-        scale = self.scale_pixel
-        struct_format = ">{}{}".format(self.image.size.width * 3,
-                                       "B" if self.maxval <= 255 else "H")
-        for i, line in enumerate(self.image):
-            data = []
-            for p in line:
-                data.extend(scale(p))
-            try:
-                self.fp.write(struct.pack(struct_format, *data))
-            except Exception as err:
-                print(len(data))
-                raise
+        self._write_samples(self._channels())
+
+    def _channels(self):
+        # gray images are written with the gray level repeated as r, g and b
+        if self.image.components < 3:
+            return (0, 0, 0)
+        return (0, 1, 2)
 
-    _header_re = re.compile(_NETPBM_HEADER % (br"36",) + _NETPBM_MAXVAL)
     _format = {b"P3": "plain", b"P6": "raw"}
     _magic_number = {"plain": b"P3", "raw": b"P6"}
 
@@ -533,24 +825,6 @@ class PnmFormat(NetpbmFormat):
     defaults = {}
     messages = {}
 
-    def read(self):
-        magic_number = self.fp.read(2)
-        try:
-            ext = {b"P1": "pbm", b"P4": "pbm",
-                   b"P2": "pgm", b"P5": "pgm",
-                   b"P3": "ppm", b"P6": "ppm"}[magic_number]
-        except KeyError:
-            raise IOError("Unrecognized magic number {} for pnm format. "
-                          "Should be P1, P2, or P3 for plain text pbm, "
-                          "pgm, or ppm, respectively, or P4, P5, or P6 for "
-                          "raw pbm, pgm, or ppm, respectively.".format(
-                              magic_number))
-        fmt = format.registry[ext](self.image_cls, **self.config)
-        # Seeking isn't always an option. Is there any way to skip reading
-        # the magic number in the other formats?
-        self.fp.seek(0)
-        return fmt.open(self.fp)
-
     def write(self):
         if self.image.components <= 2:
             ext = "pgm"
@@ -559,84 +833,48 @@ class PnmFormat(NetpbmFormat):
         fmt = format.registry[ext](self.image_cls, **self.config)
         return fmt.save(self.image, self.fp)
 
+    _format = {b"P1": "plain", b"P2": "plain", b"P3": "plain",
+               b"P4": "raw", b"P5": "raw", b"P6": "raw"}
+
 
 class PamFormat(NetpbmFormat):
     """Plugin for PAM images
     ========================
 
+    Reads any Netpbm image.  Images are written as PAM, with a ``TUPLTYPE``
+    chosen from the number of channels unless the ``tupltype`` option gives
+    one.
+
     """
 
     extensions = ("pam",)
     mimetypes = ("image/x-portable-arbitrarymap",)
+    defaults = {"tupltype": None}
 
-    REQUIRED_HEADERS = {b"HEIGHT", b"WIDTH", b"DEPTH", b"MAXVAL"}
-
-    def read(self):
-
-        def debug(o):
-            print("DEBUG!")
-            print(o)
-            print("DEBUG!")
-
-        magic_number = self.fp.read(2)
-        if magic_number != b"P7":
-            fmt = PNMFormat(image_cls, **self.config)
-            # FIXME: remove this seek or wrap the fp in a buffered object
-            self.fp.seek(0)
-            return fmt.open(self.fp)
-
-        headers = {}
-        for line in self.fp:
-            line = line.strip()
-            if not line or line.startswith(b'#'):
-                continue
-            if line == b"ENDHDR":
-                break
-            header, token = line.split(None, 1)
-            if header == b"TUPLYPE":
-                headers.setdefault(header, []).append(token)
-            elif header in headers:
-                raise ValueError(
-                        "Header includes more than one {} line: {}, {}".format(
-                            header, self.headers[header], token))
-            else:
-                headers[header] = token
-
-        for required in self.REQUIRED_HEADERS:
-            if required not in headers:
-                raise ValueError(
-                        "Required header {} was missing".format(required))
-
-        maxval = int(headers[b"MAXVAL"])
-        if maxval < 2**8:
-            bit_depth = 8
-        elif maxval < 2**16:
-            bit_depth = 16
-        else:
-            raise ValueError("MAXVAL too high: {}".format(maxval))
-        components = int(headers[b"DEPTH"])
-
-        im_mode = {
-            8:  {1: mode.L,   2: mode.LA,    3: mode.RGB,    4: mode.RGBA},
-            16: {1: mode.L16, 2: mode.LA32,  3: mode.RGB48,  4: mode.RGBA64},
-        }[bit_depth][components]
-
-        size = image.ImageSize(int(headers[b"WIDTH"]), int(headers[b"HEIGHT"]))
-        im = self.image_cls(im_mode, size)
-
-        if im_mode == mode.L:
-          debug(im.buffer.tobytes())
-          debug(im.buffer.shape)
-        data = self.fp.read()
-        if im_mode == mode.L:
-          debug(len(data))
-          debug(data)
-        im.buffer[:] = data
-
-        im.map(lambda v: affine(v, 0, maxval, 0, 2**bit_depth - 1))
-
-        return im
+    def _read_raw(self, im):
+        self._read_samples(im, self.maxval)
 
     def write(self):
-        pass
-'''
+        im = self.image
+        components = im.mode.components
+        if components > 4:
+            self.fail("Depyct doesn't write PAM images with more than 4 "
+                      "channels.")
+        self.maxval = maxval = self._check_maxval(self.config["maxval"])
+        tupltype = self.config["tupltype"] or _TUPLTYPES[components]
+        if not isinstance(tupltype, bytes):
+            tupltype = tupltype.encode("ascii")
+        self.fp.write(b"P7\nWIDTH %d\nHEIGHT %d\nDEPTH %d\nMAXVAL %d\n"
+                      b"TUPLTYPE %b\nENDHDR\n" % (
+                          im.size.width, im.size.height, components, maxval,
+                          tupltype))
+        self._write_samples(tuple(range(components)))
+
+    _format = {b"P1": "plain", b"P2": "plain", b"P3": "plain",
+               b"P4": "raw", b"P5": "raw", b"P6": "raw", b"P7": "raw"}
+
+
+_READERS = {b"P1": PbmFormat, b"P4": PbmFormat,
+            b"P2": PgmFormat, b"P5": PgmFormat,
+            b"P3": PpmFormat, b"P6": PpmFormat,
+            b"P7": PamFormat}
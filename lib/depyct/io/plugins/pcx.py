@@ -1,22 +1,297 @@
 # depyct/io/plugins/pcx.py
+import ctypes
+import re
 
+from depyct.image.mode import L, RGB, RGBA
 from depyct.io.format import FormatBase
+from depyct import util
+
+
+class PCXHeader(ctypes.LittleEndianStructure):
+
+    _pack_ = 1
+    _fields_ = [("manufacturer", ctypes.c_uint8),
+                ("version", ctypes.c_uint8),
+                ("encoding", ctypes.c_uint8),
+                ("bits_per_pixel", ctypes.c_uint8),
+                ("x_min", ctypes.c_uint16),
+                ("y_min", ctypes.c_uint16),
+                ("x_max", ctypes.c_uint16),
+                ("y_max", ctypes.c_uint16),
+                ("h_dpi", ctypes.c_uint16),
+                ("v_dpi", ctypes.c_uint16),
+                ("palette", ctypes.c_uint8 * 48),
+                ("reserved", ctypes.c_uint8),
+                ("planes", ctypes.c_uint8),
+                ("bytes_per_line", ctypes.c_uint16),
+                ("palette_info", ctypes.c_uint16),
+                ("h_screen", ctypes.c_uint16),
+                ("v_screen", ctypes.c_uint16),
+                ("filler", ctypes.c_uint8 * 54)]
+
+
+# the bits per pixel and planes of the layouts read: monochrome, CGA,
+# EGA and VGA planar, 16 and 256-color packed, and 24 and 32-bit planar
+LAYOUTS = ((1, 1), (1, 2), (1, 3), (1, 4), (2, 1), (4, 1), (8, 1), (8, 3),
+           (8, 4))
+
+# a run, its count in the low six bits of a byte with the top two set,
+# or a stretch of bytes that stand for themselves
+_CODES = re.compile(b"[\xc0-\xff](.)|[\x00-\xbf]+", re.S)
+
+# runs of a repeated byte, stretches of bytes that can be written as they
+# are, stopping short of a run, or a lone byte that needs a count
+_RUNS = re.compile(b"(.)\\1+|(?:([\x00-\xbf])(?!\\2))+|.", re.S)
+
+# for planar 1-bit pixels, one table per pixel of a byte mapping the byte
+# to that pixel's bit moved to the plane's place in the index
+_PLANE_TABLES = [[bytes((v >> (7 - k) & 1) << p for v in range(256))
+                  for k in range(8)]
+                 for p in range(4)]
+
+# 0 and 255 to the bits of a monochrome image
+_BILEVEL = bytes(v >> 7 for v in range(256))
+
+_PALETTE_MARKER = 0x0c
+
+
+def rle_decode(data, size):
+    """Expand the run-length encoded ``data`` until ``size`` bytes come
+    out, and return them, fewer if ``data`` runs out first.
+
+    Each run is expanded with one bytes multiplication, and the bytes
+    between runs are copied in one piece.
+
+    """
+    out = bytearray()
+    for m in _CODES.finditer(data):
+        value = m.group(1)
+        if value is None:
+            out += m.group(0)
+        else:
+            out += value * (data[m.start()] & 0x3f)
+        if len(out) >= size:
+            del out[size:]
+            break
+    return out
+
+
+def rle_encode(line):
+    """Run-length encode ``line``, one scan line of every plane.
+
+    Bytes below ``0xc0`` outside runs are written as they are; runs and
+    other bytes are written as a count of up to 63 and the byte.
+
+    """
+    out = bytearray()
+    for m in _RUNS.finditer(line):
+        piece = m.group(0)
+        if m.group(2) is not None:
+            out += piece
+            continue
+        value = piece[:1]
+        full, rest = divmod(len(piece), 63)
+        out += (b"\xff" + value) * full
+        if rest == 1 and value < b"\xc0":
+            out += value
+        elif rest:
+            out += bytes((0xc0 | rest,)) + value
+    return bytes(out)
 
 
 class PCXFormat(FormatBase):
     """File format plugin for PCX images
     =================================
 
+    Monochrome, 4 and 16-color planar, 4, 16 and 256-color packed and 24
+    and 32-bit planar images are read.  Images with a palette of grays are
+    read as ``L``, other palette images as ``RGB``, and planar images as
+    ``RGB`` or ``RGBA``.  The resolution, converted to pixels per meter,
+    is stored in ``info["resolution"]`` when the file gives one.
+
+    ``L`` images holding only black and white, with no palette, are
+    written as monochrome images, other ``L`` images as 256-color ones
+    with their ``info["palette"]`` or else a ramp of grays, and ``RGB``
+    images as 24-bit planar ones.
+
+    Options
+    -------
+
+    ``indexed``
+        When true, palette images are read as ``L`` images holding the
+        palette indices, with the palette in ``info["palette"]`` as a list
+        of ``(r, g, b)`` tuples.
+
     """
 
     extensions = ("pcx",)
     mimetypes = ("image/x-pcx",)
+    defaults = {
+        "indexed": False,
+    }
 
     def read(self):
-        raise NotImplementedError
+        header = self.fp.read(ctypes.sizeof(PCXHeader))
+        if len(header) < ctypes.sizeof(PCXHeader) or header[0] != 0x0a:
+            self.fail("Not a PCX file.")
+        h = PCXHeader.from_buffer_copy(header)
+        if h.encoding not in (0, 1):
+            self.fail("Unsupported PCX encoding {}.".format(h.encoding))
+        bits, planes = h.bits_per_pixel, h.planes
+        if (bits, planes) not in LAYOUTS:
+            self.fail("Unsupported PCX layout of {} planes of {}-bit "
+                      "pixels.".format(planes, bits))
+        width, height = h.x_max - h.x_min + 1, h.y_max - h.y_min + 1
+        if width <= 0 or height <= 0:
+            self.fail("Invalid image size {}x{}.".format(width, height))
+        bpl = h.bytes_per_line
+        if bpl * 8 < width * bits:
+            self.fail("PCX scan lines of {} bytes are too short for {} "
+                      "pixels.".format(bpl, width))
+
+        data = self.fp.read()
+        size = bpl * planes * height
+        raw = rle_decode(data, size) if h.encoding else data[:size]
+        if len(raw) < size:
+            self.fail("PCX image data is truncated.")
+        raw = bytes(raw)
+        stride = bpl * planes
+
+        if bits == 8 and planes > 1:
+            im = self.image_cls(RGB if planes == 3 else RGBA,
+                                size=(width, height))
+            out = bytearray(width * height * planes)
+            for p in range(planes):
+                out[p::planes] = self._rows(raw, p * bpl, stride, width,
+                                            height)
+            im.buffer[:] = out
+        else:
+            if bits == 8:
+                indices = self._rows(raw, 0, stride, width, height)
+                if h.version >= 5 and len(data) >= 769 and \
+                        data[-769] == _PALETTE_MARKER:
+                    colors = data[-768:]
+                else:
+                    colors = bytes(v for v in range(256) for _ in range(3))
+            elif planes == 1:
+                unpacked = util.unpack_samples(raw, bits)
+                indices = self._rows(unpacked, 0, bpl * 8 // bits, width,
+                                     height)
+                colors = bytes(h.palette)[:3 << bits]
+            else:
+                combined = 0
+                for p in range(planes):
+                    plane = self._rows(raw, p * bpl, stride, bpl, height)
+                    combined |= int.from_bytes(
+                            self._unpack(plane, _PLANE_TABLES[p]), "big")
+                unpacked = combined.to_bytes(bpl * 8 * height, "big")
+                indices = self._rows(unpacked, 0, bpl * 8, width, height)
+                colors = bytes(h.palette)[:3 << planes]
+            if bits * planes == 1:
+                colors = b"\x00\x00\x00\xff\xff\xff"
+            palette = list(zip(colors[0::3], colors[1::3], colors[2::3]))
+            im = self._expand_palette(indices, palette, width, height)
+
+        if h.h_dpi and h.v_dpi:
+            im.info["resolution"] = (round(h.h_dpi / 0.0254),
+                                     round(h.v_dpi / 0.0254))
+        return im
+
+    def _rows(self, data, offset, stride, length, height):
+        """Join ``length`` bytes from each of ``height`` rows of ``stride``
+        bytes, starting ``offset`` bytes into each row.
+
+        """
+        if offset == 0 and stride == length and len(data) == \
+                length * height:
+            return data
+        view = memoryview(data)
+        return b"".join([view[offset + y*stride:offset + y*stride + length]
+                         for y in range(height)])
+
+    def _unpack(self, packed, tables):
+        """Spread the bits of one plane packed in each byte of ``packed``
+        out to a byte each, moved to the plane's place by ``tables``.
+
+        """
+        per_byte = len(tables)
+        out = bytearray(len(packed) * per_byte)
+        for k, table in enumerate(tables):
+            out[k::per_byte] = packed.translate(table)
+        return out
+
+    def _expand_palette(self, indices, palette, width, height):
+        tables = [bytes(channel).ljust(256, b"\x00")
+                  for channel in zip(*palette)]
+        if self.config["indexed"]:
+            im = self.image_cls(L, size=(width, height))
+            im.buffer[:] = indices
+            im.info["palette"] = palette
+        elif tables[0] == tables[1] == tables[2]:
+            im = self.image_cls(L, size=(width, height))
+            im.buffer[:] = bytes(indices).translate(tables[0])
+        else:
+            im = self.image_cls(RGB, size=(width, height))
+            im.buffer[:] = util.expand_palette(bytes(indices), tables)
+        return im
 
     def load(self):
-        raise NotImplementedError
+        pass
 
     def write(self):
-        raise NotImplementedError
+        im = self.image
+        width, height = im.size
+        if not 0 < width <= 0x10000 or not 0 < height <= 0x10000:
+            self.fail("PCX images are at most 65536 pixels wide and "
+                      "high.")
+        data = bytes(im.buffer)
+        palette = None
+        ega = bytearray(48)
+        if im.mode == L and "palette" not in im.info and \
+                not data.translate(None, b"\x00\xff"):
+            bits, planes = 1, 1
+            ega[3:6] = b"\xff\xff\xff"
+        elif im.mode == L:
+            bits, planes = 8, 1
+            palette = [tuple(bytes(c)[:3]) for c in
+                       im.info.get("palette", [(v, v, v)
+                                               for v in range(256)])]
+            if not 0 < len(palette) <= 256:
+                self.fail("The palette must have between 1 and 256 colors.")
+        elif im.mode == RGB:
+            bits, planes = 8, 3
+        else:
+            self.fail("Images with mode {} cannot be saved as PCX.".format(
+                      im.mode))
+
+        # scan lines are padded to an even number of bytes
+        bpl = (width * bits + 15) // 16 * 2
+        if bits == 1:
+            data = data.translate(_BILEVEL)
+            lines = [util.pack_bits(data[y*width:(y+1)*width]).ljust(
+                     bpl, b"\x00") for y in range(height)]
+        else:
+            pad = bytes(bpl - width)
+            channels = [data[c::planes] for c in range(planes)]
+            lines = [b"".join([channel[y*width:(y+1)*width] + pad
+                               for channel in channels])
+                     for y in range(height)]
+
+        resolution = im.info.get("resolution", (0, 0))
+        header = PCXHeader(manufacturer=0x0a, version=5, encoding=1,
+                           bits_per_pixel=bits, x_max=width - 1,
+                           y_max=height - 1,
+                           h_dpi=round(resolution[0] * 0.0254),
+                           v_dpi=round(resolution[1] * 0.0254),
+                           planes=planes, bytes_per_line=bpl,
+                           palette_info=1)
+        header.palette[:] = ega
+        if palette is not None and all(r == g == b for r, g, b in palette):
+            header.palette_info = 2
+        self.fp.write(bytes(header))
+        self.fp.write(b"".join(map(rle_encode, lines)))
+        if palette is not None:
+            colors = bytearray(768)
+            for c, channel in enumerate(zip(*palette)):
+                colors[c:3*len(palette):3] = bytes(channel)
+            self.fp.write(bytes((_PALETTE_MARKER,)) + colors)
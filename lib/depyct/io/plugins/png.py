@@ -1,11 +1,17 @@
 # depyct/io/plugins/png.py
+import collections
 from collections import namedtuple
+from concurrent import futures
 import ctypes
+import datetime
+import os
 import struct
+import sys
 import zlib
 
 from depyct.image import mode as image_modes
 from depyct.io.format import FormatBase
+from depyct import util
 
 
 class PNGStruct(ctypes.BigEndianStructure):
@@ -77,6 +83,24 @@ class IHDR(PNGStruct):
             6: (8, 16)
         }
 
+    CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    @property
+    def bits_per_pixel(self):
+        return self.CHANNELS[self.color_type] * self.bit_depth
+
+    @property
+    def filter_unit(self):
+        """The byte distance used by the filters, at least one."""
+        return max(1, self.bits_per_pixel // 8)
+
+    def row_bytes(self, width):
+        """Bytes in a scanline of ``width`` pixels, excluding the filter
+        type byte.
+
+        """
+        return (width * self.bits_per_pixel + 7) // 8
+
 
 class pHYs(PNGStruct):
     _fields_ = [("x_resolution", ctypes.c_uint32),
@@ -108,7 +132,8 @@ class RGBTriple(PNGStruct):
 
 
 class SuggestedRGB(RGBTriple):
-    _fields_ = [("frequency", ctypes.c_uint32)]
+    _fields_ = [("alpha", ctypes.c_uint8),
+                ("frequency", ctypes.c_uint16)]
 
 
 class TrueColorRGBTriple(PNGStruct):
@@ -120,62 +145,153 @@ class TrueColorRGBTriple(PNGStruct):
         return iter((self.r, self.g, self.b))
 
 
-class SuggestedTrueColorRGB(RGBTriple):
-    _fields_ = [("frequency", ctypes.c_uint32)]
+class SuggestedTrueColorRGB(TrueColorRGBTriple):
+    _fields_ = [("alpha", ctypes.c_uint16),
+                ("frequency", ctypes.c_uint16)]
 
 
-def _noop(x, bpp, prior, raw):
-    return raw[x]
+class acTL(PNGStruct):
+    _fields_ = [("num_frames", ctypes.c_uint32),
+                ("num_plays", ctypes.c_uint32)]
 
-filter_none = unfilter_none = _noop
 
-def filter_sub(x, bpp, prior, raw):
-    return raw[x] - (0 if x-bpp < 0 else raw[x-bpp])
-
-def filter_up(x, bpp, prior, raw):
-    return raw[x] - (0 if x-bpp < 0 else prior[x-bpp])
-
-def filter_average(x, bpp, prior, raw):
-    return raw[x] - ((0 if x-bpp < 0 else raw[x-bpp]) + prior[x])//2
-
-def filter_paeth(x, bpp, prior, raw):
-    if x-bpp < 0:
-        prediction = paeth_predictor(0, prior[x], 0)
-    else:
-        prediction = paeth_predictor(raw[x-bpp], prior[x], prior[x-bpp])
-    return raw[x] - prediction
+class fcTL(PNGStruct):
+    _fields_ = [("sequence_number", ctypes.c_uint32),
+                ("width", ctypes.c_uint32),
+                ("height", ctypes.c_uint32),
+                ("x_offset", ctypes.c_uint32),
+                ("y_offset", ctypes.c_uint32),
+                ("delay_num", ctypes.c_uint16),
+                ("delay_den", ctypes.c_uint16),
+                ("dispose_op", ctypes.c_uint8),
+                ("blend_op", ctypes.c_uint8)]
+
+
+APNG_DISPOSE_OP_NONE = 0
+APNG_DISPOSE_OP_BACKGROUND = 1
+APNG_DISPOSE_OP_PREVIOUS = 2
+
+APNG_BLEND_OP_SOURCE = 0
+APNG_BLEND_OP_OVER = 1
+
+
+# The byte-string arithmetic below is carried out on large integers, one
+# byte per lane, with the high bit of each lane handled separately so that
+# no carry or borrow can cross a byte boundary.
+
+def _lane_masks(n):
+    return (int.from_bytes(b"\x7f" * n, "big"),
+            int.from_bytes(b"\x80" * n, "big"))
+
+def _add_bytes(a, b):
+    """Add two equally sized byte strings bytewise, modulo 256."""
+    n = len(a)
+    low, high = _lane_masks(n)
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    total = ((x & low) + (y & low)) ^ ((x ^ y) & high)
+    return total.to_bytes(n, "big")
+
+def _sub_bytes(a, b):
+    """Subtract two equally sized byte strings bytewise, modulo 256."""
+    n = len(a)
+    low, high = _lane_masks(n)
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    difference = ((x | high) - (y & low)) ^ ((x ^ ~y) & high)
+    return difference.to_bytes(n, "big")
+
+def _average_bytes(a, b):
+    """The bytewise floor of the mean of two equally sized byte strings."""
+    n = len(a)
+    low, _ = _lane_masks(n)
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    return ((x & y) + (((x ^ y) >> 1) & low)).to_bytes(n, "big")
+
+# The filters below take the raw bytes of a scanline and of the one before
+# it and return the filtered bytes, without the filter type byte.
+
+def filter_none(bpp, prior, raw):
+    return bytes(raw)
+
+def filter_sub(bpp, prior, raw):
+    return _sub_bytes(raw, bytes(bpp) + raw[:-bpp])
+
+def filter_up(bpp, prior, raw):
+    return _sub_bytes(raw, prior)
+
+def filter_average(bpp, prior, raw):
+    return _sub_bytes(raw, _average_bytes(bytes(bpp) + raw[:-bpp], prior))
+
+def filter_paeth(bpp, prior, raw):
+    out = bytearray(raw)
+    for i in range(min(bpp, len(raw))):
+        out[i] = (raw[i] - prior[i]) & 0xff
+    for i in range(bpp, len(raw)):
+        left, above, upper_left = raw[i-bpp], prior[i], prior[i-bpp]
+        p = left + above - upper_left
+        pa = abs(p - left)
+        pb = abs(p - above)
+        pc = abs(p - upper_left)
+        if pa <= pb and pa <= pc:
+            prediction = left
+        elif pb <= pc:
+            prediction = above
+        else:
+            prediction = upper_left
+        out[i] = (raw[i] - prediction) & 0xff
+    return bytes(out)
 
 def paeth_predictor(left, above, upper_left):
     p = left + above - upper_left
     pa = abs(p - left)
     pb = abs(p - above)
     pc = abs(p - upper_left)
-    if pa <= pb and pa < pc:
+    if pa <= pb and pa <= pc:
         return left
     elif pb <= pc:
         return above
     else:
         return upper_left
 
-def unfilter_sub(x, bpp, prior, raw):
-    i = x - bpp
-    return (filter_sub(x, bpp, prior, raw) + (0 if i < 0 else raw[i])) % 256
-
-def unfilter_up(x, bpp, prior, raw):
-    return (filter_up(x, bpp, prior, raw) + prior[x]) % 256
-
-def unfilter_average(x, bpp, prior, raw):
-    i = x - bpp
-    return (filter_average(x, bpp, prior, raw) + 
-            ((0 if i < 0 else raw[i]) + prior[x])//2) % 256
-
-def unfilter_paeth(x, bpp, prior, raw):
-    i = x - bpp
-    if i < 0:
-        prediction = paeth_predictor(0, prior[x], 0)
-    else:
-        prediction = paeth_predictor(raw[i], prior[x], prior[i])
-    return (filter_paeth(x, bpp, prior, raw) + prediction ) % 256
+# The unfilters below reconstruct a whole scanline in place.  ``raw`` is a
+# bytearray holding the filtered bytes of the current scanline and ``prior``
+# holds the reconstructed bytes of the previous one (all zeroes for the first
+# scanline of an image or pass).
+
+def unfilter_none(bpp, prior, raw):
+    pass
+
+def unfilter_sub(bpp, prior, raw):
+    for i in range(bpp, len(raw)):
+        raw[i] = (raw[i] + raw[i-bpp]) & 0xff
+
+def unfilter_up(bpp, prior, raw):
+    raw[:] = _add_bytes(raw, prior)
+
+def unfilter_average(bpp, prior, raw):
+    for i in range(min(bpp, len(raw))):
+        raw[i] = (raw[i] + (prior[i] >> 1)) & 0xff
+    for i in range(bpp, len(raw)):
+        raw[i] = (raw[i] + ((raw[i-bpp] + prior[i]) >> 1)) & 0xff
+
+def unfilter_paeth(bpp, prior, raw):
+    for i in range(min(bpp, len(raw))):
+        raw[i] = (raw[i] + prior[i]) & 0xff
+    for i in range(bpp, len(raw)):
+        left, above, upper_left = raw[i-bpp], prior[i], prior[i-bpp]
+        p = left + above - upper_left
+        pa = abs(p - left)
+        pb = abs(p - above)
+        pc = abs(p - upper_left)
+        if pa <= pb and pa <= pc:
+            prediction = left
+        elif pb <= pc:
+            prediction = above
+        else:
+            prediction = upper_left
+        raw[i] = (raw[i] + prediction) & 0xff
 
 
 COLOR_TYPE_L = 0
@@ -202,24 +318,424 @@ UNFILTERS = {
         4: unfilter_paeth
     }
 
+# Maps each filtered byte to its magnitude as a signed byte, for the minimum
+# sum of absolute differences heuristic
+_FILTER_WEIGHTS = bytes(min(b, 256 - b) for b in range(256))
+
+
+def filter_scanline(bpp, prior, raw, filter_type=None, candidates=FILTERS):
+    """Filter a scanline and return it prefixed with its filter type byte.
+
+    If ``filter_type`` is ``None`` every filter type in ``candidates`` is
+    tried and the one whose output, read as signed bytes, has the smallest
+    sum of absolute values is used.
+
+    """
+    if filter_type is not None:
+        return bytes((filter_type,)) + FILTERS[filter_type](bpp, prior, raw)
+    best, best_weight = None, None
+    for filter_type in candidates:
+        filtered = FILTERS[filter_type](bpp, prior, raw)
+        weight = sum(filtered.translate(_FILTER_WEIGHTS))
+        if best is None or weight < best_weight:
+            best, best_weight = bytes((filter_type,)) + filtered, weight
+    return best
+
+
+def _zlib_header(level):
+    if level < 0:
+        level = 6
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf, flg = 0x78, flevel << 6
+    flg |= 31 - (cmf << 8 | flg) % 31
+    return bytes((cmf, flg))
+
+
+def _deflate_band(data, level, last):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    flush = zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH
+    return compressor.compress(data) + compressor.flush(flush)
+
+
+def parallel_deflate(chunks, level=-1, threads=None, band_size=1<<17):
+    """Compress an iterable of byte strings into a single zlib stream.
+
+    The chunks are gathered into bands of at least ``band_size`` bytes,
+    without splitting a chunk, and the bands are deflated independently in
+    a pool of ``threads`` threads, much as pigz does.  Every band but the
+    last ends on a full flush, so the raw deflate streams can simply be
+    concatenated behind a zlib header and followed by the Adler-32 of all of
+    the data.  zlib releases the GIL while compressing, so this scales with
+    the number of cores.
+
+    Yields the pieces of the zlib stream in order.
+
+    """
+    threads = threads or os.cpu_count() or 1
+    yield _zlib_header(level)
+    checksum = 1
+    pending = collections.deque()
+    with futures.ThreadPoolExecutor(threads) as executor:
+        band = bytearray()
+        for chunk in chunks:
+            band += chunk
+            if len(band) >= band_size:
+                checksum = zlib.adler32(band, checksum)
+                pending.append(executor.submit(_deflate_band, bytes(band),
+                                               level, False))
+                band = bytearray()
+                while len(pending) > 2 * threads:
+                    yield pending.popleft().result()
+        checksum = zlib.adler32(band, checksum)
+        pending.append(executor.submit(_deflate_band, bytes(band), level,
+                                       True))
+        while pending:
+            yield pending.popleft().result()
+    yield struct.pack(">I", checksum & 0xffffffff)
+
+
+# Modes that can be written directly, with their color type and bit depth
+MODE_COLOR_TYPES = {
+        image_modes.L: (COLOR_TYPE_L, 8),
+        image_modes.L16: (COLOR_TYPE_L, 16),
+        image_modes.LA: (COLOR_TYPE_LA, 8),
+        image_modes.LA32: (COLOR_TYPE_LA, 16),
+        image_modes.RGB: (COLOR_TYPE_RGB, 8),
+        image_modes.RGB48: (COLOR_TYPE_RGB, 16),
+        image_modes.RGBA: (COLOR_TYPE_RGBA, 8),
+        image_modes.RGBA64: (COLOR_TYPE_RGBA, 16),
+    }
+
+
+def palette_tables(palette, alpha=None):
+    """Build one 256 byte translation table per output channel mapping a
+    palette index to that channel of its color, with an alpha table added
+    when ``alpha`` is given.  Indices past the end of the palette map to 0.
+
+    """
+    channels = [bytes(c.r for c in palette),
+                bytes(c.g for c in palette),
+                bytes(c.b for c in palette)]
+    if alpha is not None:
+        channels.append(bytes(alpha))
+    return [table.ljust(256, b"\x00") for table in channels]
+
+
+def pack_samples(row, bit_depth):
+    """Pack one byte samples, each less than ``2 ** bit_depth``, into a row
+    of sub-byte samples; the inverse of :func:`depyct.util.unpack_samples`.
+
+    Each sample position is shifted into place across the whole row at once
+    by treating the strided samples as one big integer.
+
+    """
+    per_byte = 8 // bit_depth
+    row = bytes(row) + bytes(-len(row) % per_byte)
+    n = len(row) // per_byte
+    packed = 0
+    for k in range(per_byte):
+        shift = 8 - bit_depth * (k + 1)
+        packed |= int.from_bytes(row[k::per_byte], "big") << shift
+    return packed.to_bytes(n, "big")
+
+
+PixelAnalysis = namedtuple("PixelAnalysis",
+                           "grayscale opaque fits_8_bit colors")
+
+
+def analyze_pixels(bands, channels, bit_depth, alpha):
+    """Summarize the pixels of an image in a single pass over its data.
+
+    ``bands`` yields the raw image data, in native byte order, a whole
+    number of pixels at a time.  Returns whether every pixel is gray,
+    whether ``alpha`` (the image has an alpha channel) is fully opaque
+    throughout, whether every 16-bit sample is an 8-bit value scaled by 257
+    and, when there are no more than 256 of them, the set of distinct 8-bit
+    pixel values.
+
+    """
+    grayscale = channels < 3
+    opaque = True
+    fits_8_bit = True
+    colors = set()
+    sample_size = bit_depth // 8
+    for band in bands:
+        band = bytes(band)
+        if alpha and opaque:
+            opaque = not band[(channels-1)*sample_size::
+                              channels*sample_size].strip(b"\xff")
+        if not grayscale:
+            samples = [band[c*sample_size::channels*sample_size]
+                       for c in range(3)]
+            if sample_size == 2:
+                samples = [s + band[c*2+1::channels*2]
+                           for c, s in enumerate(samples)]
+            grayscale = samples[0] == samples[1] == samples[2]
+        if fits_8_bit and bit_depth == 16:
+            fits_8_bit = band[0::2] == band[1::2]
+        if colors is not None and fits_8_bit:
+            samples = band[0::sample_size]
+            if channels == 1:
+                colors.update((v,) for v in set(samples))
+            else:
+                colors.update(zip(*(samples[c::channels]
+                                    for c in range(channels))))
+            if len(colors) > 256:
+                colors = None
+    if not fits_8_bit:
+        colors = None
+    return PixelAnalysis(grayscale, opaque or not alpha, fits_8_bit, colors)
+
+
+# Adam7 passes as (x offset, y offset, x step, y step)
+ADAM7 = (
+        (0, 0, 8, 8),
+        (4, 0, 8, 8),
+        (0, 4, 4, 8),
+        (2, 0, 4, 4),
+        (0, 2, 2, 4),
+        (1, 0, 2, 2),
+        (0, 1, 1, 2),
+    )
+
+
+# The block of the final image each decoded pixel stands for once a given
+# number of passes have been decoded
+ADAM7_BLOCKS = ((8, 8), (4, 8), (4, 4), (2, 4), (2, 2), (1, 2), (1, 1))
+
+
+def adam7_pass_sizes(width, height):
+    """Return the size of each reduced Adam7 pass image."""
+    return [((width - x0 + dx - 1) // dx, (height - y0 + dy - 1) // dy)
+            for x0, y0, dx, dy in ADAM7]
+
+
+def blend_over(dst, src, channels, top):
+    """Composite the pixels in ``src`` over those in ``dst``, in place.
+
+    Both are sequences of samples whose last channel is alpha, ranging up
+    to ``top``.
+
+    """
+    for i in range(channels - 1, len(src), channels):
+        alpha = src[i]
+        if alpha == top:
+            dst[i-channels+1:i+1] = src[i-channels+1:i+1]
+        elif alpha:
+            under = dst[i] * (top - alpha) // top
+            total = alpha + under
+            for c in range(i - channels + 1, i):
+                dst[c] = (src[c] * alpha + dst[c] * under) // total
+            dst[i] = total
+
+
+class ScanlineDecoder(object):
+    """Incrementally inflate and unfilter PNG image data.
+
+    Compressed data is passed to :meth:`feed` as each IDAT chunk is read, and
+    every scanline is handed to ``sink(pass_number, y, row)`` as soon as it
+    has been completely inflated and unfiltered.  Apart from the
+    decompressor's window, only the previous scanline and at most
+    :attr:`max_output` bytes of inflated data are held at any time.
+
+    ``passes`` is a sequence of ``(width, height)`` reduced images that make
+    up the data stream, one per interlace pass; it defaults to the whole
+    image.  Empty passes contribute no scanlines.  Decoding stops once the
+    last pass given has been completed, so passing only the leading Adam7
+    passes skips inflating the rest of the stream.
+
+    With ``raw`` set, the data starts at a full flush point inside the zlib
+    stream rather than at its header; the scanline there must not depend on
+    the one before it.
+
+    """
+
+    max_output = 1 << 16
+
+    def __init__(self, ihdr, sink, fail, passes=None, raw=False):
+        self.sink = sink
+        self.fail = fail
+        self.bpp = ihdr.filter_unit
+        if passes is None:
+            passes = [(ihdr.width, ihdr.height)]
+        self.layout = [(pass_number, ihdr.row_bytes(width), height)
+                       for pass_number, (width, height) in enumerate(passes)
+                       if width and height]
+        self.rows = sum(rows for _, _, rows in self.layout)
+        self.decoded = 0
+        self.pending = bytearray()
+        if raw:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            self.decompressor = zlib.decompressobj()
+        self._next_pass = 0
+        self._start_pass()
+
+    @property
+    def done(self):
+        return self.decoded >= self.rows
+
+    def feed(self, data):
+        decompress = self.decompressor.decompress
+        while not self.done:
+            try:
+                inflated = decompress(data, self.max_output)
+            except zlib.error as err:
+                self.fail("Corrupt image data: {}.".format(err))
+            data = self.decompressor.unconsumed_tail
+            if not inflated and not data:
+                break
+            self.pending += inflated
+            self._drain()
+
+    def finish(self):
+        if not self.done:
+            self.pending += self.decompressor.flush()
+            self._drain()
+        if not self.done:
+            self.fail("Image data ended after {} of {} scanlines.".format(
+                      self.decoded, self.rows))
+
+    def _start_pass(self):
+        if self._next_pass < len(self.layout):
+            self.pass_number, self.row_bytes, self.pass_rows = \
+                    self.layout[self._next_pass]
+            self._next_pass += 1
+            self.y = 0
+            self.prior = bytearray(self.row_bytes)
+
+    def _drain(self):
+        pending = self.pending
+        pos = 0
+        while not self.done and len(pending) - pos > self.row_bytes:
+            stride = self.row_bytes + 1
+            filter_type = pending[pos]
+            try:
+                unfilter = UNFILTERS[filter_type]
+            except KeyError:
+                self.fail("Unrecognized filter type {} on scanline "
+                          "{}.".format(filter_type, self.decoded))
+            raw = pending[pos+1:pos+stride]
+            unfilter(self.bpp, self.prior, raw)
+            self.sink(self.pass_number, self.y, raw)
+            self.prior = raw
+            self.y += 1
+            self.decoded += 1
+            pos += stride
+            if self.y == self.pass_rows:
+                self._start_pass()
+        del pending[:pos]
+
 
 class PNGFormat(FormatBase):
     """File format plugin for PNG images
     =================================
 
+    Options
+    -------
+
+    ``last_pass``
+        For Adam7 interlaced images, stop decoding after this pass (1-7).
+        Pixels not yet delivered are filled in by replicating the decoded
+        ones, giving a low resolution preview for a fraction of the cost of
+        a full decode.  Ignored for images that are not interlaced.
+
+    ``filter``
+        When writing, ``"adaptive"`` to choose a filter for each scanline
+        with the minimum sum of absolute differences heuristic, or a filter
+        type from 0 to 4 to use for every scanline.
+
+    ``compression_level``
+        The zlib compression level used when writing.
+
+    ``threads``
+        When writing, the number of threads used to deflate the image data.
+        ``None`` or 0 uses one per CPU.  With more than one thread the
+        filtered scanlines are split into bands of ``band_size`` bytes that
+        are compressed concurrently, see :func:`parallel_deflate`.
+
+    ``idat_size``
+        The maximum length of the IDAT chunks written.
+
+    ``optimize``
+        When true, the image is analyzed before it is written and stored
+        with the smallest color type and bit depth that represent it
+        exactly: 16-bit samples that fit in 8 bits are narrowed, unused
+        alpha channels and redundant color channels are dropped, gray
+        levels are packed into 1, 2 or 4 bits where possible and images
+        with at most 256 colors are written with a palette when that is
+        smaller.  Each filter strategy is then tried on a sample of
+        ``sample_rows`` scanlines and the one that compresses best is used
+        in place of ``filter``.
+
+    ``indexed``
+        When true, palette images are read as ``L`` images holding the
+        palette indices, with the palette in ``info["palette"]``, instead
+        of being expanded to ``RGB``, or ``RGBA`` when they have a tRNS
+        chunk.
+
+    ``row_index``
+        When writing, a number of scanlines.  The deflate stream is fully
+        flushed every ``row_index`` scanlines, the scanline after each flush
+        is filtered without reference to the one above it, and the position
+        of every flush point is stored in a private ``riDX`` chunk after
+        the image data.  :meth:`read_rows` uses it to start decoding close
+        to the rows asked for.  0 writes no index.
+
+    ``frames``
+        When writing, further images of the same mode and size that make
+        the image written into an animated PNG, with the image itself as
+        the first frame.  Each frame only stores the rectangle that changed
+        since the one before it.  Use :meth:`frames` to read them back.
+
+    ``delay``
+        How long each frame of an animation is shown, in milliseconds:
+        either one value for every frame or a sequence with one per frame.
+
+    ``plays``
+        How many times an animation is played; 0 loops forever.
+
+    ``lazy``
+        When true, opening a seekable file only reads the header and the
+        ancillary chunks; the image data is decoded by :meth:`load` the
+        first time the pixels of the image are accessed.  Compressed text
+        and ICC profiles are only inflated when their ``info`` entry is
+        read.
+
     """
 
     extensions = ("png",)
     mimetypes = ("image/png",)
+    defaults = {
+        "last_pass": 7,
+        "filter": "adaptive",
+        "compression_level": 6,
+        "threads": 1,
+        "band_size": 1 << 17,
+        "idat_size": 1 << 16,
+        "lazy": True,
+        "indexed": False,
+        "optimize": False,
+        "sample_rows": 64,
+        "row_index": 0,
+        "frames": (),
+        "delay": 100,
+        "plays": 0,
+    }
 
     def read(self):
         self.ihdr = None
-        self.image_data = []
+        self.image = None
+        self.decoder = None
+        self.idat_chunks = []
+        self.row_index = []
+        self.lazy = self.config["lazy"] and self._seekable(self.fp)
 
         self.info_attrs = set()
         self.background_color = None
         self.physical_pixel_dimensions = None
         self.palette = None
+        self.transparency = None
         self.suggested_palettes = {}
         self.histogram = None
         self.text = []
@@ -229,67 +745,464 @@ class PNGFormat(FormatBase):
         self.icc_profile = None
         self.significant_bits = None
         self.last_modified = None
+        self.animation = None
+        self.frame_controls = []
 
         signature = self.fp.read(8)
         if signature != PNG_SIGNATURE:
             self.fail("unrecognized file")
         while True:
             self.current_chunk_intro = ChunkIntro.load(self.fp)
-            process = getattr(self, "_read_" + self.current_chunk_intro.type)
+            chunk_type = self.current_chunk_intro.type.decode("latin-1")
+            process = getattr(self, "_read_" + chunk_type)
             if process() == "IEND":
                 break
             self._check_crc()
 
-        color_type = self.ihdr.color_type
-        mode_name = "RGB" if color_type & COLOR_TYPE_RGB else "L"
-        if color_type & COLOR_TYPE_ALPHA:
-            mode_name += "A"
-        if self.ihdr.bit_depth == 16:
-            mode_name += str(len(mode_name) * 16)
-        mode = getattr(image_modes, mode_name)
-        size = self.ihdr.width, self.ihdr.height
-        im = self.image = self.image_cls(mode, size=size,
-                                         color=tuple(self.background_color))
+        if not self.idat_chunks:
+            self.fail("No image data found.")
+        if self.lazy:
+            self._create_image(loader=self.load)
+        else:
+            self._finish_decoding()
+
+        im = self.image
         # TODO: fill out info dictionary
         for attr in self.info_attrs:
-            im.info[attr] = getattr(self, attr)
-        self.load()
+            inflate = getattr(self, "_inflate_" + attr, None)
+            if inflate is None:
+                im.info[attr] = getattr(self, attr)
+            else:
+                im.info[attr] = util.deferred(inflate)
         return im
 
     def load(self):
-        im = self.image
-        if self.ihdr.interlace_method:
-            print("Image data is interlaced.")
-            self._deinterlace_pass_1()
-            self._deinterlace_pass_2()
-            self._deinterlace_pass_3()
-            self._deinterlace_pass_4()
-            self._deinterlace_pass_5()
-            self._deinterlace_pass_6()
-            self._deinterlace_pass_7()
-        else:
-            print("Image data is not interlaced.")
-            self.image_data = zlib.decompress(b"".join(self.image_data))
-
-        line_size = self.ihdr.width * 4
-        bpp = 8 # calculate this properly
-        prior = [0] * line_size
-        for i in range(self.ihdr.height):
-            filter_offset = i * (line_size + 1)
-            filter_method = self.image_data[filter_offset]
-            im_start = line_size * i
-            im_end = im_start + line_size
-            data_start = filter_offset + 1
-            data_end = data_start + line_size
-            unfilter = UNFILTERS[ord(filter_method)]
-            # TODO: implement filter methods
-            raw = self.image_data[data_start:data_end]
-            raw = struct.unpack(">{}B".format(line_size), raw)
-            scan = [unfilter(x, bpp, prior, raw) for x in range(line_size)]
-            im.buffer[im_start:im_end] = bytearray(scan)
-            prior = scan
+        """Decode the image data of a lazily opened image into its buffer.
+
+        The IDAT chunks found by :meth:`read` are read back, checked and
+        decoded one at a time.
+
+        """
+        fp = self._reopen()
+        try:
+            self._create_decoder()
+            self._feed_image_data(fp, self.decoder)
+            self._finish_decoding()
+        finally:
+            if fp is not self.fp:
+                fp.close()
+        return self.image
+
+    def read_rows(self, start, stop):
+        """Decode scanlines ``start`` to ``stop`` of the image last opened
+        and return them as a new image, without touching the image itself.
+
+        Decoding begins at the last flush point recorded in the file's row
+        index (see the ``row_index`` option) at or above ``start``, or at
+        the top of the image when there is no index, and stops as soon as
+        the last row asked for is complete.
+
+        """
+        ihdr = self.ihdr
+        if ihdr.interlace_method:
+            self.fail("Rows cannot be read separately from an interlaced "
+                      "image.")
+        start, stop, _ = slice(start, stop).indices(ihdr.height)
+        if start >= stop:
+            self.fail("No rows between {} and {} of an image {} rows "
+                      "high.".format(start, stop, ihdr.height))
+        first, offset = 0, 0
+        for row, row_offset in self.row_index:
+            if row > start:
+                break
+            first, offset = row, row_offset
+        band = self.image_cls(self.image.mode, size=(ihdr.width,
+                                                     stop - start))
+
+        def store(pass_number, y, row):
+            y += first - start
+            if y >= 0:
+                row = self._convert_scanline(pass_number, row)
+                line_size = len(row)
+                band.buffer[y*line_size:(y+1)*line_size] = row
+
+        self.pass_widths = [ihdr.width]
+        self._prepare_conversion()
+        decoder = ScanlineDecoder(ihdr, store, self.fail,
+                                  [(ihdr.width, stop - first)],
+                                  raw=offset > 0)
+        fp = self._reopen()
+        try:
+            self._feed_image_data(fp, decoder, offset)
+            decoder.finish()
+        finally:
+            if fp is not self.fp:
+                fp.close()
+        return band
+
+    def frames(self):
+        """Iterate over the frames of the animated PNG last opened.
+
+        Yields ``(canvas, control)`` pairs, where ``control`` is the fcTL
+        chunk of the frame and ``canvas`` is the output buffer once the
+        frame has been composited onto it.  The same canvas image is
+        updated in place for every frame, so copy it to keep a frame.  Each
+        frame is only read and decoded when it is reached, and the dispose
+        operation of a frame is applied just before the next one.
+
+        Images without an acTL chunk yield the image itself once, with
+        ``None`` for the control.
+
+        """
+        if self.animation is None:
+            yield self.image, None
+            return
+        ihdr = self.ihdr
+        mode = self.image.mode
+        canvas = self.image_cls(mode, size=(ihdr.width, ihdr.height))
+        bpp = canvas.bytes_per_pixel
+        line_size = ihdr.width * bpp
+        alpha = bool(ihdr.color_type & COLOR_TYPE_ALPHA or
+                     (ihdr.color_type == COLOR_TYPE_PALETTE and
+                      self.transparency is not None and
+                      not self.config["indexed"]))
+        sample_format = "H" if ihdr.bit_depth == 16 else "B"
+        top = (1 << (8 * (bpp // mode.components))) - 1
+
+        dispose = None
+        for n, (control, chunks, chunk_type) in \
+                enumerate(self.frame_controls):
+            if dispose is not None:
+                dispose()
+            x0, y0 = control.x_offset, control.y_offset
+            width, height = control.width, control.height
+            if x0 + width > ihdr.width or y0 + height > ihdr.height:
+                self.fail("Frame {} does not fit on the canvas.".format(n))
+            if chunk_type == b"IDAT":
+                frame = self.image
+            else:
+                frame = self._decode_frame(control, chunks, chunk_type)
+            frame_line = width * bpp
+            rows = [(y0 + y) * line_size + x0 * bpp for y in range(height)]
+
+            dispose_op = control.dispose_op
+            if dispose_op == APNG_DISPOSE_OP_PREVIOUS and n == 0:
+                dispose_op = APNG_DISPOSE_OP_BACKGROUND
+            if dispose_op == APNG_DISPOSE_OP_PREVIOUS:
+                saved = [bytes(canvas.buffer[r:r+frame_line]) for r in rows]
+                def dispose(rows=rows, saved=saved):
+                    for r, data in zip(rows, saved):
+                        canvas.buffer[r:r+len(data)] = data
+            elif dispose_op == APNG_DISPOSE_OP_BACKGROUND:
+                def dispose(rows=rows, size=frame_line):
+                    for r in rows:
+                        canvas.buffer[r:r+size] = bytes(size)
+            else:
+                dispose = None
+
+            source = frame.buffer
+            for y, r in enumerate(rows):
+                row = source[y*frame_line:(y+1)*frame_line]
+                if control.blend_op == APNG_BLEND_OP_OVER and alpha:
+                    blend_over(canvas.buffer[r:r+frame_line].cast(
+                                   sample_format),
+                               row.cast(sample_format), mode.components, top)
+                else:
+                    canvas.buffer[r:r+frame_line] = row
+            yield canvas, control
+
+    def _decode_frame(self, control, chunks, chunk_type):
+        """Decode the image data of one frame into an image of its own."""
+        ihdr = IHDR.from_buffer_copy(self.ihdr)
+        ihdr.width, ihdr.height = control.width, control.height
+        state = self.ihdr, self.image, self.decoder
+        fp = self._reopen()
+        try:
+            self.ihdr = ihdr
+            self.image = self.image_cls(state[1].mode,
+                                        size=(ihdr.width, ihdr.height))
+            self._create_decoder()
+            self._feed_image_data(fp, self.decoder, chunks=chunks,
+                                  chunk_type=chunk_type)
+            self._finish_decoding()
+            return self.image
+        finally:
+            self.ihdr, self.image, self.decoder = state
+            if fp is not self.fp:
+                fp.close()
+
+    def check(self, full=False):
+        """Walk the chunks of the file, checking their framing, order and
+        CRCs.  With ``full`` the image data is also inflated, in bounded
+        pieces that are thrown away, to check that the zlib stream is intact
+        and holds as many bytes as the header calls for; no image is
+        created and nothing is unfiltered.
+
+        """
+        fp = self.fp
+        problems = []
+        if fp.read(8) != PNG_SIGNATURE:
+            return [(0, "Not a PNG file.")]
+        offset = 8
+        ihdr = None
+        decompressor = zlib.decompressobj() if full else None
+        inflated = 0
+        idat_state = None  # None, "open" or "closed"
+        while True:
+            intro = fp.read(8)
+            if len(intro) < 8:
+                problems.append((offset, "File truncated before IEND."))
+                return problems
+            length, chunk_type = struct.unpack(">I4s", intro)
+            if length > 0x7fffffff or not chunk_type.isalpha():
+                problems.append((offset, "Corrupt chunk header."))
+                return problems
+            name = chunk_type.decode("latin-1")
+            if offset == 8 and chunk_type != b"IHDR":
+                problems.append((offset, "First chunk is {}, not "
+                                         "IHDR.".format(name)))
+            crc = zlib.crc32(chunk_type)
+            remaining = length
+            data = b""
+            while remaining:
+                block = fp.read(min(remaining, 1 << 16))
+                if not block:
+                    problems.append((offset, "{} chunk truncated.".format(
+                                             name)))
+                    return problems
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+                if chunk_type == b"IHDR":
+                    data += block
+                elif chunk_type == b"IDAT" and decompressor is not None:
+                    try:
+                        while block and not decompressor.eof:
+                            inflated += len(decompressor.decompress(
+                                block, 1 << 16))
+                            block = decompressor.unconsumed_tail
+                    except zlib.error as err:
+                        problems.append((offset, "Corrupt image data: "
+                                                 "{}.".format(err)))
+                        decompressor = None
+            stored = fp.read(4)
+            if len(stored) < 4:
+                problems.append((offset, "{} chunk truncated.".format(name)))
+                return problems
+            if struct.unpack(">I", stored)[0] != crc & 0xffffffff:
+                problems.append((offset, "CRC failed for {} chunk.".format(
+                                         name)))
+
+            if chunk_type == b"IHDR":
+                header = IHDR.from_buffer_copy(data.ljust(13, b"\x00"))
+                if length != 13 or header.bit_depth not in \
+                        IHDR.BIT_DEPTHS.get(header.color_type, ()):
+                    problems.append((offset, "Invalid IHDR chunk."))
+                elif offset == 8:
+                    ihdr = header
+            elif chunk_type == b"IDAT":
+                if idat_state == "closed":
+                    problems.append((offset, "IDAT chunks are not "
+                                             "consecutive."))
+                idat_state = "open"
+            elif idat_state == "open":
+                idat_state = "closed"
+            offset += length + 12
+            if chunk_type == b"IEND":
+                break
 
-        return im
+        if idat_state is None:
+            problems.append((offset, "No image data found."))
+        elif decompressor is not None and ihdr is not None:
+            if not decompressor.eof:
+                problems.append((offset, "Image data stream is incomplete."))
+            if ihdr.interlace_method:
+                passes = adam7_pass_sizes(ihdr.width, ihdr.height)
+            else:
+                passes = [(ihdr.width, ihdr.height)]
+            expected = sum((ihdr.row_bytes(w) + 1) * h
+                           for w, h in passes if w and h)
+            if inflated != expected:
+                problems.append((offset, "Image data holds {} bytes, "
+                                         "expected {}.".format(inflated,
+                                                               expected)))
+        if fp.read(1):
+            problems.append((offset, "Data found after IEND."))
+        return problems
+
+    def _reopen(self):
+        if self.filename is not None:
+            return open(self.filename, "rb")
+        if not self._seekable(self.fp):
+            self.fail("The image data can no longer be read.")
+        return self.fp
+
+    def _feed_image_data(self, fp, decoder, start=0, chunks=None,
+                         chunk_type=b"IDAT"):
+        """Read back the IDAT chunks found by :meth:`read`, or the given
+        ``chunks`` of ``chunk_type``, check them and feed them to
+        ``decoder``, beginning ``start`` bytes into the zlib stream.
+
+        The sequence numbers leading fdAT chunks are dropped.
+
+        """
+        if chunks is None:
+            chunks = self.idat_chunks
+        skip = 4 if chunk_type == b"fdAT" else 0
+        position = 0
+        for offset, length in chunks:
+            length -= skip
+            if position + length > start:
+                fp.seek(offset + ctypes.sizeof(ChunkIntro))
+                data = fp.read(length + skip)
+                self._verify_crc(chunk_type, data, fp.read(4), offset)
+                decoder.feed(data[skip+max(0, start - position):])
+                if decoder.done:
+                    break
+            position += length
+
+    def _seekable(self, fp):
+        try:
+            return fp.seekable()
+        except AttributeError:
+            return False
+
+    def _create_image(self, loader=None):
+        """Create the image described by the IHDR chunk."""
+        ihdr = self.ihdr
+        color_type = ihdr.color_type
+        if color_type == COLOR_TYPE_PALETTE:
+            if not self.palette:
+                self.fail("Images with color type 3 must have a palette.")
+            if self.config["indexed"]:
+                mode_name = "L"
+            elif self.transparency is not None:
+                mode_name = "RGBA"
+            else:
+                mode_name = "RGB"
+        else:
+            mode_name = "RGB" if color_type & COLOR_TYPE_RGB else "L"
+            if color_type & COLOR_TYPE_ALPHA:
+                mode_name += "A"
+            if ihdr.bit_depth == 16:
+                mode_name += str(len(mode_name) * 16)
+        mode = getattr(image_modes, mode_name)
+        size = ihdr.width, ihdr.height
+        self.image = self.image_cls(mode, size=size, loader=loader)
+
+    def _create_decoder(self):
+        """Create a decoder that writes scanlines straight into the buffer
+        of the image.
+
+        """
+        ihdr = self.ihdr
+        if ihdr.interlace_method:
+            self.last_pass = self.config["last_pass"]
+            if not 1 <= self.last_pass <= len(ADAM7):
+                self.fail("last_pass must be between 1 and {}.".format(
+                          len(ADAM7)))
+            passes = adam7_pass_sizes(ihdr.width,
+                                      ihdr.height)[:self.last_pass]
+            sink = self._store_interlaced_scanline
+        else:
+            passes = [(ihdr.width, ihdr.height)]
+            sink = self._store_scanline
+        self.pass_widths = [width for width, height in passes]
+        self._prepare_conversion()
+        self.decoder = ScanlineDecoder(ihdr, sink, self.fail, passes)
+
+    def _prepare_conversion(self):
+        """Set up the lookup tables that turn decoded scanlines into the
+        pixel layout of the image.
+
+        """
+        ihdr = self.ihdr
+        self.sample_bits = None
+        self.sample_scale = None
+        self.color_tables = None
+        if ihdr.bit_depth < 8:
+            self.sample_bits = ihdr.bit_depth
+            if ihdr.color_type != COLOR_TYPE_PALETTE:
+                # gray samples are stretched to 8 bits with one more
+                # translation
+                top = (1 << ihdr.bit_depth) - 1
+                self.sample_scale = bytes(v * (255 // top)
+                                          for v in range(top + 1)).ljust(
+                                                  256, b"\x00")
+        if ihdr.color_type == COLOR_TYPE_PALETTE and \
+                not self.config["indexed"]:
+            self.color_tables = palette_tables(self.palette,
+                                               self.transparency)
+
+    def _convert_scanline(self, pass_number, row):
+        if self.sample_bits is not None:
+            row = util.unpack_samples(row, self.sample_bits,
+                                      self.pass_widths[pass_number])
+            if self.sample_scale is not None:
+                row = row.translate(self.sample_scale)
+        if self.color_tables is not None:
+            row = util.expand_palette(row, self.color_tables)
+        return self._swap_bytes(row)
+
+    def _finish_decoding(self):
+        self.decoder.finish()
+        if self.ihdr.interlace_method and self.last_pass < len(ADAM7):
+            self._fill_interlace_preview()
+
+    def _swap_bytes(self, row):
+        if self.ihdr.bit_depth == 16 and sys.byteorder == "little":
+            row = row[:]
+            row[0::2], row[1::2] = row[1::2], row[0::2]
+        return row
+
+    def _store_scanline(self, pass_number, y, row):
+        row = self._convert_scanline(pass_number, row)
+        line_size = len(row)
+        start = y * line_size
+        self.image.buffer[start:start+line_size] = row
+
+    def _store_interlaced_scanline(self, pass_number, y, row):
+        """Scatter a scanline of a reduced Adam7 image into its final
+        position with one strided write per byte of a pixel.
+
+        """
+        x0, y0, dx, dy = ADAM7[pass_number]
+        row = self._convert_scanline(pass_number, row)
+        bpp = self.image.bytes_per_pixel
+        line_size = self.image.size.width * bpp
+        start = (y0 + y * dy) * line_size + x0 * bpp
+        end = start + line_size - x0 * bpp
+        buffer = self.image.buffer
+        for k in range(bpp):
+            buffer[start+k:end:dx*bpp] = row[k::bpp]
+
+    def _fill_interlace_preview(self):
+        """Upscale the pixels delivered by the decoded passes to the whole
+        image by replicating each one over the block it stands for.
+
+        After any pass the decoded pixels form a regular grid starting at the
+        origin, see :data:`ADAM7_BLOCKS`.
+
+        """
+        im = self.image
+        block_width, block_height = ADAM7_BLOCKS[self.last_pass - 1]
+        bpp = im.bytes_per_pixel
+        width, height = im.size
+        line_size = width * bpp
+        buffer = im.buffer
+        step = block_width * bpp
+        for y in range(0, height, block_height):
+            start = y * line_size
+            line = buffer[start:start+line_size]
+            full = bytearray(line_size)
+            for k in range(bpp):
+                known = line[k::step]
+                for j in range(block_width):
+                    offset = k + j * bpp
+                    count = len(range(offset, line_size, step))
+                    full[offset::step] = known[:count]
+            for yy in range(y, min(y + block_height, height)):
+                buffer[yy*line_size:(yy+1)*line_size] = full
+        im.info["interlace_passes"] = self.last_pass
 
     def __getattr__(self, name):
         if name.startswith("_read_"):
@@ -297,26 +1210,27 @@ class PNGFormat(FormatBase):
         raise AttributeError
 
     def _check_crc(self):
-        check = zlib.crc32(self.current_chunk_intro.type + self.current_chunk)
-        check &= 0xffffffff
-        crc = struct.unpack(">I", self.fp.read(4))[0]
-        if check != crc:
-            type = self.current_chunk_intro.type
-            offset = self.current_chunk_intro.offset
-            self.fail("CRC failed for {} chunk at {}.".format(type, offset))
+        crc = self.fp.read(4)
+        if self.current_chunk is None:
+            # the chunk was skipped and is checked when it is read back
+            return
+        self._verify_crc(self.current_chunk_intro.type, self.current_chunk,
+                         crc, self.current_chunk_intro.offset)
+
+    def _verify_crc(self, chunk_type, data, crc, offset):
+        check = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+        if len(crc) != 4 or check != struct.unpack(">I", crc)[0]:
+            self.fail("CRC failed for {} chunk at {}.".format(
+                      chunk_type.decode("latin-1"), offset))
 
     def _load_current_chunk(self):
         self.current_chunk = self.fp.read(self.current_chunk_intro.length)
         return self.current_chunk
 
     def _read_unrecognized_chunk(self):
-        print("Encountered {} chunk of length {} at {}.".format(
-              self.current_chunk_intro.type,
-              self.current_chunk_intro.length, self.fp.tell()))
         self._load_current_chunk()
 
     def _read_IHDR(self):
-        print("Reading in IHDR")
         if self.ihdr:
             self.fail("Already encountered IHDR chunk.")
         self.ihdr = ihdr = IHDR.load(self._load_current_chunk())
@@ -341,31 +1255,81 @@ class PNGFormat(FormatBase):
         return ihdr
 
     def _read_PLTE(self):
-        print("Reading in PLTE")
         plte = self._load_current_chunk()
         size = self.current_chunk_intro.length
         if self.palette:
             self.fail("Only one palette is permitted per image.")
         if size % 3:
             self.fail("Palette lenghts must be divisible by 3.")
-        if self.image_data:
+        if self.idat_chunks:
             self.fail("A color palette must precede image data.")
         if self.ihdr.color_type in (0, 4):
             self.fail("Images with color type {} should not have a "
                       "palette.".format(self.ihdr.color_type))
-        self.palette = [RGBTriple.load(plte[i:i+3]) for i in range(size//3)]
+        self.palette = [RGBTriple.load(plte[i:i+3]) for i in range(0, size, 3)]
         self.info_attrs.add("palette")
 
     def _read_IDAT(self):
-        print("Reading in IDAT")
-        self.image_data.append(self._load_current_chunk())
+        intro = self.current_chunk_intro
+        self.idat_chunks.append((intro.offset, intro.length))
+        if self.lazy:
+            self.fp.seek(intro.length, os.SEEK_CUR)
+            self.current_chunk = None
+            return
+        if self.decoder is None:
+            self._create_image()
+            self._create_decoder()
+        self.decoder.feed(self._load_current_chunk())
 
     def _read_IEND(self):
-        print("Reading in IEND")
         return "IEND"
 
+    def _read_acTL(self):
+        if self.animation is not None:
+            self.fail("Only one acTL chunk is permitted per image.")
+        if self.idat_chunks:
+            self.fail("Animation control must precede image data.")
+        self.animation = acTL.load(self._load_current_chunk())
+        self.info_attrs.add("animation")
+
+    def _read_fcTL(self):
+        control = fcTL.load(self._load_current_chunk())
+        if self.animation is None:
+            # not an animated image; the chunk can be ignored
+            return
+        if control.width == 0 or control.height == 0:
+            self.fail("Frames must have a width and height greater than 0.")
+        if control.dispose_op > 2 or control.blend_op > 1:
+            self.fail("Unrecognized frame dispose or blend operation.")
+        if self.idat_chunks:
+            self.frame_controls.append((control, [], b"fdAT"))
+        else:
+            # the default image is the first frame
+            if (control.width, control.height, control.x_offset,
+                    control.y_offset) != (self.ihdr.width, self.ihdr.height,
+                                          0, 0):
+                self.fail("A frame using the default image must cover the "
+                          "whole canvas.")
+            self.frame_controls.append((control, self.idat_chunks, b"IDAT"))
+
+    def _read_fdAT(self):
+        intro = self.current_chunk_intro
+        if self.animation is None:
+            self._load_current_chunk()
+            return
+        if not self.frame_controls or \
+                self.frame_controls[-1][2] != b"fdAT":
+            self.fail("Frame data must follow a frame control chunk.")
+        if intro.length < 4:
+            self.fail("Frame data chunks must hold a sequence number.")
+        self.frame_controls[-1][1].append((intro.offset, intro.length))
+        if self._seekable(self.fp):
+            self.fp.seek(intro.length, os.SEEK_CUR)
+            self.current_chunk = None
+        else:
+            self._load_current_chunk()
+
     def _read_bKGD(self):
-        print("Reading in bKGD")
         length = self.current_chunk_intro.length
         bkgd = self.current_chunk = self.fp.read(length)
         color_type = self.ihdr.color_type
@@ -373,7 +1337,7 @@ class PNGFormat(FormatBase):
             if length != 1:
                 self.fail("The background color of an indexed image must be "
                           "1 byte.")
-            background_index = struct.unpack(">B", bkgd)
+            background_index, = struct.unpack(">B", bkgd)
             background_color = self.palette[background_index]
         elif color_type in (0, 4):
             if length != 2:
@@ -392,56 +1356,52 @@ class PNGFormat(FormatBase):
         self.info_attrs.add("background_color")
 
     def _read_tRNS(self):
-        print("Reading in tRNS")
         color_type = self.ihdr.color_type
         trns = self._load_current_chunk()
-        if self.image_data:
+        if self.idat_chunks:
             self.fail("tRNS blocks must precede image data.")
         if color_type == 3:
             if not self.palette:
                 self.fail("tRNS block must follow palette.")
-            trns_size = len(trns) // 2
-            padding = len(palette) - trns_size
+            trns_size = len(trns)
+            padding = len(self.palette) - trns_size
             if padding < 0:
                 self.fail("There must be no more than one transparency entry "
                           "per palette entry.")
             self.transparency = struct.unpack(">{}B".format(trns_size), trns)
             self.transparency += tuple(255 for i in range(padding))
         elif color_type == 0:
-            self.transparency = struct.unpack(">B", trns)
+            self.transparency = struct.unpack(">H", trns)
         elif color_type == 2:
             self.transparency = TrueColorRGBTriple.load(trns)
         else:
             self.fail("tRNS blocks are not permitted for images with alpha "
-                      "channels.") 
+                      "channels.")
+        self.info_attrs.add("transparency")
 
     def _read_gAMA(self):
-        print("Reading in gAMA")
         length = self.current_chunk_intro.length
         gama = self.current_chunk = self.fp.read(length)
         self.gamma = struct.unpack(">I", gama)
         self.info_attrs.add("gamma")
 
     def _read_cHRM(self):
-        print("Reading in cHRM")
         self.chromaticities = cHRM.load(self._load_current_chunk())
-        if self.image_data:
+        if self.idat_chunks:
             self.fail("cHRM block must precede image data.")
         if self.palette:
             self.fail("cHRM block must precede palette data.")
         self.info_attrs.add("chromaticities")
 
     def _read_sRGB(self):
-        print("Reading in sRGB")
         length = self.current_chunk_intro.length
         srgb = self.current_chunk = self.fp.read(length)
-        self.rendering_intent = struct.unpack(">B", srgb)
+        self.rendering_intent, = struct.unpack(">B", srgb)
         if self.rendering_intent not in (0, 1, 2, 3):
             self.fail("Unrecognized rendering intent: {}.".format(
                       self.rendering_intent))
 
     def _read_iCCP(self):
-        print("Reading in iCCP")
         length = self.current_chunk_intro.length
         iccp = self.current_chunk = self.fp.read(length)
         profile_name, data = iccp.split(b"\x00", 1)
@@ -449,46 +1409,56 @@ class PNGFormat(FormatBase):
         if compression_method not in (0, b"\x00"):
             self.fail("Unrecognized compression method: {}.".format(
                       compression_method))
-        self.icc_profile = iCCP(profile_name.decode("latin-1"),
-                            zlib.decompress(profile).decode("latin-1"))
+        self.icc_profile = iCCP(profile_name.decode("latin-1"), profile)
         self.info_attrs.add("icc_profile")
 
+    def _inflate_icc_profile(self):
+        name, profile = self.icc_profile
+        return iCCP(name, zlib.decompress(profile))
+
     def _read_tEXt(self):
-        print("Reading in tEXt")
         chunk = self._load_current_chunk()
-        keyword, text = chunk.split(b"\x00")
+        keyword, text = chunk.split(b"\x00", 1)
         self.text.append((keyword.decode("latin-1"), text.decode("latin-1")))
         self.info_attrs.add("text")
 
     def _read_zTXt(self):
-        print("Reading in zTXt")
         chunk = self._load_current_chunk()
-        keyword, data = chunk.split(b"\x00")
+        keyword, data = chunk.split(b"\x00", 1)
         compression_method, text = data[0], data[1:]
         if compression_method not in (0, b"\x00"):
             self.fail("Only compression method 0 (zlib) is supported.")
-        self.text.append(keyword.decode("latin-1"),
-                         zlib.decompress(text).decode("latin-1"))
+        # kept compressed until the text is asked for
+        self.text.append((keyword.decode("latin-1"), text))
         self.info_attrs.add("text")
 
+    def _inflate_text(self):
+        return [(keyword, text if isinstance(text, str)
+                          else zlib.decompress(text).decode("latin-1"))
+                for keyword, text in self.text]
+
     def _read_iTXt(self):
-        print("Reading in iTXt")
         chunk = self._load_current_chunk()
-        keyword, compression, translated_keyword, text = chunk.split(b"\x00")
-        compression_flag, compression_method = compression[0], compression[1]
-        language_tag = compression[2:]
+        keyword, data = chunk.split(b"\x00", 1)
+        compression_flag, compression_method = data[0], data[1]
+        language_tag, translated_keyword, text = data[2:].split(b"\x00", 2)
         if compression_flag:
             if compression_method not in (0, b"\x00"):
                 self.fail("Only compression method 0 (zlib) is supported.")
-            text = zlib.decompress(text)
         self.itext.append((keyword.decode("latin-1"),
                            language_tag,
                            translated_keyword.decode("utf-8"),
-                           text.decode("utf-8")))
+                           text if compression_flag else text.decode("utf-8")))
         self.info_attrs.add("itext")
 
+    def _inflate_itext(self):
+        return [(keyword, language_tag, translated_keyword,
+                 text if isinstance(text, str)
+                      else zlib.decompress(text).decode("utf-8"))
+                for keyword, language_tag, translated_keyword, text
+                in self.itext]
+
     def _read_pHYs(self):
-        print("Reading in pHYs")
         if self.physical_pixel_dimensions:
             self.fail("There can be only one pHYs block per image.")
         chunk = self._load_current_chunk()
@@ -496,7 +1466,6 @@ class PNGFormat(FormatBase):
         self.info_attrs.add("physical_pixel_dimensions")
 
     def _read_sBIT(self):
-        #print("Reading in sBIT")
         color_type = self.ihdr.color_type
         bit_depth = self.ihdr.bit_depth
         sbit = self._load_current_chunk()
@@ -507,16 +1476,15 @@ class PNGFormat(FormatBase):
         sample_depth = 8 if color_type & COLOR_TYPE_PALETTE else bit_depth
         if any(s < 0 or s > sample_depth for s in self.significant_bits):
             self.fail("Significant bits exceed sample depth.")
-        if image_data:
+        if self.idat_chunks:
             self.fail("sBIT blocks must precede image data.")
-        if palette:
+        if self.palette:
             self.fail("sBIT blocks must precede palette data.")
         self.info_attrs.add("significant_bits")
 
     def _read_sPLT(self):
-        #print("Reading in sPLT")
         splt = self._load_current_chunk()
-        if self.image_data:
+        if self.idat_chunks:
             self.fail("sPLT blocks must precede image data.")
         name, data = splt.split(b"\x00", 1)
         name = name.decode("latin-1")
@@ -530,17 +1498,17 @@ class PNGFormat(FormatBase):
             entry_size, entry_struct = 10, SuggestedTrueColorRGB
         else:
             self.fail("Sample depth must be 8 or 16.")
-        num_entries, incorrect_size = divmod(len(entries))
+        num_entries, incorrect_size = divmod(len(entries), entry_size)
         if incorrect_size:
             self.fail("Cannot cleanly fit {} bit samples into suggested "
                       "palette.".format(sample_depth))
-        suggested_palette = [RGB.load(entries[i:i+entry_size])
-                             for i in range(num_entries)]
+        suggested_palette = [
+                entry_struct.load(entries[i*entry_size:(i+1)*entry_size])
+                for i in range(num_entries)]
         self.suggested_palettes[name] = suggested_palette
         self.info_attrs.add("suggested_palettes")
 
     def _read_hIST(self):
-        #print("Reading in hIST")
         hist = self._load_current_chunk()
         if not self.palette:
             self.fail("hIST block must follow palette data.")
@@ -550,31 +1518,393 @@ class PNGFormat(FormatBase):
         self.info_attrs.add("histogram")
 
     def _read_tIME(self):
-        #print("Reading in tIME")
         time = self._load_current_chunk()
         self.last_modified = datetime.datetime(*struct.unpack(">HBBBBB", time))
         self.info_attrs.add("last_modified")
 
-    def _deinterlace_pass_1(self):
-        pass
-
-    def _deinterlace_pass_2(self):
-        pass
-
-    def _deinterlace_pass_3(self):
-        pass
-
-    def _deinterlace_pass_4(self):
-        pass
-
-    def _deinterlace_pass_5(self):
-        pass
-
-    def _deinterlace_pass_6(self):
-        pass
-
-    def _deinterlace_pass_7(self):
-        pass
+    def _read_riDX(self):
+        index = self._load_current_chunk()
+        if len(index) % 12:
+            self.fail("Row index lengths must be divisible by 12.")
+        self.row_index = [struct.unpack(">IQ", index[i:i+12])
+                          for i in range(0, len(index), 12)]
 
     def write(self):
-        raise NotImplementedError
+        im = self.image
+        try:
+            color_type, bit_depth = MODE_COLOR_TYPES[im.mode]
+        except KeyError:
+            self.fail("Images with mode {} cannot be saved as PNG.".format(
+                      im.mode))
+        width, height = im.size
+        self.ihdr = IHDR(width=width, height=height, bit_depth=bit_depth,
+                         color_type=color_type, compression_method=0,
+                         filter_method=0, interlace_method=0)
+        self.palette = None
+        self.transparency = None
+        self.reduce_scanline = None
+        self.row_index = []
+        filter_type = self.config["filter"]
+        frames = self.config["frames"]
+        if self.config["optimize"]:
+            if frames:
+                self.fail("Animated images cannot be optimized.")
+            self._optimize_encoding()
+            filter_type = self._choose_filter()
+        if frames:
+            animation = self._plan_animation(frames, filter_type)
+
+        self.fp.write(bytes(PNG_SIGNATURE))
+        self._write_chunk(b"IHDR", bytes(self.ihdr))
+        if self.palette is not None:
+            self._write_chunk(b"PLTE", b"".join(bytes(c[:3])
+                                                for c in self.palette))
+        if self.transparency is not None:
+            self._write_chunk(b"tRNS", bytes(self.transparency))
+        if frames:
+            self.sequence_number = 0
+            self._write_chunk(b"acTL", bytes(acTL(
+                num_frames=len(animation), num_plays=self.config["plays"])))
+            self._write_frame_control(animation[0][0])
+        idat_size = self.config["idat_size"]
+        idat = bytearray()
+        for data in self._compress(self._filter_scanlines(filter_type)):
+            idat += data
+            while len(idat) >= idat_size:
+                self._write_chunk(b"IDAT", bytes(idat[:idat_size]))
+                del idat[:idat_size]
+        if idat:
+            self._write_chunk(b"IDAT", bytes(idat))
+        if frames:
+            for control, data in animation[1:]:
+                self._write_frame_control(control)
+                for i in range(0, len(data), idat_size):
+                    self._write_chunk(b"fdAT", struct.pack(
+                        ">I", self.sequence_number) + data[i:i+idat_size])
+                    self.sequence_number += 1
+        if self.row_index:
+            self._write_chunk(b"riDX", b"".join(
+                struct.pack(">IQ", row, offset)
+                for row, offset in self.row_index))
+        self._write_chunk(b"IEND", b"")
+
+    def _write_chunk(self, chunk_type, data):
+        crc = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+        self.fp.write(struct.pack(">I", len(data)) + chunk_type)
+        self.fp.write(data)
+        self.fp.write(struct.pack(">I", crc))
+
+    def _write_frame_control(self, control):
+        control.sequence_number = self.sequence_number
+        self.sequence_number += 1
+        self._write_chunk(b"fcTL", bytes(control))
+
+    def _plan_animation(self, frames, filter_type):
+        """Encode the frames that follow the image being written.
+
+        Only the rectangle of pixels that changed since the previous frame
+        is stored.  Images with an alpha channel also try storing unchanged
+        pixels as fully transparent and blending the rectangle over the
+        canvas, which usually compresses better, and keep whichever blend
+        operation gives the smaller data.  Frames identical to the one
+        before them are dropped and their delay added to it.
+
+        Returns a list of ``[control, data]`` pairs, starting with the
+        control of the image itself, whose data is ``None``.
+
+        """
+        im = self.image
+        width, height = im.size
+        delays = self.config["delay"]
+        if isinstance(delays, int):
+            delays = [delays] * (len(frames) + 1)
+        elif len(delays) != len(frames) + 1:
+            self.fail("There must be one delay for every frame.")
+        bpp = im.bytes_per_pixel
+        alpha = bool(self.ihdr.color_type & COLOR_TYPE_ALPHA)
+
+        def control(left, top, right, bottom, delay, blend_op):
+            return fcTL(width=right-left, height=bottom-top, x_offset=left,
+                        y_offset=top, delay_num=delay, delay_den=1000,
+                        dispose_op=APNG_DISPOSE_OP_NONE, blend_op=blend_op)
+
+        animation = [[control(0, 0, width, height, delays[0],
+                              APNG_BLEND_OP_SOURCE), None]]
+        previous = im.buffer
+        for frame, delay in zip(frames, delays[1:]):
+            if frame.mode != im.mode or frame.size != im.size:
+                self.fail("Every frame must have the mode and size of the "
+                          "image.")
+            current = frame.buffer
+            rect = util.changed_rectangle(previous, current, width, height, bpp)
+            if rect is None:
+                last = animation[-1][0]
+                last.delay_num = min(0xffff, last.delay_num + delay)
+                continue
+            candidates = [(APNG_BLEND_OP_SOURCE,
+                           self._crop(current, rect))]
+            if alpha:
+                over = self._transparent_unchanged(previous, current, rect)
+                if over is not None:
+                    candidates.append((APNG_BLEND_OP_OVER, over))
+            best = None
+            for blend_op, region in candidates:
+                data = self._encode_region(region, rect, filter_type)
+                if best is None or len(data) < len(best[1]):
+                    best = control(*rect, delay, blend_op), data
+            animation.append(list(best))
+            previous = current
+        return animation
+
+    def _crop(self, buffer, rect):
+        left, top, right, bottom = rect
+        bpp = self.image.bytes_per_pixel
+        line_size = self.image.size.width * bpp
+        return b"".join(bytes(buffer[y*line_size+left*bpp:
+                                     y*line_size+right*bpp])
+                        for y in range(top, bottom))
+
+    def _transparent_unchanged(self, before, after, rect):
+        """Crop ``rect`` out of ``after`` with the pixels that match
+        ``before`` made fully transparent, or return ``None`` when a changed
+        pixel is not opaque and so could not be blended over the canvas.
+
+        """
+        bpp = self.image.bytes_per_pixel
+        alpha_size = bpp // self.image.mode.components
+        opaque = b"\xff" * alpha_size
+        a = memoryview(self._crop(before, rect))
+        b = bytearray(self._crop(after, rect))
+        clear = bytes(bpp)
+        for x in range(0, len(b), bpp):
+            if a[x:x+bpp] == b[x:x+bpp]:
+                b[x:x+bpp] = clear
+            elif b[x+bpp-alpha_size:x+bpp] != opaque:
+                return None
+        return bytes(b)
+
+    def _encode_region(self, data, rect, filter_type):
+        """Filter and compress the pixels ``data`` of a rectangle of the
+        image being written.
+
+        """
+        left, top, right, bottom = rect
+        ihdr = self.ihdr
+        region = self.image_cls(self.image.mode, size=(right - left,
+                                                       bottom - top))
+        region.buffer[:] = data
+        state = self.image, ihdr.width, ihdr.height
+        try:
+            self.image = region
+            ihdr.width, ihdr.height = region.size
+            return b"".join(self._compress(
+                self._filter_scanlines(filter_type, index=False),
+                index=False))
+        finally:
+            self.image, ihdr.width, ihdr.height = state
+
+    def _optimize_encoding(self):
+        """Pick the cheapest lossless color type, bit depth and palette for
+        the image being written, and set :attr:`reduce_scanline` to convert
+        its scanlines accordingly.
+
+        """
+        im = self.image
+        ihdr = self.ihdr
+        channels = IHDR.CHANNELS[ihdr.color_type]
+        alpha = bool(ihdr.color_type & COLOR_TYPE_ALPHA)
+        source_depth = ihdr.bit_depth
+        line_size = ihdr.row_bytes(ihdr.width)
+        band_size = line_size * max(1, self.config["band_size"] // line_size)
+        buffer = im.buffer
+        bands = (buffer[i:i+band_size]
+                 for i in range(0, len(buffer), band_size))
+        stats = analyze_pixels(bands, channels, ihdr.bit_depth, alpha)
+
+        bit_depth = 8 if stats.fits_8_bit else 16
+        keep_alpha = alpha and not stats.opaque
+        if stats.grayscale:
+            keep, color_type = [0], COLOR_TYPE_L
+        else:
+            keep, color_type = [0, 1, 2], COLOR_TYPE_RGB
+        if keep_alpha:
+            keep.append(channels - 1)
+            color_type |= COLOR_TYPE_ALPHA
+        if color_type == COLOR_TYPE_L and bit_depth == 8:
+            levels = set(c[0] for c in stats.colors)
+            for depth in (1, 2, 4):
+                step = 255 // ((1 << depth) - 1)
+                if all(v % step == 0 for v in levels):
+                    bit_depth = depth
+                    break
+        cost = ihdr.height * ((ihdr.width * len(keep) * bit_depth + 7) // 8)
+
+        palette = None
+        if stats.colors is not None:
+            colors = sorted(stats.colors,
+                            key=lambda c: (not keep_alpha or c[-1] == 255, c))
+            depth = next(d for d in (1, 2, 4, 8) if len(colors) <= 1 << d)
+            transparent = sum(1 for c in colors if keep_alpha and c[-1] < 255)
+            palette_cost = (ihdr.height * ((ihdr.width * depth + 7) // 8) +
+                            12 + 3 * len(colors) +
+                            (12 + transparent if transparent else 0))
+            if palette_cost < cost:
+                palette = colors
+                color_type, bit_depth = COLOR_TYPE_PALETTE, depth
+
+        ihdr.color_type, ihdr.bit_depth = color_type, bit_depth
+        narrow = source_depth == 16 and stats.fits_8_bit
+        if palette is not None:
+            self.palette = [c[:3] if channels >= 3 else (c[0],) * 3
+                            for c in palette]
+            if transparent:
+                self.transparency = [c[-1] for c in palette[:transparent]]
+            index = {c: i for i, c in enumerate(palette)}
+            table = bytes(index.get((v,), 0) for v in range(256))
+
+            def reduce_scanline(row):
+                if narrow:
+                    row = row[0::2]
+                if channels == 1:
+                    row = row.translate(table)
+                else:
+                    row = bytes(map(index.__getitem__,
+                                    zip(*(row[c::channels]
+                                          for c in range(channels)))))
+                if bit_depth < 8:
+                    row = pack_samples(row, bit_depth)
+                return row
+        else:
+            sample_size = 2 if source_depth == 16 and not narrow else 1
+            if bit_depth < 8:
+                scale = bytes(v // (255 // ((1 << bit_depth) - 1))
+                              for v in range(256))
+
+            def reduce_scanline(row):
+                if narrow:
+                    row = row[0::2]
+                if len(keep) < channels:
+                    row = util.select_samples(row, channels, keep,
+                                              sample_size)
+                if bit_depth < 8:
+                    row = pack_samples(row.translate(scale), bit_depth)
+                return row
+
+        self.reduce_scanline = reduce_scanline
+
+    def _raw_scanline(self, y):
+        """Return scanline ``y`` of the image being written, unfiltered."""
+        im = self.image
+        line_size = len(im.buffer) // im.size.height
+        row = bytes(im.buffer[y*line_size:(y+1)*line_size])
+        if self.reduce_scanline is not None:
+            row = self.reduce_scanline(row)
+        return bytes(self._swap_bytes(bytearray(row)))
+
+    def _raw_scanlines(self):
+        """Yield the unfiltered scanlines of the image being written."""
+        for y in range(self.ihdr.height):
+            yield self._raw_scanline(y)
+
+    def _filter_scanlines(self, filter_type, index=True):
+        if filter_type == "adaptive":
+            filter_type = None
+        elif filter_type not in FILTERS:
+            self.fail("Unrecognized filter type: {}.".format(filter_type))
+        bpp = self.ihdr.filter_unit
+        prior = bytes(self.ihdr.row_bytes(self.ihdr.width))
+        flush_rows = self.config["row_index"] if index else 0
+        for y, raw in enumerate(self._raw_scanlines()):
+            if flush_rows and y % flush_rows == 0 and \
+                    filter_type not in (0, 1):
+                # a decoder starting here has no prior scanline
+                yield filter_scanline(bpp, prior, raw, None, (0, 1))
+            else:
+                yield filter_scanline(bpp, prior, raw, filter_type)
+            prior = raw
+
+    def _choose_filter(self):
+        """Return the filter strategy that compresses a sample of the
+        scanlines best.
+
+        The sample is made of runs of consecutive scanlines spread evenly
+        through the image, so that the filters see realistic prior rows.
+
+        """
+        height = self.ihdr.height
+        rows = max(1, min(height, self.config["sample_rows"]))
+        run = min(rows, 8)
+        runs = rows // run
+        starts = sorted(set((height - run) * i // max(1, runs - 1)
+                            for i in range(runs)))
+        sample = []
+        for start in starts:
+            prior = (self._raw_scanline(start - 1) if start else
+                     bytes(self.ihdr.row_bytes(self.ihdr.width)))
+            raws = [self._raw_scanline(y) for y in range(start, start + run)]
+            sample.append((prior, raws))
+
+        bpp = self.ihdr.filter_unit
+        level = self.config["compression_level"]
+        best, best_size = None, None
+        for filter_type in ("adaptive", 0, 1, 2, 3, 4):
+            f = None if filter_type == "adaptive" else filter_type
+            compressor = zlib.compressobj(level)
+            size = 0
+            for prior, raws in sample:
+                for raw in raws:
+                    size += len(compressor.compress(
+                                    filter_scanline(bpp, prior, raw, f)))
+                    prior = raw
+            size += len(compressor.flush())
+            if best is None or size < best_size:
+                best, best_size = filter_type, size
+        return best
+
+    def _compress(self, scanlines, index=True):
+        """Deflate the filtered scanlines, flushing fully and recording the
+        stream offset every ``row_index`` scanlines when an index is being
+        written.
+
+        """
+        level = self.config["compression_level"]
+        threads = self.config["threads"]
+        flush_rows = self.config["row_index"] if index else 0
+        offset = 0
+        if threads == 1:
+            compressor = zlib.compressobj(level)
+            for y, scanline in enumerate(scanlines):
+                if flush_rows and y and y % flush_rows == 0:
+                    data = compressor.flush(zlib.Z_FULL_FLUSH)
+                    offset += len(data)
+                    yield data
+                    self.row_index.append((y, offset))
+                data = compressor.compress(scanline)
+                if data:
+                    offset += len(data)
+                    yield data
+            yield compressor.flush()
+        elif flush_rows:
+            # one band per flush interval, each ending on a full flush
+            def segments():
+                segment = []
+                for scanline in scanlines:
+                    segment.append(scanline)
+                    if len(segment) == flush_rows:
+                        yield b"".join(segment)
+                        segment = []
+                if segment:
+                    yield b"".join(segment)
+
+            height = self.ihdr.height
+            for i, data in enumerate(parallel_deflate(segments(), level,
+                                                      threads, 1)):
+                row = (i - 1) * flush_rows
+                if i > 1 and row < height:
+                    self.row_index.append((row, offset))
+                offset += len(data)
+                yield data
+        else:
+            for data in parallel_deflate(scanlines, level, threads,
+                                         self.config["band_size"]):
+                yield data
@@ -1,31 +1,20 @@
 # depyct/io/plugins/xbm.py
-import mmap
 import os
 import re
 import warnings
 
+from depyct.image import dither
 from depyct.image.mode import L
 from depyct.io.format import FormatBase
+from depyct import util
+
+xbm_define = re.compile(br"#[ \t]*define[ \t]+(\w+)[ \t]+(\d+)")
+xbm_declaration = re.compile(
+        br"([\w \t]*?)\w*bits[ \t]*\[[ \t]*\][ \t]*=[ \t]*\{")
+
+# the text of every byte value as written in the image data
+_HEX_BYTES = [b"0x%02x" % b for b in range(256)]
 
-xbm_header = re.compile(
-        br"(?:/\*.*\*/)?"
-        br"\s*#[ \t]*define[ \t]+[A-Za-z0-9_]*_width[ \t]+(?P<width>\d+)[\r\n]+"
-        br"(?:/\*.*\*/)?"
-        br"\s*#[ \t]*define[ \t]+[A-Za-z0-9_]*_height[ \t]+(?P<height>\d+)[\r\n]+"
-        br"(?:/\*.*\*/)?"
-        br"(?P<hotspot> "
-        br"(?:/\*.*\*/)?"
-        br"\s*#[ \t]*define[ \t]+[A-Za-z0-9_]*_x_hot[ \t]+(?P<x_hot>\d+)[\r\n]+"
-        br"(?:/\*.*\*/)?"
-        br"\s*#[ \t]*define[ \t]+[A-Za-z0-9_]*_y_hot[ \t]+(?P<y_hot>\d+)[\r\n]+"
-        br"(?:/\*.*\*/)?"
-        br")?"
-        br"(?:/\*.*\*/)?"
-        br"\s*[A-Za-z\d \t]*_bits\[\][ \t]+=[ \t]+"
-   )
-
-x10_data_re = re.compile(br"(0x[0-9a-fA-F]{4})")
-x11_data_re = re.compile(br"(0x[0-9a-fA-F]{2})")
 
 class XBMFormat(FormatBase):
     """File format plugin for XBM images
@@ -46,62 +35,129 @@ class XBMFormat(FormatBase):
     #define {optional_name}_y_hot 1
     static char _bits[] = {
     };
-    
+
+    Older X10 bitmaps hold an array of shorts instead, each row padded to
+    16 bits; both kinds are read.
+
+    Options
+    -------
+
+    ``clip``
+        A function of a pixel and the image that is true for pixels written
+        as set bits.
+
+    ``dither``
+        When writing, a method of :meth:`~depyct.image.ImageMixin.dither`.
+        The image is then converted to gray, ignoring alpha, and dithered to
+        black and white, black pixels becoming set bits, and ``clip`` is not
+        used.
+
+    ``name``
+        The prefix of the names defined in the file written.  Defaults to
+        the name of the file without its extension.
+
     """
 
     extensions = ("xbm", "bm", "bitmap")
     mimetypes = ("image/x-xbm", "image/x-xbitmap")
     defaults = {
         "clip": lambda p, im: int(tuple(p) != im.mode.transparent_color),
+        "dither": None,
+        "name": None,
     }
     messages = {}
 
+    #: The number of bytes of the file read at a time.
+    chunk_size = 1 << 16
 
     def read(self):
-        m = xbm_header.match(self.fp.read(1024))
-        # FIXME: use fail instead of these embedded try blocks
+        header, data = self._read_header()
+        defines = {}
+        for name, value in xbm_define.findall(header):
+            for key in (b"width", b"height", b"x_hot", b"y_hot"):
+                if name == key or name.endswith(b"_" + key):
+                    defines[key] = int(value)
+        if b"width" not in defines or b"height" not in defines:
+            self.fail("XBM header has no width or height.")
+        width, height = defines[b"width"], defines[b"height"]
+        im = self.image_cls(L, size=(width, height))
+        if b"x_hot" in defines and b"y_hot" in defines:
+            im.info["hotspot"] = (defines[b"x_hot"], defines[b"y_hot"])
+
+        # X10 bitmaps are arrays of shorts with each row padded to 16 bits
+        x10 = b"short" in xbm_declaration.search(header).group(1)
+        digits = 4 if x10 else 2
+        row_size = (width + 7) // 8
+        if x10:
+            row_size = (width + 15) // 16 * 2
+        raster = self._read_raster(data, digits)
+        if len(raster) != row_size * height:
+            self.fail("Read an unexpected amount of data. Expected {} "
+                      "bytes, received {}.".format(row_size * height,
+                                                   len(raster)))
+        if x10:
+            # shorts are stored least significant byte first
+            swapped = bytearray(raster)
+            swapped[0::2], swapped[1::2] = raster[1::2], raster[0::2]
+            raster = swapped
+            if row_size != (width + 7) // 8:
+                raster = b"".join(raster[y*row_size:y*row_size + row_size - 1]
+                                  for y in range(height))
+        im.buffer[:] = util.unpack_bits(raster, width, height,
+                                        lsb_first=True)
+        return im
+
+    def _read_header(self):
+        """Read up to the opening brace of the image data, returning the
+        header and whatever of the data was read with it.
+
+        """
+        data = b""
+        while True:
+            chunk = self.fp.read(self.chunk_size)
+            data += chunk
+            m = xbm_declaration.search(data)
+            if m is not None:
+                return data[:m.end()], data[m.end():]
+            if not chunk:
+                self.fail("XBM header not recognized.")
+
+    def _read_raster(self, data, digits):
+        """Read the image data up to the closing brace, ``digits`` hex
+        digits to a value, a chunk at a time.
+
+        """
+        raster = bytearray()
+        while True:
+            end = data.find(b"}")
+            if end >= 0:
+                raster += self._parse_values(data[:end], digits)
+                return raster
+            # keep a value cut off at the end of the chunk for the next one
+            cut = max(data.rfind(sep) for sep in (b",", b" ", b"\t", b"\n"))
+            if cut >= 0:
+                raster += self._parse_values(data[:cut], digits)
+                data = data[cut:]
+            chunk = self.fp.read(self.chunk_size)
+            if not chunk:
+                self.fail("XBM image data is not terminated.")
+            data += chunk
+
+    def _parse_values(self, text, digits):
+        """Convert the hex values in ``text`` to bytes in one go."""
+        values = text.replace(b",", b" ").split()
+        hex_digits = b"".join(values)
+        if len(hex_digits) == len(values) * (digits + 2):
+            hex_digits = hex_digits.replace(b"0x", b"").replace(b"0X", b"")
+        if len(hex_digits) != len(values) * digits:
+            # values written with fewer digits than usual
+            if not all(v[:2] in (b"0x", b"0X") for v in values):
+                self.fail("XBM image data holds values that aren't hex.")
+            hex_digits = b"".join(v[2:].rjust(digits, b"0") for v in values)
         try:
-            if m:
-               width = int(m.group("width"))
-               height = int(m.group("height"))
-               im = self.image_cls(L, size=(width, height))
-               if m.group("hotspot"):
-                   im.info["hotspot"] = (int(m.group("x_hot")),
-                                         int(m.group("y_hot")))
-               padding = width % 8
-               bytes_per_raster = width // 8 + (1 if padding else 0)
-               self.fp.seek(m.end())
-               # FIXME: this is dangerous.  you should be reading by chunk
-               map = self.fp.read()
-               data = []
-               raster = []
-               # FIXME: sniff to determine which data_re should be used
-               for i, match in enumerate(x11_data_re.finditer(map)):
-                   # FIXME: is this naming correct?
-                   raster.append(int(match.group(0), 16))
-                   if len(raster) < bytes_per_raster:
-                       continue
-                   while raster:
-                       byte = raster.pop(0)
-                       if raster:
-                           pixels = [(255 if (1 & (byte>>i)) else 0)
-                                     for i in range(8)]
-                       else:
-                           pixels = [(255 if (1 & (byte>>i)) else 0)
-                                     for i in range(padding)]
-                       data.extend(pixels)
-               try:
-                   im.buffer[:] = bytearray(data)
-               except ValueError:
-                   raise IOError("Read an unexpected amount of data. "
-                                 "Expected {} bits, received {}.".format(
-                                     width * height, len(data)))
-               else:
-                   return im
-            raise IOError("Header data not recognized.")
-        except IOError as e:
-            raise IOError("{} does not appear to be a valid XBM image: "
-                          "{}".format(filename, e.message))
+            return bytes.fromhex(hex_digits.decode("ascii"))
+        except (ValueError, UnicodeDecodeError):
+            self.fail("XBM image data holds values that aren't hex.")
 
     def load(self):
         pass
@@ -115,29 +171,36 @@ class XBMFormat(FormatBase):
                       "override this behavior, raise pass a function that "
                       "takes a single pixel as an argument as the `clip` "
                       "option.")
-        clip = self.config["clip"]
-        if hasattr(self, "filename"):
-            label = os.path.splitext(os.path.basename(self.filename))[0]
-        else:
+        label = self.config["name"]
+        if label is None:
+            name = getattr(self.fp, "name", None)
             label = ""
+            if isinstance(name, util.string_type):
+                label = os.path.splitext(os.path.basename(name))[0]
+        if not isinstance(label, bytes):
+            label = re.sub(r"\W", "_", label).encode("ascii")
         width, height = self.image.size
-        self.fp.write(b"#define {}_width {}\n".format(label, width))
-        self.fp.write(b"#define {}_height {}\n".format(label, height))
+        self.fp.write(b"#define %b_width %d\n" % (label, width))
+        self.fp.write(b"#define %b_height %d\n" % (label, height))
         if self.image.info.get("hotspot"):
-            hotspot = image.info["hotspot"]
-            self.fp.write(b"#define {}_x_hot {}\n".format(label, hotspot[0]))
-            self.fp.write(b"#define {}_y_hot {}\n".format(label, hotspot[1]))
-        self.fp.write(b"static char {}_bits[] = {{\n".format(label))
-        for i, line in enumerate(self.image):
-            raster = []
-            start, end = 0, 8
-            while start < len(line):
-                byte = 0
-                for j, p in enumerate(line.pixels[start:end]):
-                    byte |= (clip(p, self.image) << j)
-                raster.append(byte)
-                start, end = end, end + 8
-            self.fp.write(
-                b" " + b" ".join(b"0x{:02x}".format(b) for b in raster) + b"\n"
-            )
+            hotspot = self.image.info["hotspot"]
+            self.fp.write(b"#define %b_x_hot %d\n" % (label, hotspot[0]))
+            self.fp.write(b"#define %b_y_hot %d\n" % (label, hotspot[1]))
+        self.fp.write(b"static char %b_bits[] = {\n" % label)
+        self.fp.writelines(
+                b" " + b" ".join(map(_HEX_BYTES.__getitem__,
+                                     util.pack_bits(row, lsb_first=True)))
+                + b"\n"
+                for row in self._bilevel_rows())
         self.fp.write(b"};\n")
+
+    def _bilevel_rows(self):
+        """Yield the rows of the image being written with one byte per
+        pixel, as :func:`~depyct.image.dither.bilevel_rows` gives them.
+
+        """
+        clip = self.config["clip"]
+        if clip is self.defaults["clip"]:
+            clip = None
+        return dither.bilevel_rows(self.image, clip, self.config["dither"],
+                                   self.fail)
@@ -1,22 +1,270 @@
 # depyct/io/plugins/xpm.py
+import os
+import re
+from collections import Counter
 
+from depyct.color.x11 import NAMED_COLORS
+from depyct.image.mode import L, LA, RGB, RGBA
+from depyct.image.quantize import pack_colors, TRANSPARENT
 from depyct.io.format import FormatBase
+from depyct import util
+
+xpm_define = re.compile(br"#[ \t]*define[ \t]+(\w+)[ \t]+(\d+)")
+# C strings, skipping comments that might hold quotes of their own
+xpm_string = re.compile(br'/\*.*?\*/|"((?:[^"\\\n]|\\.)*)"', re.S)
+
+# the contexts of a color table line: color, gray, 4-level gray, mono and
+# symbolic name, in the order their colors are preferred
+_CONTEXTS = (b"c", b"g", b"g4", b"m", b"s")
+
+# key characters, the most readable first; quotes and backslashes are left
+# out so that keys never need escaping
+_KEY_CHARS = (b" .XoO+@#$%&*=-;:>,<1234567890qwertyuipasdfghjklzxcvbnm"
+              b"MNBVCZASDFGHJKLPIUYTREWQ!~^/()_`'][{}|")
 
 
 class XPMFormat(FormatBase):
     """File format plugin for XPM images
     =================================
 
+    XPM images are C source (XPM1 and XPM3) or plain text (XPM2).  A color
+    table maps keys of ``chars_per_pixel`` characters to colors, and each
+    row of the image is a string of keys.  Images with a ``None`` color are
+    read as ``RGBA``, others as ``RGB``; a hotspot is stored in
+    ``info["hotspot"]``.  Colors are given in hex or by any X11 color name,
+    in any case and with or without spaces.
+
+    ``L``, ``LA``, ``RGB`` and ``RGBA`` images are written, pixels less
+    than half opaque becoming ``None``.  Keys are as short as the number of
+    colors in the image allows.
+
+    Options
+    -------
+
+    ``format``
+        The XPM version written, ``3`` or ``2``.
+
+    ``name``
+        The name of the array written in XPM3 files.  Defaults to the name
+        of the file without its extension.
+
     """
 
     extensions = ("xpm", "pm")
     mimetypes = ("image/x-xpm", "image/x-xpixelmap")
+    defaults = {
+        "format": 3,
+        "name": None,
+    }
 
     def read(self):
-        raise NotImplementedError
+        content = self.fp.read()
+        if content.lstrip().startswith(b"! XPM2"):
+            lines = content.split(b"\n")[1:]
+            values, lines = lines[0], [line.rstrip(b"\r") for line in lines]
+            values = self._parse_values(values)
+            ncolors, height = values[2], values[1]
+            colors = lines[1:ncolors+1]
+            rows = lines[ncolors+1:ncolors+1+height]
+        elif b"XPM" in content[:content.find(b"\n")]:
+            strings = [m.group(1) for m in xpm_string.finditer(content)
+                       if m.group(1) is not None]
+            defines = {}
+            for name, value in xpm_define.findall(content):
+                for key in (b"format", b"width", b"height", b"ncolors",
+                            b"chars_per_pixel"):
+                    if name == key or name.endswith(b"_" + key):
+                        defines[key] = int(value)
+            if b"format" in defines:
+                try:
+                    values = [defines[key] for key in
+                              (b"width", b"height", b"ncolors",
+                               b"chars_per_pixel")]
+                except KeyError:
+                    self.fail("XPM1 header is incomplete.")
+                # colors are either whole table lines or key, color pairs
+                ncolors = values[2]
+                if len(strings) == 2 * ncolors + values[1]:
+                    colors = [strings[2*i] + b" c " + strings[2*i+1]
+                              for i in range(ncolors)]
+                    strings = colors + strings[2*ncolors:]
+            else:
+                if not strings:
+                    self.fail("XPM file holds no strings.")
+                values = self._parse_values(strings[0])
+                strings = strings[1:]
+            ncolors, height = values[2], values[1]
+            colors = strings[:ncolors]
+            rows = strings[ncolors:ncolors+height]
+        else:
+            self.fail("Not an XPM file.")
+        width, height, ncolors, cpp = values[:4]
+        if len(colors) < ncolors:
+            self.fail("XPM color table is truncated.")
+        if len(rows) < height:
+            self.fail("XPM image has {} rows, expected {}.".format(
+                      len(rows), height))
+
+        table = dict(self._parse_color(line, cpp) for line in colors)
+        alpha = None in table.values()
+        im = self.image_cls(RGBA if alpha else RGB, size=(width, height))
+        # pre-pack every color as the bytes of a pixel
+        pixels = {key: bytes(color + (255,) if alpha else color)
+                  if color is not None else bytes(4)
+                  for key, color in table.items()}
+        for row in rows:
+            if len(row) != width * cpp:
+                self.fail("XPM row holds {} characters, expected {}.".format(
+                          len(row), width * cpp))
+        if cpp == 1:
+            im.buffer[:] = self._translate(b"".join(rows), pixels)
+        else:
+            lookup = pixels.__getitem__
+            try:
+                im.buffer[:] = b"".join(
+                    [b"".join(map(lookup, [row[i:i+cpp] for i in
+                                           range(0, len(row), cpp)]))
+                     for row in rows])
+            except KeyError:
+                self.fail("XPM pixels use a key that has no color.")
+        if len(values) >= 6:
+            im.info["hotspot"] = tuple(values[4:6])
+        return im
+
+    def _parse_values(self, line):
+        """Parse the values line: width, height, number of colors,
+        characters per pixel and an optional hotspot.
+
+        """
+        words = line.split()
+        if words[-1:] == [b"XPMEXT"]:
+            words.pop()
+        try:
+            values = [int(w) for w in words]
+        except ValueError:
+            self.fail("XPM values line {!r} is not understood.".format(line))
+        if len(values) not in (4, 6) or min(values[:4]) <= 0:
+            self.fail("XPM values line {!r} is not understood.".format(line))
+        return values
+
+    def _parse_color(self, line, cpp):
+        """Return the key of a color table line and its ``(r, g, b)`` color,
+        or ``None`` for a transparent one.
+
+        """
+        key, words = line[:cpp], line[cpp:].split()
+        specs = {}
+        context = None
+        for word in words:
+            if word in _CONTEXTS and (context is None or specs[context]):
+                context = word
+                specs[context] = []
+            elif context is None:
+                self.fail("XPM color line {!r} is not understood.".format(
+                          line))
+            else:
+                specs[context].append(word)
+        for context in _CONTEXTS[:4]:
+            if specs.get(context):
+                return key, self._color(b"".join(specs[context]).lower())
+        self.fail("XPM color line {!r} has no color.".format(line))
+
+    def _color(self, value):
+        if value == b"none":
+            return None
+        if value.startswith(b"#") and len(value) in (4, 7, 10, 13):
+            digits = (len(value) - 1) // 3
+            try:
+                channels = [int(value[1+c*digits:1+(c+1)*digits], 16)
+                            for c in range(3)]
+            except ValueError:
+                self.fail("XPM color {!r} is not understood.".format(value))
+            if digits == 1:
+                return tuple(v * 17 for v in channels)
+            return tuple(v >> 4 * (digits - 2) for v in channels)
+        try:
+            return NAMED_COLORS[value.decode("latin-1")]
+        except KeyError:
+            self.fail("Unknown XPM color {!r}.".format(value))
+
+    def _translate(self, keys, pixels):
+        """Decode one character keys, translating the whole raster once for
+        each byte of a pixel.
+
+        """
+        if keys.translate(None, b"".join(pixels)):
+            self.fail("XPM pixels use a key that has no color.")
+        size = len(next(iter(pixels.values())))
+        out = bytearray(len(keys) * size)
+        for c in range(size):
+            table = bytearray(256)
+            for key, pixel in pixels.items():
+                table[key[0]] = pixel[c]
+            out[c::size] = keys.translate(table)
+        return out
 
     def load(self):
-        raise NotImplementedError
+        pass
 
     def write(self):
-        raise NotImplementedError
+        im = self.image
+        if im.mode not in (L, LA, RGB, RGBA):
+            self.fail("Images with mode {} cannot be saved as XPM.".format(
+                      im.mode))
+        width, height = im.size
+        channels = im.mode.components
+        data = im.buffer
+        if channels < 3:
+            # spread the gray across red, green and blue
+            expanded = bytearray(width * height * (channels + 2))
+            for c in range(3):
+                expanded[c::channels+2] = data[0::channels]
+            if channels == 2:
+                expanded[3::4] = data[1::2]
+            data, channels = expanded, channels + 2
+        packed = pack_colors(data, channels)
+        if channels == 4:
+            # all pixels less than half opaque share one key
+            packed = [c if c < TRANSPARENT else TRANSPARENT for c in packed]
+
+        # the most common colors get the most readable keys
+        census = [c for c, _ in Counter(packed).most_common()]
+        cpp = 1
+        while len(_KEY_CHARS) ** cpp < len(census):
+            cpp += 1
+        keys = {color: self._key(i, cpp) for i, color in enumerate(census)}
+        table = [keys[c] + (b" c None" if c == TRANSPARENT else
+                            b" c #%06X" % c) for c in census]
+        lookup = keys.__getitem__
+        rows = [b"".join(map(lookup, packed[y*width:(y+1)*width]))
+                for y in range(height)]
+        values = b"%d %d %d %d" % (width, height, len(census), cpp)
+        hotspot = im.info.get("hotspot")
+        if hotspot:
+            values += b" %d %d" % tuple(hotspot)
+
+        if self.config["format"] == 2:
+            self.fp.write(b"! XPM2\n")
+            self.fp.write(b"\n".join([values] + table + rows) + b"\n")
+            return
+        if self.config["format"] != 3:
+            self.fail("XPM format must be 2 or 3.")
+        name = self.config["name"]
+        if name is None:
+            filename = getattr(self.fp, "name", None)
+            name = "image"
+            if isinstance(filename, util.string_type):
+                name = os.path.splitext(os.path.basename(filename))[0]
+        if not isinstance(name, bytes):
+            name = re.sub(r"\W", "_", name).encode("ascii")
+        self.fp.write(b"/* XPM */\nstatic char * %b[] = {\n" % name)
+        self.fp.write(b",\n".join(b'"%b"' % line
+                                  for line in [values] + table + rows))
+        self.fp.write(b"\n};\n")
+
+    def _key(self, index, cpp):
+        key = bytearray()
+        for _ in range(cpp):
+            index, digit = divmod(index, len(_KEY_CHARS))
+            key.append(_KEY_CHARS[digit])
+        return bytes(key)
@@ -0,0 +1,124 @@
+# depyct/scripts/optimize.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+"""Losslessly shrink PNG files.
+
+Each file is decoded and written again with the ``optimize`` option of
+:class:`~depyct.io.plugins.png.PNGFormat`, and replaced only if the result
+is smaller.  Ancillary chunks such as text and gamma are not carried over.
+Animated PNGs are passed through unchanged, since only their default image
+would be written.  Results are written to a temporary file next to the
+destination and moved over it, so an interrupted run leaves either the old
+file or the new one.
+Files are processed in parallel by a pool of worker processes::
+
+    python -m depyct.scripts.optimize [-j JOBS] [-l LEVEL] [-o DIR] FILE...
+
+"""
+import argparse
+from concurrent import futures
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from depyct.image import Image
+from depyct.io.plugins.png import PNGFormat
+
+
+def _replace(source, destination, write):
+    """Call ``write`` with a temporary file in the directory of
+    ``destination``, give it the permissions of ``source`` and move it over
+    ``destination``.
+
+    """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(destination) or ".",
+                                suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write(fp)
+        shutil.copymode(source, temp)
+        os.replace(temp, destination)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def optimize_file(source, destination=None, **options):
+    """Optimize the PNG file ``source``, writing the result to
+    ``destination``, which defaults to ``source`` itself.  When the
+    optimized image is not smaller, or ``source`` is animated, the
+    original bytes are kept.
+
+    Returns the sizes of the file before and after.
+
+    """
+    destination = destination or source
+    before = os.path.getsize(source)
+    fmt = PNGFormat(Image, lazy=False)
+    im = fmt.open(source)
+    data = None
+    if fmt.animation is None:
+        output = io.BytesIO()
+        PNGFormat(Image, optimize=True, **options).save(im, output)
+        data = output.getvalue()
+    if data is not None and len(data) < before:
+        _replace(source, destination, lambda fp: fp.write(data))
+        return before, len(data)
+    if os.path.abspath(destination) != os.path.abspath(source):
+        with open(source, "rb") as src:
+            _replace(source, destination,
+                     lambda fp: shutil.copyfileobj(src, fp))
+    return before, before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            prog="depyct-optimize",
+            description="Losslessly shrink PNG files.")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("-l", "--level", type=int, default=9,
+                        help="zlib compression level (default: 9)")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="write the results here instead of in place")
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    total_before = total_after = 0
+    status = 0
+    with futures.ProcessPoolExecutor(args.jobs) as executor:
+        jobs = {}
+        for source in args.files:
+            destination = None
+            if args.output_dir:
+                destination = os.path.join(args.output_dir,
+                                           os.path.basename(source))
+            job = executor.submit(optimize_file, source, destination,
+                                  compression_level=args.level)
+            jobs[job] = source
+        for job in futures.as_completed(jobs):
+            source = jobs[job]
+            try:
+                before, after = job.result()
+            except Exception as e:
+                print("{}: {}".format(source, e), file=sys.stderr)
+                status = 1
+                continue
+            total_before += before
+            total_after += after
+            print("{}: {} -> {} bytes".format(source, before, after))
+    if total_before:
+        print("saved {} of {} bytes ({:.1%})".format(
+              total_before - total_after, total_before,
+              1 - total_after / total_before))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
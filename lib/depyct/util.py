@@ -40,17 +40,219 @@ class readonly_property(object):
         raise TypeError("{} is a read-only value.".format(self.name))
 
 
+class deferred(object):
+    """Wrap a callable producing a value that is only computed when it is
+    first read from a :class:`DeferredDict`.
+
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+
+class DeferredDict(dict):
+    """A dict whose :class:`deferred` values are computed, and replace the
+    placeholder, the first time they are read.
+
+    """
+
+    def _resolve(self, key, value):
+        if isinstance(value, deferred):
+            value = value.func()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._resolve(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return self.__class__(self)
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, dict(self.items()))
+
+
 def initialize_buffer(mode, size, color=None):
     if color is None:
         color = mode.transparent_color
-    initial_value = color * size[0] * size[1]
     if mode._is_float:
         s_code = {32: "f", 64: "d"}[mode.bits_per_component]
     else:
         s_code = {8: "B", 16: "H", 32: "L", 64: "Q"}[mode.bits_per_component]
-    struct_format = "{}{}".format(len(initial_value), s_code)
-    initial_value = struct.pack(struct_format, *initial_value)
+    struct_format = "{}{}".format(len(color), s_code)
+    initial_value = struct.pack(struct_format, *color)
+    # repeat the packed pixel in place rather than packing a tuple holding
+    # every component of the image
     if py27:
-        return bytearray(initial_value)
+        buffer = bytearray(initial_value)
     else:
-        return array.array("B", initial_value)
+        buffer = array.array("B", initial_value)
+    buffer *= size[0] * size[1]
+    return buffer
+
+
+def select_samples(row, channels, keep, sample_size=1):
+    """Return the pixels of ``row`` with only the channels in ``keep``."""
+    pixel_size = channels * sample_size
+    kept_size = len(keep) * sample_size
+    out = bytearray(len(row) // pixel_size * kept_size)
+    for j, c in enumerate(keep):
+        for b in range(sample_size):
+            out[j*sample_size+b::kept_size] = row[c*sample_size+b::pixel_size]
+    return out
+
+
+def expand_palette(indices, tables):
+    """Expand a row of palette indices into packed pixels, one translation
+    per channel.
+
+    """
+    n = len(tables)
+    out = bytearray(len(indices) * n)
+    for c, table in enumerate(tables):
+        out[c::n] = indices.translate(table)
+    return out
+
+
+def changed_rectangle(before, after, width, height, bpp):
+    """Return the smallest ``(left, top, right, bottom)`` rectangle holding
+    every pixel that differs between the equally sized image buffers
+    ``before`` and ``after``, or ``None`` if they are the same.
+
+    Unchanged rows are skipped with a single comparison each; the first and
+    last differing bytes of a changed row are found from the bit length and
+    the lowest set bit of the two rows exclusive-ored as integers.
+
+    """
+    line_size = width * bpp
+    top = bottom = None
+    left, right = line_size, 0
+    for y in range(height):
+        start = y * line_size
+        a = before[start:start+line_size]
+        b = after[start:start+line_size]
+        if a == b:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        x = int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+        left = min(left, line_size - (x.bit_length() + 7) // 8)
+        right = max(right, line_size - ((x & -x).bit_length() - 1) // 8)
+    if top is None:
+        return None
+    return left // bpp, top, (right + bpp - 1) // bpp, bottom
+
+
+# for pixels of 1, 2 and 4 bits, one table per pixel of a byte mapping the
+# byte to that pixel's index, most significant bits first
+UNPACK_TABLES = {bits: [bytes(v >> (8 - bits * (k + 1)) & ((1 << bits) - 1)
+                              for v in range(256))
+                        for k in range(8 // bits)]
+                 for bits in (1, 2, 4)}
+
+
+def unpack_samples(data, bits, count=None):
+    """Unpack ``data``, bytes or a bytearray of samples of 1, 2 or 4
+    ``bits`` packed most significant first, into one byte each, keeping the
+    first ``count`` of them when given.
+
+    Each sample position of a byte is filled with one translation and one
+    strided write.
+
+    """
+    tables = UNPACK_TABLES[bits]
+    per_byte = len(tables)
+    out = bytearray(len(data) * per_byte)
+    for k, table in enumerate(tables):
+        out[k::per_byte] = data.translate(table)
+    if count is not None:
+        del out[count:]
+    return out
+
+
+# 1-bit pixels, most significant bit first, expanded to 0 and 255
+_BIT_EXPANSION = [bytes(255 if b & (0x80 >> i) else 0 for i in range(8))
+                  for b in range(256)]
+BIT_REVERSE = bytes(int("{:08b}".format(b)[::-1], 2) for b in range(256))
+
+
+def unpack_bits(data, width, height, lsb_first=False):
+    """Expand ``height`` rows of 1-bit pixels, each row padded to a whole
+    number of bytes, to one byte per pixel: 255 for set bits, 0 for clear.
+
+    Each byte is expanded through a 256 entry table; ``lsb_first`` rasters
+    have their bits reversed with a single ``translate`` first.
+
+    """
+    data = bytes(data)
+    if lsb_first:
+        data = data.translate(BIT_REVERSE)
+    expanded = b"".join(map(_BIT_EXPANSION.__getitem__, data))
+    stride = (width + 7) // 8 * 8
+    if stride != width:
+        view = memoryview(expanded)
+        expanded = b"".join(view[y*stride:y*stride + width]
+                            for y in range(height))
+    return expanded
+
+
+def threshold_tables(background):
+    """Lookup tables for :func:`threshold_row`, one per channel, mapping a
+    sample to 0 if it is that channel's sample of ``background``, else 1.
+
+    """
+    return [bytes(int(v != c) for v in range(256)) for c in background]
+
+
+def threshold_row(row, tables):
+    """Return one byte per pixel of ``row``, a row of 8-bit pixels, 0 where
+    the pixel is the background color of ``tables`` and 1 elsewhere.
+
+    """
+    row = bytes(row)
+    channels = len(tables)
+    bits = 0
+    for c, table in enumerate(tables):
+        bits |= int.from_bytes(row[c::channels].translate(table), "big")
+    return bits.to_bytes(len(row) // channels, "big")
+
+
+def pack_bits(row, lsb_first=False):
+    """Pack ``row``, one byte per pixel each 0 or 1, into 1-bit pixels,
+    padding the last byte with zeros.
+
+    Each bit position is shifted into place across the whole row at once
+    by treating the strided pixels as one big integer.
+
+    """
+    row = bytes(row) + bytes(-len(row) % 8)
+    packed = 0
+    for k in range(8):
+        shift = k if lsb_first else 7 - k
+        packed |= int.from_bytes(row[k::8], "big") << shift
+    return packed.to_bytes(len(row) // 8, "big")
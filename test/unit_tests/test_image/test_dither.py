@@ -0,0 +1,149 @@
+# test/unit_tests/test_image/test_dither.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+import array
+
+from depyct import testing
+from depyct.image import Image
+from depyct.image import dither
+from depyct.image.mode import L, L16, RGB, RGBA
+
+
+def ramp(width=64, height=32):
+    im = Image(L, size=(width, height))
+    im.buffer[:] = bytes(x * 255 // (width - 1) for y in range(height)
+                         for x in range(width))
+    return im
+
+
+def column_means(im, columns):
+    width, height = im.size
+    data = bytes(im.buffer)
+    step = width // columns
+    return [sum(data[y*width+x] for y in range(height)
+                for x in range(c, c + step)) / (step * height)
+            for c in range(0, width, step)]
+
+
+class DitherLevelsTest(testing.DepyctUnitTest):
+
+    def test_bayer_matrix(self):
+        self.assertEqual(sorted(v for row in dither.BAYER for v in row),
+                         list(range(64)))
+        self.assertEqual(dither.BAYER[0][:2], [0, 32])
+
+    def test_bilevel_keeps_tone(self):
+        im = ramp()
+        expected = column_means(im, 4)
+        # Atkinson drops a quarter of the error and loses the extremes
+        for method in ("floyd-steinberg", "sierra", "sierra-2",
+                       "sierra-lite", "bayer"):
+            result = im.dither(1, method)
+            self.assertEqual(set(result.buffer), {0, 255})
+            for got, wanted in zip(column_means(result, 4), expected):
+                self.assertAlmostEqual(got, wanted, delta=12)
+
+    def test_atkinson(self):
+        result = ramp().dither(1, "atkinson")
+        self.assertEqual(set(result.buffer), {0, 255})
+        means = column_means(result, 4)
+        self.assertEqual(means, sorted(means))
+
+    def test_levels(self):
+        result = ramp().dither(2)
+        self.assertEqual(set(result.buffer), {0, 85, 170, 255})
+
+    def test_exact_levels_are_kept(self):
+        im = Image(L, size=(8, 8))
+        im.buffer[:] = bytes([0, 85, 170, 255] * 16)
+        for method in dither.METHODS:
+            self.assertEqual(bytes(im.dither(2, method).buffer),
+                             bytes(im.buffer))
+
+    def test_bayer_half_gray(self):
+        im = Image(L, size=(8, 8), color=(128,))
+        result = im.dither(1, "bayer")
+        self.assertEqual(bytes(result.buffer).count(255), 32)
+
+    def test_alpha_is_kept(self):
+        im = Image(RGBA, size=(4, 4))
+        im.buffer[:] = bytes([100, 150, 200, 77] * 16)
+        result = im.dither(1)
+        self.assertEqual(result.mode, RGBA)
+        self.assertEqual(bytes(result.buffer[3::4]), bytes([77] * 16))
+        self.assertEqual(set(result.buffer[0::4]) | set(result.buffer[1::4]),
+                         {0, 255})
+
+
+class DitherPaletteTest(testing.DepyctUnitTest):
+
+    palette = [(0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 0, 255)]
+
+    def test_palette(self):
+        im = Image(RGB, size=(16, 16))
+        im.buffer[:] = bytes([128, 0, 128] * 256)
+        result = im.dither(self.palette)
+        self.assertEqual(result.mode, L)
+        self.assertEqual(result.info["palette"], self.palette)
+        # purple comes out as red and blue in equal parts
+        self.assertEqual(bytes(result.buffer).count(2), 128)
+        self.assertEqual(bytes(result.buffer).count(3), 128)
+
+    def test_ordered_palette(self):
+        im = Image(RGB, size=(16, 16))
+        im.buffer[:] = bytes([128, 0, 128] * 256)
+        result = im.dither(self.palette, "bayer")
+        self.assertLessEqual(set(result.buffer), {0, 1, 2, 3})
+        self.assertEqual(len(set(result.buffer)), 3)
+
+    def test_gray_to_palette(self):
+        result = ramp().dither(self.palette)
+        self.assertEqual(set(result.buffer), {0, 1})
+
+    def test_invalid_arguments(self):
+        im = ramp(8, 8)
+        with self.assertRaises(ValueError):
+            im.dither(0)
+        with self.assertRaises(ValueError):
+            im.dither(8)
+        with self.assertRaises(ValueError):
+            im.dither(1, "random")
+        with self.assertRaises(ValueError):
+            im.dither([])
+        with self.assertRaises(ValueError):
+            Image(L16, size=(2, 2)).dither()
+        with self.assertRaises(ValueError):
+            Image(RGBA, size=(2, 2)).dither(self.palette)
+
+
+class BilevelRowsTest(testing.DepyctUnitTest):
+
+    def fail(self, message):
+        raise ValueError(message)
+
+    def rows(self, im, clip=None, method=None):
+        return list(dither.bilevel_rows(im, clip, method, self.fail))
+
+    def test_threshold(self):
+        im = Image(RGB, size=(3, 2))
+        im.buffer[:] = bytes(3) + b"\x01\x00\x00" + bytes(6) + b"\xff" * 6
+        self.assertEqual(self.rows(im), [b"\x00\x01\x00", b"\x00\x01\x01"])
+
+    def test_clip(self):
+        im = Image(L16, size=(2, 2))
+        im.buffer.cast("H")[:] = array.array("H", [0, 1, 2, 0])
+        self.assertEqual(self.rows(im), [b"\x00\x01", b"\x01\x00"])
+        self.assertEqual(self.rows(im, clip=lambda p, im: p.value[0] > 1),
+                         [b"\x00\x00", b"\x01\x00"])
+
+    def test_dithered(self):
+        rows = self.rows(ramp(16, 4), method="bayer")
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row[0] for row in rows], [1] * 4)
+        self.assertEqual([row[-1] for row in rows], [0] * 4)
+        with self.assertRaises(ValueError):
+            self.rows(Image(L16, size=(2, 2)), method="bayer")
+        with self.assertRaises(ValueError):
+            self.rows(ramp(4, 4), method="random")
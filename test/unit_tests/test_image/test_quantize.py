@@ -0,0 +1,140 @@
+# test/unit_tests/test_image/test_quantize.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+from collections import Counter
+import random
+
+from depyct import testing
+from depyct.image import Image
+from depyct.image import quantize
+from depyct.image.mode import L, RGB, RGBA
+
+
+def gradient(width=64, height=48, seed=43):
+    rng = random.Random(seed)
+    data = bytearray()
+    for y in range(height):
+        for x in range(width):
+            data += bytes((x * 4 + rng.randrange(4), y * 5 + rng.randrange(4),
+                           (x + y) * 2))
+    im = Image(RGB, size=(width, height))
+    im.buffer[:] = data
+    return im
+
+
+def squared_error(im, result):
+    palette = result.info["palette"]
+    data = bytes(im.buffer)
+    return sum((palette[i][c] - data[3*k+c]) ** 2
+               for k, i in enumerate(result.buffer) for c in range(3))
+
+
+class PackColorsTest(testing.DepyctUnitTest):
+
+    def test_rgb(self):
+        packed = quantize.pack_colors(b"\x01\x02\x03\xff\x00\x80", 3)
+        self.assertEqual(list(packed), [0x010203, 0xff0080])
+
+    def test_rgba(self):
+        packed = quantize.pack_colors(b"\x01\x02\x03\x80\x01\x02\x03\x7f", 4)
+        self.assertEqual(list(packed),
+                         [0x010203, 0x010203 + quantize.TRANSPARENT])
+
+
+class PaletteTest(testing.DepyctUnitTest):
+
+    def histogram(self):
+        return Counter(quantize.pack_colors(gradient().buffer, 3))
+
+    def test_median_cut(self):
+        palette = quantize.median_cut(self.histogram(), 16)
+        self.assertEqual(len(palette), 16)
+        self.assertEqual(len(set(palette)), 16)
+
+    def test_octree(self):
+        palette = quantize.octree(self.histogram(), 16)
+        self.assertLessEqual(len(palette), 16)
+        self.assertGreater(len(palette), 8)
+
+    def test_octree_merges_similar_colors(self):
+        histogram = Counter({0x000000: 5, 0x000001: 5, 0xff0000: 1})
+        self.assertEqual(sorted(quantize.octree(histogram, 2)),
+                         [(0, 0, 1), (255, 0, 0)])
+
+    def test_median_cut_single_color(self):
+        histogram = Counter({0x102030: 10})
+        self.assertEqual(quantize.median_cut(histogram, 4), [(16, 32, 48)])
+
+    def test_nearest_color(self):
+        palette = [(0, 0, 0), (255, 255, 255), (250, 10, 10), (10, 10, 250)]
+        lookup = quantize.nearest_color(palette)
+        self.assertEqual([lookup(c) for c in (0x050505, 0xf0f0f0, 0xff0000,
+                                              0x0000ff, 0x404040)],
+                         [0, 1, 2, 3, 0])
+
+    def test_nearest_color_matches_search(self):
+        rng = random.Random(43)
+        palette = [tuple(rng.randrange(256) for _ in range(3))
+                   for _ in range(64)]
+        lookup = quantize.nearest_color(palette)
+        for _ in range(200):
+            color = rng.randrange(1 << 24)
+            # the lookup works on the middle of the color's 5:6:5 cell
+            r = (color >> 16 & 0xf8) | 4
+            g = (color >> 8 & 0xfc) | 2
+            b = (color & 0xf8) | 4
+            distance = lambda p: (p[0]-r) ** 2 + (p[1]-g) ** 2 + (p[2]-b) ** 2
+            self.assertEqual(distance(palette[lookup(color)]),
+                             min(map(distance, palette)))
+
+
+class ImageQuantizeTest(testing.DepyctUnitTest):
+
+    def test_quantize(self):
+        im = gradient()
+        for method in ("mediancut", "octree"):
+            result = im.quantize(32, method)
+            self.assertEqual(result.mode, L)
+            self.assertEqual(result.size, im.size)
+            self.assertLessEqual(len(result.info["palette"]), 32)
+            self.assertLessEqual(max(result.buffer),
+                                 len(result.info["palette"]) - 1)
+            # no worse on average than 16 levels per channel
+            self.assertLess(squared_error(im, result), 3 * 16 ** 2 * 64 * 48)
+
+    def test_more_colors_less_error(self):
+        im = gradient()
+        for method in ("mediancut", "octree"):
+            self.assertLess(squared_error(im, im.quantize(64, method)),
+                            squared_error(im, im.quantize(8, method)))
+
+    def test_few_colors_are_exact(self):
+        im = Image(RGB, size=(3, 1))
+        im.buffer[:] = b"\xff\x00\x00\x00\x00\xff\xff\x00\x00"
+        result = im.quantize(2)
+        palette = result.info["palette"]
+        self.assertEqual([palette[i] for i in result.buffer],
+                         [(255, 0, 0), (0, 0, 255), (255, 0, 0)])
+
+    def test_transparency(self):
+        im = Image(RGBA, size=(3, 1))
+        im.buffer[:] = b"\xff\x00\x00\xff\x00\x00\xff\x00\xff\x00\x00\xff"
+        result = im.quantize(2)
+        transparent = result.info["transparency"]
+        self.assertEqual(len(result.info["palette"]), 2)
+        self.assertEqual(result.buffer[1], transparent)
+        self.assertEqual(result.info["palette"][result.buffer[0]],
+                         (255, 0, 0))
+
+    def test_invalid_arguments(self):
+        im = gradient(4, 4)
+        with self.assertRaises(ValueError):
+            im.quantize(0)
+        with self.assertRaises(ValueError):
+            im.quantize(257)
+        with self.assertRaises(ValueError):
+            im.quantize(16, "popularity")
+        with self.assertRaises(ValueError):
+            Image(L, size=(2, 2)).quantize()
@@ -3,3 +3,285 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import struct
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import bmp
+
+
+def bmp_file(width, height, bits, pixels, palette=b"", compression=0,
+             masks=b"", header_size=40, colors=0):
+    """Build a BMP file with an info header of ``header_size`` bytes."""
+    if header_size == 12:
+        dib = struct.pack("<IHHHH", 12, width, height, 1, bits)
+    else:
+        dib = struct.pack("<IiiHHIIiiII", header_size, width, height, 1,
+                          bits, compression, len(pixels), 2835, 2835,
+                          colors, 0)
+        dib = (dib + masks).ljust(header_size, b"\x00")
+        masks = b""
+    offset = 14 + len(dib) + len(masks) + len(palette)
+    return (struct.pack("<2sIHHI", b"BM", offset + len(pixels), 0, 0,
+                        offset) + dib + masks + palette + pixels)
+
+
+class BMPReadTest(testing.DepyctUnitTest):
+
+    def read(self, content, **options):
+        return bmp.BMPFormat(image_lib.Image, **options).open(
+                io.BytesIO(content))
+
+    def test_read_lena(self):
+        im = bmp.BMPFormat(image_lib.Image).open(
+                self.get_data_path("lena.bmp"))
+        self.assertEqual(im.size, (512, 512))
+        self.assertEqual(im.mode, mode.L)
+        with open(self.get_data_path("lena.bmp"), "rb") as fp:
+            data = fp.read()
+        # the last row of the file is the first of the image
+        self.assertEqual(bytes(im.buffer[:512]), data[-512:])
+        self.assertEqual(bytes(im.buffer[-512:]), data[1078:1078+512])
+
+    def test_read_24_bit(self):
+        # two rows of two pixels, padded to eight bytes, bottom row first
+        content = bmp_file(2, 2, 24, b"\x01\x02\x03\x04\x05\x06\x00\x00"
+                                     b"\x07\x08\x09\x0a\x0b\x0c\x00\x00")
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer),
+                         b"\x09\x08\x07\x0c\x0b\x0a\x03\x02\x01\x06\x05\x04")
+        self.assertEqual(im.info["resolution"], (2835, 2835))
+
+    def test_read_top_down(self):
+        content = bmp_file(1, -2, 24, b"\x01\x02\x03\x00\x04\x05\x06\x00")
+        self.assertEqual(bytes(self.read(content).buffer),
+                         b"\x03\x02\x01\x06\x05\x04")
+
+    def test_read_32_bit(self):
+        content = bmp_file(2, 1, 32, b"\x01\x02\x03\xff\x04\x05\x06\xff")
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer), b"\x03\x02\x01\x06\x05\x04")
+
+    def test_read_alpha_bitfields(self):
+        masks = struct.pack("<IIII", 0xff, 0xff00, 0xff0000, 0xff000000)
+        pixels = b"\x01\x02\x03\x80\x04\x05\x06\x00"
+        for header_size in (56, 108, 124):
+            im = self.read(bmp_file(2, 1, 32, pixels, compression=3,
+                                    masks=masks, header_size=header_size))
+            self.assertEqual(im.mode, mode.RGBA)
+            self.assertEqual(bytes(im.buffer), pixels)
+
+    def test_read_16_bit(self):
+        # 5-5-5 by default: pure red, pure green and white
+        content = bmp_file(3, 1, 16, struct.pack("<HHHH", 0x7c00, 0x03e0,
+                                                 0x7fff, 0))
+        self.assertEqual(bytes(self.read(content).buffer),
+                         b"\xff\x00\x00\x00\xff\x00\xff\xff\xff")
+
+    def test_read_16_bit_bitfields(self):
+        masks = struct.pack("<III", 0xf800, 0x07e0, 0x001f)
+        content = bmp_file(2, 1, 16, struct.pack("<HH", 0x07e0, 0x0841),
+                           compression=3, masks=masks)
+        self.assertEqual(bytes(self.read(content).buffer),
+                         b"\x00\xff\x00\x08\x08\x08")
+
+    def test_read_empty_mask(self):
+        # no green bits at all, with and without alpha
+        masks = struct.pack("<III", 0xff0000, 0, 0xff)
+        im = self.read(bmp_file(1, 1, 32, b"\x01\x02\x03\x04",
+                                compression=3, masks=masks))
+        self.assertEqual(bytes(im.buffer), b"\x03\x00\x01")
+        masks += struct.pack("<I", 0xff000000)
+        im = self.read(bmp_file(1, 1, 32, b"\x01\x02\x03\x04",
+                                compression=6, masks=masks))
+        self.assertEqual(bytes(im.buffer), b"\x03\x00\x01\x04")
+
+    def test_read_1_bit(self):
+        palette = b"\x00\x00\x00\x00\xff\xff\xff\x00"
+        content = bmp_file(10, 2, 1, b"\x80\x40\x00\x00\xff\xc0\x00\x00",
+                           palette)
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer),
+                         b"\xff" * 10 + b"\xff" + b"\x00" * 8 + b"\xff")
+
+    def test_read_4_bit_palette(self):
+        palette = b"\xff\x00\x00\x00\x00\xff\x00\x00\x00\x00\xff\x00"
+        content = bmp_file(3, 1, 4, b"\x12\x00\x00\x00", palette, colors=3)
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer),
+                         b"\x00\xff\x00\xff\x00\x00\x00\x00\xff")
+        im = self.read(content, indexed=True)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer), b"\x01\x02\x00")
+        self.assertEqual(im.info["palette"],
+                         [(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+
+    def test_read_core_header(self):
+        palette = b"\x00\x00\x00\x00\x00\xff"
+        content = bmp_file(2, 1, 8, b"\x01\x00\x00\x00", palette,
+                           header_size=12)
+        im = self.read(content)
+        self.assertEqual(bytes(im.buffer), b"\xff\x00\x00\x00\x00\x00")
+
+    def test_read_rle8(self):
+        palette = bytes(b for v in range(256) for b in (v, v, v, 0))
+        # a run, an absolute run padded to a word, the end of the line, a
+        # delta, a run cut off by the edge and the end of the bitmap
+        data = (b"\x02\x07\x00\x03\x01\x02\x03\x00\x00\x00"
+                b"\x00\x02\x01\x01\x04\x09\x00\x01")
+        im = self.read(bmp_file(5, 3, 8, data, palette, compression=1))
+        self.assertEqual(bytes(im.buffer),
+                         b"\x00\x09\x09\x09\x09" + bytes(5) +
+                         b"\x07\x07\x01\x02\x03")
+
+    def test_read_rle4(self):
+        palette = bytes(b for v in range(16) for b in (v, v, v, 0))
+        data = b"\x03\x12\x00\x03\x34\x50\x00\x00\x00\x01"
+        im = self.read(bmp_file(6, 1, 4, data, palette, compression=2))
+        self.assertEqual(bytes(im.buffer), b"\x01\x02\x01\x03\x04\x05")
+
+    def test_bad_files(self):
+        with self.assertRaises(IOError):
+            self.read(b"GIF89a" + bytes(40))
+        with self.assertRaises(IOError):
+            self.read(bmp_file(4, 4, 24, bytes(40)))
+        with self.assertRaises(IOError):
+            self.read(bmp_file(1, 1, 24, bytes(4), compression=4))
+        with self.assertRaises(IOError):
+            self.read(bmp_file(1, -1, 8, bytes(4), bytes(1024),
+                               compression=1))
+        # the image size promises more RLE data than there is
+        with self.assertRaisesRegex(IOError, "truncated"):
+            self.read(bmp_file(4, 1, 8, b"\x04\x01\x00\x01",
+                               bytes(1024), compression=1)[:-1])
+        with self.assertRaisesRegex(IOError, "RLE4 .* 4-bit"):
+            self.read(bmp_file(2, 1, 8, b"\x02\x11\x00\x01",
+                               bytes(1024), compression=2))
+
+
+class BMPWriteTest(testing.DepyctUnitTest):
+
+    def round_trip(self, im, read_options={}, **options):
+        fp = io.BytesIO()
+        bmp.BMPFormat(image_lib.Image, **options).save(im, fp)
+        data = fp.getvalue()
+        self.assertEqual(struct.unpack_from("<I", data, 2)[0], len(data))
+        fp.seek(0)
+        return data, bmp.BMPFormat(image_lib.Image, **read_options).open(fp)
+
+    def image(self, im_mode, width, height, data):
+        im = image_lib.Image(im_mode, size=(width, height))
+        im.buffer[:] = data
+        return im
+
+    def test_write_rgb(self):
+        im = self.image(mode.RGB, 3, 2, bytes(range(18)))
+        data, result = self.round_trip(im)
+        # rows of nine bytes padded to twelve, bottom row first
+        self.assertEqual(data[54:], b"\x0b\x0a\x09\x0e\x0d\x0c\x11\x10\x0f"
+                                    b"\x00\x00\x00"
+                                    b"\x02\x01\x00\x05\x04\x03\x08\x07\x06"
+                                    b"\x00\x00\x00")
+        self.assertEqual(result.mode, mode.RGB)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+
+    def test_write_in_bands(self):
+        im = self.image(mode.RGB, 5, 7, bytes(range(105)))
+        fmt = bmp.BMPFormat(image_lib.Image)
+        fmt.band_size = 40
+        fp = io.BytesIO()
+        fmt.save(im, fp)
+        self.assertEqual(fp.getvalue(), self.round_trip(im)[0])
+
+    def test_write_rgba(self):
+        im = self.image(mode.RGBA, 2, 2, bytes(range(16)))
+        data, result = self.round_trip(im)
+        self.assertEqual(result.mode, mode.RGBA)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+
+    def test_write_lena(self):
+        im = bmp.BMPFormat(image_lib.Image).open(
+                self.get_data_path("lena.bmp"))
+        data, result = self.round_trip(im)
+        with open(self.get_data_path("lena.bmp"), "rb") as fp:
+            self.assertEqual(data[54:], fp.read()[54:])
+        data, result = self.round_trip(im, rle=True)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+
+    def test_write_palette(self):
+        im = self.image(mode.RGB, 4, 1, b"\xff\x00\x00\x00\x00\xff"
+                                        b"\xff\x00\x00\x00\xff\x00")
+        data, result = self.round_trip(im, palette=True)
+        self.assertEqual(struct.unpack_from("<H", data, 28)[0], 8)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+        data, result = self.round_trip(im, {"indexed": True}, palette=True)
+        self.assertEqual(result.info["palette"],
+                         [(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+        self.assertEqual(bytes(result.buffer), b"\x02\x00\x02\x01")
+        # too many colors for a palette
+        im = self.image(mode.RGB, 300, 1, bytes(
+                b for v in range(300) for b in (v >> 8, v & 0xff, 0)))
+        data, result = self.round_trip(im, palette=True)
+        self.assertEqual(struct.unpack_from("<H", data, 28)[0], 24)
+
+    def test_write_indexed_rle8(self):
+        im = self.image(mode.L, 300, 2, b"\x05" * 260 + bytes(range(40)) +
+                        b"\x01\x02" + b"\x03" * 298)
+        im.info["palette"] = [(v, 0, 0) for v in range(64)]
+        data, result = self.round_trip(im, {"indexed": True}, rle=True)
+        self.assertEqual(struct.unpack_from("<I", data, 30)[0], 1)
+        self.assertLess(len(data), 54 + 256 + 100)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+        self.assertEqual(result.info["palette"], im.info["palette"])
+
+    def test_write_unsupported_mode(self):
+        with self.assertRaises(IOError):
+            self.round_trip(image_lib.Image(mode.LA, size=(1, 1)))
+
+
+class BMPCheckTest(testing.DepyctUnitTest):
+
+    def check(self, content, full=False):
+        return bmp.BMPFormat(image_lib.Image).verify(io.BytesIO(content),
+                                                     full)
+
+    def test_intact(self):
+        from depyct import io as depyct_io
+        self.assertEqual(depyct_io.verify(self.get_data_path("lena.bmp")),
+                         [])
+        rle = bmp_file(4, 2, 8, b"\x04\x01\x00\x00\x02\x05\x00\x01",
+                       palette=bytes(1024), compression=1)
+        self.assertEqual(self.check(rle, full=True), [])
+
+    def test_bad_headers(self):
+        self.assertEqual(self.check(b"PK\x03\x04"), [(0, "Not a BMP file.")])
+        content = bmp_file(2, 1, 24, bytes(8))
+        self.assertEqual(len(self.check(content[:20])), 1)
+        problems = self.check(bmp_file(2, 1, 3, bytes(8)))
+        self.assertIn("bit depth", problems[0][1])
+        problems = self.check(bmp_file(2, 1, 24, bytes(8), compression=1))
+        self.assertEqual(problems[0],
+                         (14, "RLE8 compression needs 8-bit pixels."))
+
+    def test_truncated(self):
+        content = bmp_file(2, 2, 24, bytes(16))
+        self.assertEqual(self.check(content[:-1]),
+                         [(54, "Image data is truncated.")])
+
+    def test_rle_walked_when_full(self):
+        # a run past the end of the row and no end of bitmap marker
+        content = bmp_file(4, 2, 8, b"\x06\x01\x00\x00",
+                           palette=bytes(1024), compression=1)
+        self.assertEqual(self.check(content), [])
+        problems = self.check(content, full=True)
+        self.assertEqual(problems, [(1078, "RLE data runs outside the "
+                                           "image.")])
+        content = bmp_file(4, 2, 8, b"\x04\x01\x00\x00",
+                           palette=bytes(1024), compression=1)
+        self.assertIn("end of bitmap", self.check(content, full=True)[0][1])
@@ -3,3 +3,105 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import os
+import struct
+import tempfile
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import dcx
+
+
+class CountingBytesIO(io.BytesIO):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class DCXTest(testing.DepyctUnitTest):
+
+    def page(self, value, width=40, height=3):
+        im = image_lib.Image(mode.L, size=(width, height))
+        im.buffer[:] = bytes(((x + value) % 2) * 255 for y in range(height)
+                             for x in range(width))
+        return im
+
+    def write(self, count):
+        pages = [self.page(i, width=40 + i) for i in range(count)]
+        fp = io.BytesIO()
+        dcx.DCXFormat(image_lib.Image, pages=pages[1:]).save(pages[0], fp)
+        return pages, fp.getvalue()
+
+    def test_write(self):
+        pages, data = self.write(3)
+        table = struct.unpack_from("<5I", data)
+        self.assertEqual(table[0], dcx.DCX_MAGIC)
+        self.assertEqual(table[1], 4100)
+        self.assertEqual(table[4], 0)
+        for offset in table[1:4]:
+            self.assertEqual(data[offset], 0x0a)
+
+    def test_read_first_page(self):
+        pages, data = self.write(3)
+        im = dcx.DCXFormat(image_lib.Image).open(io.BytesIO(data))
+        self.assertEqual(im.size, (40, 3))
+        self.assertEqual(bytes(im.buffer), bytes(pages[0].buffer))
+        self.assertEqual(im.info["pages"], 3)
+
+    def test_pages(self):
+        pages, data = self.write(5)
+        fmt = dcx.DCXFormat(image_lib.Image)
+        fmt.open(io.BytesIO(data))
+        sequence = fmt.pages()
+        self.assertEqual(len(sequence), 5)
+        for i in (3, 0, -1, 2):
+            self.assertEqual(bytes(sequence[i].buffer),
+                             bytes(pages[i].buffer))
+        self.assertEqual([im.size for im in sequence[1:5:2]],
+                         [(41, 3), (43, 3)])
+        self.assertEqual(len(list(sequence)), 5)
+        with self.assertRaises(IndexError):
+            sequence[5]
+
+    def test_pages_read_lazily(self):
+        pages, data = self.write(4)
+        table = struct.unpack_from("<5I", data)
+        # a broken second page only matters when it is asked for
+        data = data[:table[2]] + b"\x00" + data[table[2] + 1:]
+        fp = CountingBytesIO(data)
+        fmt = dcx.DCXFormat(image_lib.Image)
+        fmt.open(fp)
+        sequence = fmt.pages()
+        fp.bytes_read = 0
+        im = sequence[2]
+        self.assertEqual(bytes(im.buffer), bytes(pages[2].buffer))
+        self.assertEqual(fp.bytes_read, table[4] - table[3])
+        with self.assertRaises(IOError):
+            sequence[1]
+
+    def test_pages_by_filename(self):
+        pages, data = self.write(3)
+        fd, path = tempfile.mkstemp(suffix=".dcx")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            fmt = dcx.DCXFormat(image_lib.Image)
+            fmt.open(path)
+            self.assertEqual(bytes(fmt.pages()[2].buffer),
+                             bytes(pages[2].buffer))
+        finally:
+            os.remove(path)
+
+    def test_bad_files(self):
+        for content in (b"", b"\x00" * 8, struct.pack("<II",
+                                                        dcx.DCX_MAGIC, 0)):
+            with self.assertRaises(IOError):
+                dcx.DCXFormat(image_lib.Image).open(io.BytesIO(content))
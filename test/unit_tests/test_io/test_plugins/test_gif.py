@@ -3,3 +3,434 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import random
+import struct
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import gif
+
+
+def make_gif(width=2, height=2, image=(0, 0, 2, 2), local_table=False,
+             data=b"\x02\x4c\x01"):
+    content = b"GIF89a" + struct.pack("<HHBBB", width, height, 0x80, 0, 0)
+    content += b"\x00\x00\x00\xff\xff\xff"
+    content += b"\x21\xf9\x04\x00\x00\x00\x00\x00"
+    content += b"\x2c" + struct.pack("<HHHHB", *image + (
+                                     0x80 if local_table else 0,))
+    if local_table:
+        content += b"\x00\x00\x00\xff\xff\xff"
+    content += b"\x02" + bytes((len(data),)) + data + b"\x00"
+    return content + b"\x3b"
+
+
+def lzw_encode(indices, min_code_size):
+    """A plain dictionary based LZW encoder to check the decoder against."""
+    clear = 1 << min_code_size
+    table = {bytes((i,)): i for i in range(clear)}
+    next_code = clear + 2
+    code_size = min_code_size + 1
+    codes = [(clear, code_size)]
+    w = b""
+    for i in indices:
+        wc = w + bytes((i,))
+        if wc in table:
+            w = wc
+            continue
+        codes.append((table[w], code_size))
+        if next_code < 4096:
+            table[wc] = next_code
+            next_code += 1
+            if next_code > 1 << code_size and code_size < 12:
+                code_size += 1
+        w = bytes((i,))
+    codes.append((table[w], code_size))
+    codes.append((clear + 1, code_size))
+    acc = bits = 0
+    out = bytearray()
+    for code, size in codes:
+        acc |= code << bits
+        bits += size
+        while bits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            bits -= 8
+    if bits:
+        out.append(acc)
+    return bytes(out)
+
+
+def sub_blocks(data):
+    return b"".join(bytes((len(data[i:i+255]),)) + data[i:i+255]
+                    for i in range(0, len(data), 255)) + b"\x00"
+
+
+def image_block(indices, width, height, x=0, y=0, local_table=None,
+                interlaced=False, transparent=None, disposal=0, delay=0,
+                min_code_size=2, data=None):
+    block = b""
+    if transparent is not None or disposal or delay:
+        packed = disposal << 2 | (transparent is not None)
+        block += b"\x21\xf9\x04" + struct.pack("<BHBB", packed, delay,
+                                                transparent or 0, 0)
+    packed = 0x40 if interlaced else 0
+    if local_table is not None:
+        packed |= 0x80 | (len(local_table) // 3).bit_length() - 2
+    block += b"\x2c" + struct.pack("<HHHHB", x, y, width, height, packed)
+    if local_table is not None:
+        block += local_table
+    if interlaced:
+        rows = [indices[r*width:(r+1)*width] for r in range(height)]
+        indices = b"".join(rows[r] for r in gif.interlaced_rows(height))
+    if data is None:
+        data = lzw_encode(indices, min_code_size)
+    return block + bytes((min_code_size,)) + sub_blocks(data)
+
+
+def gif_file(width, height, palette, blocks, background=0):
+    size = (len(palette) // 3).bit_length() - 2
+    return (b"GIF89a" +
+            struct.pack("<HHBBB", width, height, 0x80 | size, background, 0) +
+            palette + b"".join(blocks) + b"\x3b")
+
+
+# white, red, blue and black
+PALETTE = b"\xff\xff\xff\xff\x00\x00\x00\x00\xff\x00\x00\x00"
+
+
+class LZWDecodeTest(testing.DepyctUnitTest):
+
+    def test_sample(self):
+        # the 10x10 sample image of the GIF89a walkthroughs
+        data = bytes.fromhex("8C2D99872A1CDC33A00275EC95FAA8DE608C04914C01")
+        rows = [b"\x01" * 5 + b"\x02" * 5] * 3 + \
+               [b"\x01" * 3 + b"\x00" * 4 + b"\x02" * 3] * 2 + \
+               [b"\x02" * 3 + b"\x00" * 4 + b"\x01" * 3] * 2 + \
+               [b"\x02" * 5 + b"\x01" * 5] * 3
+        self.assertEqual(gif.lzw_decode(data, 2, 100), b"".join(rows))
+
+    def test_round_trip(self):
+        rng = random.Random(41)
+        for min_code_size in (2, 3, 5, 8):
+            for size in (1, 100, 30000):
+                indices = bytes(rng.randrange(1 << min_code_size)
+                                if rng.random() < 0.3 else 0
+                                for _ in range(size))
+                data = lzw_encode(indices, min_code_size)
+                self.assertEqual(gif.lzw_decode(data, min_code_size, size),
+                                 indices)
+
+    def test_short_data(self):
+        data = lzw_encode(b"\x01\x02\x03\x00", 2)
+        # only the first code fits in one byte, the rest stays zero
+        self.assertEqual(gif.lzw_decode(data[:1], 2, 4), b"\x01\x00\x00\x00")
+
+    def test_invalid_code(self):
+        # a clear code followed by code 7 with nothing to extend
+        with self.assertRaises(ValueError):
+            gif.lzw_decode(bytes((0x3c,)), 2, 4)
+
+
+class GIFReadTest(testing.DepyctUnitTest):
+
+    def read(self, content):
+        return gif.GIFFormat(image_lib.Image).open(io.BytesIO(content))
+
+    def test_read(self):
+        indices = bytes((0, 1, 2, 3, 3, 2))
+        im = self.read(gif_file(3, 2, PALETTE, [image_block(indices, 3, 2)]))
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer), b"".join(
+                         PALETTE[3*i:3*i+3] for i in indices))
+
+    def test_interlaced(self):
+        indices = bytes(y % 4 for y in range(11) for x in range(2))
+        im = self.read(gif_file(2, 11, PALETTE, [
+                image_block(indices, 2, 11, interlaced=True)]))
+        self.assertEqual(bytes(im.buffer), b"".join(
+                         PALETTE[3*i:3*i+3] for i in indices))
+
+    def test_local_color_table(self):
+        local = b"\x01\x02\x03\x04\x05\x06"
+        im = self.read(gif_file(2, 1, PALETTE, [
+                image_block(b"\x01\x00", 2, 1, local_table=local)]))
+        self.assertEqual(bytes(im.buffer), b"\x04\x05\x06\x01\x02\x03")
+
+    def test_transparency(self):
+        im = self.read(gif_file(3, 1, PALETTE, [
+                image_block(b"\x01\x03\x02", 3, 1, transparent=3)]))
+        self.assertEqual(im.mode, mode.RGBA)
+        self.assertEqual(bytes(im.buffer),
+                         b"\xff\x00\x00\xff" + bytes(4) + b"\x00\x00\xff\xff")
+        self.assertEqual(im.info["transparency"], 3)
+
+    def test_frame_smaller_than_screen(self):
+        im = self.read(gif_file(3, 2, PALETTE, [
+                image_block(b"\x01", 1, 1, x=1, y=1)], background=2))
+        blue, red = b"\x00\x00\xff", b"\xff\x00\x00"
+        self.assertEqual(bytes(im.buffer), blue * 4 + red + blue)
+
+    def test_info(self):
+        loop = b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x05\x00\x00"
+        comment = b"\x21\xfe\x05hello\x00"
+        im = self.read(gif_file(1, 1, PALETTE, [
+                loop, comment, image_block(b"\x00", 1, 1, delay=7)]))
+        self.assertEqual(im.info["loop"], 5)
+        self.assertEqual(im.info["comment"], b"hello")
+        self.assertEqual(im.info["duration"], 70)
+
+    def test_invalid_data(self):
+        with self.assertRaises(IOError):
+            self.read(gif_file(2, 2, PALETTE, [
+                    image_block(b"", 2, 2, data=b"\x3c")]))
+
+
+class GIFFramesTest(testing.DepyctUnitTest):
+
+    def frames(self, content):
+        fmt = gif.GIFFormat(image_lib.Image)
+        fmt.open(io.BytesIO(content))
+        return [(bytes(im.buffer), frame) for im, frame in fmt.frames()]
+
+    def test_disposal(self):
+        white, red, blue, black = [PALETTE[i:i+3] for i in range(0, 12, 3)]
+        content = gif_file(3, 1, PALETTE, [
+                image_block(b"\x00\x00\x00", 3, 1),
+                image_block(b"\x01\x01", 2, 1, disposal=3, delay=5),
+                image_block(b"\x02", 1, 1, x=2, disposal=2),
+                image_block(b"\x03", 1, 1, x=1),
+            ], background=3)
+        frames = self.frames(content)
+        self.assertEqual([data for data, frame in frames], [
+                white * 3,
+                red * 2 + white,
+                white * 2 + blue,
+                white + black + black,
+            ])
+        self.assertEqual(frames[1][1], gif.GIFFrame(0, 0, 2, 1, 5, 3, None))
+
+    def test_transparent_frames(self):
+        content = gif_file(2, 1, PALETTE, [
+                image_block(b"\x01\x02", 2, 1),
+                image_block(b"\x00\x03", 2, 1, transparent=0),
+            ])
+        frames = self.frames(content)
+        self.assertEqual(frames[1][0], b"\xff\x00\x00" + bytes(3))
+
+    def test_lazy(self):
+        content = gif_file(1, 1, PALETTE, [
+                image_block(b"\x01", 1, 1),
+                image_block(b"", 1, 1, data=b"\x3c"),
+            ])
+        fmt = gif.GIFFormat(image_lib.Image)
+        im = fmt.open(io.BytesIO(content))
+        self.assertEqual(bytes(im.buffer), b"\xff\x00\x00")
+        frames = fmt.frames()
+        next(frames)
+        with self.assertRaises(IOError):
+            next(frames)
+
+
+class LZWEncodeTest(testing.DepyctUnitTest):
+
+    def test_round_trip(self):
+        rng = random.Random(42)
+        for min_code_size in (2, 4, 8):
+            for size in (0, 1, 2, 7, 1000, 50000):
+                indices = bytes(rng.randrange(1 << min_code_size)
+                                if rng.random() < 0.2 else i // 9 % 3
+                                for i in range(size))
+                data = gif.lzw_encode(indices, min_code_size)
+                self.assertEqual(gif.lzw_decode(data, min_code_size, size),
+                                 indices)
+
+    def test_full_table(self):
+        # noise fills the string table and stops compressing, which must
+        # be followed by a clear code
+        rng = random.Random(42)
+        indices = bytes(rng.randrange(256) for _ in range(100000))
+        data = gif.lzw_encode(indices, 8)
+        self.assertEqual(gif.lzw_decode(data, 8, len(indices)), indices)
+
+    def test_compresses_runs(self):
+        data = gif.lzw_encode(bytes(100000), 2)
+        self.assertLess(len(data), 1000)
+
+
+class GIFWriteTest(testing.DepyctUnitTest):
+
+    def make_image(self, im_mode, data, width):
+        im = image_lib.Image(im_mode, size=(width, len(data) //
+                                            im_mode.bytes_per_pixel // width))
+        im.buffer[:] = data
+        return im
+
+    def save(self, im, **options):
+        output = io.BytesIO()
+        gif.GIFFormat(image_lib.Image, **options).save(im, output)
+        output.seek(0)
+        return output
+
+    def frames(self, output):
+        fmt = gif.GIFFormat(image_lib.Image)
+        fmt.open(output)
+        return [(bytes(im.buffer), frame) for im, frame in fmt.frames()]
+
+    def test_round_trip(self):
+        data = PALETTE[3:] * 5 + PALETTE * 3
+        im = self.make_image(mode.RGB, data, 9)
+        output = self.save(im)
+        self.assertEqual(output.getvalue()[:6], b"GIF89a")
+        self.assertEqual(self.check(output), [])
+        result = gif.GIFFormat(image_lib.Image).open(output)
+        self.assertEqual(result.mode, mode.RGB)
+        self.assertEqual(bytes(result.buffer), data)
+
+    def test_gray(self):
+        output = self.save(self.make_image(mode.L, b"\x00\x80\xff", 3))
+        result = gif.GIFFormat(image_lib.Image).open(output)
+        self.assertEqual(bytes(result.buffer),
+                         b"\x00\x00\x00\x80\x80\x80\xff\xff\xff")
+
+    def test_transparency(self):
+        data = b"\xff\x00\x00\xff\x10\x20\x30\x7f\x00\x00\xff\xc0"
+        output = self.save(self.make_image(mode.RGBA, data, 3))
+        result = gif.GIFFormat(image_lib.Image).open(output)
+        self.assertEqual(result.mode, mode.RGBA)
+        self.assertEqual(bytes(result.buffer), b"\xff\x00\x00\xff" +
+                         bytes(4) + b"\x00\x00\xff\xff")
+
+    def test_indexed(self):
+        im = self.make_image(mode.L, b"\x00\x02\x01\x02", 4)
+        im.info["palette"] = [(1, 2, 3), (4, 5, 6), (7, 8, 9)]
+        im.info["transparency"] = 1
+        result = gif.GIFFormat(image_lib.Image).open(self.save(im))
+        self.assertEqual(bytes(result.buffer), b"\x01\x02\x03\xff" +
+                         b"\x07\x08\x09\xff" + bytes(4) + b"\x07\x08\x09\xff")
+
+    def test_quantized(self):
+        data = bytes(range(256)) * 6
+        im = self.make_image(mode.RGB, data, 32).quantize(16)
+        result = gif.GIFFormat(image_lib.Image).open(self.save(im))
+        palette = im.info["palette"]
+        self.assertEqual(bytes(result.buffer),
+                         b"".join(bytes(palette[i]) for i in im.buffer))
+
+    def test_too_many_colors(self):
+        im = self.make_image(mode.L, bytes(range(256)) * 2, 16)
+        self.save(im)
+        im = self.make_image(mode.RGB, b"".join(
+                bytes((i & 0xff, i >> 8, 0)) for i in range(257)), 257)
+        with self.assertRaises(IOError):
+            self.save(im)
+
+    def test_unsupported_mode(self):
+        im = image_lib.Image(mode.L16, size=(2, 2))
+        with self.assertRaises(IOError):
+            self.save(im)
+
+    def test_animation(self):
+        rng = random.Random(42)
+        colors = [PALETTE[i:i+3] for i in range(0, 12, 3)]
+        pixels = [rng.choice(colors) for _ in range(30 * 20)]
+        frames = []
+        for changes in ((), ((3, 4), (9, 6)), (), ((29, 19),)):
+            pixels = list(pixels)
+            for x, y in changes:
+                pixels[y*30+x] = colors[(colors.index(pixels[y*30+x]) + 1) %
+                                        4]
+            frames.append(self.make_image(mode.RGB, b"".join(pixels), 30))
+        output = self.save(frames[0], frames=frames[1:],
+                           delay=[100, 200, 300, 400], loop=3)
+        results = self.frames(output)
+        self.assertEqual([data for data, _ in results],
+                         [bytes(frames[i].buffer) for i in (0, 1, 3)])
+        frames = [frame for _, frame in results]
+        self.assertEqual([f.delay for f in frames], [10, 50, 40])
+        self.assertEqual([(f.x, f.y, f.width, f.height) for f in frames],
+                         [(0, 0, 30, 20), (3, 4, 7, 3), (29, 19, 1, 1)])
+        # unchanged pixels are padded with the reserved transparent index
+        self.assertEqual([f.transparent for f in frames], [None, 4, 4])
+        output.seek(0)
+        self.assertEqual(gif.GIFFormat(image_lib.Image).open(output)
+                         .info["loop"], 3)
+
+    def test_disposal(self):
+        red, green = b"\xff\x00\x00\xff", b"\x00\xff\x00\xff"
+        clear = bytes(4)
+        frames = [[red] * 12, [red] * 6 + [clear] * 6,
+                  [clear] * 11 + [green], [green] * 12]
+        frames = [self.make_image(mode.RGBA, b"".join(f), 4) for f in frames]
+        output = self.save(frames[0], frames=frames[1:])
+        results = self.frames(output)
+        self.assertEqual([data for data, _ in results],
+                         [bytes(f.buffer) for f in frames])
+        # only frames followed by pixels turning transparent are cleared
+        self.assertEqual([frame.disposal for _, frame in results],
+                         [gif.DISPOSE_BACKGROUND, gif.DISPOSE_BACKGROUND,
+                          gif.DISPOSE_NONE, gif.DISPOSE_NONE])
+
+    def test_frame_mismatch(self):
+        im = self.make_image(mode.RGB, bytes(12), 2)
+        with self.assertRaises(IOError):
+            self.save(im, frames=[self.make_image(mode.RGB, bytes(12), 4)])
+        with self.assertRaises(IOError):
+            self.save(im, frames=[im], delay=[10])
+
+    def check(self, output):
+        problems = gif.GIFFormat(image_lib.Image).verify(output)
+        output.seek(0)
+        return problems
+
+
+class GIFVerifyTest(testing.DepyctUnitTest):
+
+    def check(self, content):
+        return gif.GIFFormat(image_lib.Image).verify(io.BytesIO(content))
+
+    def test_intact(self):
+        self.assertEqual(self.check(make_gif()), [])
+        self.assertEqual(self.check(make_gif(local_table=True)), [])
+
+    def test_not_a_gif(self):
+        self.assertEqual(self.check(b"\x89PNG\r\n\x1a\n"),
+                         [(0, "Not a GIF file.")])
+
+    def test_truncated(self):
+        content = make_gif()
+        for end in (10, 20, 35, len(content) - 2, len(content) - 1):
+            problems = self.check(content[:end])
+            self.assertEqual(len(problems), 1)
+            self.assertIn("truncated", problems[0][1])
+
+    def test_bad_sub_block_framing(self):
+        content = bytearray(make_gif())
+        # claim a longer sub-block than the file holds
+        content[-6] = 0x20
+        self.assertEqual(self.check(bytes(content)),
+                         [(len(content) - 6, "Data sub-block truncated.")])
+
+    def test_min_code_size(self):
+        palette = bytes(range(6))
+        content = gif_file(2, 2, palette, [image_block(
+                b"\x00\x01\x01\x00", 2, 2, min_code_size=1)])
+        self.assertEqual(self.check(content), [])
+        im = gif.GIFFormat(image_lib.Image).open(io.BytesIO(content))
+        self.assertEqual(im.size, (2, 2))
+        content = gif_file(2, 2, palette, [image_block(
+                b"\x00\x01\x01\x00", 2, 2, min_code_size=0,
+                data=b"\x00")])
+        self.assertIn("code size", self.check(content)[0][1])
+
+    def test_image_outside_screen(self):
+        problems = self.check(make_gif(image=(1, 1, 2, 2)))
+        self.assertEqual(problems, [(27, "Image extends past the logical "
+                                         "screen.")])
+
+    def test_unrecognized_block(self):
+        content = make_gif()
+        problems = self.check(content[:-1] + b"\x99")
+        self.assertEqual(problems, [(len(content) - 1,
+                                     "Unrecognized block b'\\x99'.")])
@@ -3,3 +3,699 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import math
+import random
+import struct
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import jpeg
+
+
+DC_SYMBOLS = list(range(12))
+AC_SYMBOLS = [0x00, 0xf0] + [r << 4 | s for s in range(1, 11)
+                             for r in range(16)] + \
+             [r << 4 for r in range(1, 15)]
+
+
+def huffman_table(symbols, short):
+    """Give the first ``short`` symbols 8-bit codes and the rest 12-bit
+    ones, so that both the peek tables and the slow path are used.
+
+    """
+    counts = [0] * 16
+    counts[7], counts[11] = short, len(symbols) - short
+    codes = {}
+    code = 0
+    for length in range(1, 17):
+        for symbol in symbols[sum(counts[:length-1]):sum(counts[:length])]:
+            codes[symbol] = (code, length)
+            code += 1
+        code <<= 1
+    return bytes(counts) + bytes(symbols), codes
+
+
+DC_TABLE, DC_CODES = huffman_table(DC_SYMBOLS, 6)
+AC_TABLE, AC_CODES = huffman_table(AC_SYMBOLS, 60)
+
+
+class BitWriter(object):
+
+    def __init__(self):
+        self.bits = []
+
+    def write(self, value, length):
+        self.bits.extend(value >> (length - 1 - i) & 1 for i in range(length))
+
+    def huffman(self, codes, symbol):
+        self.write(*codes[symbol])
+
+    def magnitude(self, codes, symbol, value):
+        size = abs(value).bit_length()
+        self.huffman(codes, symbol | size)
+        if size:
+            self.write(value if value > 0 else value + (1 << size) - 1, size)
+
+    def flush(self):
+        bits = self.bits + [1] * (-len(self.bits) % 8)
+        self.bits = []
+        out = bytearray()
+        for i in range(0, len(bits), 8):
+            out.append(int("".join(map(str, bits[i:i+8])), 2))
+            if out[-1] == 0xff:
+                out.append(0)
+        return bytes(out)
+
+
+def encode_ac(writer, block, ss, se):
+    run = 0
+    for k in range(ss, se + 1):
+        if not block[k]:
+            run += 1
+            continue
+        while run > 15:
+            writer.huffman(AC_CODES, 0xf0)
+            run -= 16
+        writer.magnitude(AC_CODES, run << 4, block[k])
+        run = 0
+    if run:
+        writer.huffman(AC_CODES, 0x00)
+
+
+def point_transform(value, al):
+    # the first scan of successive approximation keeps the magnitude
+    # shifted down, rounding towards zero
+    return value >> al if value >= 0 else -(-value >> al)
+
+
+def flush_eobrun(writer, state):
+    """Write the pending EOB run of a progressive AC scan, followed by the
+    correction bits held back while it ran.
+
+    """
+    eobrun = state.pop("eobrun", 0)
+    if eobrun:
+        r = eobrun.bit_length() - 1
+        writer.huffman(AC_CODES, r << 4)
+        if r:
+            writer.write(eobrun - (1 << r), r)
+    for bit in state.pop("corrections", []):
+        writer.write(bit, 1)
+
+
+def encode_ac_first(writer, block, ss, se, al, state):
+    """Encode the first AC scan of a band, ending blocks with EOB runs."""
+    run = 0
+    for k in range(ss, se + 1):
+        value = point_transform(block[k], al)
+        if not value:
+            run += 1
+            continue
+        flush_eobrun(writer, state)
+        while run > 15:
+            writer.huffman(AC_CODES, 0xf0)
+            run -= 16
+        writer.magnitude(AC_CODES, run << 4, value)
+        run = 0
+    if run:
+        state["eobrun"] = state.get("eobrun", 0) + 1
+        if state["eobrun"] == 0x7fff:
+            flush_eobrun(writer, state)
+
+
+def encode_ac_refine(writer, block, ss, se, al, state):
+    """Encode an AC refinement scan of a band, bringing it down to point
+    transform ``al``, as in G.1.2.3 of the specification.
+
+    """
+    magnitudes = [abs(block[k]) >> al for k in range(64)]
+    last_new = max([k for k in range(ss, se + 1) if magnitudes[k] == 1] or
+                   [0])
+    run = 0
+    corrections = []
+    for k in range(ss, se + 1):
+        t = magnitudes[k]
+        if not t:
+            run += 1
+            continue
+        while run > 15 and k <= last_new:
+            flush_eobrun(writer, state)
+            writer.huffman(AC_CODES, 0xf0)
+            run -= 16
+            for bit in corrections:
+                writer.write(bit, 1)
+            corrections = []
+        if t > 1:
+            corrections.append(t & 1)
+            continue
+        flush_eobrun(writer, state)
+        writer.magnitude(AC_CODES, run << 4, 1 if block[k] > 0 else -1)
+        for bit in corrections:
+            writer.write(bit, 1)
+        corrections = []
+        run = 0
+    if run or corrections:
+        state["eobrun"] = state.get("eobrun", 0) + 1
+        state.setdefault("corrections", []).extend(corrections)
+        if state["eobrun"] == 0x7fff:
+            flush_eobrun(writer, state)
+
+
+def segment(marker, payload):
+    return struct.pack(">BBH", 0xff, marker, len(payload) + 2) + payload
+
+
+def jpeg_file(width, height, components, progressive=False, restart=0,
+              quantization=4, successive=False):
+    """Build a JPEG file from ``components``: ``(h, v, blocks)`` tuples,
+    ``blocks`` being rows of blocks of 64 quantized coefficients in zigzag
+    order.  Progressive files have DC scans with successive approximation
+    and two AC bands per component.  With ``successive`` the AC bands end
+    blocks with EOB runs and the first band is also sent in two passes,
+    the second a refinement scan.
+
+    """
+    hmax = max(h for h, _, _ in components)
+    vmax = max(v for _, v, _ in components)
+    content = b"\xff\xd8"
+    content += segment(jpeg.DQT, b"\x00" + bytes([quantization] * 64))
+    content += segment(jpeg.SOF2 if progressive else jpeg.SOF0,
+                       struct.pack(">BHHB", 8, height, width,
+                                   len(components)) +
+                       b"".join(bytes((i + 1, h << 4 | v, 0)) for i, (h, v, _)
+                                in enumerate(components)))
+    content += segment(jpeg.DHT, b"\x00" + DC_TABLE + b"\x10" + AC_TABLE)
+    if restart:
+        content += segment(jpeg.DRI, struct.pack(">H", restart))
+
+    def scan(indices, ss, se, ah, al, code, finish=None):
+        header = bytes((len(indices),)) + b"".join(
+            bytes((i + 1, 0)) for i in indices) + bytes((ss, se, ah << 4 | al))
+        if len(indices) == 1:
+            c = indices[0]
+            h, v, blocks = components[c]
+            units = [[(c, blocks[y][x])]
+                     for y in range(-(-height * v // vmax // 8))
+                     for x in range(-(-width * h // hmax // 8))]
+        else:
+            units = []
+            for my in range(-(-height // (8 * vmax))):
+                for mx in range(-(-width // (8 * hmax))):
+                    units.append([(c, blocks[my*v+y][mx*h+x])
+                                  for c, (h, v, blocks) in
+                                  enumerate(components)
+                                  for y in range(v) for x in range(h)])
+        writer = BitWriter()
+        data = b""
+        preds = {}
+        for m, unit in enumerate(units):
+            if restart and m and m % restart == 0:
+                if finish is not None:
+                    finish(writer, preds)
+                data += writer.flush() + bytes((0xff, jpeg.RST0 + (
+                    m // restart - 1) % 8))
+                preds = {}
+            for c, block in unit:
+                code(writer, block, preds, c)
+        if finish is not None:
+            finish(writer, preds)
+        return segment(jpeg.SOS, header) + data + writer.flush()
+
+    def sequential(writer, block, preds, c):
+        writer.magnitude(DC_CODES, 0, block[0] - preds.get(c, 0))
+        preds[c] = block[0]
+        encode_ac(writer, block, 1, 63)
+
+    def dc_first(writer, block, preds, c):
+        writer.magnitude(DC_CODES, 0, (block[0] >> 1) - preds.get(c, 0))
+        preds[c] = block[0] >> 1
+
+    def dc_refine(writer, block, preds, c):
+        writer.write(block[0] & 1, 1)
+
+    indices = list(range(len(components)))
+    if not progressive:
+        content += scan(indices, 0, 63, 0, 0, sequential)
+    elif successive:
+        content += scan(indices, 0, 0, 0, 1, dc_first)
+        for i in indices:
+            content += scan([i], 1, 5, 0, 2,
+                            lambda w, b, p, c: encode_ac_first(w, b, 1, 5,
+                                                               2, p),
+                            flush_eobrun)
+            content += scan([i], 6, 63, 0, 0,
+                            lambda w, b, p, c: encode_ac_first(w, b, 6, 63,
+                                                               0, p),
+                            flush_eobrun)
+        content += scan(indices, 0, 0, 1, 0, dc_refine)
+        for i in indices:
+            for ah in (2, 1):
+                content += scan([i], 1, 5, ah, ah - 1,
+                                lambda w, b, p, c, al=ah - 1:
+                                encode_ac_refine(w, b, 1, 5, al, p),
+                                flush_eobrun)
+    else:
+        content += scan(indices, 0, 0, 0, 1, dc_first)
+        for i in indices:
+            content += scan([i], 1, 5, 0, 0,
+                            lambda w, b, p, c: encode_ac(w, b, 1, 5))
+        content += scan(indices, 0, 0, 1, 0, dc_refine)
+        for i in indices:
+            content += scan([i], 6, 63, 0, 0,
+                            lambda w, b, p, c: encode_ac(w, b, 6, 63))
+    return content + b"\xff\xd9"
+
+
+def random_blocks(rng, columns, rows, ac=True):
+    blocks = []
+    for _ in range(rows):
+        row = []
+        for _ in range(columns):
+            block = [0] * 64
+            block[0] = rng.randrange(-200, 200)
+            if ac:
+                for k in rng.sample(range(1, 64), 6):
+                    block[k] = rng.randrange(-12, 12)
+            row.append(block)
+        blocks.append(row)
+    return blocks
+
+
+def flat_blocks(columns, rows, value):
+    # the DC coefficient of a block of ``value``, quantized by 4
+    return [[[(value - 128) * 2] + [0] * 63 for _ in range(columns)]
+            for _ in range(rows)]
+
+
+def reference_idct(block, quantization=4):
+    """Transform a block of zigzag ordered coefficients in floating point."""
+    natural = [0] * 64
+    for k, i in enumerate(jpeg.ZIGZAG):
+        natural[i] = block[k] * quantization
+    cs = [[(math.sqrt(0.5) if u == 0 else 1) *
+           math.cos((2 * x + 1) * u * math.pi / 16) for u in range(8)]
+          for x in range(8)]
+    out = []
+    for y in range(8):
+        for x in range(8):
+            s = sum(cs[x][u] * cs[y][v] * natural[v*8+u]
+                    for u in range(8) for v in range(8))
+            out.append(min(255, max(0, int(round(s / 4 + 128)))))
+    return out
+
+
+def reference_plane(blocks, width, height):
+    stride = len(blocks[0]) * 8
+    plane = [0] * (stride * len(blocks) * 8)
+    for by, row in enumerate(blocks):
+        for bx, block in enumerate(row):
+            samples = reference_idct(block)
+            for y in range(8):
+                start = (by * 8 + y) * stride + bx * 8
+                plane[start:start+8] = samples[y*8:y*8+8]
+    return [plane[y*stride + x] for y in range(height) for x in range(width)]
+
+
+class HuffmanTableTest(testing.DepyctUnitTest):
+
+    def test_lookup(self):
+        table = jpeg.HuffmanTable(DC_TABLE[:16], DC_TABLE[16:])
+        # symbol 1 has the 8-bit code 1, followed here by a 1 bit
+        e = table.lookup[1 << 1 | 1]
+        self.assertEqual((e >> 8, e & 255), (8, 1))
+        self.assertEqual(table.fast[1 << 1 | 1], (9, 0, 1))
+        # the two extra bits of symbol 2 do not fit
+        self.assertIsNone(table.fast[2 << 1 | 1])
+        # symbol 11 has a 12-bit code, too long for the peek
+        code, length = DC_CODES[11]
+        self.assertEqual(length, 12)
+        self.assertEqual(table.lookup[code >> 3], 0)
+        self.assertEqual(table.decode_slow(code << 4 | 5), (12, 11))
+
+    def test_invalid_code(self):
+        table = jpeg.HuffmanTable(DC_TABLE[:16], DC_TABLE[16:])
+        with self.assertRaises(ValueError):
+            table.decode_slow(0xffff)
+
+
+class IDCTTest(testing.DepyctUnitTest):
+
+    def test_idct_8x8(self):
+        rng = random.Random(43)
+        for _ in range(20):
+            block = random_blocks(rng, 1, 1)[0][0]
+            natural = [0] * 64
+            for k, i in enumerate(jpeg.ZIGZAG):
+                natural[i] = block[k] * 4 * jpeg.AAN_SCALES[i] + 2048 >> 12
+            samples = jpeg.idct_8x8(natural)
+            for a, b in zip(samples, reference_idct(block)):
+                self.assertLessEqual(abs(a - b), 1)
+
+    def test_flat_blocks(self):
+        self.assertEqual(jpeg.idct_8x8([80 * 4] + [0] * 63), b"\x8a" * 64)
+        self.assertEqual(jpeg.idct_4x4([80] + [0] * 15), b"\x8a" * 16)
+        self.assertEqual(jpeg.idct_2x2([80, 0, 0, 0]), b"\x8a" * 4)
+
+
+class JPEGReadTest(testing.DepyctUnitTest):
+
+    def read(self, content, **options):
+        return jpeg.JPEGFormat(image_lib.Image, **options).open(
+                io.BytesIO(content))
+
+    def gray(self, width=16, height=16, **kwargs):
+        blocks = random_blocks(random.Random(43), -(-width // 8),
+                               -(-height // 8))
+        return blocks, jpeg_file(width, height, [(1, 1, blocks)], **kwargs)
+
+    def assertClose(self, data, expected, tolerance=2):
+        self.assertEqual(len(data), len(expected))
+        self.assertLessEqual(max(abs(a - b) for a, b in zip(data, expected)),
+                             tolerance)
+
+    def test_read_gray(self):
+        blocks, content = self.gray()
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(im.size, (16, 16))
+        self.assertClose(im.buffer, reference_plane(blocks, 16, 16))
+
+    def test_read_odd_size(self):
+        blocks, content = self.gray(13, 10)
+        im = self.read(content)
+        self.assertEqual(im.size, (13, 10))
+        self.assertClose(im.buffer, reference_plane(blocks, 13, 10))
+
+    def test_read_gray_as_rgb(self):
+        _, content = self.gray()
+        gray = self.read(content)
+        im = self.read(content, mode=mode.RGB)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer[1::3]), bytes(gray.buffer))
+
+    def ycbcr(self, width=16, height=16, **kwargs):
+        columns, rows = -(-width // 16), -(-height // 16)
+        return jpeg_file(width, height,
+                         [(2, 2, flat_blocks(2 * columns, 2 * rows, 100)),
+                          (1, 1, flat_blocks(columns, rows, 90)),
+                          (1, 1, flat_blocks(columns, rows, 200))],
+                         **kwargs)
+
+    def test_read_ycbcr(self):
+        im = self.read(self.ycbcr(24, 20))
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(im.size, (24, 20))
+        # y = 100, cb = 90 and cr = 200
+        expected = [100 + 1.402 * 72,
+                    100 - 0.344136 * -38 - 0.714136 * 72,
+                    100 + 1.772 * -38]
+        self.assertClose(im.buffer, [int(round(v)) for v in expected] * 480,
+                         1)
+
+    def test_read_rgb_components(self):
+        content = self.ycbcr().replace(b"\x01\x22\x00\x02\x11\x00\x03\x11",
+                                       b"R\x22\x00G\x11\x00B\x11")
+        content = content.replace(b"\x01\x00\x02\x00\x03\x00",
+                                  b"R\x00G\x00B\x00")
+        im = self.read(content)
+        self.assertEqual(bytes(im.buffer[:3]), bytes((100, 90, 200)))
+
+    def test_read_yv12(self):
+        im = self.read(self.ycbcr(18, 17), mode=mode.JPEG_YV12)
+        self.assertEqual(im.mode, mode.JPEG_YV12)
+        self.assertEqual(im.size, (18, 16))
+        # the luma plane, then red and blue difference
+        self.assertEqual(bytes(im.buffer), b"d" * 288 + b"\xc8" * 72 +
+                         b"Z" * 72)
+
+    def test_read_yv12_needs_subsampling(self):
+        _, content = self.gray()
+        with self.assertRaises(IOError):
+            self.read(content, mode=mode.JPEG_YV12)
+
+    def test_scale(self):
+        blocks, content = self.gray(13, 10)
+        for scale, size in ((0.5, (7, 5)), ("1/4", (4, 3)), (0.125, (2, 2))):
+            im = self.read(content, scale=scale)
+            self.assertEqual(im.size, size)
+        # the first block keeps its mean
+        im = self.read(content, scale=0.5)
+        samples = [im.buffer[y * 7 + x] for y in range(4) for x in range(4)]
+        self.assertLessEqual(abs(sum(samples) / 16 - (blocks[0][0][0] / 2 +
+                                                      128)), 1)
+        im = self.read(content, scale=0.125)
+        self.assertEqual(list(im.buffer),
+                         [min(255, max(0, (row[x][0] * 4 + 4 >> 3) + 128))
+                          for row in blocks for x in range(2)])
+
+    def test_scale_flat(self):
+        content = self.ycbcr()
+        full = self.read(content)
+        for scale in (0.5, 0.25, 0.125):
+            im = self.read(content, scale=scale)
+            self.assertClose(im.buffer, full.buffer[:len(im.buffer)], 1)
+
+    def test_restart_intervals(self):
+        _, content = self.gray(40, 24)
+        for restart in (1, 2, 7):
+            im = self.read(self.gray(40, 24, restart=restart)[1])
+            self.assertEqual(bytes(im.buffer), bytes(self.read(content).buffer))
+
+    def test_progressive(self):
+        for width, height in ((16, 16), (13, 10)):
+            _, baseline = self.gray(width, height)
+            _, progressive = self.gray(width, height, progressive=True)
+            self.assertEqual(bytes(self.read(progressive).buffer),
+                             bytes(self.read(baseline).buffer))
+        self.assertEqual(bytes(self.read(self.ycbcr(24, 20,
+                                                    progressive=True)).buffer),
+                         bytes(self.read(self.ycbcr(24, 20)).buffer))
+
+    def test_progressive_successive_approximation(self):
+        for width, height, restart in ((16, 16, 0), (13, 10, 0),
+                                       (40, 24, 0), (40, 24, 2)):
+            _, baseline = self.gray(width, height)
+            _, progressive = self.gray(width, height, progressive=True,
+                                       successive=True, restart=restart)
+            self.assertEqual(bytes(self.read(progressive).buffer),
+                             bytes(self.read(baseline).buffer))
+
+    def test_long_eob_runs(self):
+        # flat blocks end every AC band at once, over the whole scan
+        blocks = flat_blocks(40, 3, 90)
+        blocks[2][39][3] = -9
+        baseline = jpeg_file(320, 24, [(1, 1, blocks)])
+        progressive = jpeg_file(320, 24, [(1, 1, blocks)], progressive=True,
+                                successive=True)
+        self.assertEqual(bytes(self.read(progressive).buffer),
+                         bytes(self.read(baseline).buffer))
+
+    def test_one_ac_coefficient_on_zero_dc(self):
+        # a block of mid-gray with one AC term is not flat
+        block = [0] * 64
+        block[1] = 20
+        im = self.read(jpeg_file(8, 8, [(1, 1, [[block]])]))
+        self.assertClose(im.buffer, reference_idct(block))
+        self.assertGreater(im.buffer[0], im.buffer[7])
+        for scale in (0.5, 0.25):
+            im = self.read(jpeg_file(8, 8, [(1, 1, [[block]])]), scale=scale)
+            self.assertGreater(im.buffer[0], im.buffer[-1])
+
+    def test_invalid_data(self):
+        _, content = self.gray()
+        with self.assertRaises(IOError):
+            self.read(b"GIF89a")
+        with self.assertRaises(IOError):
+            self.read(content, scale=0.3)
+        with self.assertRaises(IOError):
+            self.read(content, mode=mode.CMYK)
+        with self.assertRaises(IOError):
+            # lossless
+            self.read(content.replace(b"\xff\xc0", b"\xff\xc3"))
+        with self.assertRaises(IOError):
+            self.read(b"\xff\xd8\xff\xd9")
+
+
+def gradient(width, height, seed=43):
+    """A smooth RGB image with a little noise, as photographs are."""
+    rng = random.Random(seed)
+    im = image_lib.Image(mode.RGB, size=(width, height))
+    im.buffer[:] = bytes(min(255, v + rng.randrange(4))
+                         for y in range(height) for x in range(width)
+                         for v in (x * 200 // width, y * 200 // height,
+                                   (x + y) * 100 // (width + height) + 60))
+    return im
+
+
+def psnr(a, b):
+    error = sum((x - y) ** 2 for x, y in zip(a, b)) / len(a)
+    return 10 * math.log10(255 ** 2 / error) if error else float("inf")
+
+
+class FDCTTest(testing.DepyctUnitTest):
+
+    def test_fdct_8x8(self):
+        rng = random.Random(43)
+        samples = bytes(rng.randrange(256) for _ in range(64))
+        coefs = jpeg.fdct_8x8(samples)
+        cs = [[(math.sqrt(0.5) if u == 0 else 1) *
+               math.cos((2 * x + 1) * u * math.pi / 16) for x in range(8)]
+              for u in range(8)]
+        for v in range(8):
+            for u in range(8):
+                expected = sum(cs[u][x] * cs[v][y] * (samples[y*8+x] - 128)
+                               for x in range(8) for y in range(8)) / 4
+                scale = jpeg.AAN_SCALES[v*8+u] / (1 << 14) * 8
+                self.assertLess(abs(coefs[v*8+u] / scale - expected), 3)
+
+    def test_stride(self):
+        samples = bytes(range(256))
+        block = b"".join(samples[y*16+4:y*16+12] for y in range(8))
+        self.assertEqual(jpeg.fdct_8x8(samples, 4, 16),
+                         jpeg.fdct_8x8(block))
+
+    def test_flat_block(self):
+        self.assertEqual(jpeg.fdct_8x8(b"\x8a" * 64), [64 * 10] + [0] * 63)
+
+
+class HuffmanCodingTest(testing.DepyctUnitTest):
+
+    def test_scale_quantization(self):
+        table = jpeg.LUMINANCE_QUANTIZATION
+        self.assertEqual(jpeg.scale_quantization(table, 50), table)
+        self.assertEqual(jpeg.scale_quantization(table, 100), [1] * 64)
+        self.assertEqual(jpeg.scale_quantization(table, 1), [255] * 64)
+        self.assertEqual(jpeg.scale_quantization(table, 75)[:4],
+                         [8, 6, 6, 7])
+
+    def test_standard_codes(self):
+        codes = jpeg.huffman_codes(*jpeg.LUMINANCE_DC)
+        self.assertEqual(codes[0], (0, 2))
+        self.assertEqual(codes[1], (2, 3))
+        self.assertEqual(codes[11], (0x1fe, 9))
+        self.assertIsNone(codes[12])
+
+    def test_optimal_table(self):
+        frequencies = [0] * 256
+        frequencies[:5] = [40, 20, 10, 6, 4]
+        counts, symbols = jpeg.optimal_table(frequencies)
+        self.assertEqual(sorted(symbols), [0, 1, 2, 3, 4])
+        codes = jpeg.huffman_codes(counts, symbols)
+        lengths = [codes[s][1] for s in range(5)]
+        self.assertEqual(lengths, sorted(lengths))
+        # the all ones code of the longest length is left unused
+        longest = max(lengths)
+        self.assertNotIn(((1 << longest) - 1, longest), codes)
+
+    def test_optimal_table_limits_lengths(self):
+        # Fibonacci frequencies make a tree as deep as it has symbols
+        frequencies = [0] * 256
+        a, b = 1, 1
+        for s in range(30):
+            frequencies[s] = a
+            a, b = b, a + b
+        counts, symbols = jpeg.optimal_table(frequencies)
+        self.assertEqual(len(symbols), 30)
+        self.assertEqual(sum(counts), 30)
+        # a complete code, less the all ones code
+        self.assertEqual(sum(c << (16 - i) for i, c in enumerate(counts, 1)),
+                         (1 << 16) - 1)
+        codes = jpeg.huffman_codes(counts, symbols)
+        self.assertEqual(codes[0][1], 16)
+        self.assertLess(codes[29][1], codes[0][1])
+
+    def test_single_symbol(self):
+        frequencies = [0] * 256
+        frequencies[7] = 100
+        self.assertEqual(jpeg.optimal_table(frequencies),
+                         (bytes((1,) + (0,) * 15), b"\x07"))
+
+
+class JPEGWriteTest(testing.DepyctUnitTest):
+
+    def round_trip(self, im, read_options={}, **options):
+        fp = io.BytesIO()
+        jpeg.JPEGFormat(image_lib.Image, **options).save(im, fp)
+        content = fp.getvalue()
+        return content, jpeg.JPEGFormat(image_lib.Image,
+                                        **read_options).open(
+                                            io.BytesIO(content))
+
+    def test_write_rgb(self):
+        im = gradient(37, 29)
+        for subsampling in ("4:4:4", "4:2:2", "4:2:0"):
+            content, result = self.round_trip(im, subsampling=subsampling)
+            self.assertEqual(content[:4], b"\xff\xd8\xff\xe0")
+            self.assertEqual(content[6:11], b"JFIF\x00")
+            self.assertEqual(result.mode, mode.RGB)
+            self.assertEqual(result.size, (37, 29))
+            self.assertGreater(psnr(result.buffer, im.buffer), 35)
+
+    def test_subsampling_factors(self):
+        im = gradient(16, 16)
+        for subsampling, factors in (("4:4:4", 0x11), ("4:2:2", 0x21),
+                                     ("4:2:0", 0x22)):
+            content, _ = self.round_trip(im, subsampling=subsampling)
+            frame = content.index(b"\xff\xc0")
+            self.assertEqual(content[frame+10:frame+19],
+                             bytes((1, factors, 0, 2, 0x11, 1, 3, 0x11, 1)))
+
+    def test_write_gray(self):
+        im = image_lib.Image(mode.L, size=(20, 13))
+        im.buffer[:] = bytes(gradient(20, 13).buffer[0::3])
+        content, result = self.round_trip(im)
+        self.assertEqual(result.mode, mode.L)
+        self.assertEqual(result.size, (20, 13))
+        self.assertGreater(psnr(result.buffer, im.buffer), 35)
+        # one table of each kind
+        self.assertEqual(content.count(b"\xff\xdb\x00\x43"), 1)
+
+    def test_quality(self):
+        im = gradient(32, 32)
+        sizes = []
+        errors = []
+        for quality in (20, 75, 100):
+            content, result = self.round_trip(im, quality=quality,
+                                              subsampling="4:4:4")
+            sizes.append(len(content))
+            errors.append(psnr(result.buffer, im.buffer))
+        self.assertEqual(sizes, sorted(sizes))
+        self.assertEqual(errors, sorted(errors))
+        self.assertGreater(errors[-1], 45)
+
+    def test_high_frequencies(self):
+        im = image_lib.Image(mode.L, size=(16, 16))
+        im.buffer[:] = bytes(255 * ((x + y) & 1)
+                             for y in range(16) for x in range(16))
+        _, result = self.round_trip(im, quality=100)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+
+    def test_optimize(self):
+        im = gradient(40, 24)
+        content, result = self.round_trip(im)
+        optimized, optimized_result = self.round_trip(im, optimize=True)
+        self.assertLess(len(optimized), len(content))
+        self.assertEqual(bytes(optimized_result.buffer),
+                         bytes(result.buffer))
+
+    def test_write_yv12(self):
+        _, im = self.round_trip(gradient(22, 18), {"mode": mode.JPEG_YV12},
+                                quality=95)
+        content, result = self.round_trip(
+            im, read_options={"mode": mode.JPEG_YV12}, quality=95)
+        self.assertEqual(result.mode, mode.JPEG_YV12)
+        self.assertEqual(result.size, (22, 18))
+        frame = content.index(b"\xff\xc0")
+        self.assertEqual(content[frame+11], 0x22)
+        self.assertGreater(psnr(result.buffer, im.buffer), 40)
+
+    def test_invalid(self):
+        im = gradient(8, 8)
+        with self.assertRaises(IOError):
+            self.round_trip(im, quality=0)
+        with self.assertRaises(IOError):
+            self.round_trip(im, subsampling="4:1:1")
+        with self.assertRaises(IOError):
+            self.round_trip(image_lib.Image(mode.RGBA, size=(8, 8)))
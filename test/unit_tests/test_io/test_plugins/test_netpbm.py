@@ -3,6 +3,7 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import array
 import io
 import os
 
@@ -249,6 +250,281 @@ class PamFormatTest(NetpbmTest):
         self.check_read({}, "in.ppm.pam", test_im)
 
 
+class RawSampleReadTest(testing.DepyctUnitTest):
+
+    def read(self, format_cls, content):
+        return format_cls(image_lib.Image).open(io.BytesIO(content))
+
+    def test_read_ppm_maxval_255(self):
+        data = bytes(range(2 * 3 * 3))
+        im = self.read(netpbm.PpmFormat, b"P6\n3 2\n255\n" + data)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer), data)
+
+    def test_read_pgm_16_bit(self):
+        samples = [0, 1, 258, 65535, 40000, 7]
+        data = b"".join(v.to_bytes(2, "big") for v in samples)
+        im = self.read(netpbm.PgmFormat, b"P5\n3 2\n65535\n" + data)
+        self.assertEqual(im.mode, mode.L16)
+        self.assertEqual([p.value[0] for p in im.pixels()], samples)
+
+    def test_read_rescaled(self):
+        samples = [0, 1, 500, 999, 1000, 250]
+        data = b"".join(v.to_bytes(2, "big") for v in samples)
+        im = self.read(netpbm.PgmFormat, b"P5\n3 2\n1000\n" + data)
+        self.assertEqual([p.value[0] for p in im.pixels()],
+                         [netpbm.affine(v, 0, 1000, 0, 65535)
+                          for v in samples])
+
+    def test_read_pam(self):
+        data = bytes(range(0, 2 * 2 * 4 * 10, 10))
+        content = (b"P7\nWIDTH 2\nHEIGHT 2\nDEPTH 4\nMAXVAL 255\n"
+                   b"TUPLTYPE RGB_ALPHA\nENDHDR\n" + data)
+        im = self.read(netpbm.PamFormat, content)
+        self.assertEqual(im.mode, mode.RGBA)
+        self.assertEqual(bytes(im.buffer), data)
+
+    def test_read_truncated(self):
+        with self.assertRaises(IOError):
+            self.read(netpbm.PpmFormat, b"P6\n3 2\n255\n" + bytes(17))
+
+    def test_sample_above_maxval(self):
+        data = b"".join(v.to_bytes(2, "big") for v in (0, 1001))
+        with self.assertRaises(IOError):
+            self.read(netpbm.PgmFormat, b"P5\n2 1\n1000\n" + data)
+        with self.assertRaises(IOError):
+            self.read(netpbm.PgmFormat, b"P5\n2 1\n100\n\x32\xc8")
+
+
+class SampleWriteTest(testing.DepyctUnitTest):
+
+    def write(self, format_cls, im, **options):
+        capture = io.BytesIO()
+        format_cls(image_lib.Image, **options).save(im, capture)
+        return capture.getvalue()
+
+    def make_image(self, im_mode, samples, width=3):
+        height = len(samples) // (width * im_mode.components)
+        im = image_lib.Image(im_mode, image_lib.ImageSize(width, height))
+        code = "B" if im_mode.bits_per_component == 8 else "H"
+        im.buffer[:] = array.array(code, samples).tobytes()
+        return im
+
+    def test_write_pgm_16_bit(self):
+        samples = [0, 1, 258, 65535, 40000, 7]
+        im = self.make_image(mode.L16, samples)
+        content = self.write(netpbm.PgmFormat, im, maxval=65535)
+        self.assertEqual(content, b"P5\n3 2\n65535\n" + b"".join(
+                         v.to_bytes(2, "big") for v in samples))
+        copy = netpbm.PgmFormat(image_lib.Image).open(io.BytesIO(content))
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_write_ppm_16_bit_to_8_bit(self):
+        samples = list(range(0, 65536, 65535 // 17))[:18]
+        im = self.make_image(mode.RGB48, samples)
+        content = self.write(netpbm.PpmFormat, im)
+        self.assertEqual(content, b"P6\n3 2\n255\n" + bytes(
+                         netpbm.affine(v, 0, 65535, 0, 255) for v in samples))
+
+    def test_write_ppm_8_bit_to_16_bit(self):
+        samples = list(range(0, 256, 15))[:18]
+        im = self.make_image(mode.RGB, samples)
+        content = self.write(netpbm.PpmFormat, im, maxval=1000)
+        self.assertEqual(content, b"P6\n3 2\n1000\n" + b"".join(
+                         netpbm.affine(v, 0, 255, 0, 1000).to_bytes(2, "big")
+                         for v in samples))
+
+    def test_write_ppm_from_gray(self):
+        im = self.make_image(mode.L, [0, 10, 20, 30, 40, 50])
+        content = self.write(netpbm.PpmFormat, im)
+        self.assertEqual(content, b"P6\n3 2\n255\n" + bytes(
+                         v for v in (0, 10, 20, 30, 40, 50) for _ in range(3)))
+
+    def test_write_plain_16_bit(self):
+        im = self.make_image(mode.L16, [0, 1, 258, 65535, 40000, 7])
+        content = self.write(netpbm.PgmFormat, im, format="plain",
+                             maxval=65535)
+        self.assertEqual(content,
+                         b"P2\n3 2\n65535\n0\t1\t258\n65535\t40000\t7\n")
+
+    def test_write_dithered_pbm(self):
+        im = self.make_image(mode.L, [0] * 8 + [128] * 48 + [255] * 8, 8)
+        content = self.write(netpbm.PbmFormat, im, dither="bayer")
+        self.assertEqual(content[:7], b"P4\n8 8\n")
+        rows = content[7:]
+        self.assertEqual(rows[0], 0xff)
+        self.assertEqual(rows[7], 0)
+        self.assertEqual(sum(bin(b).count("1") for b in rows[1:7]), 24)
+
+    def test_write_dithered_pbm_unknown_method(self):
+        im = self.make_image(mode.L, [0] * 6)
+        with self.assertRaises(IOError):
+            self.write(netpbm.PbmFormat, im, dither="random")
+
+    def test_write_in_bands(self):
+        samples = [v % 256 for v in range(3 * 50 * 3)]
+        im = self.make_image(mode.RGB, samples)
+        fmt = netpbm.PpmFormat(image_lib.Image, format="plain")
+        fmt.band_size = 20
+        capture = io.BytesIO()
+        fmt.save(im, capture)
+        rows = capture.getvalue().split(b"\n")[3:-1]
+        self.assertEqual(len(rows), 50)
+        self.assertEqual([int(v) for row in rows for v in row.split()],
+                         samples)
+
+    def test_bad_maxval(self):
+        im = self.make_image(mode.L, [0] * 6)
+        with self.assertRaises(IOError):
+            self.write(netpbm.PgmFormat, im, maxval=65536)
+
+
+class PlainReadTest(testing.DepyctUnitTest):
+
+    def read(self, format_cls, content, chunk_size=None):
+        fmt = format_cls(image_lib.Image)
+        if chunk_size is not None:
+            fmt.chunk_size = chunk_size
+        return fmt.open(io.BytesIO(content))
+
+    def test_rows_across_lines(self):
+        samples = list(range(0, 180, 10))
+        text = b"P3\n3 2\n255\n" + b" ".join(
+                b"%d" % v for v in samples[:5]) + b"\n" + b"\n".join(
+                b"%d" % v for v in samples[5:]) + b"\n"
+        im = self.read(netpbm.PpmFormat, text)
+        self.assertEqual(list(im.buffer), samples)
+
+    def test_tokens_split_across_chunks(self):
+        samples = [0, 1, 258, 65535, 40000, 7]
+        text = b"P2\n3 2\n65535\n" + b"  ".join(b"%d" % v for v in samples)
+        for chunk_size in (1, 2, 3, 5, 64):
+            im = self.read(netpbm.PgmFormat, text, chunk_size)
+            self.assertEqual(im.mode, mode.L16)
+            self.assertEqual(list(im.buffer.cast("H")), samples)
+
+    def test_rescaled(self):
+        im = self.read(netpbm.PgmFormat, b"P2\n3 1\n15\n0 7 15")
+        self.assertEqual(list(im.buffer), [0, 119, 255])
+
+    def test_pbm_without_whitespace(self):
+        im = self.read(netpbm.PbmFormat, b"P1\n3 2\n10\n0 1\n1\t1")
+        self.assertEqual(list(im.buffer), [255, 0, 0, 255, 255, 255])
+
+    def test_bad_token(self):
+        with self.assertRaises(IOError):
+            self.read(netpbm.PgmFormat, b"P2\n2 1\n255\n1 x\n")
+        with self.assertRaises(IOError):
+            self.read(netpbm.PbmFormat, b"P1\n2 1\n1 2\n")
+
+    def test_truncated(self):
+        with self.assertRaises(IOError):
+            self.read(netpbm.PpmFormat, b"P3\n1 1\n255\n1 2\n")
+        with self.assertRaises(IOError):
+            self.read(netpbm.PbmFormat, b"P1\n2 2\n1 0 1\n")
+
+    def test_sample_above_maxval(self):
+        with self.assertRaises(IOError):
+            self.read(netpbm.PgmFormat, b"P2\n2 1\n15\n1 16\n")
+
+
+class Pipe(io.RawIOBase):
+    """A non-seekable stream handing out at most ``step`` bytes a read."""
+
+    def __init__(self, data, step=7):
+        self.data = memoryview(data)
+        self.step = step
+
+    def readable(self):
+        return True
+
+    def readinto(self, view):
+        n = min(len(view), self.step, len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+class StreamTest(testing.DepyctUnitTest):
+
+    def pipe(self, content):
+        return io.BufferedReader(Pipe(content), 16)
+
+    def test_mixed_frames(self):
+        content = (b"P6\n2 1\n255\n\x01\x02\x03\x04\x05\x06"
+                   b"P5 2 1 # two\n15\n\x0f\x00"
+                   b"P1\n3 1\n1 0 1\n"
+                   b"P4\n3 2\n\xa0\x40"
+                   b"P2\n2 1\n65535\n1 65535\n"
+                   b"P7\nWIDTH 1\nHEIGHT 1\nDEPTH 4\nMAXVAL 255\n"
+                   b"TUPLTYPE RGB_ALPHA\nENDHDR\n\x09\x08\x07\x06"
+                   b"\n")
+        frames = [(im.mode, bytes(im.buffer)) for im in
+                  netpbm.PamFormat(image_lib.Image).frames(self.pipe(content))]
+        self.assertEqual(frames, [
+            (mode.RGB, b"\x01\x02\x03\x04\x05\x06"),
+            (mode.L, b"\xff\x00"),
+            (mode.L, b"\xff\x00\xff"),
+            (mode.L, b"\xff\x00\xff\x00\xff\x00"),
+            (mode.L16, array.array("H", [1, 65535]).tobytes()),
+            (mode.RGBA, b"\x09\x08\x07\x06"),
+        ])
+
+    def test_ring(self):
+        content = b"".join(b"P5\n1 1\n255\n%c" % v for v in range(5))
+        fmt = netpbm.PgmFormat(image_lib.Image, ring_size=2)
+        seen = []
+        values = []
+        for im in fmt.frames(self.pipe(content)):
+            seen.append(im)
+            values.append(im.buffer[0])
+        self.assertEqual(values, [0, 1, 2, 3, 4])
+        self.assertIs(seen[0], seen[2])
+        self.assertIs(seen[1], seen[3])
+        self.assertIsNot(seen[0], seen[1])
+
+    def test_save_frames(self):
+        images = []
+        for v in range(3):
+            im = image_lib.Image(mode.RGB, image_lib.ImageSize(2, 2))
+            im.buffer[:] = bytes(range(v, v + 12))
+            images.append(im)
+        for format_cls, options in ((netpbm.PpmFormat, {}),
+                                    (netpbm.PpmFormat, {"format": "plain"}),
+                                    (netpbm.PamFormat, {})):
+            capture = io.BytesIO()
+            format_cls(image_lib.Image, **options).save_frames(images,
+                                                               capture)
+            frames = format_cls(image_lib.Image).frames(
+                    self.pipe(capture.getvalue()))
+            self.assertEqual([bytes(im.buffer) for im in frames],
+                             [bytes(im.buffer) for im in images])
+
+    def test_wrong_kind(self):
+        with self.assertRaises(IOError):
+            netpbm.PgmFormat(image_lib.Image).open(
+                    io.BytesIO(b"P6\n1 1\n255\n\x00\x00\x00"))
+
+    def test_truncated_frame(self):
+        content = b"P5\n2 1\n255\n\x00\x00P5\n2 1\n255\n\x00"
+        frames = netpbm.PgmFormat(image_lib.Image).frames(self.pipe(content))
+        next(frames)
+        with self.assertRaises(IOError):
+            next(frames)
+
+
+class PamWriteTest(NetpbmTest):
+
+    FORMAT_CLS = netpbm.PamFormat
+
+    def test_write_pgm(self):
+        self.check_write({"maxval": 15}, PgmFormatTest.get_test_image(),
+                         "out.pgm.pam")
+
+    def test_write_ppm(self):
+        self.check_write({"maxval": 15}, PpmFormatTest.get_test_image(),
+                         "out.ppm.pam")
+
 
 if __name__ == "__main__":
     testing.main()
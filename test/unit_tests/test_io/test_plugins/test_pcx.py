@@ -3,3 +3,206 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import random
+import struct
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import pcx
+
+
+def pcx_file(width, height, bits, planes, bytes_per_line, data, ega=b"",
+             palette=None, encoding=1, version=5, dpi=(0, 0)):
+    """Build a PCX file from its already encoded ``data``."""
+    header = struct.pack("<BBBBHHHHHH48sBBHHHH", 0x0a, version, encoding,
+                         bits, 0, 0, width - 1, height - 1, dpi[0], dpi[1],
+                         ega, 0, planes, bytes_per_line, 1, 0, 0)
+    content = header.ljust(128, b"\x00") + data
+    if palette is not None:
+        content += b"\x0c" + palette.ljust(768, b"\x00")
+    return content
+
+
+class RLETest(testing.DepyctUnitTest):
+
+    def test_decode(self):
+        self.assertEqual(pcx.rle_decode(b"\xc3\x07ab\xc1\xd0\xc0\x01c", 8),
+                         b"\x07\x07\x07ab\xd0c")
+        # decoding stops once enough bytes come out
+        self.assertEqual(pcx.rle_decode(b"\xff\x01\x0c" + bytes(768), 50),
+                         b"\x01" * 50)
+        self.assertEqual(pcx.rle_decode(b"\xc4\x02", 10), b"\x02" * 4)
+
+    def test_encode(self):
+        self.assertEqual(pcx.rle_encode(b"abbbc"), b"a\xc3bc")
+        self.assertEqual(pcx.rle_encode(b"\xd0x\xd0\xd0"),
+                         b"\xc1\xd0x\xc2\xd0")
+        self.assertEqual(pcx.rle_encode(b"\x05" * 127),
+                         b"\xff\x05\xff\x05\x05")
+        self.assertEqual(pcx.rle_encode(b"\xc0" * 127),
+                         b"\xff\xc0\xff\xc0\xc1\xc0")
+
+    def test_round_trip(self):
+        rng = random.Random(5)
+        for _ in range(20):
+            line = bytes(rng.choice(b"\x00\x01\xbf\xc0\xff")
+                         for _ in range(rng.randrange(1, 300)))
+            self.assertEqual(pcx.rle_decode(pcx.rle_encode(line),
+                                            len(line)), line)
+
+
+class PCXReadTest(testing.DepyctUnitTest):
+
+    def read(self, content, **options):
+        return pcx.PCXFormat(image_lib.Image, **options).open(
+                io.BytesIO(content))
+
+    def test_read_256_colors(self):
+        palette = b"\x00\x00\x00\xff\x00\x00\x00\x00\xff"
+        # lines of three pixels padded to four bytes
+        content = pcx_file(3, 2, 8, 1, 4, b"\x00\xc2\x01\x09"
+                                          b"\x02\x01\x00\x00",
+                           palette=palette)
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer),
+                         b"\x00\x00\x00\xff\x00\x00\xff\x00\x00"
+                         b"\x00\x00\xff\xff\x00\x00\x00\x00\x00")
+        im = self.read(content, indexed=True)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer), b"\x00\x01\x01\x02\x01\x00")
+        self.assertEqual(im.info["palette"][:3],
+                         [(0, 0, 0), (255, 0, 0), (0, 0, 255)])
+
+    def test_read_gray(self):
+        content = pcx_file(2, 1, 8, 1, 2, b"\x10\x20", palette=bytes(
+                v for v in range(256) for _ in range(3)))
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer), b"\x10\x20")
+        # without a palette the indices are grays
+        im = self.read(pcx_file(2, 1, 8, 1, 2, b"\x10\x20", version=3))
+        self.assertEqual(bytes(im.buffer), b"\x10\x20")
+
+    def test_read_24_bit(self):
+        # each line holds the red, green and blue planes in turn
+        content = pcx_file(3, 2, 8, 3, 4, b"\x01\x02\x03\x00"
+                                          b"\x04\x05\x06\x00"
+                                          b"\x07\x08\x09\x00"
+                                          b"\xc4\x0a\xc4\x0b\xc4\x0c",
+                           dpi=(72, 300))
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer), b"\x01\x04\x07\x02\x05\x08"
+                                           b"\x03\x06\x09\x0a\x0b\x0c"
+                                           b"\x0a\x0b\x0c\x0a\x0b\x0c")
+        self.assertEqual(im.info["resolution"], (2835, 11811))
+
+    def test_read_32_bit(self):
+        content = pcx_file(1, 1, 8, 4, 2, b"\x01\x00\x02\x00\x03\x00"
+                                          b"\x04\x00", encoding=0)
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGBA)
+        self.assertEqual(bytes(im.buffer), b"\x01\x02\x03\x04")
+
+    def test_read_monochrome(self):
+        content = pcx_file(10, 2, 1, 1, 2, b"\xa5\x40\xc2\xff")
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer),
+                         b"\xff\x00\xff\x00\x00\xff\x00\xff\x00\xff"
+                         b"\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff")
+
+    def test_read_16_color_planar(self):
+        ega = bytes(b for i in range(16) for b in (i * 16, i, 0))
+        # planes of one line: the bits of pixel i are bit 7 - i of each
+        planes = [0b10100000, 0b01100000, 0b00010000, 0b11110000]
+        content = pcx_file(4, 1, 1, 4, 2, b"".join(
+                bytes((p, 0)) for p in planes), ega=ega, encoding=0)
+        im = self.read(content, indexed=True)
+        self.assertEqual(bytes(im.buffer), b"\x09\x0a\x0b\x0c")
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(bytes(im.buffer), b"\x90\x09\x00\xa0\x0a\x00"
+                                           b"\xb0\x0b\x00\xc0\x0c\x00")
+
+    def test_read_packed(self):
+        ega = bytes(b for i in range(16) for b in (i, i, 0))
+        im = self.read(pcx_file(3, 1, 4, 1, 2, b"\x12\x30", ega=ega,
+                                encoding=0), indexed=True)
+        self.assertEqual(bytes(im.buffer), b"\x01\x02\x03")
+        im = self.read(pcx_file(5, 1, 2, 1, 2, b"\x1b\x80", ega=ega,
+                                encoding=0), indexed=True)
+        self.assertEqual(bytes(im.buffer), b"\x00\x01\x02\x03\x02")
+
+    def test_bad_files(self):
+        good = pcx_file(2, 1, 8, 1, 2, b"\xc2\x00")
+        for content in (b"", b"\x0b" + good[1:], good[:100],
+                        # encoding, layout, short lines and truncated data
+                        good[:2] + b"\x02" + good[3:],
+                        good[:3] + b"\x03" + good[4:],
+                        pcx_file(3, 1, 8, 1, 2, b"\xc3\x00"),
+                        good[:-1]):
+            with self.assertRaises(IOError):
+                self.read(content)
+
+
+class PCXWriteTest(testing.DepyctUnitTest):
+
+    def round_trip(self, im, **read_options):
+        fp = io.BytesIO()
+        pcx.PCXFormat(image_lib.Image).save(im, fp)
+        data = fp.getvalue()
+        fp.seek(0)
+        return data, pcx.PCXFormat(image_lib.Image, **read_options).open(fp)
+
+    def image(self, im_mode, width, height, data):
+        im = image_lib.Image(im_mode, size=(width, height))
+        im.buffer[:] = data
+        return im
+
+    def test_write_rgb(self):
+        im = self.image(mode.RGB, 3, 2, bytes(range(9)) + b"\xee" * 9)
+        im.info["resolution"] = (2835, 2835)
+        data, result = self.round_trip(im)
+        header = struct.unpack_from("<BBBBHHHHHH", data)
+        self.assertEqual(header, (0x0a, 5, 1, 8, 0, 0, 2, 1, 72, 72))
+        self.assertEqual(data[65:68], b"\x03\x04\x00")
+        # red, green and blue lines padded to four bytes each
+        self.assertEqual(data[128:], b"\x00\x03\x06\x00\x01\x04\x07\x00"
+                                     b"\x02\x05\x08\x00"
+                                     b"\xc3\xee\x00\xc3\xee\x00\xc3\xee\x00")
+        self.assertEqual(result.mode, mode.RGB)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+        self.assertEqual(result.info["resolution"], (2835, 2835))
+
+    def test_write_gray(self):
+        im = self.image(mode.L, 70, 3, bytes(range(70)) + b"\x80" * 140)
+        data, result = self.round_trip(im)
+        self.assertEqual(data[3], 8)
+        self.assertEqual(struct.unpack_from("<H", data, 68)[0], 2)
+        self.assertEqual(data[-769], 0x0c)
+        self.assertEqual(result.mode, mode.L)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+
+    def test_write_palette(self):
+        im = self.image(mode.L, 4, 1, b"\x00\x02\x01\x02")
+        im.info["palette"] = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+        data, result = self.round_trip(im, indexed=True)
+        self.assertEqual(bytes(result.buffer), bytes(im.buffer))
+        self.assertEqual(result.info["palette"][:3], im.info["palette"])
+        self.assertEqual(result.info["palette"][3:], [(0, 0, 0)] * 253)
+
+    def test_write_monochrome(self):
+        rng = random.Random(3)
+        pixels = bytes(rng.choice(b"\x00\xff") for _ in range(17 * 5))
+        im = self.image(mode.L, 17, 5, pixels)
+        data, result = self.round_trip(im)
+        self.assertEqual((data[3], data[65], data[66]), (1, 1, 4))
+        self.assertEqual(bytes(result.buffer), pixels)
+
+    def test_write_unsupported_mode(self):
+        with self.assertRaises(IOError):
+            self.round_trip(image_lib.Image(mode.LA, size=(1, 1)))
@@ -3,3 +3,743 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import struct
+import zlib
+
+from depyct import testing
+from depyct import util
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import png
+
+
+def chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return struct.pack(">I", len(data)) + chunk_type + data + \
+           struct.pack(">I", crc)
+
+
+def filter_scanline(filter_type, bpp, prior, raw):
+    """A byte-at-a-time reference implementation of the PNG filters."""
+    out = bytearray([filter_type])
+    for i, x in enumerate(raw):
+        a = raw[i-bpp] if i >= bpp else 0
+        b = prior[i]
+        c = prior[i-bpp] if i >= bpp else 0
+        if filter_type == 0:
+            predictor = 0
+        elif filter_type == 1:
+            predictor = a
+        elif filter_type == 2:
+            predictor = b
+        elif filter_type == 3:
+            predictor = (a + b) // 2
+        else:
+            predictor = png.paeth_predictor(a, b, c)
+        out.append((x - predictor) % 256)
+    return out
+
+
+def pack_samples(samples, bit_depth):
+    packed = bytearray()
+    per_byte = 8 // bit_depth
+    for i in range(0, len(samples), per_byte):
+        byte = 0
+        for j, sample in enumerate(samples[i:i+per_byte]):
+            byte |= sample << (8 - bit_depth * (j + 1))
+        packed.append(byte)
+    return packed
+
+
+def make_png(width, height, color_type, bit_depth, scanlines,
+             idat_size=None, extra_chunks=(), interlace=0):
+    """Build a PNG file.  Scanlines of images with fewer than 8 bits per
+    sample are given as lists of samples.
+
+    """
+    bpp = max(1, png.IHDR.CHANNELS[color_type] * bit_depth // 8)
+    if bit_depth < 8:
+        pack = lambda row: pack_samples(row, bit_depth)
+        bpp = 1
+    else:
+        pack = bytearray
+    if interlace:
+        passes = []
+        for x0, y0, dx, dy in png.ADAM7:
+            size = 1 if bit_depth < 8 else bpp
+            passes.append([pack(b"".join(
+                    bytes(raw[x*size:(x+1)*size])
+                    for x in range(x0, width, dx)))
+                for raw in scanlines[y0::dy]])
+    else:
+        passes = [[pack(raw) for raw in scanlines]]
+    filtered = bytearray()
+    for reduced in passes:
+        if not reduced or not reduced[0]:
+            continue
+        prior = bytearray(len(reduced[0]))
+        for y, raw in enumerate(reduced):
+            filtered += filter_scanline(y % 5, bpp, prior, raw)
+            prior = raw
+    data = zlib.compress(bytes(filtered))
+    idat_size = idat_size or len(data)
+    ihdr = struct.pack(">IIBBBBB", width, height, bit_depth, color_type,
+                       0, 0, interlace)
+    content = bytes(png.PNG_SIGNATURE) + chunk(b"IHDR", ihdr)
+    for c in extra_chunks:
+        content += c
+    for i in range(0, len(data), idat_size):
+        content += chunk(b"IDAT", data[i:i+idat_size])
+    return content + chunk(b"IEND", b"")
+
+
+class PNGReadTest(testing.DepyctUnitTest):
+
+    def read(self, content, **options):
+        fmt = png.PNGFormat(image_lib.Image, **options)
+        return fmt.open(io.BytesIO(content))
+
+    def test_read_rgb_all_filters(self):
+        width, height = 7, 10
+        scanlines = [bytearray((x * 37 + y * 11 + c * 90) % 256
+                               for x in range(width) for c in range(3))
+                     for y in range(height)]
+        content = make_png(width, height, 2, 8, scanlines, idat_size=5)
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertEqual(im.size, (width, height))
+        self.assertEqual(bytes(im.buffer), b"".join(map(bytes, scanlines)))
+
+    def test_read_la(self):
+        scanlines = [bytearray([10, 255, 200, 128]),
+                     bytearray([0, 0, 99, 1])]
+        im = self.read(make_png(2, 2, 4, 8, scanlines))
+        self.assertEqual(im.mode, mode.LA)
+        self.assertEqual(im[1, 0].value, (200, 128))
+        self.assertEqual(im[1, 1].value, (99, 1))
+
+    def test_read_16_bit(self):
+        values = [[0x0102, 0xfffe, 0x8000], [0x00ff, 0x1234, 0x0001]]
+        scanlines = [bytearray(struct.pack(">3H", *row)) for row in values]
+        im = self.read(make_png(3, 2, 0, 16, scanlines, idat_size=3))
+        self.assertEqual(im.mode, mode.L16)
+        for y, row in enumerate(values):
+            self.assertEqual(tuple(p.value[0] for p in im[y]), tuple(row))
+
+    def test_read_bad_crc(self):
+        scanlines = [bytearray(3)]
+        content = bytearray(make_png(1, 1, 2, 8, scanlines))
+        content[-13] ^= 0xff
+        with self.assertRaises(IOError):
+            self.read(bytes(content), lazy=False)
+        im = self.read(bytes(content))
+        with self.assertRaises(IOError):
+            im.buffer
+
+    def test_read_truncated_image_data(self):
+        scanlines = [bytearray(range(3 * 4)) for y in range(4)]
+        content = make_png(4, 4, 2, 8, scanlines)
+        start = content.index(b"IDAT") - 4
+        length, = struct.unpack(">I", content[start:start+4])
+        data = zlib.decompressobj().decompress(content[start+8:start+8+length])
+        short = zlib.compress(data[:-20])
+        content = content[:start] + chunk(b"IDAT", short) + \
+                  chunk(b"IEND", b"")
+        with self.assertRaises(IOError):
+            self.read(content, lazy=False)
+
+
+class PNGPaletteReadTest(testing.DepyctUnitTest):
+
+    PALETTE = [(0, 0, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+    def palette_chunks(self, alpha=None):
+        chunks = [chunk(b"PLTE", b"".join(bytes(c) for c in self.PALETTE))]
+        if alpha is not None:
+            chunks.append(chunk(b"tRNS", bytes(alpha)))
+        return chunks
+
+    def read(self, content, **options):
+        return png.PNGFormat(image_lib.Image, **options).open(
+            io.BytesIO(content))
+
+    def test_read_palette_8_bit(self):
+        indices = [[0, 1, 2], [3, 2, 1]]
+        content = make_png(3, 2, 3, 8, [bytearray(r) for r in indices],
+                           extra_chunks=self.palette_chunks())
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGB)
+        for y, row in enumerate(indices):
+            self.assertEqual(tuple(p.value for p in im[y]),
+                             tuple(self.PALETTE[i] for i in row))
+
+    def test_read_palette_2_bit_with_transparency(self):
+        indices = [[(x + y) % 4 for x in range(11)] for y in range(3)]
+        alpha = [0, 128]
+        content = make_png(11, 3, 3, 2, indices,
+                           extra_chunks=self.palette_chunks(alpha))
+        im = self.read(content)
+        self.assertEqual(im.mode, mode.RGBA)
+        alpha += [255, 255]
+        for y, row in enumerate(indices):
+            self.assertEqual(tuple(p.value for p in im[y]),
+                             tuple(self.PALETTE[i] + (alpha[i],)
+                                   for i in row))
+
+    def test_read_indexed(self):
+        indices = [[(x * y) % 4 for x in range(9)] for y in range(5)]
+        content = make_png(9, 5, 3, 4, indices,
+                           extra_chunks=self.palette_chunks())
+        im = self.read(content, indexed=True)
+        self.assertEqual(im.mode, mode.L)
+        self.assertEqual(bytes(im.buffer), b"".join(map(bytes, indices)))
+        self.assertEqual([tuple(c) for c in im.info["palette"]],
+                         self.PALETTE)
+
+    def test_read_sub_byte_grayscale(self):
+        for bit_depth in (1, 2, 4):
+            top = (1 << bit_depth) - 1
+            samples = [[(x * 5 + y) % (top + 1) for x in range(13)]
+                       for y in range(4)]
+            im = self.read(make_png(13, 4, 0, bit_depth, samples))
+            self.assertEqual(im.mode, mode.L)
+            expected = b"".join(bytes(v * 255 // top for v in row)
+                                for row in samples)
+            self.assertEqual(bytes(im.buffer), expected)
+
+    def test_read_interlaced_palette_4_bit(self):
+        indices = [[(3 * x + y) % 4 for x in range(10)] for y in range(9)]
+        content = make_png(10, 9, 3, 4, indices, interlace=1,
+                           extra_chunks=self.palette_chunks())
+        im = self.read(content)
+        for y, row in enumerate(indices):
+            self.assertEqual(tuple(p.value for p in im[y]),
+                             tuple(self.PALETTE[i] for i in row))
+
+
+class PNGLazyReadTest(testing.DepyctUnitTest):
+
+    def setUp(self):
+        self.scanlines = [bytearray([1, 2, 3, 4, 5, 6]),
+                          bytearray([7, 8, 9, 10, 11, 12])]
+        ztxt = b"Comment\x00\x00" + zlib.compress(b"compressed text")
+        itxt = b"Title\x00\x01\x00en\x00Titel\x00" + \
+               zlib.compress(u"\u00fcber".encode("utf-8"))
+        self.content = make_png(2, 2, 2, 8, self.scanlines, extra_chunks=[
+            chunk(b"tEXt", b"Author\x00someone"),
+            chunk(b"zTXt", ztxt),
+            chunk(b"iTXt", itxt),
+        ])
+
+    def test_pixels_decoded_on_first_access(self):
+        fmt = png.PNGFormat(image_lib.Image)
+        im = fmt.open(io.BytesIO(self.content))
+        self.assertEqual(im.size, (2, 2))
+        self.assertEqual(im.mode, mode.RGB)
+        self.assertIsNone(fmt.decoder)
+        self.assertEqual(im[1, 1].value, (10, 11, 12))
+        self.assertIsNotNone(fmt.decoder)
+        self.assertEqual(bytes(im.buffer), b"".join(map(bytes,
+                                                        self.scanlines)))
+
+    def test_compressed_text_inflated_on_access(self):
+        im = png.PNGFormat(image_lib.Image).open(io.BytesIO(self.content))
+        self.assertIsInstance(dict.__getitem__(im.info, "text"),
+                              util.deferred)
+        self.assertEqual(im.info["text"], [("Author", "someone"),
+                                           ("Comment", "compressed text")])
+        self.assertEqual(im.info["itext"],
+                         [("Title", b"en", "Titel", u"\u00fcber")])
+
+    def test_icc_profile_inflated_to_bytes(self):
+        profile = bytes(range(256)) * 2
+        content = make_png(2, 2, 2, 8, self.scanlines, extra_chunks=[
+            chunk(b"iCCP", b"sRGB\x00\x00" + zlib.compress(profile))])
+        im = png.PNGFormat(image_lib.Image).open(io.BytesIO(content))
+        self.assertEqual(im.info["icc_profile"], png.iCCP("sRGB", profile))
+
+    def test_suggested_palettes(self):
+        content = make_png(2, 2, 2, 8, self.scanlines, extra_chunks=[
+            chunk(b"sPLT", b"small\x00\x08" +
+                  struct.pack(">4BH4BH", 1, 2, 3, 4, 500, 5, 6, 7, 8, 0)),
+            chunk(b"sPLT", b"wide\x00\x10" +
+                  struct.pack(">4HH", 1000, 2000, 3000, 65535, 7)),
+        ])
+        im = png.PNGFormat(image_lib.Image).open(io.BytesIO(content))
+        palettes = im.info["suggested_palettes"]
+        self.assertEqual([(tuple(e), e.alpha, e.frequency)
+                          for e in palettes["small"]],
+                         [((1, 2, 3), 4, 500), ((5, 6, 7), 8, 0)])
+        self.assertEqual([(tuple(e), e.alpha, e.frequency)
+                          for e in palettes["wide"]],
+                         [((1000, 2000, 3000), 65535, 7)])
+
+        content = make_png(2, 2, 2, 8, self.scanlines, extra_chunks=[
+            chunk(b"sPLT", b"odd\x00\x08" + bytes(7))])
+        with self.assertRaises(IOError):
+            png.PNGFormat(image_lib.Image).open(io.BytesIO(content))
+
+    def test_eager_read(self):
+        fmt = png.PNGFormat(image_lib.Image, lazy=False)
+        im = fmt.open(io.BytesIO(self.content))
+        self.assertIsNotNone(fmt.decoder)
+        self.assertEqual(im[0, 1].value, (7, 8, 9))
+
+
+class PNGInterlaceTest(testing.DepyctUnitTest):
+
+    def setUp(self):
+        self.width, self.height = 13, 11
+        self.scanlines = [bytearray((x * 19 + y * 7 + c * 50) % 256
+                                    for x in range(self.width)
+                                    for c in range(3))
+                          for y in range(self.height)]
+        self.content = make_png(self.width, self.height, 2, 8,
+                                self.scanlines, idat_size=17, interlace=1)
+
+    def read(self, **options):
+        fmt = png.PNGFormat(image_lib.Image, **options)
+        return fmt.open(io.BytesIO(self.content))
+
+    def test_read_interlaced(self):
+        im = self.read()
+        self.assertEqual(bytes(im.buffer),
+                         b"".join(map(bytes, self.scanlines)))
+
+    def test_read_interlaced_16_bit(self):
+        values = [[(x * 4099 + y * 517) % 65536 for x in range(5)]
+                  for y in range(6)]
+        scanlines = [bytearray(struct.pack(">5H", *row)) for row in values]
+        content = make_png(5, 6, 0, 16, scanlines, interlace=1)
+        im = png.PNGFormat(image_lib.Image).open(io.BytesIO(content))
+        for y, row in enumerate(values):
+            self.assertEqual(tuple(p.value[0] for p in im[y]), tuple(row))
+
+    def test_preview(self):
+        for last_pass in range(1, 8):
+            block_width, block_height = png.ADAM7_BLOCKS[last_pass - 1]
+            im = self.read(last_pass=last_pass)
+            for y in range(self.height):
+                for x in range(self.width):
+                    sx = x - x % block_width
+                    sy = y - y % block_height
+                    expected = tuple(self.scanlines[sy][sx*3:sx*3+3])
+                    self.assertEqual(im[x, y].value, expected)
+
+    def test_tiny_image_with_empty_passes(self):
+        scanlines = [bytearray([1, 2, 3])]
+        content = make_png(1, 1, 2, 8, scanlines, interlace=1)
+        im = png.PNGFormat(image_lib.Image).open(io.BytesIO(content))
+        self.assertEqual(im[0, 0].value, (1, 2, 3))
+
+
+class PNGWriteTestCase(testing.DepyctUnitTest):
+
+    def make_image(self, im_mode, width=9, height=7):
+        im = image_lib.Image(im_mode, size=(width, height))
+        top = 2 ** im_mode.bits_per_component
+        for y, line in enumerate(im):
+            for x, pixel in enumerate(line):
+                pixel.value = tuple((x * 977 + y * 131 + c * 4099) % top
+                                    for c in range(im_mode.components))
+        return im
+
+    def round_trip(self, im, **options):
+        capture = io.BytesIO()
+        png.PNGFormat(image_lib.Image, **options).save(im, capture)
+        content = capture.getvalue()
+        capture.seek(0)
+        return content, png.PNGFormat(image_lib.Image).open(capture)
+
+    def idat_data(self, content):
+        data = bytearray()
+        pos = 8
+        while pos < len(content):
+            length, = struct.unpack(">I", content[pos:pos+4])
+            if content[pos+4:pos+8] == b"IDAT":
+                data += content[pos+8:pos+8+length]
+            pos += length + 12
+        return bytes(data)
+
+
+class PNGWriteTest(PNGWriteTestCase):
+
+    def test_write_modes(self):
+        for im_mode in png.MODE_COLOR_TYPES:
+            im = self.make_image(im_mode)
+            _, copy = self.round_trip(im)
+            self.assertEqual(copy.mode, im_mode)
+            self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_write_fixed_filters(self):
+        im = self.make_image(image_lib.RGB)
+        for filter_type in range(5):
+            content, copy = self.round_trip(im, filter=filter_type)
+            self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+            filtered = zlib.decompress(self.idat_data(content))
+            stride = im.size.width * 3 + 1
+            self.assertEqual(set(filtered[::stride]), {filter_type})
+
+    def test_adaptive_filter_on_gradient(self):
+        im = image_lib.Image(mode.L, size=(64, 4))
+        for y, line in enumerate(im):
+            for x, pixel in enumerate(line):
+                pixel.value = (x * 3,)
+        content, copy = self.round_trip(im)
+        filtered = zlib.decompress(self.idat_data(content))
+        self.assertEqual(filtered[65], 2)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_write_threaded(self):
+        im = self.make_image(image_lib.RGBA, 40, 50)
+        serial, _ = self.round_trip(im)
+        threaded, copy = self.round_trip(im, threads=4, band_size=500,
+                                         idat_size=100)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+        self.assertEqual(zlib.decompress(self.idat_data(threaded)),
+                         zlib.decompress(self.idat_data(serial)))
+
+    def test_unsupported_mode(self):
+        im = image_lib.Image(mode.CMYK, size=(1, 1))
+        with self.assertRaises(IOError):
+            png.PNGFormat(image_lib.Image).save(im, io.BytesIO())
+
+
+
+class PNGOptimizeTest(PNGWriteTestCase):
+
+    def fill(self, im_mode, colors, width=16, height=12):
+        im = image_lib.Image(im_mode, size=(width, height))
+        for y, line in enumerate(im):
+            for x, pixel in enumerate(line):
+                pixel.value = colors[(x // 3 + y) % len(colors)]
+        return im
+
+    def full_color(self, im_mode, width=40, height=30):
+        """An image with more than 256 colors and no redundant channels."""
+        im = image_lib.Image(im_mode, size=(width, height))
+        top = 2 ** im_mode.bits_per_component - 1
+        for y, line in enumerate(im):
+            for x, pixel in enumerate(line):
+                pixel.value = (x * 6, y * 8, x * y, 3 * x + y)[
+                    -im_mode.components:]
+                if top > 255:
+                    pixel.value = tuple(v * 251 for v in pixel.value)
+        return im
+
+    def ihdr(self, content):
+        return png.IHDR.load(content[16:29])
+
+    def test_gray_levels_are_packed(self):
+        levels = [(v * 257, v * 257, v * 257, 65535) for v in (0, 85, 170, 255)]
+        im = self.fill(mode.RGBA64, levels)
+        content, copy = self.round_trip(im, optimize=True)
+        ihdr = self.ihdr(content)
+        self.assertEqual((ihdr.color_type, ihdr.bit_depth), (0, 2))
+        self.assertEqual(copy.mode, mode.L)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer)[::8])
+
+    def test_few_colors_use_palette(self):
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (9, 9, 9), (1, 2, 3)]
+        im = self.fill(mode.RGB, colors)
+        content, copy = self.round_trip(im, optimize=True)
+        ihdr = self.ihdr(content)
+        self.assertEqual((ihdr.color_type, ihdr.bit_depth), (3, 4))
+        self.assertNotIn(b"tRNS", content)
+        self.assertEqual(copy.mode, mode.RGB)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_translucent_palette(self):
+        colors = [(255, 0, 0, 255), (0, 255, 0, 128), (0, 0, 255, 0)]
+        im = self.fill(mode.RGBA, colors)
+        content, copy = self.round_trip(im, optimize=True)
+        self.assertEqual(self.ihdr(content).color_type, 3)
+        self.assertIn(b"tRNS", content)
+        self.assertEqual(copy.mode, mode.RGBA)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_opaque_alpha_is_dropped(self):
+        im = self.full_color(mode.RGBA)
+        for pixel in im.pixels():
+            pixel.value = pixel.value[:3] + (255,)
+        content, copy = self.round_trip(im, optimize=True)
+        self.assertEqual(self.ihdr(content).color_type, 2)
+        self.assertEqual(copy.mode, mode.RGB)
+        self.assertEqual(bytes(copy.buffer),
+                         bytes(b for i, b in enumerate(bytes(im.buffer))
+                               if i % 4 != 3))
+
+    def test_full_color_is_unchanged(self):
+        for im_mode in png.MODE_COLOR_TYPES:
+            im = self.full_color(im_mode)
+            content, copy = self.round_trip(im, optimize=True,
+                                            sample_rows=10)
+            self.assertEqual(copy.mode, im_mode)
+            self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_pack_samples(self):
+        for bit_depth in (1, 2, 4):
+            samples = bytes(i % (1 << bit_depth) for i in range(13))
+            packed = png.pack_samples(samples, bit_depth)
+            self.assertEqual(len(packed), -(-13 * bit_depth // 8))
+            self.assertEqual(bytes(util.unpack_samples(packed, bit_depth,
+                                                       13)),
+                             samples)
+
+
+class PNGRowIndexTest(PNGWriteTestCase):
+
+    def write_indexed(self, im, **options):
+        capture = io.BytesIO()
+        png.PNGFormat(image_lib.Image, row_index=16, idat_size=64,
+                      **options).save(im, capture)
+        return capture.getvalue()
+
+    def rows(self, im, start, stop):
+        line_size = len(im.buffer) // im.size.height
+        return bytes(im.buffer[start*line_size:stop*line_size])
+
+    def test_read_rows(self):
+        im = self.make_image(image_lib.RGB, 20, 100)
+        for threads in (1, 3):
+            content = self.write_indexed(im, threads=threads)
+            self.assertIn(b"riDX", content)
+            fmt = png.PNGFormat(image_lib.Image)
+            copy = fmt.open(io.BytesIO(content))
+            self.assertEqual([row for row, _ in fmt.row_index],
+                             list(range(16, 100, 16)))
+            for start, stop in ((0, 5), (16, 32), (40, 41), (70, 100)):
+                band = fmt.read_rows(start, stop)
+                self.assertEqual(band.size, (20, stop - start))
+                self.assertEqual(bytes(band.buffer),
+                                 self.rows(im, start, stop))
+            self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+
+    def test_read_rows_skips_earlier_data(self):
+        im = self.make_image(image_lib.L16, 20, 100)
+        content = bytearray(self.write_indexed(im, filter=4))
+        # damage the first IDAT chunk, which the band never reads
+        content[content.index(b"IDAT") + 10] ^= 0xff
+        fmt = png.PNGFormat(image_lib.Image)
+        copy = fmt.open(io.BytesIO(bytes(content)))
+        self.assertEqual(bytes(fmt.read_rows(80, 90).buffer),
+                         self.rows(im, 80, 90))
+        with self.assertRaises(IOError):
+            copy.buffer
+
+    def test_read_rows_without_index(self):
+        im = self.make_image(image_lib.RGBA, 10, 30)
+        content, _ = self.round_trip(im)
+        fmt = png.PNGFormat(image_lib.Image)
+        fmt.open(io.BytesIO(content))
+        self.assertEqual(fmt.row_index, [])
+        self.assertEqual(bytes(fmt.read_rows(12, 20).buffer),
+                         self.rows(im, 12, 20))
+
+    def test_read_rows_empty_range(self):
+        im = self.make_image(image_lib.RGB, 10, 30)
+        content, _ = self.round_trip(im)
+        fmt = png.PNGFormat(image_lib.Image)
+        fmt.open(io.BytesIO(content))
+        for start, stop in ((5, 5), (10, 3), (30, 40)):
+            with self.assertRaises(IOError):
+                fmt.read_rows(start, stop)
+
+
+class APNGTest(PNGWriteTestCase):
+
+    RED, GREEN = (255, 0, 0, 255), (0, 255, 0, 255)
+
+    def frame_chunks(self, sequence, x, y, pixels, dispose_op, blend_op):
+        """Build the fcTL and fdAT chunks of an RGBA frame."""
+        height, width = len(pixels), len(pixels[0])
+        control = png.fcTL(sequence_number=sequence, width=width,
+                           height=height, x_offset=x, y_offset=y,
+                           delay_num=1, delay_den=10, dispose_op=dispose_op,
+                           blend_op=blend_op)
+        data = zlib.compress(b"".join(b"\x00" + bytes(sum(row, ()))
+                                      for row in pixels))
+        return (chunk(b"fcTL", bytes(control)) +
+                chunk(b"fdAT", struct.pack(">I", sequence + 1) + data))
+
+    def pixels(self, im):
+        return [p.value for p in im.pixels()]
+
+    def test_read_dispose_and_blend(self):
+        first = png.fcTL(sequence_number=0, width=4, height=4, delay_num=1,
+                         delay_den=10)
+        content = make_png(4, 4, 6, 8,
+                           [bytearray(self.RED * 4) for y in range(4)],
+                           extra_chunks=[chunk(b"acTL", struct.pack(">II", 4,
+                                                                    0)),
+                                         chunk(b"fcTL", bytes(first))])
+        frames = (self.frame_chunks(1, 1, 1, [[self.GREEN] * 2] * 2,
+                                    png.APNG_DISPOSE_OP_PREVIOUS,
+                                    png.APNG_BLEND_OP_SOURCE) +
+                  self.frame_chunks(3, 0, 0, [[(0, 0, 255, 128)]],
+                                    png.APNG_DISPOSE_OP_BACKGROUND,
+                                    png.APNG_BLEND_OP_OVER) +
+                  self.frame_chunks(5, 3, 3, [[(255,) * 4]],
+                                    png.APNG_DISPOSE_OP_NONE,
+                                    png.APNG_BLEND_OP_SOURCE))
+        end = content.index(b"IEND") - 4
+        content = content[:end] + frames + content[end:]
+
+        fmt = png.PNGFormat(image_lib.Image)
+        im = fmt.open(io.BytesIO(content))
+        self.assertEqual(im.info["animation"].num_frames, 4)
+        canvases = [self.pixels(canvas) for canvas, _ in fmt.frames()]
+        self.assertEqual(len(canvases), 4)
+        self.assertEqual(canvases[0], [self.RED] * 16)
+        green = [5, 6, 9, 10]
+        self.assertEqual(canvases[1], [self.GREEN if i in green else
+                                       self.RED for i in range(16)])
+        self.assertEqual(canvases[2], [(127, 0, 128, 255)] +
+                                      [self.RED] * 15)
+        self.assertEqual(canvases[3], [(0, 0, 0, 0)] + [self.RED] * 14 +
+                                      [(255,) * 4])
+
+    def test_not_animated(self):
+        content, _ = self.round_trip(self.make_image(image_lib.RGB))
+        fmt = png.PNGFormat(image_lib.Image)
+        im = fmt.open(io.BytesIO(content))
+        self.assertEqual([(canvas, control)
+                          for canvas, control in fmt.frames()], [(im, None)])
+
+    def animate(self, im_mode, changes):
+        """Build frames by applying each ``(x, y, value)`` change to a copy
+        of the frame before.
+
+        """
+        frames = [self.make_image(im_mode, 30, 20)]
+        for change in changes:
+            frame = image_lib.Image(im_mode, size=(30, 20))
+            frame.buffer[:] = frames[-1].buffer
+            for x, y, value in change:
+                frame[x, y].value = value
+            frames.append(frame)
+        return frames
+
+    def test_write_round_trip(self):
+        for im_mode, opaque, translucent in (
+                (image_lib.RGBA, (1, 2, 3, 255), (1, 2, 3, 4)),
+                (image_lib.RGB48, (1, 2, 3), (4, 5, 6)),
+                (image_lib.LA32, (7, 65535), (7, 8))):
+            frames = self.animate(im_mode, [
+                [(3, 4, opaque), (9, 6, opaque)],
+                [],
+                [(29, 19, translucent)],
+            ])
+            capture = io.BytesIO()
+            png.PNGFormat(image_lib.Image, frames=frames[1:],
+                          delay=[10, 20, 30, 40]).save(frames[0], capture)
+            capture.seek(0)
+            fmt = png.PNGFormat(image_lib.Image)
+            fmt.open(capture)
+            results = [(bytes(canvas.buffer), control)
+                       for canvas, control in fmt.frames()]
+            self.assertEqual([data for data, _ in results],
+                             [bytes(frames[i].buffer) for i in (0, 1, 3)])
+            controls = [control for _, control in results]
+            self.assertEqual([c.delay_num for c in controls], [10, 50, 40])
+            self.assertEqual([(c.x_offset, c.y_offset, c.width, c.height)
+                              for c in controls],
+                             [(0, 0, 30, 20), (3, 4, 7, 3), (29, 19, 1, 1)])
+            # only opaque changes can be blended over the canvas
+            self.assertEqual(controls[2].blend_op, png.APNG_BLEND_OP_SOURCE)
+
+
+class PNGVerifyTest(PNGWriteTestCase):
+
+    def check(self, content, full=False):
+        return png.PNGFormat(image_lib.Image).verify(io.BytesIO(content),
+                                                     full)
+
+    def test_intact(self):
+        for interlace in (0, 1):
+            content = make_png(9, 7, 2, 8, [bytearray(27)] * 7,
+                               idat_size=20, interlace=interlace)
+            self.assertEqual(self.check(content), [])
+            self.assertEqual(self.check(content, full=True), [])
+
+    def test_bad_crc(self):
+        content = bytearray(make_png(9, 7, 2, 8, [bytearray(27)] * 7,
+                                     idat_size=20))
+        first = content.index(b"IDAT") - 4
+        second = content.index(b"IDAT", first + 8) - 4
+        content[second + 9] ^= 1
+        self.assertEqual(self.check(bytes(content)),
+                         [(second, "CRC failed for IDAT chunk.")])
+
+    def test_truncated(self):
+        content = make_png(9, 7, 2, 8, [bytearray(27)] * 7)
+        idat = content.index(b"IDAT") - 4
+        self.assertEqual(self.check(content[:idat + 12]),
+                         [(idat, "IDAT chunk truncated.")])
+        self.assertEqual(self.check(content[:-12]),
+                         [(len(content) - 12, "File truncated before "
+                                              "IEND.")])
+
+    def test_full_checks_image_data(self):
+        short = make_png(9, 7, 2, 8, [bytearray(27)] * 6)
+        # claim one more row than the image data holds
+        ihdr = struct.pack(">IIBBBBB", 9, 7, 8, 2, 0, 0, 0)
+        content = (bytes(png.PNG_SIGNATURE) + chunk(b"IHDR", ihdr) +
+                   short[33:])
+        self.assertEqual(self.check(content), [])
+        problems = self.check(content, full=True)
+        self.assertEqual(len(problems), 1)
+        self.assertIn("expected {}".format(7 * 28), problems[0][1])
+
+        garbage = (bytes(png.PNG_SIGNATURE) + chunk(b"IHDR", ihdr) +
+                   chunk(b"IDAT", b"\x78\x9c\xff\xff") +
+                   chunk(b"IEND", b""))
+        problems = self.check(garbage, full=True)
+        self.assertEqual(problems[0][0], 33)
+        self.assertIn("Corrupt image data", problems[0][1])
+
+    def test_verify_path(self):
+        import os
+        import tempfile
+        from depyct import io as depyct_io
+        content, _ = self.round_trip(self.make_image(image_lib.RGB))
+        fd, path = tempfile.mkstemp(suffix=".png")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(content[:-20])
+            problems = depyct_io.verify(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(problems), 1)
+        self.assertIn("truncated", problems[0][1])
+
+
+class ScanlineDecoderTest(testing.DepyctUnitTest):
+
+    def test_pending_data_is_bounded(self):
+        width, height = 300, 200
+        scanlines = [bytearray(width * 3) for y in range(height)]
+        content = make_png(width, height, 2, 8, scanlines)
+        fmt = png.PNGFormat(image_lib.Image)
+        ihdr = png.IHDR(width=width, height=height, bit_depth=8,
+                        color_type=2)
+        rows = []
+        high_water = [0]
+
+        def sink(pass_number, y, row):
+            rows.append(y)
+            high_water[0] = max(high_water[0], len(decoder.pending))
+
+        decoder = png.ScanlineDecoder(ihdr, sink, fmt.fail)
+        decoder.max_output = 4096
+        start = content.index(b"IDAT") + 4
+        end = content.index(b"IEND") - 8
+        decoder.feed(content[start:end])
+        decoder.finish()
+        self.assertEqual(rows, list(range(height)))
+        self.assertLessEqual(high_water[0], 4096 + width * 3 + 1)
+
+
+if __name__ == "__main__":
+    testing.main()
@@ -3,3 +3,102 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+import warnings
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import xbm
+from depyct.io.plugins.netpbm import PbmFormat
+
+
+class XBMReadTest(testing.DepyctUnitTest):
+
+    def test_read_x11(self):
+        im = xbm.XBMFormat(image_lib.Image).open(
+                self.get_data_path("depyct-x11.xbm"))
+        expected = PbmFormat(image_lib.Image).open(
+                self.get_data_path("netpbm/in.raw.pbm"))
+        self.assertEqual(bytes(im.buffer), bytes(expected.buffer))
+
+    def read(self, content, chunk_size=None):
+        fmt = xbm.XBMFormat(image_lib.Image)
+        if chunk_size is not None:
+            fmt.chunk_size = chunk_size
+        return fmt.open(io.BytesIO(content))
+
+    def test_read_in_chunks(self):
+        content = (b"/* icon */\n#define my_icon_width 10\n"
+                   b"#define my_icon_height 2\n#define my_icon_x_hot 1\n"
+                   b"#define my_icon_y_hot 0\n"
+                   b"static unsigned char my_icon_bits[] = {\n"
+                   b"   0x01, 0x3, 0xff,\n   0x02 };\n")
+        for chunk_size in (1, 3, 16, 1024):
+            im = self.read(content, chunk_size)
+            self.assertEqual(im.size, (10, 2))
+            self.assertEqual(im.info["hotspot"], (1, 0))
+            self.assertEqual(bytes(im.buffer),
+                             b"\xff" + bytes(7) + b"\xff\xff" +
+                             b"\xff" * 8 + b"\x00\xff")
+
+    def test_read_x10(self):
+        content = (b"#define x10_width 18\n#define x10_height 1\n"
+                   b"static short x10_bits[] = {\n 0x8001, 0x0002};\n")
+        im = self.read(content)
+        self.assertEqual(bytes(im.buffer), b"\xff" + bytes(14) + b"\xff" +
+                         b"\x00\xff")
+
+    def test_bad_data(self):
+        with self.assertRaises(IOError):
+            self.read(b"#define a_width 8\n#define a_height 1\n"
+                      b"static char a_bits[] = { 0xzz };\n")
+        with self.assertRaises(IOError):
+            self.read(b"#define a_width 8\n#define a_height 2\n"
+                      b"static char a_bits[] = { 0x01 };\n")
+        with self.assertRaises(IOError):
+            self.read(b"#define a_width 8\n#define a_height 1\n"
+                      b"static char a_bits[] = { 0x01, ")
+
+
+class XBMWriteTest(testing.DepyctUnitTest):
+
+    def test_write(self):
+        im = PbmFormat(image_lib.Image).open(
+                self.get_data_path("netpbm/in.raw.pbm"))
+        capture = io.BytesIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            xbm.XBMFormat(image_lib.Image, name="depyct").save(im, capture)
+        self.assertEqual(capture.getvalue(),
+                         self.read_data("depyct-x11.xbm"))
+
+    def test_round_trip_with_hotspot(self):
+        im = image_lib.Image(mode.L, image_lib.ImageSize(11, 3))
+        im.buffer[:] = bytes(255 * (i % 4 == 1) for i in range(33))
+        im.info["hotspot"] = (4, 2)
+        capture = io.BytesIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            xbm.XBMFormat(image_lib.Image).save(im, capture)
+        capture.seek(0)
+        copy = xbm.XBMFormat(image_lib.Image).open(capture)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+        self.assertEqual(copy.info["hotspot"], (4, 2))
+
+    def test_write_dithered(self):
+        im = image_lib.Image(mode.RGB, image_lib.ImageSize(4, 2))
+        im.buffer[:] = b"\x00\x00\x00\xff\xff\xff" * 4
+        capture = io.BytesIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            xbm.XBMFormat(image_lib.Image, dither="atkinson").save(im,
+                                                                   capture)
+        capture.seek(0)
+        copy = xbm.XBMFormat(image_lib.Image).open(capture)
+        # black pixels are the set bits
+        self.assertEqual(bytes(copy.buffer), b"\xff\x00" * 4)
+
+
+if __name__ == "__main__":
+    testing.main()
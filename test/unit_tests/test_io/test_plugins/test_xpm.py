@@ -1,5 +1,129 @@
-# test/unit_tests/test_io/test_plugins/test_xbm.py
+# test/unit_tests/test_io/test_plugins/test_xpm.py
 # Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+import io
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.image import mode
+from depyct.io.plugins import xpm
+
+
+WHITE, BLACK, RED = b"\xff\xff\xff", b"\x00\x00\x00", b"\xff\x00\x00"
+
+
+class XPMReadTest(testing.DepyctUnitTest):
+
+    def read(self, content):
+        return xpm.XPMFormat(image_lib.Image).open(io.BytesIO(content))
+
+    def check_depyct(self, im, colors):
+        self.assertEqual(im.size, (23, 7))
+        self.assertEqual(im.mode, mode.RGB)
+        data = bytes(im.buffer)
+        # the first row starts with two dark pixels, the sixth is underlined
+        self.assertEqual(data[:9], BLACK * 2 + WHITE)
+        self.assertEqual(data[5*69:5*69+9], colors * 3)
+
+    def test_read_xpm1(self):
+        im = xpm.XPMFormat(image_lib.Image).open(
+                self.get_data_path("depyct-xpm1.xpm"))
+        self.check_depyct(im, b"\xdd\x88\x00")
+
+    def test_read_xpm2(self):
+        im = xpm.XPMFormat(image_lib.Image).open(
+                self.get_data_path("depyct-xpm2.xpm"))
+        self.check_depyct(im, RED)
+
+    def test_read_xpm3(self):
+        im = xpm.XPMFormat(image_lib.Image).open(
+                self.get_data_path("depyct-xpm3.xpm"))
+        self.check_depyct(im, RED)
+
+    def test_read_two_character_keys(self):
+        im = self.read(b'/* XPM */\nstatic char *a[] = {\n'
+                       b'/* values */\n"3 1 3 2 1 0",\n'
+                       b'"a. c red",\n"b. s border c #00F m black",\n'
+                       b'"c. c None",\n/* pixels */\n"b.a.c."\n};\n')
+        self.assertEqual(im.mode, mode.RGBA)
+        self.assertEqual(bytes(im.buffer),
+                         b"\x00\x00\xff\xff\xff\x00\x00\xff" + bytes(4))
+        self.assertEqual(im.info["hotspot"], (1, 0))
+
+    def test_read_long_hex_colors(self):
+        im = self.read(b'! XPM2\n2 1 2 1\nx c #FFFF00008000\n'
+                       b'y g4 gray\nxy\n')
+        self.assertEqual(bytes(im.buffer), b"\xff\x00\x80\xbe\xbe\xbe")
+
+    def test_read_x11_color_names(self):
+        im = self.read(b'! XPM2\n5 1 5 1\na c Dark Slate Gray\n'
+                       b'b c LightGoldenrod3\nc c grey50\nd c gray91\n'
+                       b'e c navajo white\nabcde\n')
+        self.assertEqual(bytes(im.buffer), bytes([47, 79, 79, 205, 190, 112,
+                                                  127, 127, 127,
+                                                  232, 232, 232,
+                                                  255, 222, 173]))
+
+    def test_bad_files(self):
+        for content in (b"GIF89a",
+                        b'! XPM2\n2 1 1 1\nx c #000000\nxy\n',
+                        b'! XPM2\n2 2 1 1\nx c #000000\nxx\n',
+                        b'! XPM2\n1 1 1 1\nx c mauvish\nx\n',
+                        b'! XPM2\n1 1 one 1\nx c red\nx\n',
+                        b'/* XPM */\nstatic char *a[] = {\n"2 1 1 2",\n'
+                        b'"aa c red",\n"aabb"};\n'):
+            with self.assertRaises(IOError):
+                self.read(content)
+
+
+class XPMWriteTest(testing.DepyctUnitTest):
+
+    def round_trip(self, im, **options):
+        capture = io.BytesIO()
+        xpm.XPMFormat(image_lib.Image, **options).save(im, capture)
+        capture.seek(0)
+        return capture.getvalue(), xpm.XPMFormat(image_lib.Image).open(
+                capture)
+
+    def test_round_trip(self):
+        im = xpm.XPMFormat(image_lib.Image).open(
+                self.get_data_path("depyct-xpm3.xpm"))
+        im.info["hotspot"] = (3, 4)
+        for fmt in (2, 3):
+            content, copy = self.round_trip(im, format=fmt, name="depyct")
+            self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+            self.assertEqual(copy.info["hotspot"], (3, 4))
+        self.assertEqual(content.split(b"\n")[:4],
+                         [b"/* XPM */", b"static char * depyct[] = {",
+                          b'"23 7 3 1 3 4",', b'"  c #FFFFFF",'])
+
+    def test_shortest_keys(self):
+        im = image_lib.Image(mode.RGB, size=(100, 1))
+        im.buffer[:] = bytes(b for v in range(100) for b in (v, 0, 0))
+        content, copy = self.round_trip(im)
+        self.assertIn(b'"100 1 100 2",', content)
+        self.assertEqual(bytes(copy.buffer), bytes(im.buffer))
+        im = image_lib.Image(mode.RGB, size=(92, 1))
+        im.buffer[:] = bytes(b for v in range(92) for b in (v, 0, 0))
+        self.assertIn(b'"92 1 92 1",', self.round_trip(im)[0])
+
+    def test_write_transparency(self):
+        im = image_lib.Image(mode.LA, size=(3, 1))
+        im.buffer[:] = b"\x10\xff\x20\x00\x30\x7f"
+        content, copy = self.round_trip(im, format=2)
+        self.assertIn(b"c None", content)
+        self.assertEqual(copy.mode, mode.RGBA)
+        self.assertEqual(bytes(copy.buffer),
+                         b"\x10\x10\x10\xff" + bytes(8))
+
+    def test_write_unsupported_mode(self):
+        with self.assertRaises(IOError):
+            self.round_trip(image_lib.Image(mode.RGB48, size=(1, 1)))
+        with self.assertRaises(IOError):
+            self.round_trip(image_lib.Image(mode.RGB, size=(1, 1)), format=1)
+
+
+if __name__ == "__main__":
+    testing.main()
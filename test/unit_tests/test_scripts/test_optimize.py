@@ -0,0 +1,98 @@
+# test/unit_tests/test_scripts/test_optimize.py
+# Copyright (c) 2012-2017 the Depyct authors and contributors <see AUTHORS>
+#
+# This module is part of Depyct and is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license.php
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+from depyct import testing
+from depyct import image as image_lib
+from depyct.io.plugins import png
+from depyct.scripts import optimize
+
+
+class OptimizeTest(testing.DepyctUnitTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.im = image_lib.Image(image_lib.RGB, size=(64, 64))
+        for y in range(0, 64, 8):
+            self.im[3, y].value = (255, y, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, im=None, **options):
+        path = os.path.join(self.directory, name)
+        png.PNGFormat(image_lib.Image, **options).save(im or self.im, path)
+        return path
+
+    def read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def run_main(self, *argv):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = optimize.main(["-j", "1"] + list(argv))
+        return status, out.getvalue(), err.getvalue()
+
+    def test_in_place(self):
+        path = self.write("a.png", compression_level=0)
+        before = os.path.getsize(path)
+        self.assertEqual(optimize.optimize_file(path),
+                         (before, os.path.getsize(path)))
+        self.assertLess(os.path.getsize(path), before)
+        im = png.PNGFormat(image_lib.Image).open(path)
+        self.assertEqual(bytes(im.buffer), bytes(self.im.buffer))
+        self.assertEqual(os.listdir(self.directory), ["a.png"])
+
+    def test_output_directory(self):
+        path = self.write("a.png", compression_level=0)
+        original = self.read(path)
+        output = os.path.join(self.directory, "out")
+        status, out, err = self.run_main("-o", output, path)
+        self.assertEqual((status, err), (0, ""))
+        self.assertEqual(self.read(path), original)
+        result = os.path.join(output, "a.png")
+        self.assertLess(os.path.getsize(result), len(original))
+        im = png.PNGFormat(image_lib.Image).open(result)
+        self.assertEqual(bytes(im.buffer), bytes(self.im.buffer))
+
+    def test_keep_original_bytes(self):
+        path = self.write("a.png", optimize=True, compression_level=9)
+        original = self.read(path)
+        self.assertEqual(optimize.optimize_file(path),
+                         (len(original), len(original)))
+        self.assertEqual(self.read(path), original)
+        copy = os.path.join(self.directory, "b.png")
+        optimize.optimize_file(path, copy)
+        self.assertEqual(self.read(copy), original)
+
+    def test_animation_passed_through(self):
+        second = image_lib.Image(image_lib.RGB, size=(64, 64))
+        path = self.write("a.png", frames=[second], compression_level=0)
+        original = self.read(path)
+        self.assertEqual(optimize.optimize_file(path),
+                         (len(original), len(original)))
+        self.assertEqual(self.read(path), original)
+
+    def test_errors_reported_per_file(self):
+        good = self.write("good.png", compression_level=0)
+        before = os.path.getsize(good)
+        bad = os.path.join(self.directory, "bad.png")
+        with open(bad, "wb") as fp:
+            fp.write(b"\x89PNG\r\n\x1a\n" + b"\x00" * 20)
+        missing = os.path.join(self.directory, "missing.png")
+        status, out, err = self.run_main(bad, good, missing)
+        self.assertEqual(status, 1)
+        self.assertIn(good + ":", out)
+        self.assertLess(os.path.getsize(good), before)
+        errors = err.splitlines()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(sorted(line.split(":")[0] for line in errors),
+                         [bad, missing])
@@ -3,3 +3,63 @@
 #
 # This module is part of Depyct and is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license.php
+from depyct import testing
+from depyct import util
+
+
+class BitPackingTest(testing.DepyctUnitTest):
+
+    def test_unpack_msb_first(self):
+        self.assertEqual(util.unpack_bits(b"\xa0\x40", 3, 2),
+                         b"\xff\x00\xff\x00\xff\x00")
+
+    def test_unpack_lsb_first(self):
+        self.assertEqual(util.unpack_bits(b"\x05\x02", 3, 2, lsb_first=True),
+                         b"\xff\x00\xff\x00\xff\x00")
+
+    def test_unpack_whole_bytes(self):
+        self.assertEqual(util.unpack_bits(b"\x81", 8, 1),
+                         b"\xff" + bytes(6) + b"\xff")
+
+    def test_unpack_samples(self):
+        self.assertEqual(util.unpack_samples(b"\xa5", 1),
+                         b"\x01\x00\x01\x00\x00\x01\x00\x01")
+        self.assertEqual(util.unpack_samples(b"\x1b\xe4", 2, 6),
+                         b"\x00\x01\x02\x03\x03\x02")
+        self.assertEqual(util.unpack_samples(bytearray(b"\x9f"), 4),
+                         b"\x09\x0f")
+
+    def test_pack_round_trip(self):
+        row = bytes(i % 3 == 0 for i in range(21))
+        for lsb_first in (False, True):
+            packed = util.pack_bits(row, lsb_first)
+            self.assertEqual(len(packed), 3)
+            self.assertEqual(util.unpack_bits(packed, 21, 1, lsb_first),
+                             bytes(255 * b for b in row))
+        self.assertEqual(util.pack_bits(b"\x01\x00\x01"), b"\xa0")
+        self.assertEqual(util.pack_bits(b"\x01\x00\x01", True), b"\x05")
+
+    def test_threshold_row(self):
+        tables = util.threshold_tables((0, 0, 0))
+        row = bytes([0, 0, 0, 0, 9, 0, 255, 255, 255])
+        self.assertEqual(util.threshold_row(row, tables), b"\x00\x01\x01")
+        tables = util.threshold_tables((255,))
+        self.assertEqual(util.threshold_row(b"\xff\x00\xfe", tables),
+                         b"\x00\x01\x01")
+
+
+if __name__ == "__main__":
+    testing.main()
+
+
+class ChangedRectangleTest(testing.DepyctUnitTest):
+
+    def test_changed_rectangle(self):
+        before = bytes(5 * 4 * 2)
+        after = bytearray(before)
+        after[(2 * 5 + 1) * 2 + 1] = 1
+        after[(3 * 5 + 3) * 2] = 1
+        self.assertEqual(util.changed_rectangle(before, after, 5, 4, 2),
+                         (1, 2, 4, 4))
+        self.assertIsNone(util.changed_rectangle(before, before, 5, 4, 2))
+